@@ -9,6 +9,7 @@ from types import SimpleNamespace
 from flask import Flask, render_template, redirect, url_for, flash, request, session, send_file, send_from_directory, g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import event, inspect
+from sqlalchemy.orm import configure_mappers
 from sqlalchemy.pool import NullPool, StaticPool, QueuePool
 from sqlalchemy.exc import OperationalError
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -937,150 +938,67 @@ def create_app():
     db.init_app(app)
 
     def _register_audit_logging(_app):
+        # Auditoria capturada no flush e gravada em lote após o commit (spool local + thread)
         if _app.extensions.get('audit_log_registered'):
             return
 
-        from models import AuditLog
+        from utils.auditoria import escritor_auditoria, registrar_eventos_sessao as registrar_auditoria
+        registrar_auditoria(db.session.__class__, escritor_auditoria)
+        try:
+            escritor_auditoria.iniciar(_app)
+        except Exception as e:
+            _app.logger.warning("Falha ao iniciar gravador de auditoria: %s", e)
+        _app.extensions['audit_log_registered'] = True
 
-        def _get_actor():
-            usuario = getattr(g, 'usuario', None)
-            if usuario is not None:
-                return usuario.id, getattr(usuario, 'nome', None)
-            if 'usuario_id' in session:
-                return session.get('usuario_id'), session.get('usuario_nome')
-            return None, None
+    _register_audit_logging(app)
 
-        def _get_request_meta():
-            if not has_request_context():
-                return None, None, None, None
-            try:
-                endpoint = request.endpoint
-            except Exception:
-                endpoint = None
-            try:
-                metodo = request.method
-            except Exception:
-                metodo = None
-            try:
-                ip = request.headers.get('X-Forwarded-For', request.remote_addr)
-            except Exception:
-                ip = None
-            try:
-                ua = request.headers.get('User-Agent')
-            except Exception:
-                ua = None
-            return endpoint, metodo, ip, ua
+    def _register_estado_chao_fabrica(_app):
+        # Marca as OS alteradas em cada commit para o estado materializado de /apontamento/status-ativos
+        if _app.extensions.get('estado_chao_fabrica_registered'):
+            return
 
-        def _row_identity(obj):
-            try:
-                mapper = inspect(obj).mapper
-                pks = [col.key for col in mapper.primary_key]
-                if not pks:
-                    return None
-                if len(pks) == 1:
-                    return str(getattr(obj, pks[0], None))
-                return json.dumps({k: getattr(obj, k, None) for k in pks}, ensure_ascii=False, default=str)
-            except Exception:
-                return None
+        from utils.estado_chao_fabrica import estado_chao_fabrica, registrar_eventos_sessao
+        registrar_eventos_sessao(db.session.__class__, estado_chao_fabrica)
+        _app.extensions['estado_chao_fabrica_registered'] = True
 
-        def _collect_changes(obj, action):
-            try:
-                state = inspect(obj)
-                mapper = state.mapper
-                changes = {}
-
-                for attr in mapper.column_attrs:
-                    key = attr.key
-                    if key == 'id':
-                        continue
-                    hist = state.attrs[key].history
-
-                    if action == 'create':
-                        val = getattr(obj, key, None)
-                        if val is not None:
-                            changes[key] = {'old': None, 'new': val}
-                        continue
-
-                    if action == 'delete':
-                        val = getattr(obj, key, None)
-                        if val is not None:
-                            changes[key] = {'old': val, 'new': None}
-                        continue
-
-                    if action == 'update':
-                        if not hist.has_changes():
-                            continue
-                        old = hist.deleted[0] if hist.deleted else None
-                        new = hist.added[0] if hist.added else getattr(obj, key, None)
-                        changes[key] = {'old': old, 'new': new}
-
-                if not changes:
-                    return None
-                return changes
-            except Exception:
-                return None
+    _register_estado_chao_fabrica(app)
 
-        @event.listens_for(db.session.__class__, 'before_flush')
-        def _audit_before_flush(session_, flush_context, instances):
-            if session_.info.get('_audit_logging_disabled'):
-                return
+    def _register_kanban_changelog(_app):
+        # Log de alterações (seq monotônico) usado pelo sync incremental do Kanban PWA
+        if _app.extensions.get('kanban_changelog_registered'):
+            return
 
-            usuario_id, usuario_nome = _get_actor()
-            endpoint, metodo, ip, ua = _get_request_meta()
+        from utils.kanban_changelog import registrar_eventos_sessao as registrar_changelog_kanban
+        registrar_changelog_kanban(db.session.__class__)
+        _app.extensions['kanban_changelog_registered'] = True
 
-            def _add_log(acao, obj, changes):
-                if isinstance(obj, AuditLog):
-                    return
+    _register_kanban_changelog(app)
 
-                entidade_tipo = obj.__class__.__name__
-                entidade_id = _row_identity(obj)
-                mudancas_json = None
-                if changes is not None:
-                    try:
-                        mudancas_json = json.dumps(changes, ensure_ascii=False, default=str)
-                    except Exception:
-                        mudancas_json = None
-
-                session_.add(
-                    AuditLog(
-                        usuario_id=usuario_id,
-                        usuario_nome=usuario_nome,
-                        acao=acao,
-                        entidade_tipo=entidade_tipo,
-                        entidade_id=entidade_id,
-                        mudancas_json=mudancas_json,
-                        endpoint=endpoint,
-                        metodo=metodo,
-                        ip=ip,
-                        user_agent=ua,
-                    )
-                )
+    def _register_resumo_apontamentos(_app):
+        # Tempos acumulados por OS/item/trabalho atualizados a cada flush de apontamentos
+        if _app.extensions.get('resumo_apontamentos_registered'):
+            return
 
-            for obj in list(session_.new):
-                if isinstance(obj, AuditLog):
-                    continue
-                changes = _collect_changes(obj, 'create')
-                _add_log('create', obj, changes)
-
-            for obj in list(session_.dirty):
-                if isinstance(obj, AuditLog):
-                    continue
-                if not session_.is_modified(obj, include_collections=False):
-                    continue
-                changes = _collect_changes(obj, 'update')
-                if changes:
-                    _add_log('update', obj, changes)
-
-            for obj in list(session_.deleted):
-                if isinstance(obj, AuditLog):
-                    continue
-                changes = _collect_changes(obj, 'delete')
-                _add_log('delete', obj, changes)
+        from utils.resumo_apontamentos import registrar_eventos_sessao as registrar_resumo_apontamentos
+        registrar_resumo_apontamentos(db.session.__class__)
+        _app.extensions['resumo_apontamentos_registered'] = True
 
-        _app.extensions['audit_log_registered'] = True
+    _register_resumo_apontamentos(app)
+
+    def _register_query_profiler(_app):
+        # Perfil SQL por requisição: Server-Timing, assinaturas de N+1 e orçamentos de queries
+        if _app.extensions.get('query_profiler_registered'):
+            return
+
+        try:
+            from utils.query_monitor import instalar_profiler
+            instalar_profiler(_app)
+        except Exception as e:
+            _app.logger.warning("Falha ao instalar profiler de queries: %s", e)
+        _app.extensions['query_profiler_registered'] = True
+
+    _register_query_profiler(app)
 
-    _register_audit_logging(app)
-    
     if not skip_db_checks:
         with app.app_context():
             try:
@@ -1141,6 +1059,43 @@ def create_app():
                     app.logger.warning("Falha ao verificar/adicionar campos de localização (grid) do Estoque de Peças.")
             except Exception as e:
                 app.logger.warning(f"Migração localização (grid) Estoque de Peças: {str(e)}")
+
+            # Índices compostos/parciais de apontamento_producao (abertos e janelas de tempo)
+            try:
+                from migrations.add_apontamento_indexes import upgrade
+                upgrade(db.engine)
+            except Exception as e:
+                app.logger.warning(f"Migração índices apontamento_producao: {str(e)}")
+
+            # Resumo de tempos por OS/item/trabalho (backfill quando a tabela está vazia)
+            try:
+                from migrations.add_apontamento_resumo import upgrade
+                upgrade(db.engine)
+            except Exception as e:
+                app.logger.warning(f"Migração apontamento_resumo: {str(e)}")
+
+            # Índices de busca (pg_trgm/tsvector no PostgreSQL, FTS5 no SQLite)
+            try:
+                from migrations.add_busca_indices import upgrade
+                upgrade(db.engine)
+            except Exception as e:
+                app.logger.warning(f"Migração índices de busca: {str(e)}")
+
+            # audit_log: índices, partições mensais (PostgreSQL) e tabela de arquivo (SQLite)
+            try:
+                from migrations.add_audit_log_particionamento import upgrade
+                upgrade(db.engine)
+            except Exception as e:
+                app.logger.warning(f"Migração particionamento audit_log: {str(e)}")
+
+            # Consultor de índices: reporta consultas quentes sem índice utilizável
+            if not app.extensions.get('consultor_indices_verificado'):
+                try:
+                    from utils.consultor_indices import verificar_no_startup
+                    verificar_no_startup(db.engine)
+                except Exception as e:
+                    app.logger.warning(f"Consultor de índices: {str(e)}")
+                app.extensions['consultor_indices_verificado'] = True
             
             # Garantir que o usuário admin existe (especialmente importante no Vercel)
             from models import Usuario
@@ -1199,6 +1154,9 @@ def create_app():
     from routes.dashboard_apontamentos import dashboard_apontamentos_bp
     from routes.orcamentos import orcamentos_bp
     from routes.pedidos_consumo import pedidos_consumo
+    from routes.tempo_real import tempo_real_bp
+    from routes.busca import busca_bp
+    from routes.cron import cron_bp
     
     app.register_blueprint(clientes)
     app.register_blueprint(materiais)
@@ -1227,6 +1185,9 @@ def create_app():
     app.register_blueprint(diagnostico_bp)
     app.register_blueprint(dashboard_apontamentos_bp)
     app.register_blueprint(pedidos_consumo)
+    app.register_blueprint(tempo_real_bp)
+    app.register_blueprint(busca_bp)
+    app.register_blueprint(cron_bp)
 
     try:
         from notificacoes import init_notificacoes
@@ -1253,6 +1214,9 @@ def create_app():
             return
         if endpoint == 'supabase_redirect':
             return
+        # Cron da Vercel: a própria rota confere o CRON_SECRET
+        if blueprint == 'cron':
+            return
         # PWA assets públicos
         if endpoint in ('pwa_manifest', 'pwa_service_worker'):
             return
@@ -1390,13 +1354,34 @@ def create_app():
                 bucket = bucket_env
                 rel_path = path_clean
 
+            # Miniatura (<original>.thumb.webp): se ainda não existir, serve o
+            # original e a geração fica agendada em segundo plano
+            from utils.imagens_derivadas import separar_derivada, garantir_supabase
+            derivada = separar_derivada(rel_path)
+            provisorio = bool(derivada) and not garantir_supabase(bucket, rel_path)
+            if provisorio:
+                rel_path = derivada[0]
+
             # Não codificar as barras do caminho
             rel_encoded = quote(rel_path, safe='/')
             public_url = f"{supabase_url}/storage/v1/object/public/{bucket}/{rel_encoded}"
+
+            # Já baixado/enviado por este servidor: servir do cache local em vez de ir ao Storage
+            from utils.storage import caminho_em_cache
+            em_cache = caminho_em_cache(public_url)
+            if em_cache:
+                import mimetypes
+                return send_file(
+                    em_cache,
+                    mimetype=mimetypes.guess_type(rel_path)[0] or 'application/octet-stream',
+                    max_age=60 if provisorio else 3600,
+                )
+
             _current_app.logger.info("Redirecionando para URL Supabase: %s", public_url)
             response = redirect(public_url, code=302)
-            # Cache do redirect por 1 hora para evitar requisições repetidas ao Flask
-            response.headers['Cache-Control'] = 'public, max-age=3600'
+            # Cache do redirect por 1 hora para evitar requisições repetidas ao Flask;
+            # o original no lugar da miniatura só até ela ficar pronta
+            response.headers['Cache-Control'] = 'public, max-age={}'.format(60 if provisorio else 3600)
             return response
         else:
             # Log do erro de configuração
@@ -1424,6 +1409,10 @@ def create_app():
                 else:
                     local_path = None
                 
+                if local_path and not os.path.exists(local_path):
+                    from utils.imagens_derivadas import derivada_local
+                    local_path = derivada_local(local_path) or local_path
+
                 if local_path and os.path.exists(local_path):
                     _current_app.logger.info("Arquivo local encontrado, servindo: %s", local_path)
                     return send_file(local_path)
@@ -1526,5 +1515,11 @@ def create_app():
     @app.errorhandler(500)
     def erro_servidor(e):
         return render_template('500.html'), 500
-    
+
+    # Relacionamentos via backref (Pedido.cliente, Pedido.item...) só existem depois
+    # de configurar os mappers; as rotas montam loader options com eles antes da
+    # primeira query, então não dá para depender do startup ter usado o ORM
+    # (SKIP_DB_CHECKS/serverless pulam as verificações de banco)
+    configure_mappers()
+
     return app
@@ -0,0 +1,584 @@
+"""
+Benchmark reprodutível dos endpoints quentes com uma fábrica sintética.
+
+Gera uma fábrica fictícia (itens, itens compostos, pedidos, OS, listas Kanban,
+cartões fantasma, meses de histórico de apontamentos e estoque de peças) em um
+banco descartável (SQLite ou PostgreSQL) e mede:
+
+- /apontamento/status-ativos
+- /kanban/full-data e /kanban/sync
+- /dashboard/apontamentos/timeline
+- /estoque-pecas/mapa
+- exportação da planilha de valores dos itens
+
+O resultado (p50/p95 de latência, número de queries e pico de memória Python
+por cenário) sai em JSON para comparar entre commits:
+
+    python bench_fabrica.py --tamanho medio --saida antes.json
+    git checkout minha-branch
+    python bench_fabrica.py --tamanho medio --saida depois.json --comparar antes.json
+
+O banco padrão é um SQLite em diretório temporário. Nunca aponte --db para o
+banco de produção: com --recriar todas as tabelas são apagadas.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+try:
+    import resource  # indisponível no Windows
+except ImportError:
+    resource = None
+
+
+TAMANHOS = {
+    'pequeno': {'itens': 300, 'compostos': 0.1, 'pedidos': 600, 'os': 300, 'listas': 8,
+                'fantasmas': 0.1, 'meses': 1, 'operadores': 6, 'clientes': 20, 'estoque': 200},
+    'medio': {'itens': 3000, 'compostos': 0.1, 'pedidos': 6000, 'os': 2500, 'listas': 14,
+              'fantasmas': 0.1, 'meses': 6, 'operadores': 15, 'clientes': 80, 'estoque': 1500},
+    'grande': {'itens': 12000, 'compostos': 0.12, 'pedidos': 25000, 'os': 10000, 'listas': 22,
+               'fantasmas': 0.12, 'meses': 24, 'operadores': 30, 'clientes': 250, 'estoque': 4000},
+}
+
+TIPOS_SERVICO = ['Serra', 'Torno CNC', 'Centro de Usinagem', 'Manual', 'Acabamento']
+MOTIVOS_PAUSA = ['Almoço', 'Troca de ferramenta', 'Falta de material', 'Manutenção', 'Medição']
+LOTE_INSERCAO = 2000
+
+
+# ---------------------------------------------------------------------------
+# Fábrica sintética
+# ---------------------------------------------------------------------------
+
+def _inserir(db, model, linhas):
+    """Insert em lote direto na tabela (sem eventos do ORM, bem mais rápido)"""
+    tabela = model.__table__
+    # executemany exige as mesmas colunas em todas as linhas do lote
+    grupos = {}
+    for linha in linhas:
+        grupos.setdefault(tuple(sorted(linha)), []).append(linha)
+    for grupo in grupos.values():
+        for i in range(0, len(grupo), LOTE_INSERCAO):
+            db.session.execute(tabela.insert(), grupo[i:i + LOTE_INSERCAO])
+
+
+def _ajustar_sequencias(db, models):
+    """No PostgreSQL os ids explícitos não avançam as sequences"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    from sqlalchemy import text
+    for model in models:
+        tabela = model.__tablename__
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{tabela}', 'id'), COALESCE((SELECT MAX(id) FROM {tabela}), 1))"
+        ))
+
+
+def _sessoes_do_dia(rnd, dia, inicio_turno=7, fim_turno=17):
+    """Blocos setup/produção/pausa de uma máquina num dia: [(tipo, inicio, fim, quantidade, motivo)]"""
+    eventos = []
+    cursor = dia.replace(hour=inicio_turno, minute=rnd.randint(0, 30), second=0, microsecond=0)
+    fim_dia = dia.replace(hour=fim_turno, minute=0, second=0, microsecond=0)
+    while cursor < fim_dia - timedelta(minutes=40):
+        setup = timedelta(minutes=rnd.randint(10, 45))
+        eventos.append(('inicio_setup', cursor, cursor + setup, 0, None))
+        cursor += setup
+        eventos.append(('fim_setup', cursor, cursor, 0, None))
+        quantidade = 0
+        for _ in range(rnd.randint(1, 3)):
+            bloco = timedelta(minutes=rnd.randint(30, 150))
+            quantidade += rnd.randint(5, 60)
+            eventos.append(('inicio_producao', cursor, cursor + bloco, quantidade, None))
+            cursor += bloco
+            if rnd.random() < 0.4:
+                pausa = timedelta(minutes=rnd.randint(5, 40))
+                eventos.append(('pausa', cursor, cursor + pausa, quantidade, rnd.choice(MOTIVOS_PAUSA)))
+                cursor += pausa
+        eventos.append(('fim_producao', cursor, cursor, quantidade, None))
+        cursor += timedelta(minutes=rnd.randint(5, 30))
+    return eventos
+
+
+def gerar_fabrica(db, tamanho='pequeno', semente=42, agora=None):
+    """
+    Popula o banco (vazio) com uma fábrica sintética determinística.
+
+    Retorna um dict com a quantidade de linhas geradas por entidade.
+    """
+    from models import (Usuario, Cliente, UnidadeEntrega, Trabalho, KanbanLista, Item, ItemComposto,
+                        ItemTrabalho, Pedido, OrdemServico, PedidoOrdemServico, CartaoFantasma,
+                        ApontamentoProducao, StatusProducaoOS, EstoquePecas, KanbanAlteracao, local_now_naive)
+
+    cfg = TAMANHOS[tamanho] if isinstance(tamanho, str) else dict(tamanho)
+    rnd = random.Random(semente)
+    agora = agora or local_now_naive()
+    hoje = agora.date()
+    contagem = {}
+
+    # Usuários: id 1 é o admin usado pelo benchmark
+    usuarios = [{'id': 1, 'nome': 'Admin Bench', 'email': 'admin@acbusinagem.com.br', 'senha_hash': 'x',
+                 'nivel_acesso': 'admin', 'acesso_kanban': True, 'acesso_estoque': True, 'acesso_pedidos': True,
+                 'acesso_cadastros': True, 'acesso_valores_itens': True, 'pode_finalizar_os': True}]
+    for i in range(cfg['operadores']):
+        usuarios.append({'id': i + 2, 'nome': f'Operador {i + 1}', 'email': f'operador{i + 1}@bench.local',
+                         'senha_hash': 'x', 'nivel_acesso': 'usuario', 'acesso_kanban': True,
+                         'codigo_operador': f'{1000 + i}'})
+    _inserir(db, Usuario, usuarios)
+    operadores = [u['id'] for u in usuarios[1:]] or [1]
+    contagem['usuarios'] = len(usuarios)
+
+    clientes = [{'id': i + 1, 'nome': f'Cliente {i + 1:04d}'} for i in range(cfg['clientes'])]
+    unidades = [{'id': i + 1, 'nome': f'Unidade {i + 1:04d}', 'cliente_id': i + 1} for i in range(cfg['clientes'])]
+    _inserir(db, Cliente, clientes)
+    _inserir(db, UnidadeEntrega, unidades)
+    contagem['clientes'] = len(clientes)
+
+    trabalhos = []
+    for i, tipo in enumerate(TIPOS_SERVICO * 2):
+        trabalhos.append({'id': i + 1, 'nome': f'{tipo} {i // len(TIPOS_SERVICO) + 1}', 'categoria': tipo})
+    _inserir(db, Trabalho, trabalhos)
+
+    # Listas: Entrada, máquinas e Expedição
+    listas = [{'id': 1, 'nome': 'Entrada', 'ordem': 0, 'tipo_servico': None, 'ativa': True, 'cor': '#6c757d'}]
+    for i in range(max(1, cfg['listas'] - 2)):
+        tipo = TIPOS_SERVICO[i % len(TIPOS_SERVICO)]
+        listas.append({'id': i + 2, 'nome': f'{tipo.upper()} {i + 1:02d}', 'ordem': i + 1, 'tipo_servico': tipo,
+                       'ativa': True, 'cor': '#%06x' % rnd.randint(0, 0xFFFFFF)})
+    listas.append({'id': len(listas) + 1, 'nome': 'Expedição', 'ordem': len(listas), 'tipo_servico': None,
+                   'ativa': True, 'cor': '#198754'})
+    _inserir(db, KanbanLista, listas)
+    maquinas = [l for l in listas if l['tipo_servico']]
+    contagem['listas'] = len(listas)
+
+    # Itens, itens compostos e trabalhos de cada item
+    itens, item_trabalhos, compostos = [], [], []
+    n_compostos = int(cfg['itens'] * cfg['compostos'])
+    it_id = 0
+    for i in range(cfg['itens']):
+        it_id += 1
+        eh_composto = i < n_compostos
+        itens.append({
+            'id': it_id, 'nome': f'Item sintético {i + 1:06d}', 'codigo_acb': f'ACB-{i + 1:06d}',
+            'valor_item': round(rnd.uniform(10, 2000), 2), 'valor_material': round(rnd.uniform(1, 500), 2),
+            'outros_custos': round(rnd.uniform(0, 100), 2), 'imposto_percentual': rnd.choice([0, 6, 12, 18]),
+            'peso': round(rnd.uniform(0.1, 30), 3), 'eh_composto': eh_composto, 'tipo_item': 'producao',
+            'data_criacao': agora - timedelta(days=rnd.randint(0, 900)),
+        })
+        for trab_id in rnd.sample([t['id'] for t in trabalhos], rnd.randint(1, 3)):
+            item_trabalhos.append({'item_id': it_id, 'trabalho_id': trab_id,
+                                   'tempo_setup': rnd.randint(5, 60) * 60, 'tempo_peca': rnd.randint(20, 900)})
+    simples = list(range(n_compostos + 1, cfg['itens'] + 1)) or [1]
+    for pai in range(1, n_compostos + 1):
+        for comp in rnd.sample(simples, min(len(simples), rnd.randint(2, 4))):
+            compostos.append({'item_pai_id': pai, 'item_componente_id': comp, 'quantidade': rnd.randint(1, 4)})
+    _inserir(db, Item, itens)
+    _inserir(db, ItemTrabalho, item_trabalhos)
+    _inserir(db, ItemComposto, compostos)
+    contagem.update(itens=len(itens), itens_compostos=n_compostos, item_trabalhos=len(item_trabalhos))
+    trabalhos_do_item = {}
+    for it in item_trabalhos:
+        trabalhos_do_item.setdefault(it['item_id'], []).append(it['trabalho_id'])
+
+    # Pedidos
+    pedidos = []
+    for i in range(cfg['pedidos']):
+        cliente = rnd.randint(1, cfg['clientes'])
+        entrada = hoje - timedelta(days=rnd.randint(0, 30 * cfg['meses'] + 30))
+        entregue = rnd.random() < 0.55
+        pedidos.append({
+            'id': i + 1, 'cliente_id': cliente, 'unidade_entrega_id': cliente, 'item_id': rnd.randint(1, cfg['itens']),
+            'quantidade': rnd.randint(1, 500), 'data_entrada': entrada, 'numero_pedido': f'PED-{i + 1:06d}',
+            'numero_pedido_cliente': f'OC{rnd.randint(10000, 99999)}',
+            'previsao_entrega': entrada + timedelta(days=rnd.randint(5, 45)),
+            'data_entrega': (entrada + timedelta(days=rnd.randint(3, 40))) if entregue else None,
+            'material_comprado': rnd.random() < 0.7, 'cancelado': rnd.random() < 0.02,
+        })
+    _inserir(db, Pedido, pedidos)
+    contagem['pedidos'] = len(pedidos)
+
+    # Ordens de serviço (1..3 pedidos cada) distribuídas pelas listas
+    ordens, vinculos = [], []
+    posicoes = {}
+    pedidos_livres = list(range(1, len(pedidos) + 1))
+    rnd.shuffle(pedidos_livres)
+    for i in range(cfg['os']):
+        r = rnd.random()
+        if r < 0.45:
+            lista = 'Finalizado'
+        elif r < 0.55:
+            lista = 'Entrada'
+        elif r < 0.62:
+            lista = 'Expedição'
+        else:
+            lista = rnd.choice(maquinas)['nome']
+        posicoes[lista] = posicoes.get(lista, 0) + 1
+        ordens.append({'id': i + 1, 'numero': f'OS-{i + 1:06d}', 'status': lista, 'posicao': posicoes[lista],
+                       'data_criacao': hoje - timedelta(days=rnd.randint(0, 30 * cfg['meses'])),
+                       'data_atualizacao': agora - timedelta(minutes=rnd.randint(0, 60 * 24 * 30))})
+        for _ in range(rnd.randint(1, 3)):
+            if not pedidos_livres:
+                break
+            vinculos.append({'pedido_id': pedidos_livres.pop(), 'ordem_servico_id': i + 1})
+    _inserir(db, OrdemServico, ordens)
+    _inserir(db, PedidoOrdemServico, vinculos)
+    contagem.update(ordens_servico=len(ordens), pedido_os=len(vinculos))
+    item_da_os = {}
+    for v in vinculos:
+        item_da_os.setdefault(v['ordem_servico_id'], pedidos[v['pedido_id'] - 1]['item_id'])
+
+    # Cartões fantasma
+    fantasmas = []
+    abertas = [o for o in ordens if o['status'] not in ('Finalizado', 'Expedição')]
+    for o in rnd.sample(abertas, int(len(abertas) * cfg['fantasmas'])):
+        lista = rnd.choice(maquinas)
+        trabs = trabalhos_do_item.get(item_da_os.get(o['id']), [None])
+        fantasmas.append({'ordem_servico_id': o['id'], 'lista_kanban': lista['nome'], 'posicao_fila': len(fantasmas) + 1,
+                          'ativo': True, 'trabalho_id': rnd.choice(trabs), 'criado_por_id': 1,
+                          'data_criacao': agora - timedelta(days=rnd.randint(0, 20))})
+    _inserir(db, CartaoFantasma, fantasmas)
+    contagem['cartoes_fantasma'] = len(fantasmas)
+
+    # Log de alterações do Kanban (o insert em lote não passa pelos eventos da sessão)
+    # (últimas 48h, dentro da retenção do log)
+    alteracoes = [{'entidade': 'cartao', 'entidade_id': o['id'], 'operacao': 'upsert'} for o in ordens]
+    alteracoes += [{'entidade': 'fantasma', 'entidade_id': i + 1, 'operacao': 'upsert'} for i in range(len(fantasmas))]
+    momentos = sorted(agora - timedelta(seconds=rnd.randint(60, 2 * 86400)) for _ in alteracoes)
+    for alteracao, momento in zip(alteracoes, momentos):
+        alteracao['data_criacao'] = momento
+    _inserir(db, KanbanAlteracao, alteracoes)
+
+    # Histórico de apontamentos (dias úteis) por máquina
+    ordens_por_lista = {}
+    for o in ordens:
+        if o['id'] in item_da_os:
+            ordens_por_lista.setdefault(o['status'], []).append(o['id'])
+    todas_com_item = [o['id'] for o in ordens if o['id'] in item_da_os]
+    apontamentos = []
+    inicio = datetime.combine(hoje - timedelta(days=30 * cfg['meses']), datetime.min.time())
+    dia = inicio
+    while dia.date() < hoje:
+        if dia.weekday() < 5:
+            for lista in maquinas:
+                operador = rnd.choice(operadores)
+                candidatas = ordens_por_lista.get(lista['nome']) or todas_com_item
+                os_id = None
+                for tipo, ini, fim, qtd, motivo in _sessoes_do_dia(rnd, dia):
+                    if tipo == 'inicio_setup' or os_id is None:
+                        os_id = rnd.choice(candidatas)
+                        item_id = item_da_os[os_id]
+                        trabalho_id = rnd.choice(trabalhos_do_item.get(item_id) or [trabalhos[0]['id']])
+                    apontamentos.append({
+                        'ordem_servico_id': os_id, 'usuario_id': operador, 'operador_id': operador,
+                        'item_id': item_id, 'trabalho_id': trabalho_id, 'tipo_acao': tipo, 'data_hora': ini,
+                        'data_fim': fim, 'tempo_decorrido': int((fim - ini).total_seconds()),
+                        'quantidade': qtd, 'motivo_parada': motivo, 'lista_kanban': lista['nome'],
+                    })
+        dia += timedelta(days=1)
+
+    # Estado atual: ~70% das máquinas com OS em andamento (apontamento aberto + status)
+    status_rows = []
+    for lista in maquinas:
+        candidatas = ordens_por_lista.get(lista['nome'])
+        if not candidatas or rnd.random() < 0.3:
+            continue
+        os_id = rnd.choice(candidatas)
+        if any(s['ordem_servico_id'] == os_id for s in status_rows):
+            continue
+        item_id = item_da_os[os_id]
+        trabalho_id = rnd.choice(trabalhos_do_item.get(item_id) or [trabalhos[0]['id']])
+        operador = rnd.choice(operadores)
+        t0 = agora - timedelta(minutes=rnd.randint(20, 240))
+        tipo, status = rnd.choice([('inicio_setup', 'Setup em andamento'),
+                                   ('inicio_producao', 'Produção em andamento'),
+                                   ('pausa', 'Pausado')])
+        quantidade = 0 if tipo == 'inicio_setup' else rnd.randint(1, 80)
+        apontamentos.append({
+            'ordem_servico_id': os_id, 'usuario_id': operador, 'operador_id': operador, 'item_id': item_id,
+            'trabalho_id': trabalho_id, 'tipo_acao': tipo, 'data_hora': t0, 'data_fim': None,
+            'quantidade': quantidade, 'motivo_parada': rnd.choice(MOTIVOS_PAUSA) if tipo == 'pausa' else None,
+            'lista_kanban': lista['nome'],
+        })
+        status_rows.append({'ordem_servico_id': os_id, 'status_atual': status, 'operador_atual_id': operador,
+                            'item_atual_id': item_id, 'trabalho_atual_id': trabalho_id, 'inicio_acao': t0,
+                            'quantidade_atual': quantidade,
+                            'motivo_pausa': apontamentos[-1]['motivo_parada']})
+    _inserir(db, ApontamentoProducao, apontamentos)
+    _inserir(db, StatusProducaoOS, status_rows)
+    contagem.update(apontamentos=len(apontamentos), os_em_andamento=len(status_rows))
+
+    # Estoque de peças espalhado pelas estantes
+    estoque = []
+    for i in range(cfg['estoque']):
+        estoque.append({'item_id': rnd.randint(1, cfg['itens']), 'quantidade': rnd.randint(0, 300),
+                        'data_entrada': hoje - timedelta(days=rnd.randint(0, 365)),
+                        'estante': rnd.randint(1, 8), 'secao': rnd.randint(1, 4), 'linha': rnd.randint(1, 2),
+                        'coluna': rnd.randint(1, 6), 'permitir_compartilhado': rnd.random() < 0.2})
+    _inserir(db, EstoquePecas, estoque)
+    contagem['estoque_pecas'] = len(estoque)
+
+    # Inserts diretos não passam pelos eventos que mantêm o resumo de tempos
+    from utils.resumo_apontamentos import reconstruir
+    contagem['apontamento_resumo'] = reconstruir(db.session.connection())
+
+    _ajustar_sequencias(db, [Usuario, Cliente, UnidadeEntrega, Trabalho, KanbanLista, Item, Pedido, OrdemServico])
+    db.session.commit()
+    return contagem
+
+
+# ---------------------------------------------------------------------------
+# Medição
+# ---------------------------------------------------------------------------
+
+class ContadorQueries:
+    """Conta statements executados no engine (inclusive em threads de background)"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.total = 0
+        event.listen(engine, 'before_cursor_execute', self._contar)
+
+    def _contar(self, *args, **kwargs):
+        self.total += 1
+
+
+def percentil(valores, p):
+    """Percentil com interpolação linear (p em 0..100)"""
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100.0
+    baixo = int(k)
+    alto = min(baixo + 1, len(ordenados) - 1)
+    return ordenados[baixo] + (ordenados[alto] - ordenados[baixo]) * (k - baixo)
+
+
+def medir_cenario(executar, contador, iteracoes=10, aquecimento=1):
+    """Roda ``executar()`` (retorna status HTTP) e devolve latências, queries e pico de memória"""
+    for _ in range(aquecimento):
+        executar()
+
+    latencias, queries, status = [], [], set()
+    for _ in range(iteracoes):
+        antes = contador.total
+        t0 = time.perf_counter()
+        status.add(executar())
+        latencias.append((time.perf_counter() - t0) * 1000)
+        queries.append(contador.total - antes)
+
+    # Passada separada com tracemalloc (ele deixa a execução mais lenta)
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        executar()
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iteracoes': iteracoes,
+        'p50_ms': round(percentil(latencias, 50), 2),
+        'p95_ms': round(percentil(latencias, 95), 2),
+        'min_ms': round(min(latencias), 2),
+        'max_ms': round(max(latencias), 2),
+        'media_ms': round(statistics.mean(latencias), 2),
+        'queries': max(queries),
+        'queries_min': min(queries),
+        'pico_memoria_kb': round(pico / 1024, 1),
+        'status': sorted(status),
+    }
+
+
+def _exportar_valores_itens(client):
+    """Fluxo completo da exportação: dispara o job, acompanha o status e baixa a planilha"""
+    headers = {'X-Requested-With': 'XMLHttpRequest'}
+    resp = client.get('/itens/valores/exportar', headers=headers)
+    dados = resp.get_json(silent=True) or {}
+    if resp.status_code != 200 or not dados.get('ok'):
+        return resp.status_code
+    limite = time.time() + 300
+    while time.time() < limite:
+        status = client.get(dados['status_url']).get_json(silent=True) or {}
+        if status.get('pronto') or status.get('erro'):
+            break
+        time.sleep(0.05)
+    return client.get(dados['download_url']).status_code
+
+
+def cenarios_padrao(hoje):
+    """Nome -> função(client) que executa o cenário e retorna o status HTTP"""
+    seq = {}
+
+    def _full_data(c):
+        resp = c.get('/kanban/full-data')
+        seq['valor'] = (resp.get_json(silent=True) or {}).get('seq')
+        return resp.status_code
+
+    def _sync(c):
+        since = seq.get('valor') or 0
+        return c.get(f'/kanban/sync?since={max(0, since - 200)}').status_code
+
+    def _status_ativos_frio(c):
+        # Sem o estado materializado: mede a reconstrução de todos os cartões
+        from utils.estado_chao_fabrica import estado_chao_fabrica
+        estado_chao_fabrica.invalidar_tudo()
+        return c.get('/apontamento/status-ativos').status_code
+
+    return {
+        'status_ativos': lambda c: c.get('/apontamento/status-ativos').status_code,
+        'status_ativos_frio': _status_ativos_frio,
+        'kanban_full_data': _full_data,
+        'kanban_sync': _sync,
+        'dashboard_timeline': lambda c: c.get(f'/dashboard/apontamentos/timeline?data={hoje}').status_code,
+        'estoque_mapa': lambda c: c.get('/estoque-pecas/mapa?estante=1').status_code,
+        'itens_exportar_valores': _exportar_valores_itens,
+    }
+
+
+def preparar_app(db_url):
+    """Cria o app apontando para o banco descartável (sem as checagens de inicialização)"""
+    os.environ['DATABASE_URL'] = db_url
+    os.environ.pop('FORCE_SQLITE', None)
+    os.environ.setdefault('SKIP_DB_CHECKS', '1')
+    os.environ.setdefault('SSE_ATIVO', '0')
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    app.testing = True
+    return app, db
+
+
+def cliente_autenticado(app):
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess.update({
+            'usuario_id': 1, 'usuario_nome': 'Admin Bench', 'usuario_nivel': 'admin',
+            'usuario_email': 'admin@acbusinagem.com.br', 'acesso_kanban': True, 'acesso_pedidos': True,
+            'acesso_estoque': True, 'acesso_cadastros': True, 'acesso_valores_itens': True,
+            'pode_finalizar_os': True,
+        })
+    return client
+
+
+def _commit_atual():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except Exception:
+        return None
+
+
+def comparar(atual, anterior):
+    """Tabela de variação p50/p95/queries entre dois resultados"""
+    linhas = [f"{'cenário':<26}{'p50 antes':>11}{'p50 agora':>11}{'Δ%':>8}{'p95 Δ%':>9}{'queries':>12}"]
+    for nome, dados in atual.get('cenarios', {}).items():
+        base = anterior.get('cenarios', {}).get(nome)
+        if not base or 'erro' in dados or 'erro' in base:
+            continue
+
+        def _delta(chave):
+            return ((dados[chave] - base[chave]) / base[chave] * 100) if base[chave] else 0.0
+
+        linhas.append(
+            f"{nome:<26}{base['p50_ms']:>11.1f}{dados['p50_ms']:>11.1f}{_delta('p50_ms'):>+8.1f}"
+            f"{_delta('p95_ms'):>+9.1f}{base['queries']:>6}→{dados['queries']:<5}"
+        )
+    return '\n'.join(linhas)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark dos endpoints quentes com fábrica sintética')
+    parser.add_argument('--tamanho', choices=sorted(TAMANHOS), default='pequeno')
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--db', default=None,
+                        help='URL do banco descartável (padrão: SQLite em diretório temporário)')
+    parser.add_argument('--recriar', action='store_true', help='Apaga e recria todas as tabelas antes de gerar')
+    parser.add_argument('--reusar', action='store_true', help='Usa os dados já existentes no banco (não gera)')
+    parser.add_argument('-n', '--iteracoes', type=int, default=10)
+    parser.add_argument('--aquecimento', type=int, default=1)
+    parser.add_argument('--cenarios', default=None, help='Lista separada por vírgula (padrão: todos)')
+    parser.add_argument('--saida', default=None, help='Arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--comparar', default=None, help='JSON de uma execução anterior para comparar')
+    args = parser.parse_args()
+
+    db_url = args.db or 'sqlite:///' + os.path.join(tempfile.gettempdir(), f'bench_fabrica_{args.tamanho}.db')
+    if db_url == (os.getenv('DATABASE_URL') or '') and not args.reusar:
+        parser.error('--db aponta para DATABASE_URL do ambiente; use um banco descartável')
+    if db_url.startswith('sqlite:///') and not args.reusar and not args.db:
+        caminho = db_url[len('sqlite:///'):]
+        if os.path.exists(caminho):
+            os.remove(caminho)
+
+    app, db = preparar_app(db_url)
+    with app.app_context():
+        if args.recriar:
+            db.drop_all()
+        db.create_all()
+
+        from models import Item
+        contagem = None
+        if not args.reusar:
+            if db.session.query(Item.id).first() is not None:
+                parser.error('O banco já tem dados; use --recriar para apagar ou --reusar para medir como está')
+            t0 = time.perf_counter()
+            contagem = gerar_fabrica(db, args.tamanho, args.semente)
+            contagem['geracao_s'] = round(time.perf_counter() - t0, 2)
+            print(f"Fábrica '{args.tamanho}' gerada em {contagem['geracao_s']}s: "
+                  + ', '.join(f'{k}={v}' for k, v in contagem.items() if k != 'geracao_s'), file=sys.stderr)
+        contador = ContadorQueries(db.engine)
+
+    client = cliente_autenticado(app)
+    cenarios = cenarios_padrao(datetime.now().strftime('%Y-%m-%d'))
+    if args.cenarios:
+        escolhidos = [c.strip() for c in args.cenarios.split(',') if c.strip()]
+        cenarios = {k: v for k, v in cenarios.items() if k in escolhidos}
+
+    resultados = {}
+    for nome, executar in cenarios.items():
+        try:
+            resultados[nome] = medir_cenario(lambda: executar(client), contador, args.iteracoes, args.aquecimento)
+            r = resultados[nome]
+            print(f"{nome:<26} p50={r['p50_ms']:>9.1f}ms p95={r['p95_ms']:>9.1f}ms "
+                  f"queries={r['queries']:>5} pico={r['pico_memoria_kb']:>9.1f}KB status={r['status']}",
+                  file=sys.stderr)
+        except Exception as e:
+            resultados[nome] = {'erro': str(e)}
+            print(f"{nome:<26} ERRO: {e}", file=sys.stderr)
+
+    saida = {
+        'meta': {
+            'commit': _commit_atual(),
+            'gerado_em': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'banco': db_url.split(':', 1)[0],
+            'tamanho': args.tamanho,
+            'semente': args.semente,
+            'iteracoes': args.iteracoes,
+            'rss_max_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        },
+        'dados': contagem,
+        'cenarios': resultados,
+    }
+
+    texto = json.dumps(saida, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding='utf-8') as f:
+            print('\n' + comparar(saida, json.load(f)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -49,13 +49,33 @@ def main():
     parser.add_argument("--status", default=None, help="Filter by status (comma-separated)")
     parser.add_argument("-n", "--iterations", type=int, default=1, help="Number of iterations")
     parser.add_argument("--print-json", action="store_true", help="Print a sample of the JSON (first card only)")
+    parser.add_argument("--sintetico", choices=["pequeno", "medio", "grande"], default=None,
+                        help="Generate a seeded synthetic shop in a scratch SQLite DB instead of using DATABASE_URL")
+    parser.add_argument("--semente", type=int, default=42, help="Seed for --sintetico")
+    parser.add_argument("--json", dest="saida_json", default=None,
+                        help="Write p50/p95/query-count summary as JSON to this file ('-' for stdout)")
 
     args = parser.parse_args()
 
+    contador = None
     t_app0 = time.perf_counter()
-    app = create_app()
+    if args.sintetico:
+        import tempfile
+        import bench_fabrica
+
+        db_path = os.path.join(tempfile.gettempdir(), f"bench_status_ativos_{args.sintetico}.db")
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        app, db = bench_fabrica.preparar_app(f"sqlite:///{db_path}")
+        with app.app_context():
+            db.create_all()
+            dados = bench_fabrica.gerar_fabrica(db, args.sintetico, args.semente)
+            contador = bench_fabrica.ContadorQueries(db.engine)
+        print(f"Synthetic shop '{args.sintetico}': {dados}")
+    else:
+        app = create_app()
+        app.testing = True
     app_start_ms = int((time.perf_counter() - t_app0) * 1000)
-    app.testing = True
 
     params = {
         "timing": "1",
@@ -66,9 +86,17 @@ def main():
 
     results = []
     print(f"App startup: {app_start_ms} ms (SKIP_DB_CHECKS={os.getenv('SKIP_DB_CHECKS')})")
-    with app.test_client() as client:
+    if args.sintetico:
+        import bench_fabrica
+        client_ctx = bench_fabrica.cliente_autenticado(app)
+    else:
+        client_ctx = app.test_client()
+    with client_ctx as client:
         for i in range(args.iterations):
+            antes = contador.total if contador else None
             res = run_once(client, params)
+            if contador:
+                res["queries"] = contador.total - antes
             results.append(res)
             if not res.get("ok"):
                 print(f"[{i+1}] ERROR status={res.get('status_code')} client_total_ms={res['client_total_ms']} msg={res.get('error')}")
@@ -101,6 +129,26 @@ def main():
                     continue
                 print(f"  {k}: min={min(vals)} avg={int(sum(vals)/len(vals))} max={max(vals)}")
 
+        if args.saida_json and oks:
+            import bench_fabrica
+            totais = [r["timings"]["client_total_ms"] for r in oks]
+            resumo = {
+                "sintetico": args.sintetico,
+                "semente": args.semente if args.sintetico else None,
+                "iteracoes": len(oks),
+                "n_cards": oks[-1].get("n_cards"),
+                "p50_ms": round(bench_fabrica.percentil(totais, 50), 2),
+                "p95_ms": round(bench_fabrica.percentil(totais, 95), 2),
+                "queries": max((r["queries"] for r in oks if "queries" in r), default=None),
+                "timings_ultima": oks[-1].get("timings"),
+            }
+            texto = json.dumps(resumo, ensure_ascii=False, indent=2)
+            if args.saida_json == "-":
+                print(texto)
+            else:
+                with open(args.saida_json, "w", encoding="utf-8") as f:
+                    f.write(texto)
+
         if args.print_json and oks:
             sample = oks[0]
             # fetch full JSON for first run again to print sample
@@ -0,0 +1,36 @@
+"""
+Configuração do gunicorn para servidor próprio (no Vercel não é usada)
+
+O canal de tempo real (/tempo-real/stream) mantém a resposta aberta por até
+SSE_MAX_DURACAO_S. Com o worker ``sync`` padrão cada tela conectada prende um
+worker inteiro, e poucas telas esgotam o pool. Por isso os workers usam
+threads (``gthread``): um stream ocupa uma thread, e no máximo
+``SSE_MAX_CONEXOES`` threads por processo (padrão: metade das threads) ficam
+com streams; o resto atende as demais rotas. Acima do limite o cliente
+continua no polling do /kanban/sync.
+
+Uso:
+    gunicorn -c gunicorn.conf.py run:app
+
+Variáveis: GUNICORN_WORKERS (padrão 2 × CPUs + 1), GUNICORN_THREADS (padrão 8),
+GUNICORN_WORKER_CLASS (``gthread``; ``gevent`` se instalado), PORT.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+if worker_class == 'gevent':
+    # Greenlets: streams ociosos custam pouco, o limite pode ser bem maior
+    worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '1000'))
+    os.environ.setdefault('SSE_MAX_CONEXOES', str(max(1, worker_connections // 2)))
+else:
+    os.environ.setdefault('SSE_MAX_CONEXOES', str(max(1, threads // 2)))
+
+# Streams SSE ficam abertos até SSE_MAX_DURACAO_S; o timeout do worker precisa ser maior
+timeout = max(int(os.getenv('GUNICORN_TIMEOUT', '60')), int(os.getenv('SSE_MAX_DURACAO_S', '120')) + 30)
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,195 @@
+"""
+Migração: índices compostos e parciais para apontamento_producao
+
+Cobre os formatos de consulta dos caminhos quentes:
+- apontamentos abertos (data_fim IS NULL) por OS/item/trabalho, por operador e por lista;
+- varreduras por janela de tempo (data_hora) por combinação OS/item/trabalho e por lista.
+
+Em PostgreSQL os índices são criados com CONCURRENTLY (sem bloquear escrita);
+índices que ficaram inválidos por uma criação interrompida são descartados e
+recriados. Um advisory lock (pg_try_advisory_lock) garante que só um worker
+cria índices por vez; os demais seguem o start sem esperar.
+Roda a cada start: com todos os índices presentes e válidos faz só uma
+consulta ao catálogo (sem DDL nem ANALYZE); ANALYZE só depois de criar algum.
+
+Uso manual:
+    python migrations/add_apontamento_indexes.py
+"""
+import os
+import sys
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TABELA = 'apontamento_producao'
+
+# Chave do advisory lock que impede dois workers de criar os índices ao mesmo tempo
+_CHAVE_LOCK = 730_009_001
+
+# nome -> (colunas, predicado parcial, colunas INCLUDE apenas PostgreSQL)
+INDICES = [
+    # _query_apontamento_aberto, fechar/resetar apontamento, _obter_estados_batch (IN por OS)
+    ('ix_apontamento_aberto_combo',
+     ['ordem_servico_id', 'item_id', 'trabalho_id', 'tipo_acao'], 'data_fim IS NULL',
+     ['usuario_id', 'data_hora']),
+    # _buscar_apontamento_aberto_operador (usuario + tipo IN, ORDER BY data_hora DESC)
+    ('ix_apontamento_aberto_usuario',
+     ['usuario_id', 'tipo_acao', 'data_hora'], 'data_fim IS NULL', None),
+    # Dashboard: máquinas ativas por lista
+    ('ix_apontamento_aberto_lista',
+     ['lista_kanban', 'tipo_acao'], 'data_fim IS NULL', None),
+    # Monitoramento (setup aberto há muito tempo) e gerenciar ativos
+    ('ix_apontamento_aberto_tipo_data',
+     ['tipo_acao', 'data_hora'], 'data_fim IS NULL', None),
+    # Métricas do Stop e histórico por combinação numa janela de tempo
+    ('ix_apontamento_combo_data_hora',
+     ['ordem_servico_id', 'item_id', 'trabalho_id', 'data_hora'], None, None),
+    # Timeline do dashboard por lista
+    ('ix_apontamento_lista_data_hora',
+     ['lista_kanban', 'data_hora'], None, None),
+    # Varreduras por janela sem outro filtro (kanban, relatórios)
+    ('ix_apontamento_data_hora',
+     ['data_hora'], None, None),
+]
+
+
+def _is_postgres(db_engine):
+    return 'postgresql' in db_engine.dialect.name or 'postgres' in db_engine.dialect.name
+
+
+def sql_indice(nome, colunas, parcial=None, incluir=None, postgres=False, concorrente=False):
+    """Monta o CREATE INDEX IF NOT EXISTS para o dialeto."""
+    sql = "CREATE INDEX {}IF NOT EXISTS {} ON {} ({})".format(
+        'CONCURRENTLY ' if (postgres and concorrente) else '',
+        nome, TABELA, ', '.join(colunas),
+    )
+    if postgres and incluir:
+        sql += " INCLUDE ({})".format(', '.join(incluir))
+    if parcial:
+        sql += " WHERE {}".format(parcial)
+    return sql
+
+
+def _indices_invalidos_postgres(conn):
+    result = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        WHERE t.relname = :tabela AND NOT i.indisvalid
+    """), {'tabela': TABELA})
+    return {row[0] for row in result.fetchall()}
+
+
+@contextmanager
+def _conexao_com_lock(db_engine):
+    """
+    Conexão AUTOCOMMIT com o advisory lock da migração, ou None se outro
+    worker já está criando os índices (o lock é de sessão: CONCURRENTLY
+    não roda dentro de transação, então não dá para usar o _xact_).
+    """
+    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:chave)"), {'chave': _CHAVE_LOCK}).scalar():
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': _CHAVE_LOCK})
+
+
+def _indices_existentes(conn, postgres):
+    """Nomes dos índices válidos já criados em apontamento_producao"""
+    if postgres:
+        result = conn.execute(text("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_class t ON t.oid = i.indrelid
+            WHERE t.relname = :tabela AND i.indisvalid
+        """), {'tabela': TABELA})
+    else:
+        result = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabela"
+        ), {'tabela': TABELA})
+    return {row[0] for row in result.fetchall()}
+
+
+def upgrade(db_engine):
+    """Cria os índices de apontamento_producao que ainda não existem"""
+    try:
+        postgres = _is_postgres(db_engine)
+        nomes = {nome for nome, _, _, _ in INDICES}
+
+        if postgres:
+            # CONCURRENTLY não pode rodar dentro de transação
+            with _conexao_com_lock(db_engine) as conn:
+                if conn is None:
+                    logger.info(f"Índices de {TABELA} sendo criados por outro worker; seguindo")
+                    return True
+
+                faltando = [idx for idx in INDICES if idx[0] not in _indices_existentes(conn, True)]
+                if not faltando:
+                    logger.debug(f"Índices de {TABELA} já existem")
+                    return True
+
+                # Um CONCURRENTLY interrompido deixa o índice inválido; IF NOT EXISTS o pularia
+                for invalido in sorted(_indices_invalidos_postgres(conn) & nomes):
+                    logger.warning(f"Índice {invalido} inválido (criação interrompida); recriando...")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {invalido}"))
+
+                for nome, colunas, parcial, incluir in faltando:
+                    conn.execute(text(sql_indice(nome, colunas, parcial, incluir, postgres=True, concorrente=True)))
+                conn.execute(text(f"ANALYZE {TABELA}"))
+        else:  # SQLite
+            with db_engine.connect() as conn:
+                faltando = [idx for idx in INDICES if idx[0] not in _indices_existentes(conn, False)]
+                if not faltando:
+                    logger.debug(f"Índices de {TABELA} já existem")
+                    return True
+
+                for nome, colunas, parcial, incluir in faltando:
+                    conn.execute(text(sql_indice(nome, colunas, parcial, incluir)))
+                conn.execute(text(f"ANALYZE {TABELA}"))
+                conn.commit()
+
+        logger.info(f"✓ Índices de {TABELA} criados ({len(faltando)} de {len(INDICES)})")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao criar índices de {TABELA}: {str(e)}")
+        return False
+
+
+def downgrade(db_engine):
+    """Remove os índices criados por esta migração"""
+    try:
+        postgres = _is_postgres(db_engine)
+        opcoes = {'isolation_level': 'AUTOCOMMIT'} if postgres else {}
+        with db_engine.connect().execution_options(**opcoes) as conn:
+            for nome, _, _, _ in INDICES:
+                conn.execute(text("DROP INDEX {}IF EXISTS {}".format('CONCURRENTLY ' if postgres else '', nome)))
+            if not postgres:
+                conn.commit()
+        logger.info("✅ Migração revertida com sucesso!")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao reverter migração: {str(e)}")
+        return False
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+    logging.basicConfig(level=logging.INFO)
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if '--downgrade' in sys.argv:
+            downgrade(db.engine)
+        else:
+            upgrade(db.engine)
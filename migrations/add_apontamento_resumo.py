@@ -0,0 +1,72 @@
+"""
+Migração: tabela apontamento_resumo (tempos acumulados por OS/item/trabalho)
+
+Cria a tabela quando não existir e, se ela estiver vazia e houver
+apontamentos, preenche o resumo a partir do histórico. Depois disso o resumo
+é mantido pelos eventos da sessão (utils/resumo_apontamentos.py).
+
+Uso manual (recalcula tudo, útil após restaurar backup):
+    python migrations/add_apontamento_resumo.py --recalcular
+"""
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import func, inspect, select
+
+logger = logging.getLogger(__name__)
+
+
+def upgrade(db_engine, recalcular=False):
+    """Cria apontamento_resumo e faz o backfill inicial"""
+    try:
+        from models import ResumoApontamento, ApontamentoProducao
+        from utils.resumo_apontamentos import reconstruir
+
+        tabela = ResumoApontamento.__table__
+        if not inspect(db_engine).has_table(tabela.name):
+            logger.info("Criando tabela apontamento_resumo...")
+            tabela.create(db_engine, checkfirst=True)
+
+        with db_engine.begin() as conn:
+            if not recalcular:
+                if conn.execute(select(func.count()).select_from(tabela)).scalar():
+                    logger.info("✓ apontamento_resumo já preenchida")
+                    return True
+                if not conn.execute(select(ApontamentoProducao.__table__.c.id).limit(1)).first():
+                    logger.info("✓ Sem apontamentos para resumir")
+                    return True
+            combinacoes = reconstruir(conn)
+        logger.info(f"✅ apontamento_resumo preenchida ({combinacoes} combinações OS/item/trabalho)")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao preencher apontamento_resumo: {str(e)}")
+        return False
+
+
+def downgrade(db_engine):
+    """Remove a tabela apontamento_resumo"""
+    try:
+        with db_engine.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE IF EXISTS apontamento_resumo")
+        logger.info("✅ Migração revertida com sucesso!")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao reverter migração: {str(e)}")
+        return False
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if '--downgrade' in sys.argv:
+            downgrade(db.engine)
+        else:
+            upgrade(db.engine, recalcular='--recalcular' in sys.argv)
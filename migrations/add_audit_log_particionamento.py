@@ -0,0 +1,147 @@
+"""
+Migração: índices, particionamento (PostgreSQL) e tabela de arquivo (SQLite) do audit_log
+
+- Índices (entidade_tipo, entidade_id, data_criacao), (usuario_id, data_criacao)
+  e (data_criacao);
+- PostgreSQL: converte audit_log em tabela particionada por mês (o histórico
+  existente é anexado como partição, sem cópia) e cria as partições dos
+  próximos meses. ``AUDITORIA_PARTICIONAR=0`` mantém a tabela simples;
+- SQLite: cria audit_log_arquivo, que recebe os meses antigos.
+
+Roda a cada start: índices só são criados se faltarem (um índice inválido,
+sobra de um CONCURRENTLY interrompido, é descartado e recriado) e ANALYZE só
+roda depois de particionar ou criar algum índice. No PostgreSQL um advisory
+lock (pg_try_advisory_lock) deixa só um worker migrar; os demais seguem. As partições dos próximos meses
+são conferidas sempre (consulta barata quando já existem).
+
+O arquivamento em si fica em utils/auditoria_arquivo.py.
+
+Uso manual:
+    python migrations/add_audit_log_particionamento.py
+    python migrations/add_audit_log_particionamento.py --arquivar
+"""
+import os
+import sys
+import logging
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Chave do advisory lock da migração. Diferente de _CHAVE_LOCK de
+# utils/auditoria_arquivo: particionar() pega aquele em outra conexão.
+_CHAVE_LOCK = 730_009_002
+
+
+@contextmanager
+def _lock_migracao(db_engine):
+    """True com o advisory lock de sessão; False se outro worker já está migrando"""
+    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        if not conn.execute(text("SELECT pg_try_advisory_lock(:chave)"), {'chave': _CHAVE_LOCK}).scalar():
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': _CHAVE_LOCK})
+
+
+def _indices_postgres(conn, tabela, validos):
+    """Nomes dos índices válidos (ou inválidos) da tabela no schema corrente"""
+    return set(conn.execute(text(
+        "SELECT c.relname FROM pg_index i "
+        "JOIN pg_class c ON c.oid = i.indexrelid "
+        "JOIN pg_class t ON t.oid = i.indrelid "
+        "JOIN pg_namespace n ON n.oid = t.relnamespace "
+        "WHERE n.nspname = current_schema() AND t.relname = :tabela AND i.indisvalid = :validos"
+    ), {'tabela': tabela, 'validos': validos}).scalars().all())
+
+
+def _nome_indice(sql):
+    return sql.split(' IF NOT EXISTS ', 1)[1].split(' ', 1)[0]
+
+
+def _indices_faltando(conn, tabela, postgres):
+    """CREATE INDEX de ``sql_indices`` cujos índices ainda não existem (ou estão inválidos)"""
+    from utils.auditoria_arquivo import sql_indices
+
+    if postgres:
+        existentes = _indices_postgres(conn, tabela, True)
+    else:
+        existentes = conn.execute(text(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :tabela"
+        ), {'tabela': tabela}).scalars().all()
+    return [sql for sql in sql_indices(tabela) if _nome_indice(sql) not in existentes]
+
+
+def upgrade(db_engine):
+    """Cria índices/partições (PostgreSQL) ou a tabela de arquivo (SQLite) do audit_log"""
+    try:
+        from utils.auditoria_arquivo import (
+            TABELA, TABELA_ARQUIVO, garantir_particoes, is_postgres, particionada, particionar, tabela_arquivo,
+        )
+
+        if not inspect(db_engine).has_table(TABELA):
+            logger.info(f"✓ {TABELA} ainda não existe")
+            return True
+
+        if is_postgres(db_engine):
+            with _lock_migracao(db_engine) as travado:
+                if not travado:
+                    logger.info(f"{TABELA} sendo migrada por outro worker; seguindo")
+                    return True
+
+                with db_engine.connect() as conn:
+                    ja_particionada = particionada(conn)
+                    faltando = _indices_faltando(conn, TABELA, True)
+                    invalidos = _indices_postgres(conn, TABELA, False) & {_nome_indice(sql) for sql in faltando}
+                alterou = False
+                if not ja_particionada and os.getenv('AUDITORIA_PARTICIONAR', '1') != '0':
+                    alterou = bool(particionar(db_engine))
+                else:
+                    if faltando:
+                        # CONCURRENTLY não pode rodar dentro de transação (nem em tabela particionada)
+                        concorrente = '' if ja_particionada else 'CONCURRENTLY '
+                        with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                            # IF NOT EXISTS pularia o índice inválido deixado por um CONCURRENTLY interrompido
+                            for nome in sorted(invalidos):
+                                logger.warning(f"Índice {nome} inválido (criação interrompida); recriando...")
+                                conn.execute(text(f"DROP INDEX {concorrente}IF EXISTS {nome}"))
+                            for sql in faltando:
+                                conn.execute(text(sql.replace('CREATE INDEX ', f'CREATE INDEX {concorrente}', 1)))
+                        alterou = True
+                    garantir_particoes(db_engine)
+                if alterou:
+                    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                        conn.execute(text(f"ANALYZE {TABELA}"))
+        else:  # SQLite
+            tabela_arquivo().create(db_engine, checkfirst=True)
+            with db_engine.begin() as conn:
+                faltando = _indices_faltando(conn, TABELA, False) + _indices_faltando(conn, TABELA_ARQUIVO, False)
+                for sql in faltando:
+                    conn.execute(text(sql))
+            alterou = bool(faltando)
+
+        logger.info(f"✓ {TABELA}: índices/partições verificados" + (' (alterados)' if alterou else ''))
+        return True
+    except Exception as e:
+        logger.error(f"Erro na migração de particionamento do audit_log: {str(e)}")
+        return False
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if '--arquivar' in sys.argv:
+            from utils.auditoria_arquivo import arquivar
+            print(arquivar(db.engine))
+        else:
+            upgrade(db.engine)
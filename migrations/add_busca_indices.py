@@ -0,0 +1,207 @@
+"""
+Migração: índices de busca (itens, pedidos, OS e orçamentos)
+
+PostgreSQL:
+- extensão pg_trgm e índices GIN gin_trgm_ops nas colunas de código e nome,
+  que atendem ILIKE '%termo%' sem varrer a tabela;
+- índice GIN tsvector ('simple') no nome do item, para buscas por palavras.
+  Criados com CONCURRENTLY; índices inválidos de uma criação interrompida
+  são recriados. Sem permissão para CREATE EXTENSION, só o tsvector é criado.
+
+SQLite:
+- tabela FTS5 busca_indice (tokenizer trigram) e triggers de
+  insert/update/delete em cada tabela de origem; preenchida na primeira vez.
+
+Uso manual (recria a FTS do zero no SQLite):
+    python migrations/add_busca_indices.py --recriar
+"""
+import os
+import sys
+import logging
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+# (nome, tabela, coluna) indexados com gin_trgm_ops
+INDICES_TRGM = [
+    ('ix_busca_item_codigo_trgm', 'item', 'codigo_acb'),
+    ('ix_busca_item_nome_trgm', 'item', 'nome'),
+    ('ix_busca_pedido_numero_trgm', 'pedido', 'numero_pedido'),
+    ('ix_busca_pedido_numero_cliente_trgm', 'pedido', 'numero_pedido_cliente'),
+    ('ix_busca_pedido_nome_item_trgm', 'pedido', 'nome_item'),
+    ('ix_busca_os_numero_trgm', 'ordem_servico', 'numero'),
+    ('ix_busca_orcamento_numero_trgm', 'orcamento', 'numero'),
+    ('ix_busca_orcamento_cliente_trgm', 'orcamento', 'cliente_nome'),
+]
+INDICE_TSVECTOR = ('ix_busca_item_nome_tsv', 'item', "to_tsvector('simple', coalesce(nome, ''))")
+
+
+def _is_postgres(db_engine):
+    return 'postgresql' in db_engine.dialect.name or 'postgres' in db_engine.dialect.name
+
+
+def _upgrade_postgres(db_engine):
+    tabelas = set(inspect(db_engine).get_table_names())
+    nomes = {nome for nome, _, _ in INDICES_TRGM} | {INDICE_TSVECTOR[0]}
+
+    # CONCURRENTLY não pode rodar dentro de transação
+    with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        invalidos = {row[0] for row in conn.execute(text("""
+            SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid
+        """)).fetchall()} & nomes
+        for invalido in invalidos:
+            logger.warning(f"Índice {invalido} inválido (criação interrompida); recriando...")
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {invalido}"))
+
+        try:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            trgm = True
+        except Exception as e:
+            logger.warning(f"pg_trgm indisponível ({e}); busca usará apenas o índice tsvector")
+            trgm = False
+
+        if trgm:
+            for nome, tabela, coluna in INDICES_TRGM:
+                if tabela in tabelas:
+                    conn.execute(text(
+                        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} USING gin ({coluna} gin_trgm_ops)"
+                    ))
+
+        nome, tabela, expressao = INDICE_TSVECTOR
+        conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} USING gin ({expressao})"))
+        for tabela in sorted({t for _, t, _ in INDICES_TRGM} & tabelas):
+            conn.execute(text(f"ANALYZE {tabela}"))
+
+
+def _expr_codigo(prefixo, fonte):
+    from utils.busca import SEPARADOR_CODIGOS
+    partes = [f"coalesce({prefixo}{c}, '')" for c in fonte['codigos']]
+    return f" || '{SEPARADOR_CODIGOS}' || ".join(partes)
+
+
+def _expr_texto(prefixo, fonte):
+    return f"coalesce({prefixo}{fonte['texto']}, '')" if fonte['texto'] else "''"
+
+
+def sql_triggers_sqlite(tipo, fonte):
+    """Triggers que mantêm busca_indice em dia com a tabela de origem."""
+    from utils.busca import TABELA_FTS
+    tabela, sufixo = fonte['tabela'], fonte['sufixo']
+    colunas = ', '.join(fonte['codigos'] + ([fonte['texto']] if fonte['texto'] else []))
+
+    def inserir(prefixo):
+        return (
+            f"INSERT INTO {TABELA_FTS}(rowid, tipo, ref_id, codigo, texto) VALUES "
+            f"({prefixo}id * 8 + {sufixo}, '{tipo}', {prefixo}id, {_expr_codigo(prefixo, fonte)}, {_expr_texto(prefixo, fonte)});"
+        )
+
+    remover = f"DELETE FROM {TABELA_FTS} WHERE rowid = old.id * 8 + {sufixo};"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ai AFTER INSERT ON {tabela} BEGIN {inserir('new.')} END",
+        f"CREATE TRIGGER IF NOT EXISTS busca_{tabela}_au AFTER UPDATE OF id, {colunas} ON {tabela} "
+        f"BEGIN {remover} {inserir('new.')} END",
+        f"CREATE TRIGGER IF NOT EXISTS busca_{tabela}_ad AFTER DELETE ON {tabela} BEGIN {remover} END",
+    ]
+
+
+def preencher_sqlite(conn, tabelas=None):
+    """Recria o conteúdo de busca_indice a partir das tabelas de origem."""
+    from utils.busca import FONTES, TABELA_FTS
+    tabelas = tabelas if tabelas is not None else set(inspect(conn).get_table_names())
+    conn.execute(text(f"DELETE FROM {TABELA_FTS}"))
+    total = 0
+    for tipo, fonte in FONTES.items():
+        if fonte['tabela'] not in tabelas:
+            continue
+        total += conn.execute(text(
+            f"INSERT INTO {TABELA_FTS}(rowid, tipo, ref_id, codigo, texto) "
+            f"SELECT id * 8 + {fonte['sufixo']}, '{tipo}', id, {_expr_codigo('', fonte)}, {_expr_texto('', fonte)} "
+            f"FROM {fonte['tabela']}"
+        )).rowcount or 0
+    return total
+
+
+def _upgrade_sqlite(db_engine, recriar=False):
+    from utils.busca import FONTES, TABELA_FTS
+
+    with db_engine.begin() as conn:
+        tabelas = set(inspect(conn).get_table_names())
+        existia = TABELA_FTS in tabelas
+        if recriar and existia:
+            conn.execute(text(f"DROP TABLE {TABELA_FTS}"))
+            existia = False
+        try:
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} "
+                f"USING fts5(tipo UNINDEXED, ref_id UNINDEXED, codigo, texto, tokenize='trigram')"
+            ))
+        except Exception as e:
+            # SQLite sem FTS5/trigram (< 3.34): a busca segue com LIKE
+            logger.warning(f"FTS5 trigram indisponível ({e}); busca usará LIKE")
+            return
+
+        for tipo, fonte in FONTES.items():
+            if fonte['tabela'] not in tabelas:
+                continue
+            for sql in sql_triggers_sqlite(tipo, fonte):
+                conn.execute(text(sql))
+
+        if not existia:
+            total = preencher_sqlite(conn, tabelas)
+            logger.info(f"✅ {TABELA_FTS} preenchida ({total} registros)")
+
+
+def upgrade(db_engine, recriar=False):
+    """Cria os índices de busca do dialeto"""
+    try:
+        if _is_postgres(db_engine):
+            _upgrade_postgres(db_engine)
+        else:
+            _upgrade_sqlite(db_engine, recriar=recriar)
+
+        from utils.busca import limpar_cache_disponibilidade
+        limpar_cache_disponibilidade()
+        logger.info("✓ Índices de busca verificados/criados")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao criar índices de busca: {str(e)}")
+        return False
+
+
+def downgrade(db_engine):
+    """Remove índices, triggers e tabela FTS de busca"""
+    try:
+        from utils.busca import FONTES, TABELA_FTS
+        if _is_postgres(db_engine):
+            with db_engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+                for nome in [n for n, _, _ in INDICES_TRGM] + [INDICE_TSVECTOR[0]]:
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}"))
+        else:
+            with db_engine.begin() as conn:
+                for fonte in FONTES.values():
+                    for sufixo in ('ai', 'au', 'ad'):
+                        conn.execute(text(f"DROP TRIGGER IF EXISTS busca_{fonte['tabela']}_{sufixo}"))
+                conn.execute(text(f"DROP TABLE IF EXISTS {TABELA_FTS}"))
+        logger.info("✅ Migração revertida com sucesso!")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao reverter migração: {str(e)}")
+        return False
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        if '--downgrade' in sys.argv:
+            downgrade(db.engine)
+        else:
+            upgrade(db.engine, recriar='--recriar' in sys.argv)
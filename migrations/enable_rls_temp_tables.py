@@ -75,6 +75,24 @@ def migrate_postgres() -> bool:
                 WITH CHECK (true);
             END IF;
         END $$;
+        """,
+
+        # Tabela importacao_excel_temp (staging das importações de pedidos/estoque);
+        # criada pelo db.create_all, então só age quando ela já existe
+        """
+        DO $$ 
+        BEGIN
+            IF to_regclass('public.importacao_excel_temp') IS NOT NULL THEN
+                EXECUTE 'ALTER TABLE importacao_excel_temp ENABLE ROW LEVEL SECURITY';
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_policies 
+                    WHERE tablename = 'importacao_excel_temp' 
+                    AND policyname = 'allow_authenticated_all'
+                ) THEN
+                    EXECUTE 'CREATE POLICY allow_authenticated_all ON importacao_excel_temp FOR ALL TO authenticated USING (true) WITH CHECK (true)';
+                END IF;
+            END IF;
+        END $$;
         """
     ]
     
@@ -88,7 +106,7 @@ def migrate_postgres() -> bool:
                     if 'already exists' not in str(e).lower() and 'already enabled' not in str(e).lower():
                         logger.warning(f"Aviso ao executar RLS migration: {e}")
         
-        logger.info("✅ RLS habilitado nas tabelas temporárias (estoque_pecas_slot_temp, import_valores_temp)")
+        logger.info("✅ RLS habilitado nas tabelas temporárias (estoque_pecas_slot_temp, import_valores_temp, importacao_excel_temp)")
         return True
     except Exception as e:
         logger.error(f"❌ Erro ao habilitar RLS: {e}")
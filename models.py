@@ -438,6 +438,14 @@ class Item(db.Model):
             from utils import get_file_url
             return get_file_url(self.imagem)
         return None
+
+    @property
+    def imagem_thumb_path(self):
+        # Miniatura WebP (160px) para cartões, listas e mapas
+        if self.imagem:
+            from utils import get_file_url
+            return get_file_url(self.imagem, size='thumb')
+        return None
     
     @property
     def blank_laser_path(self):
@@ -899,6 +907,23 @@ class EstoquePecasSlotTemp(db.Model):
     def __repr__(self):
         return f'<EstoquePecasSlotTemp {self.id}>'
 
+
+class ImportacaoExcelTemp(db.Model):
+    """Linhas validadas de uma importação por Excel aguardando confirmação (uma linha por linha da planilha)"""
+    __tablename__ = 'importacao_excel_temp'
+
+    id = db.Column(db.Integer, primary_key=True)
+    import_id = db.Column(db.String(36), nullable=False, index=True)
+    tipo = db.Column(db.String(20), nullable=False)       # 'pedidos' | 'estoque'
+    usuario_id = db.Column(db.Integer, nullable=True)
+    linha = db.Column(db.Integer, nullable=False)         # número da linha na planilha
+    dados = db.Column(db.Text, nullable=False)            # JSON da linha validada
+    confirmado = db.Column(db.Boolean, default=False)
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+    def __repr__(self):
+        return f'<ImportacaoExcelTemp {self.import_id}:{self.linha}>'
+
 # Novo modelo para registro mensal de cartões finalizados
 class RegistroMensal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1242,6 +1267,46 @@ class CartaoFantasma(db.Model):
         lista = KanbanLista.query.filter_by(nome=self.lista_kanban).first()
         return lista.cor if lista else '#6c757d'
 
+# Log de alterações do Kanban para sync incremental do PWA (/kanban/sync?since=<seq>)
+class KanbanAlteracao(db.Model):
+    __tablename__ = 'kanban_alteracao'
+
+    id = db.Column(db.Integer, primary_key=True)  # Sequência monotônica (seq)
+    entidade = db.Column(db.String(20), nullable=False)  # 'cartao', 'fantasma', 'apontamento', 'lista'
+    entidade_id = db.Column(db.Integer, nullable=False)
+    operacao = db.Column(db.String(10), nullable=False, default='upsert')  # 'upsert' ou 'delete'
+    data_criacao = db.Column(db.DateTime, default=local_now_naive, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<KanbanAlteracao {self.id} {self.operacao} {self.entidade}:{self.entidade_id}>'
+
+# Tempos acumulados por OS/item/trabalho (mantido por utils/resumo_apontamentos.py)
+class ResumoApontamento(db.Model):
+    __tablename__ = 'apontamento_resumo'
+
+    id = db.Column(db.Integer, primary_key=True)
+    ordem_servico_id = db.Column(db.Integer, nullable=False, index=True)
+    item_id = db.Column(db.Integer, nullable=False)
+    trabalho_id = db.Column(db.Integer, nullable=False)
+    tempo_setup_s = db.Column(db.Integer, nullable=False, default=0)  # Soma de data_fim - data_hora (inicio_setup/fim_setup)
+    tempo_producao_s = db.Column(db.Integer, nullable=False, default=0)  # inicio_producao/fim_producao
+    tempo_pausas_s = db.Column(db.Integer, nullable=False, default=0)  # pausa/stop
+    sessoes_setup = db.Column(db.Integer, nullable=False, default=0)  # inicio_setup encerrados
+    sessoes_producao = db.Column(db.Integer, nullable=False, default=0)  # inicio_producao encerrados
+    pausas = db.Column(db.Integer, nullable=False, default=0)  # pausa/stop encerradas
+    total_apontamentos = db.Column(db.Integer, nullable=False, default=0)
+    ultima_quantidade = db.Column(db.Integer, nullable=True)
+    ultima_quantidade_em = db.Column(db.DateTime, nullable=True)  # data_hora do apontamento com a última quantidade
+    ultimo_apontamento_em = db.Column(db.DateTime, nullable=True)
+    atualizado_em = db.Column(db.DateTime, default=local_now_naive, onupdate=local_now_naive)
+
+    __table_args__ = (
+        db.UniqueConstraint('ordem_servico_id', 'item_id', 'trabalho_id', name='uq_apontamento_resumo_combo'),
+    )
+
+    def __repr__(self):
+        return f'<ResumoApontamento OS:{self.ordem_servico_id} item:{self.item_id} trab:{self.trabalho_id}>'
+
 # Modelo para controle do status atual de produção de cada OS
 class StatusProducaoOS(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -1670,6 +1735,33 @@ class CacheAlerta(db.Model):
         return f'<CacheAlerta {self.chave}>'
 
 
+class NotificacaoSaida(db.Model):
+    """Caixa de saída de notificações (uma linha por mensagem e destino), entregue por notificacoes/fila.py"""
+    __tablename__ = 'notificacao_saida'
+
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(50), nullable=False)
+    destino = db.Column(db.String(100), nullable=False)
+    mensagem = db.Column(db.Text, nullable=False)
+    dados = db.Column(db.Text, nullable=True)  # JSON do evento (base para agrupar rajadas)
+    chave_agrupamento = db.Column(db.String(150), nullable=True, index=True)  # ex.: 'kanban_movido:OS-0012'
+    eventos = db.Column(db.Integer, nullable=False, default=1)  # Eventos agrupados nesta mensagem
+    status = db.Column(db.String(20), nullable=False, default='pendente')  # pendente, enviando, enviado, falha
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    proxima_tentativa_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    travado_ate = db.Column(db.DateTime, nullable=True)  # Reserva do worker que está enviando
+    ultimo_erro = db.Column(db.Text, nullable=True)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    enviado_em = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_notificacao_saida_status_proxima', 'status', 'proxima_tentativa_em'),
+    )
+
+    def __repr__(self):
+        return f'<NotificacaoSaida {self.id} {self.tipo} -> {self.destino} ({self.status})>'
+
+
 # ============================================================================
 # MÓDULO DE USO E CONSUMO
 # ============================================================================
@@ -12,6 +12,15 @@ class ConfiguracaoNotificacoes:
     WHATSAPP_TIMEOUT = int(os.getenv('WHATSAPP_TIMEOUT', '10'))
     WHATSAPP_RETRIES = int(os.getenv('WHATSAPP_RETRIES', '2'))
     FILA_ATIVA = os.getenv('NOTIFICACOES_FILA_ATIVA', '1').strip().lower() in ('1', 'true', 'yes', 'on')
+    # Caixa de saída (notificacao_saida) e workers de envio
+    FILA_WORKERS = int(os.getenv('NOTIFICACOES_WORKERS', '3'))
+    FILA_INTERVALO_DESTINO_MS = int(os.getenv('NOTIFICACOES_INTERVALO_DESTINO_MS', '1000'))
+    FILA_MAX_TENTATIVAS = int(os.getenv('NOTIFICACOES_MAX_TENTATIVAS', '6'))
+    FILA_BACKOFF_BASE_SEGUNDOS = int(os.getenv('NOTIFICACOES_BACKOFF_BASE_SEGUNDOS', '5'))
+    FILA_BACKOFF_MAX_SEGUNDOS = int(os.getenv('NOTIFICACOES_BACKOFF_MAX_SEGUNDOS', '600'))
+    FILA_JANELA_AGRUPAMENTO_SEGUNDOS = int(os.getenv('NOTIFICACOES_JANELA_AGRUPAMENTO_SEGUNDOS', '60'))
+    FILA_AGRUPAR_TIPOS = {t.strip() for t in os.getenv('NOTIFICACOES_AGRUPAR_TIPOS', 'kanban_movido').split(',') if t.strip()}
+    FILA_RETENCAO_DIAS = int(os.getenv('NOTIFICACOES_RETENCAO_DIAS', '7'))
     SCHEDULER_ATIVO = os.getenv('NOTIFICACOES_SCHEDULER_ATIVO', '0').strip().lower() in ('1', 'true', 'yes', 'on')
     MONITORAMENTO_INTERVALO_SEGUNDOS = int(os.getenv('MONITORAMENTO_INTERVALO_SEGUNDOS', '60'))
     ALERTA_SERVICO_PARADO_MINUTOS = int(os.getenv('ALERTA_SERVICO_PARADO_MINUTOS', '25'))
@@ -25,6 +34,10 @@ EXEMPLO_ENV = '''
 NOTIFICACOES_ATIVO=1
 NOTIFICACOES_FILA_ATIVA=1
 NOTIFICACOES_SCHEDULER_ATIVO=1
+NOTIFICACOES_WORKERS=3
+NOTIFICACOES_INTERVALO_DESTINO_MS=1000
+NOTIFICACOES_JANELA_AGRUPAMENTO_SEGUNDOS=60
+NOTIFICACOES_AGRUPAR_TIPOS=kanban_movido
 MONITORAMENTO_INTERVALO_SEGUNDOS=60
 ALERTA_SERVICO_PARADO_MINUTOS=25
 ALERTA_SETUP_LONGO_MINUTOS=30
@@ -36,6 +36,10 @@ def registrar_evento(tipo, **dados):
     }
     log_evento(tipo, dados, status='registrado')
 
+    # Telas abertas recebem o evento via SSE mesmo com o envio (WhatsApp) desativado
+    from utils.barramento import publicar
+    publicar('notificacoes', tipo, **dados)
+
     if not ConfiguracaoNotificacoes.ATIVO:
         log_evento(tipo, dados, status='ignorado_notificacoes_desativadas')
         return {'success': False, 'skipped': True, 'reason': 'NOTIFICACOES_ATIVO desativado'}
@@ -1,64 +1,438 @@
-import queue
+"""
+Fila de notificações com caixa de saída persistente
+
+``enfileirar_evento`` monta a mensagem e grava uma linha por destino em
+``notificacao_saida`` (conexão própria, fora da sessão da requisição); nada
+se perde num restart ou quando a função serverless congela. Um pool de
+``NOTIFICACOES_WORKERS`` threads (padrão 3) entrega as linhas vencidas. Em
+serverless essas threads ficam congeladas entre invocações: quem esvazia a
+fila lá é o cron da Vercel (``/cron/manutencao``, routes/cron.py), que chama
+``processar_pendentes``.
+
+- cada worker reserva uma linha com um UPDATE condicional (``status`` de
+  ``pendente`` para ``enviando`` com ``travado_ate``), o que evita envio em
+  dobro entre workers e processos; reservas vencidas (worker morto) voltam
+  para a fila;
+- limite por destino: no máximo uma mensagem a cada
+  ``NOTIFICACOES_INTERVALO_DESTINO_MS`` (padrão 1000) e um destino só tem um
+  envio em andamento por processo. Um destino lento ou fora do ar não segura
+  os outros;
+- falha reagenda a linha com backoff exponencial
+  (``NOTIFICACOES_BACKOFF_BASE_SEGUNDOS`` × 2^tentativas, até
+  ``NOTIFICACOES_BACKOFF_MAX_SEGUNDOS``) e suspende o destino pelo mesmo
+  tempo, sem ``sleep`` no worker. Após ``NOTIFICACOES_MAX_TENTATIVAS`` (ou
+  erro 4xx) a linha fica como ``falha``;
+- rajadas: eventos de ``NOTIFICACOES_AGRUPAR_TIPOS`` (padrão
+  ``kanban_movido``) esperam ``NOTIFICACOES_JANELA_AGRUPAMENTO_SEGUNDOS``
+  (padrão 60) antes de sair; outro evento da mesma OS nesse intervalo
+  atualiza a mensagem pendente em vez de criar outra.
+
+Linhas enviadas/com falha são apagadas após ``NOTIFICACOES_RETENCAO_DIAS``.
+``get_stats()`` expõe a profundidade da fila por status e os contadores dos
+workers. Com ``NOTIFICACOES_FILA_ATIVA=0`` o evento é processado na hora.
+"""
+import json
+import random
 import threading
-from flask import current_app
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+
 from .configuracao import ConfiguracaoNotificacoes
-from .logs import log_evento
+from .logs import log_evento, logger
+
+RESERVA_SEGUNDOS = 120
+INTERVALO_OCIOSO_SEGUNDOS = 5
+CANDIDATOS_POR_RESERVA = 20
 
-_fila = queue.Queue()
-_worker = None
+_workers = []
 _stop_event = threading.Event()
+_novo_evento = threading.Event()
 _app_ref = None
 
+_estado_lock = threading.Lock()
+_destinos_ocupados = set()
+_destino_livre_em = {}  # destino -> time.monotonic() a partir do qual pode enviar
+_ultima_limpeza = 0.0
+
+_stats = defaultdict(int)
+_tempo_envio_total = 0.0
+
+
+def _tabela():
+    from models import NotificacaoSaida
+    return NotificacaoSaida.__table__
+
+
+def _engine():
+    from flask import has_app_context
+    from models import db
+    if has_app_context():
+        return db.engine
+    if _app_ref is not None:
+        with _app_ref.app_context():
+            return db.engine
+    return None
+
+
+def _contar(evento, quantidade=1):
+    with _estado_lock:
+        _stats[evento] += quantidade
+
 
 def iniciar_fila(app=None):
-    global _worker, _app_ref
+    global _app_ref
     _app_ref = app
     if not ConfiguracaoNotificacoes.FILA_ATIVA:
         return False
-    if _worker and _worker.is_alive():
+    if any(w.is_alive() for w in _workers):
         return True
+
+    # Ambiente sem db.create_all() no startup (serverless): garante a tabela aqui
+    try:
+        engine = _engine()
+        if engine is not None:
+            _tabela().create(engine, checkfirst=True)
+    except Exception as exc:
+        logger.warning('[NOTIFICACOES] Falha ao verificar notificacao_saida: %s', exc)
+
     _stop_event.clear()
-    _worker = threading.Thread(target=_processar_loop, name='notificacoes-worker', daemon=True)
-    _worker.start()
+    _workers.clear()
+    for n in range(max(1, ConfiguracaoNotificacoes.FILA_WORKERS)):
+        worker = threading.Thread(target=_processar_loop, name=f'notificacoes-worker-{n + 1}', daemon=True)
+        worker.start()
+        _workers.append(worker)
     return True
 
 
 def parar_fila():
     _stop_event.set()
+    _novo_evento.set()
     return True
 
 
+# ---------------------------------------------------------------------------
+# Enfileiramento
+# ---------------------------------------------------------------------------
+
+def _chave_agrupamento(tipo, dados, destino):
+    if tipo not in ConfiguracaoNotificacoes.FILA_AGRUPAR_TIPOS:
+        return None
+    referencia = dados.get('os') or dados.get('item')
+    if not referencia or referencia == '-':
+        return None
+    return f'{tipo}:{referencia}:{destino}'[:150]
+
+
+def _agrupar(anterior, novo):
+    """Junta os dados de dois eventos da mesma rajada: origem do primeiro, o resto do último."""
+    dados = dict(novo)
+    if 'lista_origem' in anterior:
+        dados['lista_origem'] = anterior['lista_origem']
+    dados['eventos'] = int(anterior.get('eventos') or 1) + 1
+    return dados
+
+
 def enfileirar_evento(evento):
-    if not ConfiguracaoNotificacoes.FILA_ATIVA:
-        from .eventos import processar_evento
+    from .eventos import EVENTOS_WHATSAPP, processar_evento
+    from .templates import mensagem_evento
+    from .whatsapp import destinos_configurados, motivo_indisponivel
+
+    tipo = evento.get('tipo')
+    dados = dict(evento.get('dados') or {})
+    dados.setdefault('tipo', tipo)
+
+    engine = _engine() if ConfiguracaoNotificacoes.FILA_ATIVA else None
+    # Fila desativada, evento sem envio ou WhatsApp indisponível: nada a entregar depois
+    if engine is None or tipo not in EVENTOS_WHATSAPP or motivo_indisponivel() or not destinos_configurados():
         return processar_evento(evento)
-    _fila.put(evento)
-    log_evento(evento.get('tipo'), evento.get('dados'), status='enfileirado')
-    return {'success': True, 'queued': True}
 
+    tabela = _tabela()
+    agora = datetime.utcnow()
+    janela = timedelta(seconds=ConfiguracaoNotificacoes.FILA_JANELA_AGRUPAMENTO_SEGUNDOS)
+    gravadas = agrupadas = 0
+    try:
+        with engine.begin() as conn:
+            for destino in destinos_configurados():
+                chave = _chave_agrupamento(tipo, dados, destino)
+                if chave:
+                    pendente = conn.execute(
+                        select(tabela.c.id, tabela.c.dados, tabela.c.eventos)
+                        .where(tabela.c.chave_agrupamento == chave, tabela.c.status == 'pendente', tabela.c.tentativas == 0)
+                        .order_by(tabela.c.id.desc())
+                        .limit(1)
+                    ).first()
+                    if pendente:
+                        try:
+                            anterior = json.loads(pendente.dados or '{}')
+                        except ValueError:
+                            anterior = {}
+                        juntos = _agrupar(anterior, dados)
+                        atualizadas = conn.execute(
+                            update(tabela)
+                            .where(tabela.c.id == pendente.id, tabela.c.status == 'pendente')
+                            .values(
+                                mensagem=mensagem_evento(tipo, juntos),
+                                dados=json.dumps(juntos, default=str),
+                                eventos=pendente.eventos + 1,
+                            )
+                        ).rowcount
+                        if atualizadas:
+                            agrupadas += 1
+                            continue
 
-def tamanho_fila():
-    return _fila.qsize()
+                conn.execute(insert(tabela).values(
+                    tipo=tipo,
+                    destino=destino,
+                    mensagem=mensagem_evento(tipo, dados),
+                    dados=json.dumps(dados, default=str),
+                    chave_agrupamento=chave,
+                    eventos=1,
+                    status='pendente',
+                    tentativas=0,
+                    proxima_tentativa_em=agora + janela if chave else agora,
+                    criado_em=agora,
+                ))
+                gravadas += 1
+    except Exception as exc:
+        # Banco indisponível: não perder o evento, enviar direto fora da requisição
+        log_evento(tipo, dados, status='erro_caixa_saida', erro=exc)
+        threading.Thread(target=_processar_direto, args=(evento,), name='notificacoes-direto', daemon=True).start()
+        return {'success': True, 'queued': False, 'fallback': True}
 
+    _contar('enfileiradas', gravadas)
+    _contar('agrupadas', agrupadas)
+    _novo_evento.set()
+    log_evento(tipo, dados, status='agrupado' if agrupadas and not gravadas else 'enfileirado')
+    return {'success': True, 'queued': True, 'mensagens': gravadas, 'agrupadas': agrupadas}
 
-def _processar_loop():
-    while not _stop_event.is_set():
+
+def _processar_direto(evento):
+    from .eventos import processar_evento
+    try:
+        if _app_ref:
+            with _app_ref.app_context():
+                processar_evento(evento)
+        else:
+            processar_evento(evento)
+    except Exception as exc:
+        log_evento(evento.get('tipo'), evento.get('dados'), status='erro_worker', erro=exc)
+
+
+# ---------------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------------
+
+def _destino_disponivel(destino, agora_mono):
+    return destino not in _destinos_ocupados and _destino_livre_em.get(destino, 0) <= agora_mono
+
+
+def _reservar(engine):
+    """
+    Reserva a próxima linha vencida de um destino livre. Devolve
+    ``(linha, None)``; sem linha reservada, ``(None, livre_em)`` com o
+    ``time.monotonic()`` em que o primeiro destino das candidatas sai do
+    intervalo mínimo/backoff (None se não há candidata esperando por isso).
+    """
+    tabela = _tabela()
+    agora = datetime.utcnow()
+    vencidas = or_(
+        and_(tabela.c.status == 'pendente', tabela.c.proxima_tentativa_em <= agora),
+        and_(tabela.c.status == 'enviando', tabela.c.travado_ate < agora),
+    )
+    with engine.connect() as conn:
+        candidatas = conn.execute(
+            select(tabela.c.id, tabela.c.destino, tabela.c.status)
+            .where(vencidas)
+            .order_by(tabela.c.proxima_tentativa_em, tabela.c.id)
+            .limit(CANDIDATOS_POR_RESERVA)
+        ).all()
+
+    livre_em = None
+    for candidata in candidatas:
+        with _estado_lock:
+            if not _destino_disponivel(candidata.destino, time.monotonic()):
+                if candidata.destino not in _destinos_ocupados:
+                    espera_ate = _destino_livre_em[candidata.destino]
+                    livre_em = espera_ate if livre_em is None else min(livre_em, espera_ate)
+                continue
+            _destinos_ocupados.add(candidata.destino)
         try:
-            evento = _fila.get(timeout=1)
-        except queue.Empty:
+            with engine.begin() as conn:
+                reservada = conn.execute(
+                    update(tabela)
+                    .where(tabela.c.id == candidata.id, vencidas)
+                    .values(status='enviando', travado_ate=agora + timedelta(seconds=RESERVA_SEGUNDOS))
+                ).rowcount
+                if reservada:
+                    return conn.execute(select(tabela).where(tabela.c.id == candidata.id)).first(), None
+        except Exception:
+            with _estado_lock:
+                _destinos_ocupados.discard(candidata.destino)
+            raise
+        with _estado_lock:
+            _destinos_ocupados.discard(candidata.destino)
+    return None, livre_em
+
+
+def _backoff(tentativas):
+    base = ConfiguracaoNotificacoes.FILA_BACKOFF_BASE_SEGUNDOS * (2 ** max(0, tentativas - 1))
+    espera = min(ConfiguracaoNotificacoes.FILA_BACKOFF_MAX_SEGUNDOS, base)
+    return espera * random.uniform(0.8, 1.2)
+
+
+def _entregar(engine, linha):
+    global _tempo_envio_total
+    from .whatsapp import enviar_para_destino
+
+    tabela = _tabela()
+    tentativa = linha.tentativas + 1
+    inicio = time.monotonic()
+    try:
+        resultado = enviar_para_destino(linha.mensagem, linha.destino, tentativa=tentativa)
+    except Exception as exc:
+        resultado = {'success': False, 'error': str(exc), 'permanente': False}
+    duracao = time.monotonic() - inicio
+
+    agora = datetime.utcnow()
+    with _estado_lock:
+        _tempo_envio_total += duracao
+        _destinos_ocupados.discard(linha.destino)
+        livre_em = time.monotonic() + ConfiguracaoNotificacoes.FILA_INTERVALO_DESTINO_MS / 1000.0
+        if not resultado.get('success') and not resultado.get('permanente'):
+            livre_em = time.monotonic() + _backoff(tentativa)
+        _destino_livre_em[linha.destino] = livre_em
+
+    if resultado.get('success'):
+        valores = {'status': 'enviado', 'enviado_em': agora, 'tentativas': tentativa, 'travado_ate': None, 'ultimo_erro': None}
+        _contar('enviadas')
+    elif resultado.get('permanente') or tentativa >= ConfiguracaoNotificacoes.FILA_MAX_TENTATIVAS:
+        valores = {'status': 'falha', 'tentativas': tentativa, 'travado_ate': None, 'ultimo_erro': resultado.get('error')}
+        _contar('falhas')
+    else:
+        valores = {
+            'status': 'pendente',
+            'tentativas': tentativa,
+            'travado_ate': None,
+            'ultimo_erro': resultado.get('error'),
+            'proxima_tentativa_em': agora + timedelta(seconds=_backoff(tentativa)),
+        }
+        _contar('reagendadas')
+
+    with engine.begin() as conn:
+        conn.execute(update(tabela).where(tabela.c.id == linha.id).values(**valores))
+
+
+def _limpar_antigas(engine):
+    """Apaga enviadas/falhas além da retenção (no máximo uma vez por hora por processo)."""
+    global _ultima_limpeza
+    with _estado_lock:
+        if time.monotonic() - _ultima_limpeza < 3600:
+            return
+        _ultima_limpeza = time.monotonic()
+    tabela = _tabela()
+    limite = datetime.utcnow() - timedelta(days=ConfiguracaoNotificacoes.FILA_RETENCAO_DIAS)
+    with engine.begin() as conn:
+        conn.execute(delete(tabela).where(tabela.c.status.in_(('enviado', 'falha')), tabela.c.criado_em < limite))
+
+
+def processar_pendentes(limite=100, prazo_s=None):
+    """
+    Entrega até ``limite`` mensagens vencidas na thread atual (scripts e
+    ``/cron/manutencao``), parando ao passar de ``prazo_s`` segundos. Quando
+    as pendentes só esperam o intervalo mínimo do destino, dorme até o
+    primeiro destino liberar (se couber no prazo) em vez de desistir.
+    Devolve quantas processou.
+    """
+    engine = _engine()
+    if engine is None:
+        return 0
+    _limpar_antigas(engine)
+    fim = time.monotonic() + prazo_s if prazo_s else None
+    processadas = 0
+    while processadas < limite and (fim is None or time.monotonic() < fim):
+        linha, livre_em = _reservar(engine)
+        if linha is None:
+            if livre_em is None or (fim is not None and livre_em >= fim):
+                break
+            time.sleep(max(0.0, livre_em - time.monotonic()))
             continue
+        _entregar(engine, linha)
+        processadas += 1
+    return processadas
+
+
+def _processar_loop():
+    while not _stop_event.is_set():
+        linha = None
         try:
-            from .eventos import processar_evento
-            if _app_ref:
-                with _app_ref.app_context():
-                    processar_evento(evento)
-            else:
-                processar_evento(evento)
+            engine = _engine()
+            if engine is None:
+                _stop_event.wait(INTERVALO_OCIOSO_SEGUNDOS)
+                continue
+            _limpar_antigas(engine)
+            linha, livre_em = _reservar(engine)
+            if linha is None:
+                # Destino em intervalo mínimo/backoff: acorda quando ele liberar
+                espera = INTERVALO_OCIOSO_SEGUNDOS
+                if livre_em is not None:
+                    espera = min(espera, max(0.0, livre_em - time.monotonic()))
+                _novo_evento.wait(espera)
+                _novo_evento.clear()
+                continue
+            _entregar(engine, linha)
         except Exception as exc:
-            try:
-                current_app.logger.exception('Erro ao processar evento de notificacao')
-            except Exception:
-                pass
-            log_evento(evento.get('tipo'), evento.get('dados'), status='erro_worker', erro=exc)
-        finally:
-            _fila.task_done()
+            logger.exception('[NOTIFICACOES] Erro no worker de envio')
+            if linha is not None:
+                with _estado_lock:
+                    _destinos_ocupados.discard(linha.destino)
+                log_evento(linha.tipo, {'id': linha.id, 'destino': linha.destino}, status='erro_worker', erro=exc)
+            _stop_event.wait(INTERVALO_OCIOSO_SEGUNDOS)
+
+
+# ---------------------------------------------------------------------------
+# Métricas
+# ---------------------------------------------------------------------------
+
+def tamanho_fila():
+    """Mensagens ainda não entregues (pendentes + em envio)."""
+    try:
+        engine = _engine()
+        if engine is None:
+            return 0
+        tabela = _tabela()
+        with engine.connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(tabela).where(tabela.c.status.in_(('pendente', 'enviando')))
+            ).scalar() or 0
+    except Exception:
+        return 0
+
+
+def get_stats():
+    with _estado_lock:
+        stats = dict(_stats)
+        enviadas = stats.get('enviadas', 0) + stats.get('falhas', 0) + stats.get('reagendadas', 0)
+        stats['tempo_medio_envio_ms'] = round(_tempo_envio_total / enviadas * 1000, 1) if enviadas else None
+        stats['destinos_suspensos'] = sorted(d for d, t in _destino_livre_em.items() if t > time.monotonic() + 1)
+    stats['workers_ativos'] = sum(1 for w in _workers if w.is_alive())
+    try:
+        engine = _engine()
+        tabela = _tabela()
+        with engine.connect() as conn:
+            por_status = dict(conn.execute(
+                select(tabela.c.status, func.count()).group_by(tabela.c.status)
+            ).all())
+            mais_antiga = conn.execute(
+                select(func.min(tabela.c.criado_em)).where(tabela.c.status == 'pendente')
+            ).scalar()
+        stats['por_status'] = por_status
+        stats['profundidade'] = por_status.get('pendente', 0) + por_status.get('enviando', 0)
+        stats['pendente_mais_antiga_s'] = (
+            round((datetime.utcnow() - mais_antiga).total_seconds()) if mais_antiga else None
+        )
+    except Exception as exc:
+        stats['erro'] = str(exc)
+    return stats
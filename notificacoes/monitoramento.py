@@ -1,4 +1,28 @@
+"""
+Monitoramento automático da produção (job do APScheduler)
+
+Cada execução é set-based, com custo fixo independente do número de máquinas:
+
+1. uma consulta com janela (ROW_NUMBER por OS/item/trabalho) pega o setup
+   aberto mais recente de cada combinação e, na mesma passada, soma os
+   setups encerrados das últimas 24h e detecta ação posterior
+   (produção/pausa/stop) que indique que o serviço já saiu do setup;
+2. as chaves que passaram do limite são deduplicadas num único upsert em
+   ``cache_alerta`` (``ON CONFLICT ... WHERE data_envio <= agora - intervalo
+   RETURNING chave``): só as chaves devolvidas geram alerta, o que também vale
+   entre várias instâncias;
+3. só os apontamentos que vão gerar alerta são carregados com os
+   relacionamentos, numa consulta.
+
+A tabela ``cache_alerta`` é garantida uma vez no startup
+(``garantir_tabela_cache_alerta``). Os tempos de cada etapa vão no retorno,
+no log ``monitoramento_producao`` e em ``get_stats()``.
+"""
+import threading
+import time
+from collections import Counter
 from datetime import timedelta
+
 from .configuracao import ConfiguracaoNotificacoes
 from .eventos import registrar_evento
 from .logs import log_evento
@@ -7,109 +31,124 @@ from .logs import log_evento
 # Cache de alertas em memória (fallback)
 _alertas_enviados = {}
 
+_metricas_lock = threading.Lock()
+_metricas = {'execucoes': 0, 'tempo_total_ms': 0.0, 'ultima': None}
 
-def _garantir_tabela_cache_alerta():
+
+def garantir_tabela_cache_alerta(engine):
+    """Cria cache_alerta se não existir (chamado uma vez no startup)."""
     try:
-        from models import db
-        from sqlalchemy import text
-
-        dialect = (db.engine.dialect.name or '').lower()
-        if dialect.startswith('postgres'):
-            db.session.execute(text(
-                """
-                CREATE TABLE IF NOT EXISTS cache_alerta (
-                    id SERIAL PRIMARY KEY,
-                    chave VARCHAR(100) UNIQUE NOT NULL,
-                    data_envio TIMESTAMP NOT NULL
-                );
-                CREATE INDEX IF NOT EXISTS ix_cache_alerta_chave ON cache_alerta(chave);
-                """
-            ))
-        else:
-            db.session.execute(text(
-                """
-                CREATE TABLE IF NOT EXISTS cache_alerta (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    chave VARCHAR(100) UNIQUE NOT NULL,
-                    data_envio DATETIME NOT NULL
-                );
-                """
-            ))
-            try:
-                db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_cache_alerta_chave ON cache_alerta(chave);"))
-            except Exception:
-                pass
-        db.session.commit()
+        from models import CacheAlerta
+        CacheAlerta.__table__.create(engine, checkfirst=True)
         return True
     except Exception as e:
-        try:
-            from models import db
-            db.session.rollback()
-        except Exception:
-            pass
         log_evento('cache_db_erro_tabela', {'erro': str(e)}, status='aviso')
         return False
 
 
-def _deve_enviar_alerta_db(chave, agora, intervalo_minutos):
+def _reservar_alertas_db(chaves, agora, intervalo_minutos):
+    """
+    Upsert em lote: grava ``agora`` para as chaves novas ou cujo último envio
+    foi há ``intervalo_minutos`` ou mais e devolve o conjunto dessas chaves
+    (as que devem gerar alerta). None se o banco falhar.
+    """
+    if not chaves:
+        return set()
     try:
-        from models import db
-        from sqlalchemy import text
+        from models import db, CacheAlerta
 
-        if not _garantir_tabela_cache_alerta():
+        dialeto = (db.engine.dialect.name or '').lower()
+        if dialeto.startswith('postgres'):
+            from sqlalchemy.dialects.postgresql import insert
+        elif dialeto == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
             return None
 
-        dialect = (db.engine.dialect.name or '').lower()
-        if dialect.startswith('postgres'):
-            res = db.session.execute(
-                text(
-                    """
-                    INSERT INTO cache_alerta (chave, data_envio)
-                    VALUES (:chave, :agora)
-                    ON CONFLICT (chave)
-                    DO UPDATE SET data_envio = EXCLUDED.data_envio
-                    WHERE cache_alerta.data_envio <= (:agora - (:intervalo * INTERVAL '1 minute'))
-                    RETURNING data_envio;
-                    """
-                ),
-                {'chave': chave, 'agora': agora, 'intervalo': int(intervalo_minutos)}
-            )
-            row = res.first()
-            db.session.commit()
-            return True if row else False
-
-        # SQLite fallback (não é atômico como Postgres, mas ajuda para dev local)
-        ultimo = db.session.execute(
-            text("SELECT data_envio FROM cache_alerta WHERE chave = :chave"),
-            {'chave': chave}
-        ).first()
-        if ultimo and ultimo[0] is not None:
-            try:
-                delta_min = int((agora - ultimo[0]).total_seconds() // 60)
-                if delta_min < int(intervalo_minutos):
-                    db.session.rollback()
-                    return False
-            except Exception:
-                pass
-
-        db.session.execute(
-            text("INSERT OR REPLACE INTO cache_alerta (chave, data_envio) VALUES (:chave, :agora)"),
-            {'chave': chave, 'agora': agora}
-        )
-        db.session.commit()
-        return True
+        tabela = CacheAlerta.__table__
+        stmt = insert(tabela).values([{'chave': chave, 'data_envio': agora} for chave in chaves])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[tabela.c.chave],
+            set_={'data_envio': stmt.excluded.data_envio},
+            where=tabela.c.data_envio <= agora - timedelta(minutes=int(intervalo_minutos)),
+        ).returning(tabela.c.chave)
+        with db.engine.begin() as conn:
+            return {linha[0] for linha in conn.execute(stmt)}
     except Exception as e:
-        try:
-            from models import db
-            db.session.rollback()
-        except Exception:
-            pass
-        log_evento('cache_db_erro_dedup', {'chave': chave, 'erro': str(e)}, status='aviso')
+        log_evento('cache_db_erro_dedup', {'chaves': len(chaves), 'erro': str(e)}, status='aviso')
         return None
 
-def monitorar_producao():
+
+def _reservar_alertas_memoria(chaves, agora, intervalo_minutos):
+    """Fallback sem banco (pode duplicar se houver múltiplas instâncias)."""
+    reservadas = set()
+    for chave in chaves:
+        ultimo_envio = _alertas_enviados.get(chave)
+        if ultimo_envio is None or int((agora - ultimo_envio).total_seconds() // 60) >= intervalo_minutos:
+            reservadas.add(chave)
+    return reservadas
+
+
+def _consulta_setups_abertos(limite_tempo, limite_somatoria):
+    """
+    Uma linha por OS/item/trabalho com setup aberto: o setup mais recente,
+    a soma (min) dos outros setups das últimas 24h e a primeira ação de
+    produção/pausa/stop posterior a ele, se houver.
+    """
     from models import ApontamentoProducao
+    from sqlalchemy import and_, case, func, select
+
+    ap = ApontamentoProducao.__table__
+    combo = (ap.c.ordem_servico_id, ap.c.item_id, ap.c.trabalho_id)
+    abertos = (
+        select(
+            ap.c.id, *combo, ap.c.data_hora,
+            func.row_number().over(partition_by=combo, order_by=(ap.c.data_hora.desc(), ap.c.id.desc())).label('ordem'),
+            func.count().over(partition_by=combo).label('abertos_combo'),
+        )
+        .where(
+            ap.c.data_fim.is_(None),
+            ap.c.tipo_acao == 'inicio_setup',
+            ap.c.data_hora >= limite_tempo,
+        )
+        .cte('abertos')
+    )
+    atual = select(abertos).where(abertos.c.ordem == 1).cte('atual')
+
+    e = ap.alias('e')
+    mesma_combinacao = and_(
+        e.c.ordem_servico_id == atual.c.ordem_servico_id,
+        e.c.item_id == atual.c.item_id,
+        e.c.trabalho_id == atual.c.trabalho_id,
+        e.c.data_hora >= limite_somatoria,
+    )
+    posterior = and_(e.c.tipo_acao.in_(['inicio_producao', 'pausa', 'stop']), e.c.data_hora > atual.c.data_hora)
+    setup_encerrado = and_(e.c.tipo_acao == 'inicio_setup', e.c.id != atual.c.id)
+
+    return (
+        select(
+            atual.c.id, atual.c.ordem_servico_id, atual.c.item_id, atual.c.trabalho_id, atual.c.data_hora,
+            atual.c.abertos_combo,
+            func.coalesce(func.sum(case((setup_encerrado, func.coalesce(e.c.tempo_decorrido, 0) // 60), else_=0)), 0)
+            .label('soma_setup_min'),
+            func.min(case((posterior, e.c.data_hora))).label('posterior_em'),
+            func.max(case((posterior, e.c.tipo_acao))).label('acao_posterior'),
+        )
+        .select_from(atual.outerjoin(e, mesma_combinacao))
+        .group_by(
+            atual.c.id, atual.c.ordem_servico_id, atual.c.item_id, atual.c.trabalho_id, atual.c.data_hora,
+            atual.c.abertos_combo,
+        )
+    )
+
+
+def monitorar_producao():
+    from models import db, ApontamentoProducao
     from models import local_now_naive
+    from sqlalchemy.orm import selectinload
+
+    inicio = time.perf_counter()
+    tempos = {}
 
     # Usar horário local naive (America/Sao_Paulo) para casar com o padrão do sistema.
     # Isso evita alertas incorretos (ex.: +180min) quando o servidor está em UTC.
@@ -120,158 +159,99 @@ def monitorar_producao():
 
     # Janela para somatória (setup acumulado) - última 24h
     limite_somatoria = agora - timedelta(hours=24)
-    
-    # IMPORTANTE: Buscar APENAS setups que estão ABERTOS (data_fim = NULL) e recentes
-    abertos = ApontamentoProducao.query.filter(
-        ApontamentoProducao.data_fim.is_(None),
-        ApontamentoProducao.tipo_acao == 'inicio_setup',
-        ApontamentoProducao.data_hora >= limite_tempo
-    ).all()
 
-    total_alertas = 0
-    setups_ignorados = 0
-    
-    # Log de debug
-    log_evento('monitoramento_inicio', {
-        'total_abertos': len(abertos),
-        'limite_alerta_min': ConfiguracaoNotificacoes.ALERTA_SETUP_LONGO_MINUTOS,
-        'intervalo_alerta_min': getattr(ConfiguracaoNotificacoes, 'ALERTA_SETUP_LONGO_INTERVALO_MINUTOS', 15)
-    }, status='debug')
-    
-    # Se existir mais de 1 setup aberto para a MESMA OS/Item/Trabalho,
-    # vamos considerar apenas o MAIS RECENTE para monitoramento.
-    abertos_por_chave = {}
-    for ap in abertos:
-        chave_combo = (ap.ordem_servico_id, ap.item_id, ap.trabalho_id)
-        atual = abertos_por_chave.get(chave_combo)
-        if atual is None or (ap.data_hora and atual.data_hora and ap.data_hora > atual.data_hora) or (atual.data_hora is None and ap.data_hora is not None):
-            abertos_por_chave[chave_combo] = ap
-
-    for ap in abertos_por_chave.values():
-        # VERIFICAÇÃO EXTRA: Confirmar que data_fim é realmente NULL
-        if ap.data_fim is not None:
-            setups_ignorados += 1
-            log_evento('monitoramento_setup_ignorado', {
-                'id': ap.id,
-                'motivo': 'data_fim não é NULL',
-                'data_fim': str(ap.data_fim)
-            }, status='ignorado')
-            continue
-        
-        # VERIFICAÇÃO CRÍTICA: Confirmar que este serviço está REALMENTE em setup agora
-        # Verificar se não há produção ou pausa mais recente para o mesmo OS/Item/Trabalho
-        apontamento_mais_recente = ApontamentoProducao.query.filter(
-            ApontamentoProducao.ordem_servico_id == ap.ordem_servico_id,
-            ApontamentoProducao.item_id == ap.item_id,
-            ApontamentoProducao.trabalho_id == ap.trabalho_id,
-            ApontamentoProducao.data_hora > ap.data_hora,
-            ApontamentoProducao.tipo_acao.in_(['inicio_producao', 'pausa', 'stop'])
-        ).first()
-        
-        if apontamento_mais_recente:
-            setups_ignorados += 1
-            log_evento('monitoramento_setup_ignorado', {
-                'id': ap.id,
-                'motivo': 'serviço não está mais em setup (já iniciou produção/pausa/stop)',
-                'acao_posterior': apontamento_mais_recente.tipo_acao,
-                'data_posterior': str(apontamento_mais_recente.data_hora)
-            }, status='ignorado')
+    limite_alerta = ConfiguracaoNotificacoes.ALERTA_SETUP_LONGO_MINUTOS
+    intervalo_alerta = getattr(ConfiguracaoNotificacoes, 'ALERTA_SETUP_LONGO_INTERVALO_MINUTOS', 15)
+
+    # 1) Estado atual + soma de setup 24h de todas as combinações abertas
+    linhas = db.session.execute(_consulta_setups_abertos(limite_tempo, limite_somatoria)).all()
+    tempos['consulta_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+
+    total_abertos = sum(linha.abertos_combo for linha in linhas)
+    ignorados = Counter()
+    candidatos = {}  # chave_alerta -> (id do apontamento, minutos)
+    for linha in linhas:
+        # Serviço já saiu do setup (produção/pausa/stop posterior)
+        if linha.posterior_em is not None:
+            ignorados['ja_saiu_do_setup'] += 1
             continue
-        
-        minutos_aberto = int((agora - ap.data_hora).total_seconds() // 60) if ap.data_hora else 0
-        
-        # Verificar se minutos é negativo (horário futuro - bug de timezone)
+
+        minutos_aberto = int((agora - linha.data_hora).total_seconds() // 60) if linha.data_hora else 0
+        # Horário futuro (bug de timezone)
         if minutos_aberto < 0:
-            setups_ignorados += 1
-            log_evento('monitoramento_setup_ignorado', {
-                'id': ap.id,
-                'motivo': 'horário no futuro',
-                'minutos': minutos_aberto,
-                'data_hora': str(ap.data_hora)
-            }, status='ignorado')
+            ignorados['horario_futuro'] += 1
             continue
 
-        # Calcular setup acumulado (últimas 24h) para este OS/Item/Trabalho
-        # - soma tempo_decorrido de ciclos já encerrados (inicio_setup com tempo_decorrido)
-        # - soma o tempo do setup em andamento
-        soma_setup_min = 0
-        try:
-            ciclos = ApontamentoProducao.query.filter(
-                ApontamentoProducao.ordem_servico_id == ap.ordem_servico_id,
-                ApontamentoProducao.item_id == ap.item_id,
-                ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                ApontamentoProducao.tipo_acao == 'inicio_setup',
-                ApontamentoProducao.data_hora >= limite_somatoria,
-            ).all()
-            for c in ciclos:
-                if c.id == ap.id:
-                    continue
-                if c.tempo_decorrido:
-                    soma_setup_min += int(c.tempo_decorrido // 60)
-        except Exception as exc:
-            log_evento('monitoramento_setup_soma_erro', {
-                'id': ap.id,
-                'erro': str(exc),
-            }, status='aviso')
-
-        minutos = max(0, soma_setup_min + minutos_aberto)
-        
-        limite_alerta = ConfiguracaoNotificacoes.ALERTA_SETUP_LONGO_MINUTOS
-        intervalo_alerta = getattr(ConfiguracaoNotificacoes, 'ALERTA_SETUP_LONGO_INTERVALO_MINUTOS', 15)
-        
-        # Cada setup tem seu próprio controle de alerta
+        minutos = max(0, int(linha.soma_setup_min or 0) + minutos_aberto)
         if minutos >= limite_alerta:
             # Deduplicação por OS/Item/Trabalho (e não por id do apontamento)
             # Isso evita spam quando existirem múltiplos inicio_setup abertos por bug.
-            chave_alerta = f"setup_{ap.ordem_servico_id}_{ap.item_id}_{ap.trabalho_id}"
-            
-            # Log de debug
-            log_evento('setup_passou_limite', {
-                'id': ap.id,
-                'minutos': minutos,
-                'limite': limite_alerta,
-                'item': getattr(ap.item, 'nome', None) or getattr(ap.item, 'codigo_acb', '-'),
-                'servico': getattr(ap.trabalho, 'nome', '-')
-            }, status='debug')
-            
-            # Deduplicação entre múltiplas instâncias (Vercel) usando banco de dados.
-            # Se DB falhar, usa fallback em memória (pode duplicar se houver múltiplas instâncias).
-            deve_enviar = _deve_enviar_alerta_db(chave_alerta, agora, intervalo_alerta)
-            ultimo_envio = None
-            if deve_enviar is None:
-                ultimo_envio = _alertas_enviados.get(chave_alerta)
-                if ultimo_envio is None:
-                    deve_enviar = True
-                else:
-                    minutos_desde_ultimo = int((agora - ultimo_envio).total_seconds() // 60)
-                    deve_enviar = minutos_desde_ultimo >= intervalo_alerta
-            
-            if deve_enviar:
-                _alertar_setup_longo(ap, minutos)
-                # Salvar em memória (DB já foi atualizado quando disponível)
-                _alertas_enviados[chave_alerta] = agora
-                total_alertas += 1
-                log_evento('alerta_setup_enviado', {
-                    'id': ap.id,
-                    'minutos': minutos,
-                    'minutos_desde_ultimo': int((agora - ultimo_envio).total_seconds() // 60) if ultimo_envio else None,
-                    'dedup_db': True if deve_enviar is True and ultimo_envio is None else None
-                }, status='enviado')
-            else:
-                log_evento('alerta_setup_ignorado', {
-                    'id': ap.id,
-                    'minutos': minutos,
-                    'minutos_desde_ultimo': int((agora - ultimo_envio).total_seconds() // 60),
-                    'motivo': f'aguardando {intervalo_alerta}min desde último alerta'
-                }, status='ignorado')
+            chave_alerta = f"setup_{linha.ordem_servico_id}_{linha.item_id}_{linha.trabalho_id}"
+            candidatos[chave_alerta] = (linha.id, minutos)
+
+    # 2) Deduplicação entre instâncias num único upsert (fallback em memória se o banco falhar)
+    marca = time.perf_counter()
+    reservadas = _reservar_alertas_db(list(candidatos), agora, intervalo_alerta)
+    dedup_db = reservadas is not None
+    if reservadas is None:
+        reservadas = _reservar_alertas_memoria(candidatos, agora, intervalo_alerta)
+    ignorados['aguardando_intervalo'] += len(candidatos) - len(reservadas)
+    tempos['dedup_ms'] = round((time.perf_counter() - marca) * 1000, 1)
+
+    # 3) Alertas: só os apontamentos que vão gerar mensagem, com os relacionamentos
+    marca = time.perf_counter()
+    total_alertas = 0
+    if reservadas:
+        ids = [candidatos[chave][0] for chave in reservadas]
+        apontamentos = {
+            ap.id: ap for ap in ApontamentoProducao.query.options(
+                selectinload(ApontamentoProducao.item),
+                selectinload(ApontamentoProducao.trabalho),
+                selectinload(ApontamentoProducao.ordem_servico),
+                selectinload(ApontamentoProducao.operador),
+                selectinload(ApontamentoProducao.usuario),
+            ).filter(ApontamentoProducao.id.in_(ids)).all()
+        }
+        for chave in sorted(reservadas):
+            ap_id, minutos = candidatos[chave]
+            ap = apontamentos.get(ap_id)
+            if ap is None:
+                continue
+            _alertar_setup_longo(ap, minutos)
+            _alertas_enviados[chave] = agora
+            total_alertas += 1
+            log_evento('alerta_setup_enviado', {'id': ap_id, 'minutos': minutos, 'dedup_db': dedup_db}, status='enviado')
+    tempos['alertas_ms'] = round((time.perf_counter() - marca) * 1000, 1)
 
     _limpar_alertas_antigos(agora)
-    log_evento('monitoramento_producao', {
-        'abertos': len(abertos),
+    tempos['total_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+
+    resultado = {
+        'abertos': total_abertos,
+        'combinacoes': len(linhas),
+        'acima_do_limite': len(candidatos),
         'alertas': total_alertas,
-        'ignorados': setups_ignorados
-    }, status='executado')
-    return {'abertos': len(abertos), 'alertas': total_alertas, 'ignorados': setups_ignorados}
+        'ignorados': sum(ignorados.values()),
+        'ignorados_por_motivo': dict(ignorados),
+        'tempos_ms': tempos,
+    }
+    with _metricas_lock:
+        _metricas['execucoes'] += 1
+        _metricas['tempo_total_ms'] += tempos['total_ms']
+        _metricas['ultima'] = dict(resultado, executado_em=agora.isoformat(timespec='seconds'))
+    log_evento('monitoramento_producao', resultado, status='executado')
+    return resultado
+
+
+def get_stats():
+    """Execuções do monitoramento: contagem, tempo médio e a última execução."""
+    with _metricas_lock:
+        execucoes = _metricas['execucoes']
+        return {
+            'execucoes': execucoes,
+            'tempo_medio_ms': round(_metricas['tempo_total_ms'] / execucoes, 1) if execucoes else None,
+            'ultima': _metricas['ultima'],
+        }
 
 
 def _limpar_alertas_antigos(agora):
@@ -19,6 +19,12 @@ def iniciar_scheduler(app):
     if _scheduler and _scheduler.running:
         return True
 
+    # cache_alerta (dedup dos alertas) é garantida aqui, não a cada verificação
+    with app.app_context():
+        from models import db
+        from .monitoramento import garantir_tabela_cache_alerta
+        garantir_tabela_cache_alerta(db.engine)
+
     _scheduler = BackgroundScheduler(timezone='America/Sao_Paulo')
 
     def job_monitoramento():
@@ -76,14 +76,17 @@ def mensagem_setup_finalizado(dados):
 
 
 def mensagem_kanban_movido(dados):
-    return (
+    msg = (
         '📋 ITEM MOVIDO NO KANBAN\n\n'
         f"📦 OS: {dados.get('os', '-')}\n"
         f"📦 Item: {dados.get('item', '-')}\n"
         f"➡️ De: {dados.get('lista_origem', '-')}\n"
         f"✅ Para: {dados.get('lista_destino', '-')}\n"
-        f"⏰ Horário: {_hora(dados.get('horario'))}"
     )
+    # Rajada agrupada pela fila (várias movimentações da mesma OS)
+    if (dados.get('eventos') or 1) > 1:
+        msg += f"🔁 Movimentações: {dados['eventos']}\n"
+    return msg + f"⏰ Horário: {_hora(dados.get('horario'))}"
 
 
 def mensagem_atraso_detectado(dados):
@@ -1,8 +1,47 @@
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from .configuracao import ConfiguracaoNotificacoes
 from .logs import log_envio_whatsapp
 
+_sessao = None
+_sessao_lock = threading.Lock()
+
+
+def _sessao_http():
+    """Sessão keep-alive compartilhada pelos workers (uma conexão por worker no pool)."""
+    global _sessao
+    with _sessao_lock:
+        if _sessao is None:
+            conexoes = max(2, ConfiguracaoNotificacoes.FILA_WORKERS)
+            s = requests.Session()
+            s.mount('https://', HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes))
+            s.mount('http://', HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes))
+            _sessao = s
+        return _sessao
+
+
+def motivo_indisponivel():
+    """Motivo para não enviar (WhatsApp desativado/config incompleta) ou None se pronto."""
+    if not ConfiguracaoNotificacoes.WHATSAPP_ATIVO:
+        return 'WHATSAPP_ATIVO desativado'
+    if not all([
+        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_URL,
+        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_APIKEY,
+        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_INSTANCE,
+    ]):
+        return 'configuracao incompleta'
+    return None
+
+
+def destinos_configurados():
+    """WHATSAPP_NUMEROS + WHATSAPP_GRUPO_PRODUCAO."""
+    destinos = list(ConfiguracaoNotificacoes.WHATSAPP_NUMEROS or [])
+    if ConfiguracaoNotificacoes.WHATSAPP_GRUPO_PRODUCAO:
+        destinos.append(ConfiguracaoNotificacoes.WHATSAPP_GRUPO_PRODUCAO)
+    return destinos
+
 
 def enviar_whatsapp(mensagem, destino=None, *, timeout=None, retries=None, enviar_para_todos=False):
     """
@@ -18,23 +57,15 @@ def enviar_whatsapp(mensagem, destino=None, *, timeout=None, retries=None, envia
     timeout = timeout or ConfiguracaoNotificacoes.WHATSAPP_TIMEOUT
     retries = ConfiguracaoNotificacoes.WHATSAPP_RETRIES if retries is None else retries
 
-    if not ConfiguracaoNotificacoes.WHATSAPP_ATIVO:
-        log_envio_whatsapp('sistema', mensagem, status='ignorado_whatsapp_desativado')
-        return {'success': False, 'skipped': True, 'reason': 'WHATSAPP_ATIVO desativado'}
-
-    if not all([
-        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_URL,
-        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_APIKEY,
-        ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_INSTANCE,
-    ]):
-        log_envio_whatsapp('sistema', mensagem, status='ignorado_config_incompleta')
-        return {'success': False, 'skipped': True, 'reason': 'configuracao incompleta'}
+    motivo = motivo_indisponivel()
+    if motivo:
+        status = 'ignorado_whatsapp_desativado' if not ConfiguracaoNotificacoes.WHATSAPP_ATIVO else 'ignorado_config_incompleta'
+        log_envio_whatsapp('sistema', mensagem, status=status)
+        return {'success': False, 'skipped': True, 'reason': motivo}
     
     # Determinar destinos
     if enviar_para_todos or destino is None:
-        destinos = ConfiguracaoNotificacoes.WHATSAPP_NUMEROS or []
-        if ConfiguracaoNotificacoes.WHATSAPP_GRUPO_PRODUCAO:
-            destinos.append(ConfiguracaoNotificacoes.WHATSAPP_GRUPO_PRODUCAO)
+        destinos = destinos_configurados()
         if not destinos:
             log_envio_whatsapp('sistema', mensagem, status='ignorado_sem_destinos')
             return {'success': False, 'skipped': True, 'reason': 'nenhum destino configurado'}
@@ -52,10 +83,14 @@ def enviar_whatsapp(mensagem, destino=None, *, timeout=None, retries=None, envia
     return {'success': sucesso, 'resultados': resultados}
 
 
-def _enviar_whatsapp_unico(mensagem, destino, timeout, retries):
-    """Envia mensagem para um único destino."""
+def enviar_para_destino(mensagem, destino, timeout=None, tentativa=1):
+    """
+    Uma única tentativa de envio, sem espera (usada pelos workers da fila,
+    que reagendam a mensagem em caso de falha). ``permanente`` indica erro que
+    não adianta repetir (4xx exceto 408/429).
+    """
     if not destino:
-        return {'success': False, 'skipped': True, 'reason': 'destino vazio'}
+        return {'success': False, 'skipped': True, 'reason': 'destino vazio', 'permanente': True}
 
     url = (
         f'{ConfiguracaoNotificacoes.WHATSAPP_EVOLUTION_URL}'
@@ -70,19 +105,34 @@ def _enviar_whatsapp_unico(mensagem, destino, timeout, retries):
         'text': mensagem,
     }
 
-    ultima_excecao = None
+    try:
+        response = _sessao_http().post(
+            url, headers=headers, json=payload, timeout=timeout or ConfiguracaoNotificacoes.WHATSAPP_TIMEOUT,
+        )
+        if 200 <= response.status_code < 300:
+            log_envio_whatsapp(destino, mensagem, status='enviado')
+            return {'success': True, 'status_code': response.status_code, 'response': response.text}
+        erro = RuntimeError(f'HTTP {response.status_code}: {response.text[:300]}')
+        log_envio_whatsapp(destino, mensagem, status=f'falha_tentativa_{tentativa}', erro=erro)
+        permanente = 400 <= response.status_code < 500 and response.status_code not in (408, 429)
+        return {'success': False, 'status_code': response.status_code, 'error': str(erro), 'permanente': permanente}
+    except Exception as exc:
+        log_envio_whatsapp(destino, mensagem, status=f'erro_tentativa_{tentativa}', erro=exc)
+        return {'success': False, 'error': str(exc), 'permanente': False}
+
+
+def _enviar_whatsapp_unico(mensagem, destino, timeout, retries):
+    """Envia mensagem para um único destino."""
+    if not destino:
+        return {'success': False, 'skipped': True, 'reason': 'destino vazio'}
+
+    resultado = None
     for tentativa in range(1, retries + 2):
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=timeout)
-            if 200 <= response.status_code < 300:
-                log_envio_whatsapp(destino, mensagem, status='enviado')
-                return {'success': True, 'status_code': response.status_code, 'response': response.text}
-            ultima_excecao = RuntimeError(f'HTTP {response.status_code}: {response.text[:300]}')
-            log_envio_whatsapp(destino, mensagem, status=f'falha_tentativa_{tentativa}', erro=ultima_excecao)
-        except Exception as exc:
-            ultima_excecao = exc
-            log_envio_whatsapp(destino, mensagem, status=f'erro_tentativa_{tentativa}', erro=exc)
+        resultado = enviar_para_destino(mensagem, destino, timeout, tentativa)
+        if resultado.get('success') or resultado.get('permanente'):
+            break
         if tentativa <= retries:
             time.sleep(min(2 * tentativa, 5))
 
-    return {'success': False, 'error': str(ultima_excecao)}
+    resultado.pop('permanente', None)
+    return resultado
@@ -1,8 +1,15 @@
 from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, session
 from models import db, Usuario, ApontamentoProducao, StatusProducaoOS, OrdemServico, ItemTrabalho, PedidoOrdemServico, Pedido, Item, Trabalho, KanbanLista, CartaoFantasma
 from datetime import datetime, timezone, timedelta
-from sqlalchemy.orm import joinedload
-from sqlalchemy import func, select
+from collections import defaultdict
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy import func
+from utils.estado_chao_fabrica import estado_chao_fabrica
+from utils import kanban_changelog
+from utils.barramento import publicar as publicar_tempo_real
+from routes.dashboard_apontamentos import invalidar_cache_dashboard
+from utils.resumo_apontamentos import carregar_resumos, ultimo_com_quantidade as ultimo_resumo_com_quantidade
+import copy
 import logging
 import random
 import string
@@ -152,7 +159,6 @@ def _calcular_metricas_stop_completo(os_id, item_id, trab_id, quantidade_final):
     """
     Calcula métricas completas do Stop incluindo informações de todos os serviços da OS.
     """
-    from datetime import timedelta
     from models import local_now_naive
     
     # Métricas do serviço atual
@@ -169,46 +175,49 @@ def _calcular_metricas_stop_completo(os_id, item_id, trab_id, quantidade_final):
         ItemTrabalho.item_id == item_id
     ).all()
     
-    # Calcular métricas de cada serviço
-    limite_tempo = local_now_naive() - timedelta(hours=24)
+    # Métricas dos outros serviços na mesma janela de 24h do serviço atual (o
+    # resumo acumulado não serve aqui: o Stop mostra só o trabalho recente).
+    # Uma query para todos os serviços, mais recente primeiro.
+    agora = local_now_naive()
+    limite_tempo = agora - timedelta(hours=24)
     outros_servicos = []
-    
+    por_trabalho = defaultdict(list)
+    for ap in ApontamentoProducao.query.with_entities(
+        ApontamentoProducao.trabalho_id, ApontamentoProducao.tipo_acao, ApontamentoProducao.data_hora,
+        ApontamentoProducao.data_fim, ApontamentoProducao.quantidade, ApontamentoProducao.tempo_decorrido
+    ).filter(
+        ApontamentoProducao.ordem_servico_id == os_id,
+        ApontamentoProducao.item_id == item_id,
+        ApontamentoProducao.trabalho_id != trab_id,
+        ApontamentoProducao.data_hora >= limite_tempo
+    ).order_by(ApontamentoProducao.data_hora.desc()).all():
+        por_trabalho[ap.trabalho_id].append(ap)
+
     for trabalho_id_loop, trabalho_nome in todos_trabalhos:
         if trabalho_id_loop == trab_id:
             continue  # Pular o serviço atual
-        
-        # Buscar última quantidade e tempo deste serviço
-        aps = ApontamentoProducao.query.filter(
-            ApontamentoProducao.ordem_servico_id == os_id,
-            ApontamentoProducao.item_id == item_id,
-            ApontamentoProducao.trabalho_id == trabalho_id_loop,
-            ApontamentoProducao.data_hora >= limite_tempo
-        ).order_by(ApontamentoProducao.data_hora.desc()).all()
-        
+
         ultima_qtd = None
         tempo_setup = 0
         tempo_producao = 0
-        agora = local_now_naive()
-        
-        if aps:
-            for ap in aps:
-                if ultima_qtd is None and ap.quantidade is not None:
-                    ultima_qtd = ap.quantidade
-                
-                tempo_min = 0
-                if ap.tempo_decorrido:
-                    # Apontamento já finalizado
-                    tempo_min = ap.tempo_decorrido // 60
-                elif ap.data_fim is None and ap.data_hora:
-                    # Apontamento ABERTO (em andamento)
-                    tempo_min = int((agora - ap.data_hora).total_seconds() // 60)
-                
-                if tempo_min > 0:
-                    if ap.tipo_acao == 'inicio_setup':
-                        tempo_setup += tempo_min
-                    elif ap.tipo_acao == 'inicio_producao':
-                        tempo_producao += tempo_min
-        
+        for ap in por_trabalho.get(trabalho_id_loop, ()):
+            if ultima_qtd is None and ap.quantidade is not None:
+                ultima_qtd = ap.quantidade
+
+            tempo_min = 0
+            if ap.tempo_decorrido:
+                # Apontamento já finalizado
+                tempo_min = ap.tempo_decorrido // 60
+            elif ap.data_fim is None and ap.data_hora:
+                # Apontamento ABERTO (em andamento)
+                tempo_min = int((agora - ap.data_hora).total_seconds() // 60)
+
+            if tempo_min > 0:
+                if ap.tipo_acao == 'inicio_setup':
+                    tempo_setup += tempo_min
+                elif ap.tipo_acao == 'inicio_producao':
+                    tempo_producao += tempo_min
+
         # Adicionar serviço mesmo sem apontamento
         outros_servicos.append({
             'nome': trabalho_nome,
@@ -654,1324 +663,1037 @@ def gerar_codigo_unico():
     
     return None
 
-@apontamento_bp.route('/status-ativos', methods=['GET'])
-def status_ativos():
-    """Retorna todos os status de produção ativos para apontamentos (usado para persistência frontend)"""
+TOLERANCIA_DESEMPENHO = 0.15  # 15%
+
+ESTADO_PADRAO_OS = {
+    'status_atual': 'Aguardando',
+    'apontamento_base': None,
+    'setup_aberto': None,
+    'producao_aberta': None,
+    'pausa_aberta': None,
+    'item_id': None,
+    'trabalho_id': None,
+    'usuario_id': None,
+    'inicio_acao': None
+}
+
+# Acima disso, alterações de outros workers desde a última leitura remontam tudo
+LIMITE_ALTERACOES_MARCA_DAGUA = 500
+
+
+def _classificar_desempenho(usado, estimado):
+    if usado <= estimado * (1 - TOLERANCIA_DESEMPENHO):
+        return 'Excelente'
+    if usado <= estimado * (1 + TOLERANCIA_DESEMPENHO):
+        return 'Dentro do esperado'
+    return 'Abaixo do esperado'
+
+
+def _analytics_vazio(tempos_zerados=False):
+    valor = 0 if tempos_zerados else None
+    return {
+        'tempo_setup_estimado': None,
+        'tempo_setup_utilizado': valor,
+        'setup_status': None,
+        'tempo_peca_estimado': None,
+        'tempo_producao_utilizado': valor,
+        'tempo_pausas_utilizado': valor,
+        'media_seg_por_peca': None,
+        'producao_status': None
+    }
+
+
+def _tem_pedido_entregue(os_obj):
+    for pedido_os in getattr(os_obj, 'pedidos', None) or []:
+        if pedido_os.pedido and pedido_os.pedido.status == 'entregue':
+            return True
+    return False
+
+
+def _agregar_clientes_os(os_obj, status_info):
+    """Agrega clientes e quantidade total de todos os pedidos vinculados à OS"""
+    clientes_map = {}
+    total_q = 0
+    for po in getattr(os_obj, 'pedidos', []) or []:
+        ped = getattr(po, 'pedido', None)
+        if not ped:
+            continue
+        q = int(getattr(ped, 'quantidade', 0) or 0)
+        total_q += q
+        cli = getattr(ped, 'cliente', None)
+        nome_cli = getattr(cli, 'nome', None) or 'Cliente'
+        clientes_map[nome_cli] = clientes_map.get(nome_cli, 0) + q
+    status_info['quantidade_total'] = int(total_q)
+    if clientes_map:
+        status_info['clientes_quantidades'] = [
+            {'cliente_nome': k, 'quantidade': v} for k, v in clientes_map.items()
+        ]
+        # Compatibilidade: primeiro cliente
+        status_info['cliente_nome'] = next(iter(clientes_map.keys()))
+
+
+def _aplicar_lista_kanban(status_info, nome_lista_raw, map_lista_por_lower):
+    """Normaliza o nome da lista para o nome canônico da KanbanLista (quando existir)"""
+    status_info['lista_kanban'] = nome_lista_raw
+    if not nome_lista_raw:
+        return
+    kl = map_lista_por_lower.get(nome_lista_raw.strip().lower())
+    if kl:
+        status_info['lista_kanban'] = getattr(kl, 'nome', None)
+        status_info['lista_tipo'] = getattr(kl, 'tipo_servico', None)
+        status_info['lista_cor'] = getattr(kl, 'cor', None)
+
+
+def _aplicar_padroes_cartao(status_info):
+    """Valores padrão para campos obrigatórios no frontend"""
+    status_info.setdefault('ultima_quantidade', 0)
+    status_info.setdefault('ativos_por_trabalho', [])
+    status_info.setdefault('qtd_ativos', 0)
+    status_info.setdefault('multiplo_ativos', False)
+    status_info.setdefault('analytics', {})
+    status_info.setdefault('quantidade_total', 0)
+    status_info.setdefault('cliente_nome', None)
+    status_info.setdefault('resumo_status', {'setup': 0, 'pausado': 0, 'producao': 0})
+    status_info.setdefault('trabalhos_do_item', [])
+
+
+def _montar_ghost_por_os(cartoes_fantasma, map_lista_por_lower):
+    """Agrupa os cartões fantasma ativos por OS (cards, listas e tipos) para mesclar nos cartões principais"""
+    ghost_por_os = {}
+    for cf in cartoes_fantasma:
+        try:
+            os_id = getattr(cf, 'ordem_servico_id', None)
+            if not os_id:
+                continue
+            lista_cf = (getattr(cf, 'lista_kanban', None) or '').strip()
+            lista_cf_lower = lista_cf.lower() if lista_cf else None
+            kl_cf = map_lista_por_lower.get(lista_cf_lower) if lista_cf_lower else None
+            trabalho_cf = getattr(cf, 'trabalho', None)
+            criado_por = getattr(cf, 'criado_por', None)
+            info_cf = {
+                'id': cf.id,
+                'lista_kanban': lista_cf or None,
+                'lista_tipo': getattr(kl_cf, 'tipo_servico', None) if kl_cf else None,
+                'lista_cor': getattr(kl_cf, 'cor', None) if kl_cf else None,
+                'trabalho_id': getattr(cf, 'trabalho_id', None),
+                'trabalho_nome': getattr(trabalho_cf, 'nome', None) if trabalho_cf else None,
+                'posicao_fila': getattr(cf, 'posicao_fila', None),
+                'observacoes': getattr(cf, 'observacoes', None),
+                'criado_por_id': getattr(criado_por, 'id', None) if criado_por else None,
+                'criado_por_nome': getattr(criado_por, 'nome', None) if criado_por else None,
+                'data_criacao': cf.data_criacao.isoformat() if getattr(cf, 'data_criacao', None) else None,
+            }
+            bucket = ghost_por_os.setdefault(os_id, {
+                'cards': [],
+                'listas_lower': set(),
+                'tipos_lower': set(),
+                'trabalhos_ids': set(),
+            })
+            bucket['cards'].append(info_cf)
+            if lista_cf_lower:
+                bucket['listas_lower'].add(lista_cf_lower)
+                if kl_cf and getattr(kl_cf, 'tipo_servico', None):
+                    bucket['tipos_lower'].add(str(kl_cf.tipo_servico).strip().lower())
+            trab_id_cf = getattr(cf, 'trabalho_id', None)
+            if trab_id_cf:
+                bucket['trabalhos_ids'].add(trab_id_cf)
+        except Exception as e_cf_it:
+            logger.error(f"Falha ao processar cartão fantasma para OS {getattr(cf, 'ordem_servico_id', None)}: {e_cf_it}")
+            continue
+    return ghost_por_os
+
+
+def _em_lotes(ids, tamanho=500):
+    ids = list(ids)
+    for i in range(0, len(ids), tamanho):
+        yield ids[i:i + tamanho]
+
+
+def _chave_cronologica(ap):
+    return (ap.data_hora or datetime.min, ap.id)
+
+
+def _carregar_dados_status_ativos(os_ids, os_ids_resumo=()):
+    """
+    Estágio de carga em lote dos cartões de status-ativos.
+
+    Busca de uma vez (``IN (...)``) os apontamentos das OS informadas e os itens,
+    trabalhos, operadores e estimativas referenciados por eles, entregando
+    dicionários aos montadores de cartão. O número de queries não depende da
+    quantidade de cartões.
+
+    Para ``os_ids_resumo`` (OS sem apontamento ativo) basta o resumo de tempos
+    por OS/item/trabalho; sem a tabela de resumo, o histórico delas também é lido.
+    """
+    dados = {
+        'por_os': defaultdict(list),
+        'por_combo': defaultdict(list),
+        'itens': {},
+        'trabalhos': {},
+        'usuarios': {},
+        'estimativas': {},
+        'resumos': {},
+    }
+    os_ids = set(os_ids or [])
+    os_ids_resumo = set(os_ids_resumo or []) - os_ids
+    if os_ids_resumo:
+        dados['resumos'] = carregar_resumos(db.session, os_ids_resumo)
+        if dados['resumos'] is None:
+            os_ids |= os_ids_resumo
+    os_ids = [i for i in os_ids if i is not None]
+    if not os_ids:
+        return dados
+
+    colunas = (
+        ApontamentoProducao.id,
+        ApontamentoProducao.ordem_servico_id,
+        ApontamentoProducao.item_id,
+        ApontamentoProducao.trabalho_id,
+        ApontamentoProducao.usuario_id,
+        ApontamentoProducao.operador_id,
+        ApontamentoProducao.tipo_acao,
+        ApontamentoProducao.data_hora,
+        ApontamentoProducao.data_fim,
+        ApontamentoProducao.quantidade,
+        ApontamentoProducao.motivo_parada,
+        ApontamentoProducao.tempo_decorrido,
+        ApontamentoProducao.lista_kanban,
+    )
+    apontamentos = []
+    for lote in _em_lotes(os_ids):
+        apontamentos.extend(
+            db.session.query(*colunas)
+            .filter(ApontamentoProducao.ordem_servico_id.in_(lote))
+            .all()
+        )
+    apontamentos.sort(key=_chave_cronologica)
+
+    item_ids, trabalho_ids, usuario_ids = set(), set(), set()
+    for ap in apontamentos:
+        dados['por_os'][ap.ordem_servico_id].append(ap)
+        dados['por_combo'][(ap.ordem_servico_id, ap.item_id, ap.trabalho_id)].append(ap)
+        item_ids.add(ap.item_id)
+        trabalho_ids.add(ap.trabalho_id)
+        usuario_ids.add(ap.operador_id or ap.usuario_id)
+    item_ids.discard(None)
+    trabalho_ids.discard(None)
+    usuario_ids.discard(None)
+
+    for lote in _em_lotes(item_ids):
+        for item in Item.query.filter(Item.id.in_(lote)).all():
+            dados['itens'][item.id] = item
+        for it_rel in ItemTrabalho.query.filter(ItemTrabalho.item_id.in_(lote)).all():
+            dados['estimativas'].setdefault((it_rel.item_id, it_rel.trabalho_id), it_rel)
+    for lote in _em_lotes(trabalho_ids):
+        for trabalho in Trabalho.query.filter(Trabalho.id.in_(lote)).all():
+            dados['trabalhos'][trabalho.id] = trabalho
+    for lote in _em_lotes(usuario_ids):
+        for usuario in Usuario.query.filter(Usuario.id.in_(lote)).all():
+            dados['usuarios'][usuario.id] = usuario
+    return dados
+
+
+def _ultimo_com_quantidade(aps):
+    """Último apontamento (mais recente) com quantidade informada"""
+    for ap in reversed(aps):
+        if ap.quantidade is not None:
+            return ap
+    return None
+
+
+def _usa_historico(dados, os_id):
+    """OS com histórico carregado (ou sem resumo disponível) somam os apontamentos"""
+    return os_id in dados['por_os'] or dados.get('resumos') is None
+
+
+def _ultima_quantidade_os(dados, os_id):
+    """(quantidade, item_id, trabalho_id) do último apontamento com quantidade da OS"""
+    if _usa_historico(dados, os_id):
+        ap = _ultimo_com_quantidade(dados['por_os'].get(os_id, []))
+        return (int(ap.quantidade), ap.item_id, ap.trabalho_id) if ap else None
+    resumo = ultimo_resumo_com_quantidade(dados['resumos'], os_id)
+    return (int(resumo.ultima_quantidade), resumo.item_id, resumo.trabalho_id) if resumo else None
+
+
+def _ultima_quantidade_combo(dados, combo):
+    if _usa_historico(dados, combo[0]):
+        ap = _ultimo_com_quantidade(dados['por_combo'].get(combo, []))
+        return int(ap.quantidade) if ap else None
+    resumo = dados['resumos'].get(combo)
+    return resumo.ultima_quantidade if resumo else None
+
+
+def _tempos_encerrados_combo(dados, combo):
+    """(setup, produção, pausas) em segundos dos apontamentos encerrados do combo"""
+    if not _usa_historico(dados, combo[0]):
+        resumo = dados['resumos'].get(combo)
+        if not resumo:
+            return 0, 0, 0
+        return resumo.tempo_setup_s, resumo.tempo_producao_s, resumo.tempo_pausas_s
+
+    tempo_setup = tempo_producao = tempo_pausas = 0
+    for ap in dados['por_combo'].get(combo, []):
+        if ap.data_fim and ap.data_hora:
+            duracao = int((ap.data_fim - ap.data_hora).total_seconds())
+            if ap.tipo_acao in ['inicio_setup', 'fim_setup']:
+                tempo_setup += duracao
+            elif ap.tipo_acao in ['inicio_producao', 'fim_producao']:
+                tempo_producao += duracao
+            elif ap.tipo_acao in ['pausa', 'stop']:
+                tempo_pausas += duracao
+    return tempo_setup, tempo_producao, tempo_pausas
+
+
+def _calcular_analytics_trabalho(aps_combo, agora_utc):
+    """
+    Tempos do último ciclo de setup/produção/pausa de um item/trabalho da OS,
+    a partir dos apontamentos do combo em ordem cronológica.
+    Retorna (analytics, cronometro, relogio); ``relogio`` lista os campos que
+    ainda estão correndo (contados até ``agora_utc``).
+    """
+    analytics = {}
+    cronometro = {'tipo': None, 'inicio': None}
+    relogio = []
+
+    inicio_setup = None
+    inicio_prod = None
+    for ap in aps_combo:
+        if ap.tipo_acao == 'inicio_setup':
+            inicio_setup = ap
+        elif ap.tipo_acao == 'inicio_producao':
+            inicio_prod = ap
+
+    # Setup: tempo utilizado no último ciclo
+    if inicio_setup:
+        fim_setup = next(
+            (ap for ap in aps_combo
+             if ap.tipo_acao == 'fim_setup' and ap.data_hora and ap.data_hora > inicio_setup.data_hora),
+            None
+        )
+        if fim_setup:
+            analytics['tempo_setup_utilizado'] = int((fim_setup.data_hora - inicio_setup.data_hora).total_seconds())
+        else:
+            analytics['tempo_setup_utilizado'] = int((agora_utc - inicio_setup.data_hora).total_seconds())
+            relogio.append('tempo_setup_utilizado')
+
+    # Produção: tempo de produção + pausas desde o último início
+    tempo_producao_util = 0
+    tempo_pausa_util = 0
+    if inicio_prod:
+        # Pausa aberta após esse início (a mais recente)
+        pausa_aberta = None
+        for ap in aps_combo:
+            if ap.tipo_acao in ('pausa', 'stop') and ap.data_fim is None \
+                    and ap.data_hora and ap.data_hora >= inicio_prod.data_hora:
+                pausa_aberta = ap
+        if pausa_aberta:
+            # produção até início da pausa + tempo da pausa até agora
+            tempo_producao_util = int((pausa_aberta.data_hora - inicio_prod.data_hora).total_seconds())
+            tempo_pausa_util = int((agora_utc - pausa_aberta.data_hora).total_seconds())
+            relogio.append('tempo_pausas_utilizado')
+            cronometro['tipo'] = 'pausa'
+            cronometro['inicio'] = to_brt_iso(pausa_aberta.data_hora)
+        elif inicio_prod.data_fim is None:
+            tempo_producao_util = int((agora_utc - inicio_prod.data_hora).total_seconds())
+            relogio.append('tempo_producao_utilizado')
+            cronometro['tipo'] = 'producao'
+            cronometro['inicio'] = to_brt_iso(inicio_prod.data_hora)
+        else:
+            # produção encerrada; usar último tempo_decorrido se disponível
+            tempo_producao_util = int(inicio_prod.tempo_decorrido or 0)
+
+    analytics['tempo_producao_utilizado'] = max(0, tempo_producao_util)
+    analytics['tempo_pausas_utilizado'] = max(0, tempo_pausa_util)
+    return analytics, cronometro, relogio
+
+
+def _classificar_analytics(analytics, qtd):
+    """Recalcula média por peça e status de setup/produção a partir dos tempos"""
+    if analytics.get('tempo_setup_estimado') and analytics.get('tempo_setup_utilizado') is not None:
+        analytics['setup_status'] = _classificar_desempenho(analytics['tempo_setup_utilizado'], analytics['tempo_setup_estimado'])
+    total_seg = (analytics.get('tempo_producao_utilizado') or 0) + (analytics.get('tempo_pausas_utilizado') or 0)
+    if qtd and total_seg:
+        media = int(total_seg / max(qtd, 1))
+        analytics['media_seg_por_peca'] = media
+        if analytics.get('tempo_peca_estimado'):
+            analytics['producao_status'] = _classificar_desempenho(media, analytics['tempo_peca_estimado'])
+
+
+def _somar_tempos_trabalhos(trabalhos_list, ativos_lista):
+    """Soma os tempos dos apontamentos ativos em cada entrada de trabalhos_do_item"""
+    for entrada in trabalhos_list:
+        tempo_setup = tempo_pausas = tempo_producao = 0
+        for a in ativos_lista:
+            if a.get('trabalho_id') != entrada.get('trabalho_id'):
+                continue
+            an = a.get('analytics') or {}
+            tempo_setup += int(an.get('tempo_setup_utilizado') or 0)
+            tempo_pausas += int(an.get('tempo_pausas_utilizado') or 0)
+            tempo_producao += int(an.get('tempo_producao_utilizado') or 0)
+        entrada['tempo_setup_utilizado'] = int(tempo_setup)
+        entrada['tempo_pausas_utilizado'] = int(tempo_pausas)
+        entrada['tempo_producao_utilizado'] = int(tempo_producao)
+
+
+def _montar_cartao_ativo(status, map_lista_por_lower, dados):
+    """Cartão de uma OS com apontamento ativo (setup, produção ou pausa)"""
+    status_info = {
+        'id': status.id,
+        'ordem_servico_id': status.ordem_servico_id,
+        'ordem_id': status.ordem_servico_id,  # Mantido para compatibilidade com frontend
+        'status_atual': status.status_atual or 'Desconhecido'
+    }
+    os_obj = getattr(status, 'ordem_servico', None)
+    aps_os = dados['por_os'].get(status.ordem_servico_id, [])
+    por_combo = dados['por_combo']
+
+    # Número da OS e clientes/quantidades usando relações pré-carregadas
     try:
-        # Cache curto de 5 segundos para evitar múltiplas queries idênticas
-        from flask import current_app
-        cache_key = f"status_ativos:{request.query_string.decode('utf-8')}"
-        
-        # Tentar buscar do cache se disponível
+        if os_obj:
+            status_info['os_numero'] = getattr(os_obj, 'numero', None) or getattr(os_obj, 'codigo', None) or f"OS-{os_obj.id}"
+            _agregar_clientes_os(os_obj, status_info)
+    except Exception as e_os:
+        logger.error(f"Falha ao obter OS relacionada: {e_os}")
+
+    # Operador atual (pré-carregado)
+    try:
+        operador = getattr(status, 'operador_atual', None)
+        if operador:
+            status_info['operador_id'] = operador.id
+            status_info['operador_nome'] = operador.nome
+            status_info['operador_codigo'] = getattr(operador, 'codigo_operador', None)
+    except Exception as e_op:
+        logger.error(f"Falha ao buscar operador: {e_op}")
+
+    # Item atual; fallback para o item do primeiro pedido da OS
+    item_obj = None
+    try:
+        item_obj = getattr(status, 'item_atual', None)
+        if not item_obj and os_obj and getattr(os_obj, 'pedidos', None):
+            pedido = getattr(os_obj.pedidos[0], 'pedido', None)
+            item_obj = getattr(pedido, 'item', None) if pedido else None
+        if item_obj:
+            status_info['item_id'] = item_obj.id
+            status_info['item_nome'] = item_obj.nome
+            status_info['item_codigo'] = item_obj.codigo_acb
+            status_info['item_imagem_path'] = getattr(item_obj, 'imagem_thumb_path', None)
+    except Exception as e_item:
+        logger.error(f"Status {status.id}: falha ao buscar item: {e_item}")
+
+    # Trabalho atual (pré-carregado)
+    try:
+        trabalho = getattr(status, 'trabalho_atual', None)
+        if trabalho:
+            status_info['trabalho_id'] = trabalho.id
+            status_info['trabalho_nome'] = trabalho.nome
+    except Exception as e_trab:
+        logger.error(f"Falha ao buscar trabalho: {e_trab}")
+
+    combo_atual = (status.ordem_servico_id, status.item_atual_id, status.trabalho_atual_id)
+
+    # Quantidade atual e última quantidade apontada para este item/trabalho
+    try:
+        status_info['quantidade_atual'] = status.quantidade_atual
+        ultima_q = None
+        if status.item_atual_id and status.trabalho_atual_id:
+            ultimo_ap = _ultimo_com_quantidade(por_combo.get(combo_atual, []))
+            if ultimo_ap:
+                ultima_q = int(ultimo_ap.quantidade)
+        if ultima_q is None and status.quantidade_atual is not None:
+            ultima_q = int(status.quantidade_atual)
+        status_info['ultima_quantidade'] = ultima_q if ultima_q is not None else 0
+    except Exception as e_q:
+        logger.error(f"Falha ao calcular ultima_quantidade: {e_q}")
+
+    status_info['inicio_acao'] = to_brt_iso(getattr(status, 'inicio_acao', None))
+
+    agora_utc = datetime.now(LOCAL_TZ).replace(tzinfo=None)
+
+    # Analytics por OS/item/trabalho para o Dashboard
+    try:
+        analytics = _analytics_vazio()
+        cronometro = {'tipo': None, 'inicio': None}
+        if status.item_atual_id and status.trabalho_atual_id:
+            it_rel = dados['estimativas'].get((status.item_atual_id, status.trabalho_atual_id))
+            if it_rel:
+                analytics['tempo_setup_estimado'] = int(it_rel.tempo_setup) if it_rel.tempo_setup else None
+                analytics['tempo_peca_estimado'] = int(it_rel.tempo_peca) if it_rel.tempo_peca else None
+            try:
+                tempos, cronometro, relogio = _calcular_analytics_trabalho(por_combo.get(combo_atual, []), agora_utc)
+                analytics.update(tempos)
+                if analytics['tempo_setup_utilizado'] is not None:
+                    analytics['tempo_setup_utilizado'] = max(0, analytics['tempo_setup_utilizado'])
+                if relogio:
+                    analytics['_relogio'] = relogio
+                _classificar_analytics(analytics, status_info.get('ultima_quantidade') or 0)
+            except Exception as e_prod:
+                logger.error(f"Analytics produção: {e_prod}")
+
+            # Cronômetro de setup se em setup (inicio_acao já está em BRT ISO)
+            if status.status_atual == 'Setup em andamento' and not cronometro['tipo'] and status_info.get('inicio_acao'):
+                cronometro = {'tipo': 'setup', 'inicio': status_info['inicio_acao']}
+
+        status_info['analytics'] = analytics
+        status_info['cronometro'] = cronometro
+    except Exception as e_an:
+        logger.error(f"Falha ao montar analytics do status {getattr(status, 'id', None)}: {e_an}")
+
+    # Lista Kanban atual: status da OS quando for uma lista conhecida, senão o último apontamento
+    try:
+        nome_lista_raw = None
+        os_status = getattr(os_obj, 'status', None) if os_obj else None
+        if os_status and os_status.strip().lower() in map_lista_por_lower:
+            nome_lista_raw = os_status
+        if not nome_lista_raw:
+            nome_lista_raw = next((ap.lista_kanban for ap in reversed(aps_os) if ap.lista_kanban is not None), None)
+        if nome_lista_raw:
+            _aplicar_lista_kanban(status_info, nome_lista_raw, map_lista_por_lower)
+    except Exception as e:
+        logger.error(f"Falha ao determinar lista_kanban para status {status.id}: {e}")
+
+    # Posição atual da OS para ordenação no dashboard
+    if os_obj:
+        status_info['posicao'] = getattr(os_obj, 'posicao', None)
+
+    # Apontamentos ativos por (item, trabalho) para indicar múltiplos simultâneos
+    try:
+        base_an = status_info.get('analytics') or {}
+        ativos_info = []
+        vistos = set()
+        for ap in reversed(aps_os):
+            if ap.data_fim is not None or ap.tipo_acao not in ('inicio_setup', 'inicio_producao', 'pausa', 'stop'):
+                continue
+            chave = (ap.item_id, ap.trabalho_id)
+            if chave in vistos:
+                continue
+            vistos.add(chave)
+
+            it = dados['itens'].get(ap.item_id)
+            tr = dados['trabalhos'].get(ap.trabalho_id)
+            operador_id = ap.operador_id or ap.usuario_id
+            op_user = dados['usuarios'].get(operador_id)
+            aps_combo = por_combo.get((status.ordem_servico_id, ap.item_id, ap.trabalho_id), [])
+            ultimo_combo = _ultimo_com_quantidade(aps_combo)
+            ultima_q_combo = int(ultimo_combo.quantidade) if ultimo_combo else 0
+
+            ativo_info = {
+                'item_id': ap.item_id,
+                'item_codigo': getattr(it, 'codigo_acb', None),
+                'item_nome': getattr(it, 'nome', None),
+                'item_imagem_path': getattr(it, 'imagem_thumb_path', None) if it else None,
+                'trabalho_id': ap.trabalho_id,
+                'trabalho_nome': getattr(tr, 'nome', None),
+                'status': 'Setup em andamento' if ap.tipo_acao == 'inicio_setup' else ('Pausado' if ap.tipo_acao in ['pausa', 'stop'] else 'Produção em andamento'),
+                'inicio_acao': to_brt_iso(ap.data_hora),
+                'operador_id': operador_id,
+                'operador_nome': getattr(op_user, 'nome', None),
+                'operador_codigo': getattr(op_user, 'codigo_operador', None),
+                'ultima_quantidade': ultima_q_combo,
+                # Motivo da pausa (somente quando tipo_acao == 'pausa')
+                'motivo_pausa': ap.motivo_parada if ap.tipo_acao in ['pausa', 'stop'] else None
+            }
+
+            # Analytics por trabalho (mesmo critério do cartão principal; estimativas reaproveitadas)
+            try:
+                analytics_t = {
+                    'tempo_setup_estimado': base_an.get('tempo_setup_estimado'),
+                    'tempo_peca_estimado': base_an.get('tempo_peca_estimado'),
+                }
+                tempos_t, _, relogio_t = _calcular_analytics_trabalho(aps_combo, agora_utc)
+                analytics_t.update(tempos_t)
+                if relogio_t:
+                    analytics_t['_relogio'] = relogio_t
+                _classificar_analytics(analytics_t, ultima_q_combo or 0)
+                ativo_info['analytics'] = analytics_t
+            except Exception as e_an_t:
+                logger.error(f"Analytics por trabalho (item={ap.item_id}, trab={ap.trabalho_id}): {e_an_t}")
+
+            ativos_info.append(ativo_info)
+
+        status_info['ativos_por_trabalho'] = ativos_info
+        status_info['qtd_ativos'] = len(ativos_info)
+        status_info['multiplo_ativos'] = len(ativos_info) > 1
+    except Exception as e_mult:
+        logger.error(f"Falha ao montar ativos_por_trabalho: {e_mult}")
+
+    # Resumo de contagens por status (setup, pausa, producao)
+    counts = {'setup': 0, 'pausado': 0, 'producao': 0}
+    for a in status_info.get('ativos_por_trabalho', []) or []:
+        s = (a.get('status') or '').lower()
+        if 'setup' in s:
+            counts['setup'] += 1
+        elif 'pausado' in s:
+            counts['pausado'] += 1
+        elif 'produção' in s or 'producao' in s:
+            counts['producao'] += 1
+    status_info['resumo_status'] = counts
+
+    # Lista completa de trabalhos do item com status e tempos somados
+    try:
+        if item_obj and getattr(item_obj, 'trabalhos', None):
+            ativos_lista = status_info.get('ativos_por_trabalho', []) or []
+            trabalhos_list = []
+            for it in item_obj.trabalhos:
+                trab = getattr(it, 'trabalho', None)
+                if not trab:
+                    continue
+                ultima_q = 0
+                status_trab = 'Aguardando'
+                inicio_mais_recente = None
+                for a in ativos_lista:
+                    if a.get('trabalho_id') != trab.id:
+                        continue
+                    # última quantidade/status: pegar da entrada mais recente
+                    ini = a.get('inicio_acao')
+                    if ini and (not inicio_mais_recente or str(ini) > str(inicio_mais_recente)):
+                        inicio_mais_recente = ini
+                        ultima_q = int(a.get('ultima_quantidade') or 0)
+                        status_trab = a.get('status') or status_trab
+                trabalhos_list.append({
+                    'trabalho_id': trab.id,
+                    'trabalho_nome': getattr(trab, 'nome', ''),
+                    'status': status_trab,
+                    'ultima_quantidade': int(ultima_q or 0),
+                })
+            _somar_tempos_trabalhos(trabalhos_list, ativos_lista)
+            status_info['trabalhos_do_item'] = trabalhos_list
+    except Exception as e_trabs:
+        logger.error(f"Falha ao montar trabalhos_do_item: {e_trabs}")
+
+    if any('_relogio' in (a.get('analytics') or {}) for a in status_info.get('ativos_por_trabalho', [])) \
+            or '_relogio' in (status_info.get('analytics') or {}):
+        status_info['_relogios'] = True
+    return status_info
+
+
+def _montar_cartao_os_sem_ativos(ordem, map_lista_por_lower, dados):
+    """Cartão de uma OS parada em uma lista/máquina sem apontamento ativo"""
+    status_info = {
+        'id': f"os_{ordem.id}",
+        'ordem_servico_id': ordem.id,
+        'ordem_id': ordem.id,
+        'status_atual': 'Aguardando',
+        'posicao': getattr(ordem, 'posicao', None),
+        'os_numero': getattr(ordem, 'numero', None) or getattr(ordem, 'codigo', None) or f"OS-{ordem.id}",
+    }
+    try:
+        _aplicar_lista_kanban(status_info, getattr(ordem, 'status', None), map_lista_por_lower)
+    except Exception:
+        pass
+
+    # Último apontamento com quantidade e tempos históricos acumulados (resumo por OS/item/trabalho)
+    status_info['analytics'] = _analytics_vazio(tempos_zerados=True)
+    ultimo = _ultima_quantidade_os(dados, ordem.id)
+    if ultimo:
+        quantidade, item_atual_id, trabalho_atual_id = ultimo
+        status_info['ultima_quantidade'] = quantidade
+        status_info['item_atual_id'] = item_atual_id
+        status_info['trabalho_atual_id'] = trabalho_atual_id
         try:
-            if hasattr(current_app, 'cache_store'):
-                cached = current_app.cache_store.get(cache_key)
-                if cached:
-                    logger.debug(f"[CACHE HIT] status-ativos")
-                    return jsonify(cached)
-        except:
-            pass
-        
-        t_start = time.perf_counter()
-        timings = {}
+            tempo_setup_total, tempo_producao_total, tempo_pausas_total = _tempos_encerrados_combo(
+                dados, (ordem.id, item_atual_id, trabalho_atual_id)
+            )
 
-        excluir_entregues = str(request.args.get('excluir_entregues', '')).strip().lower() in ('1', 'true', 'yes')
-        # Query params (opcionais) para filtragem
-        lista_filters_set = None
-        lista_raw = (request.args.get('lista') or '').strip().lower()
-        if lista_raw and lista_raw != 'todas':
-            lista_filters = [s.strip() for s in lista_raw.split(',') if s.strip() and s.strip() != 'todas']
-            if lista_filters:
-                lista_filters_set = set(lista_filters)
-            
-        lista_tipo_filter = None
-        if request.args.get('lista_tipo') and request.args.get('lista_tipo').strip():
-            lista_tipo_filter = request.args.get('lista_tipo').strip().lower()
-            
-        status_filter_raw = request.args.get('status', '').strip().lower()
-        status_filter_set = None
-        if status_filter_raw and status_filter_raw != 'todos':
-            status_filter_set = set([s.strip() for s in status_filter_raw.split(',') if s.strip()])
+            status_info['analytics'].update({
+                'tempo_setup_utilizado': tempo_setup_total,
+                'tempo_producao_utilizado': tempo_producao_total,
+                'tempo_pausas_utilizado': tempo_pausas_total,
+            })
+            if status_info['ultima_quantidade'] > 0 and tempo_producao_total > 0:
+                status_info['analytics']['media_seg_por_peca'] = int(tempo_producao_total / status_info['ultima_quantidade'])
+        except Exception as e_hist:
+            logger.error(f"OS {ordem.id}: falha ao calcular tempos históricos: {e_hist}")
+    else:
+        status_info['ultima_quantidade'] = 0
+
+    # Item/trabalho da OS (mesmo sem apontamento ativo)
+    try:
+        if ordem.pedidos:
+            try:
+                _agregar_clientes_os(ordem, status_info)
+            except Exception as e_cli2:
+                logger.error(f"OS {ordem.id}: falha ao agregar clientes/quantidades: {e_cli2}")
+
+            pedido = ordem.pedidos[0].pedido
+            item = pedido.item if pedido else None
+            if item:
+                status_info['item_id'] = item.id
+                status_info['item_nome'] = item.nome
+                status_info['item_codigo'] = item.codigo_acb
+                status_info['item_imagem_path'] = getattr(item, 'imagem_thumb_path', None)
+
+                if item.trabalhos:
+                    trabalho = item.trabalhos[0].trabalho
+                    if trabalho:
+                        status_info['trabalho_id'] = trabalho.id
+                        status_info['trabalho_nome'] = trabalho.nome
+
+                    # trabalhos_do_item mesmo sem ativos, usando último apontamento de cada trabalho
+                    trabalhos_list = []
+                    for it in item.trabalhos:
+                        trab = it.trabalho
+                        if not trab:
+                            continue
+                        ultima_trab = _ultima_quantidade_combo(dados, (ordem.id, item.id, trab.id))
+                        trabalhos_list.append({
+                            'trabalho_id': trab.id,
+                            'trabalho_nome': trab.nome,
+                            'status': 'Aguardando',
+                            'ultima_quantidade': int(ultima_trab or 0),
+                            'tempo_setup_utilizado': 0,
+                            'tempo_pausas_utilizado': 0,
+                            'tempo_producao_utilizado': 0
+                        })
+                    if trabalhos_list:
+                        status_info['trabalhos_do_item'] = trabalhos_list
+    except Exception as e:
+        logger.error(f"OS {ordem.id}: falha ao buscar item via pedidos: {e}")
+
+    _aplicar_padroes_cartao(status_info)
+    return status_info
+
+
+def _montar_cartao_fantasma(cf, status_atual_real, dados):
+    """Cartão separado para um cartão fantasma ativo"""
+    os_fantasma = getattr(cf, 'ordem_servico', None)
+    status_info_fantasma = {
+        'id': f"fantasma_{cf.id}",
+        'ordem_servico_id': cf.ordem_servico_id,
+        'ordem_id': cf.ordem_servico_id,
+        'status_atual': status_atual_real,
+        'lista_kanban': cf.lista_kanban,
+        'is_fantasma': True,
+        'fantasma_id': cf.id,
+        # Compatibilidade com frontend
+        'is_ghost_card': True,
+        'ghost_card_id': cf.id,
+        # posicao_fila do cartão fantasma é usada para ordenação
+        'posicao': getattr(cf, 'posicao_fila', None),
+        'posicao_fila': getattr(cf, 'posicao_fila', None),
+        'os_numero': getattr(os_fantasma, 'numero', None) or f"OS-{os_fantasma.id}",
+    }
+    try:
+        if os_fantasma.pedidos:
+            pedido = os_fantasma.pedidos[0].pedido
+            item = pedido.item if pedido else None
+            if item:
+                status_info_fantasma['item_id'] = item.id
+                status_info_fantasma['item_nome'] = item.nome
+                status_info_fantasma['item_codigo'] = item.codigo_acb
+                status_info_fantasma['item_imagem_path'] = getattr(item, 'imagem_thumb_path', None)
+                ultimo = _ultima_quantidade_os(dados, cf.ordem_servico_id)
+                status_info_fantasma['ultima_quantidade'] = ultimo[0] if ultimo else 0
+                _agregar_clientes_os(os_fantasma, status_info_fantasma)
+    except Exception:
+        pass
+
+    _aplicar_padroes_cartao(status_info_fantasma)
+    return status_info_fantasma
+
+
+def _opcoes_carga_os(caminho=None):
+    """
+    Opções de carga de pedidos → cliente/item → trabalhos de uma OS.
+    Coleções usam selectinload (um ``IN (...)`` por nível) em vez de joinedload
+    para não multiplicar as linhas do resultado.
+    """
+    pedidos = caminho.selectinload(OrdemServico.pedidos) if caminho is not None else selectinload(OrdemServico.pedidos)
+    pedidos = pedidos.selectinload(PedidoOrdemServico.pedido)
+    return (
+        pedidos.joinedload(Pedido.cliente),
+        pedidos.joinedload(Pedido.item).selectinload(Item.trabalhos).joinedload(ItemTrabalho.trabalho),
+    )
 
-        # Buscar TODAS as listas Kanban ativas para garantir que apareçam no dashboard
-        logger.debug("Buscando todas as listas Kanban ativas...")
+
+def _construir_entradas_status_ativos(os_ids=None, timings=None):
+    """
+    Monta as entradas do estado do chão de fábrica, uma por OS.
+
+    ``os_ids`` ``None`` monta todas as OS; caso contrário apenas as informadas.
+    Cada entrada guarda o cartão principal (ativo ou aguardando), os cartões
+    fantasma e os metadados usados pelos filtros do endpoint.
+    """
+    timings = timings if timings is not None else {}
+    with db.session.no_autoflush:
         t0 = time.perf_counter()
         listas_kanban = KanbanLista.query.filter_by(ativa=True).all()
-        timings['listas_kanban_query_ms'] = int((time.perf_counter() - t0) * 1000)
-        logger.debug(f"Encontradas {len(listas_kanban)} listas Kanban ativas")
-        # Mapas auxiliares para normalização de nomes (case-insensitive)
-        nomes_listas = [lista.nome for lista in listas_kanban]
-        nomes_listas_lower = [lista.nome.strip().lower() for lista in listas_kanban]
         map_lista_por_lower = {lista.nome.strip().lower(): lista for lista in listas_kanban}
-        
-        # Construir mapa de cartões fantasma por OS para mesclar na resposta
-        logger.debug("Buscando cartões fantasma ativos para mesclagem...")
+        nomes_listas_lower = list(map_lista_por_lower.keys())
+        timings['listas_kanban_query_ms'] = int((time.perf_counter() - t0) * 1000)
+
         t0 = time.perf_counter()
-        ghost_por_os = {}
+        cartoes_fantasma = []
         try:
-            cartoes_fantasma_all = (
+            query_cf = (
                 CartaoFantasma.query.options(
-                    joinedload(CartaoFantasma.ordem_servico)
-                        .joinedload(OrdemServico.pedidos)
-                        .joinedload(PedidoOrdemServico.pedido)
-                        .joinedload(Pedido.cliente),
-                    joinedload(CartaoFantasma.ordem_servico)
-                        .joinedload(OrdemServico.pedidos)
-                        .joinedload(PedidoOrdemServico.pedido)
-                        .joinedload(Pedido.item)
-                        .joinedload(Item.trabalhos)
-                        .joinedload(ItemTrabalho.trabalho),
+                    *_opcoes_carga_os(joinedload(CartaoFantasma.ordem_servico)),
                     joinedload(CartaoFantasma.trabalho),
                     joinedload(CartaoFantasma.criado_por)
                 )
                 .filter(CartaoFantasma.ativo == True)
-                .all()
             )
-            for cf in cartoes_fantasma_all:
-                try:
-                    os_id = getattr(cf, 'ordem_servico_id', None)
-                    if not os_id:
-                        continue
-                    lista_cf = (getattr(cf, 'lista_kanban', None) or '').strip()
-                    lista_cf_lower = lista_cf.lower() if lista_cf else None
-                    kl_cf = map_lista_por_lower.get(lista_cf_lower) if lista_cf_lower else None
-                    info_cf = {
-                        'id': cf.id,
-                        'lista_kanban': lista_cf or None,
-                        'lista_tipo': getattr(kl_cf, 'tipo_servico', None) if kl_cf else None,
-                        'lista_cor': getattr(kl_cf, 'cor', None) if kl_cf else None,
-                        'trabalho_id': getattr(cf, 'trabalho_id', None),
-                        'trabalho_nome': getattr(getattr(cf, 'trabalho', None), 'nome', None) if getattr(cf, 'trabalho', None) else None,
-                        'posicao_fila': getattr(cf, 'posicao_fila', None),
-                        'observacoes': getattr(cf, 'observacoes', None),
-                        'criado_por_id': getattr(getattr(cf, 'criado_por', None), 'id', None) if getattr(cf, 'criado_por', None) else None,
-                        'criado_por_nome': getattr(getattr(cf, 'criado_por', None), 'nome', None) if getattr(cf, 'criado_por', None) else None,
-                        'data_criacao': cf.data_criacao.isoformat() if getattr(cf, 'data_criacao', None) else None,
-                    }
-                    bucket = ghost_por_os.setdefault(os_id, {
-                        'cards': [],
-                        'listas_lower': set(),
-                        'tipos_lower': set(),
-                        'trabalhos_ids': set(),
-                    })
-                    bucket['cards'].append(info_cf)
-                    if lista_cf_lower:
-                        bucket['listas_lower'].add(lista_cf_lower)
-                        if kl_cf and getattr(kl_cf, 'tipo_servico', None):
-                            bucket['tipos_lower'].add(str(kl_cf.tipo_servico).strip().lower())
-                    trab_id_cf = getattr(cf, 'trabalho_id', None)
-                    if trab_id_cf:
-                        bucket['trabalhos_ids'].add(trab_id_cf)
-                except Exception as e_cf_it:
-                    logger.error(f"Falha ao processar cartão fantasma para OS {getattr(cf, 'ordem_servico_id', None)}: {e_cf_it}")
-                    continue
+            if os_ids is not None:
+                query_cf = query_cf.filter(CartaoFantasma.ordem_servico_id.in_(os_ids))
+            cartoes_fantasma = query_cf.all()
         except Exception as e_cf:
             logger.error(f"Falha ao buscar cartões fantasma para mesclagem: {e_cf}")
+        ghost_por_os = _montar_ghost_por_os(cartoes_fantasma, map_lista_por_lower)
         timings['ghost_cards_query_ms'] = int((time.perf_counter() - t0) * 1000)
-        
-        # Buscar todos os status ativos de produção
-        logger.debug("Buscando status ativos...")
+
+        # Status de produção não finalizados com o estado real dos apontamentos abertos
         t0 = time.perf_counter()
-        # Buscar todos os status não finalizados primeiro
-        status_ativos_raw = (
+        query_status = (
             StatusProducaoOS.query.options(
-                joinedload(StatusProducaoOS.ordem_servico)
-                    .joinedload(OrdemServico.pedidos)
-                    .joinedload(PedidoOrdemServico.pedido)
-                    .joinedload(Pedido.cliente),
-                joinedload(StatusProducaoOS.ordem_servico)
-                    .joinedload(OrdemServico.pedidos)
-                    .joinedload(PedidoOrdemServico.pedido)
-                    .joinedload(Pedido.item)
-                    .joinedload(Item.trabalhos)
-                    .joinedload(ItemTrabalho.trabalho),
+                *_opcoes_carga_os(joinedload(StatusProducaoOS.ordem_servico)),
                 joinedload(StatusProducaoOS.operador_atual),
                 joinedload(StatusProducaoOS.trabalho_atual),
-                joinedload(StatusProducaoOS.item_atual),
+                joinedload(StatusProducaoOS.item_atual).selectinload(Item.trabalhos).joinedload(ItemTrabalho.trabalho),
             )
             .filter(StatusProducaoOS.status_atual != 'Finalizado')
-            .all()
         )
-        
-        # OTIMIZAÇÃO: Batch processing de estados - buscar TODOS de uma vez
-        os_ids = [status.ordem_servico_id for status in status_ativos_raw]
-        estados_batch = _obter_estados_batch(os_ids)
-        
+        if os_ids is not None:
+            query_status = query_status.filter(StatusProducaoOS.ordem_servico_id.in_(os_ids))
+        status_raw = query_status.all()
+        estados_batch = _obter_estados_batch([s.ordem_servico_id for s in status_raw])
+        status_por_os = {}
         status_ativos = []
-        for status in status_ativos_raw:
-            # Usar estado pré-carregado do batch (O(1) lookup)
-            estado_real = estados_batch.get(status.ordem_servico_id, {
-                'status_atual': 'Aguardando',
-                'apontamento_base': None,
-                'setup_aberto': None,
-                'producao_aberta': None,
-                'pausa_aberta': None,
-                'item_id': None,
-                'trabalho_id': None,
-                'usuario_id': None,
-                'inicio_acao': None
-            })
+        for status in status_raw:
+            estado_real = estados_batch.get(status.ordem_servico_id, ESTADO_PADRAO_OS)
             _aplicar_estado_real_status(status, estado_real)
-            if estado_real['status_atual'] not in ['Setup em andamento', 'Produção em andamento', 'Pausado']:
-                continue
-            os = status.ordem_servico
-            if excluir_entregues and os and os.pedidos:
-                tem_pedido_entregue = False
-                for pedido_os in os.pedidos:
-                    if pedido_os.pedido and pedido_os.pedido.status == 'entregue':
-                        tem_pedido_entregue = True
-                        break
-                if tem_pedido_entregue:
-                    continue
-            status_ativos.append(status)
+            status_por_os[status.ordem_servico_id] = status
+            if estado_real['status_atual'] in ['Setup em andamento', 'Produção em andamento', 'Pausado']:
+                status_ativos.append(status)
         timings['status_ativos_query_ms'] = int((time.perf_counter() - t0) * 1000)
 
-        logger.debug(f"Encontrados {len(status_ativos)} status ativos (pré-filtro)")
-        
-        # Buscar TODAS as OS que estão em máquinas (mesmo sem apontamento ativo)
-        logger.debug(
-            "Buscando todas as OS em máquinas%s...",
-            " (excluindo entregues)" if excluir_entregues else ""
-        )
-        logger.debug(f"Nomes das listas Kanban: {nomes_listas}")
-        
-        # Uso de comparação case-insensitive para evitar divergências de caixa
+        # OS em listas/máquinas (para mostrar todas as máquinas, mesmo sem apontamento ativo)
         t0 = time.perf_counter()
-        # Buscar todas as OS em máquinas primeiro
-        todas_os_em_maquinas_raw = (
-            OrdemServico.query.options(
-                joinedload(OrdemServico.pedidos)
-                    .joinedload(PedidoOrdemServico.pedido)
-                    .joinedload(Pedido.cliente),
-                joinedload(OrdemServico.pedidos)
-                    .joinedload(PedidoOrdemServico.pedido)
-                    .joinedload(Pedido.item)
-                    .joinedload(Item.trabalhos)
-                    .joinedload(ItemTrabalho.trabalho),
-            )
+        query_os = (
+            OrdemServico.query.options(*_opcoes_carga_os())
             .filter(db.func.lower(db.func.trim(OrdemServico.status)).in_(nomes_listas_lower))
-            .all()
         )
-        
-        todas_os_em_maquinas = []
-        for os in todas_os_em_maquinas_raw:
-            if excluir_entregues and os.pedidos:
-                tem_pedido_entregue = False
-                for pedido_os in os.pedidos:
-                    if pedido_os.pedido and pedido_os.pedido.status == 'entregue':
-                        tem_pedido_entregue = True
-                        break
-                if tem_pedido_entregue:
-                    continue
-            todas_os_em_maquinas.append(os)
+        if os_ids is not None:
+            query_os = query_os.filter(OrdemServico.id.in_(os_ids))
+        ordens_em_listas = query_os.all()
         timings['os_em_maquinas_query_ms'] = int((time.perf_counter() - t0) * 1000)
-        logger.debug(f"Encontradas {len(todas_os_em_maquinas)} OS em máquinas")
-        
-        # Debug: mostrar todas as OS encontradas
-        # Debug logs removidos para melhor performance
-        
-        # Formatar resposta
-        resultado = {
-            'status_ativos': []
-        }
-        
-        # Criar um mapa de OS que já têm status ativo
-        os_com_status_ativo = set()
-        
-        # Adicionar informações detalhadas para cada status ativo
-        t0 = time.perf_counter()
-        for status in status_ativos:
-            try:
-                status_info = {
-                    'id': status.id,
-                    'ordem_servico_id': status.ordem_servico_id,
-                    'ordem_id': status.ordem_servico_id,  # Mantido para compatibilidade com frontend
-                    'status_atual': status.status_atual or 'Desconhecido'
-                }
-
-                # Buscar número/identificador da OS e agregar clientes/quantidades usando relações pre-carregadas
-                try:
-                    os_obj = getattr(status, 'ordem_servico', None)
-                    if os_obj:
-                        os_num = getattr(os_obj, 'numero', None) or getattr(os_obj, 'codigo', None) or f"OS-{os_obj.id}"
-                        status_info['os_numero'] = os_num
-                        # Clientes e quantidade total (agregar todos os pedidos vinculados à OS)
-                        try:
-                            clientes_map = {}
-                            total_q = 0
-                            for po in getattr(os_obj, 'pedidos', []) or []:
-                                ped = getattr(po, 'pedido', None)
-                                if not ped:
-                                    continue
-                                q = int(getattr(ped, 'quantidade', 0) or 0)
-                                total_q += q
-                                cli = getattr(ped, 'cliente', None)
-                                nome_cli = getattr(cli, 'nome', None) or 'Cliente'
-                                clientes_map[nome_cli] = clientes_map.get(nome_cli, 0) + q
-                            status_info['quantidade_total'] = int(total_q)
-                            if clientes_map:
-                                status_info['clientes_quantidades'] = [
-                                    {'cliente_nome': k, 'quantidade': v} for k, v in clientes_map.items()
-                                ]
-                                # Compatibilidade: primeiro cliente
-                                status_info['cliente_nome'] = next(iter(clientes_map.keys()))
-                        except Exception as e_cli:
-                            logger.error(f"Falha ao agregar clientes/quantidades: {e_cli}")
-                except Exception as e_os:
-                    logger.error(f"Falha ao obter OS relacionada: {e_os}")
-                
-                # Buscar operador atual (pré-carregado)
-                try:
-                    operador = getattr(status, 'operador_atual', None)
-                    if not operador and hasattr(status, 'operador_id') and status.operador_id:
-                        operador = Usuario.query.get(status.operador_id)
-                    if operador:
-                        status_info['operador_id'] = operador.id
-                        status_info['operador_nome'] = operador.nome
-                        status_info['operador_codigo'] = getattr(operador, 'codigo_operador', None)
-                except Exception as e_op:
-                    logger.error(f"Falha ao buscar operador: {e_op}")
-                
-                # Buscar item atual
-                try:
-                    item_encontrado = False
-                    
-                    # Primeira tentativa: usar item_atual_id se disponível
-                    if getattr(status, 'item_atual', None):
-                        item = status.item_atual
-                        if item:
-                            status_info['item_id'] = item.id
-                            status_info['item_nome'] = item.nome
-                            status_info['item_codigo'] = item.codigo_acb
-                            status_info['item_imagem_path'] = getattr(item, 'imagem_path', None)
-                            item_encontrado = True
-                    
-                    # Fallback: buscar via OS → Pedido → Item se não encontrou item_atual_id
-                    if not item_encontrado:
-                        os_obj_fallback = getattr(status, 'ordem_servico', None)
-                        if os_obj_fallback and getattr(os_obj_fallback, 'pedidos', None):
-                            pedido_os = os_obj_fallback.pedidos[0]
-                            pedido = getattr(pedido_os, 'pedido', None)
-                            item = getattr(pedido, 'item', None) if pedido else None
-                            if item:
-                                status_info['item_id'] = item.id
-                                status_info['item_nome'] = item.nome
-                                status_info['item_codigo'] = item.codigo_acb
-                                status_info['item_imagem_path'] = getattr(item, 'imagem_path', None)
-                                item_encontrado = True
-                    
-                except Exception as e_item:
-                    logger.error(f"Status {status.id}: falha ao buscar item: {e_item}")
-                
-                # Buscar trabalho atual (pré-carregado)
-                try:
-                    trabalho = getattr(status, 'trabalho_atual', None)
-                    if trabalho:
-                        status_info['trabalho_id'] = trabalho.id
-                        status_info['trabalho_nome'] = trabalho.nome
-                except Exception as e_trab:
-                    logger.error(f"Falha ao buscar trabalho: {e_trab}")
-                
-                # Adicionar quantidade atual e última quantidade apontada para este item/trabalho
-                try:
-                    if hasattr(status, 'quantidade_atual'):
-                        status_info['quantidade_atual'] = status.quantidade_atual
-                    ultima_q = None
-                    if getattr(status, 'item_atual_id', None) and getattr(status, 'trabalho_atual_id', None):
-                        ultimo_ap = ApontamentoProducao.query.filter(
-                            ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                            ApontamentoProducao.item_id == status.item_atual_id,
-                            ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                            ApontamentoProducao.quantidade != None
-                        ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                        if ultimo_ap and ultimo_ap.quantidade is not None:
-                            ultima_q = int(ultimo_ap.quantidade)
-                    if ultima_q is None:
-                        if hasattr(status, 'quantidade_atual') and status.quantidade_atual is not None:
-                            ultima_q = int(status.quantidade_atual)
-                    status_info['ultima_quantidade'] = ultima_q if ultima_q is not None else 0
-                except Exception as e_q:
-                    logger.error(f"Falha ao calcular ultima_quantidade: {e_q}")
-                
-                # Adicionar timestamp de início da ação
-                status_info['inicio_acao'] = to_brt_iso(getattr(status, 'inicio_acao', None))
-
-                # Analytics por OS/item/trabalho para o Dashboard
-                try:
-                    analytics = {
-                        'tempo_setup_estimado': None,
-                        'tempo_setup_utilizado': None,
-                        'setup_status': None,
-                        'tempo_peca_estimado': None,
-                        'tempo_producao_utilizado': None,
-                        'tempo_pausas_utilizado': None,
-                        'media_seg_por_peca': None,
-                        'producao_status': None
-                    }
-
-                    cronometro = {
-                        'tipo': None,
-                        'inicio': None
-                    }
-
-                    tolerancia = 0.15  # 15%
-                    agora_utc = datetime.now(LOCAL_TZ).replace(tzinfo=None)
-
-                    if getattr(status, 'item_atual_id', None) and getattr(status, 'trabalho_atual_id', None):
-                        # Estimativas do ItemTrabalho
-                        try:
-                            it_rel = ItemTrabalho.query.filter_by(
-                                item_id=status.item_atual_id,
-                                trabalho_id=status.trabalho_atual_id
-                            ).first()
-                            if it_rel:
-                                analytics['tempo_setup_estimado'] = int(it_rel.tempo_setup) if it_rel.tempo_setup else None
-                                analytics['tempo_peca_estimado'] = int(it_rel.tempo_peca) if it_rel.tempo_peca else None
-                        except Exception:
-                            pass
-
-                        # Setup: calcular tempo utilizado (último ciclo)
-                        try:
-                            inicio_setup = ApontamentoProducao.query.filter(
-                                ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                ApontamentoProducao.item_id == status.item_atual_id,
-                                ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                                ApontamentoProducao.tipo_acao == 'inicio_setup'
-                            ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                            tempo_setup_util = None
-                            if inicio_setup:
-                                fim_setup = ApontamentoProducao.query.filter(
-                                    ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                    ApontamentoProducao.item_id == status.item_atual_id,
-                                    ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                                    ApontamentoProducao.tipo_acao == 'fim_setup',
-                                    ApontamentoProducao.data_hora > inicio_setup.data_hora
-                                ).order_by(ApontamentoProducao.data_hora.asc()).first()
-                                if fim_setup:
-                                    tempo_setup_util = int((fim_setup.data_hora - inicio_setup.data_hora).total_seconds())
-                                else:
-                                    tempo_setup_util = int((agora_utc - inicio_setup.data_hora).total_seconds())
-                                analytics['tempo_setup_utilizado'] = max(0, tempo_setup_util)
-                                # Status de setup
-                                if analytics['tempo_setup_estimado']:
-                                    est = analytics['tempo_setup_estimado']
-                                    usado = analytics['tempo_setup_utilizado']
-                                    if usado <= est * (1 - tolerancia):
-                                        analytics['setup_status'] = 'Excelente'
-                                    elif usado <= est * (1 + tolerancia):
-                                        analytics['setup_status'] = 'Dentro do esperado'
-                                    else:
-                                        analytics['setup_status'] = 'Abaixo do esperado'
-                        except Exception as e_set:
-                            logger.error(f"Analytics setup: {e_set}")
-
-                        # Produção: calcular tempo de produção + pausas desde o último início
-                        try:
-                            inicio_prod = ApontamentoProducao.query.filter(
-                                ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                ApontamentoProducao.item_id == status.item_atual_id,
-                                ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                                ApontamentoProducao.tipo_acao == 'inicio_producao'
-                            ).order_by(ApontamentoProducao.data_hora.desc()).first()
-
-                            tempo_producao_util = 0
-                            tempo_pausa_util = 0
-
-                            if inicio_prod:
-                                # Verificar se há pausa aberta após esse início
-                                pausa_aberta = ApontamentoProducao.query.filter(
-                                    ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                    ApontamentoProducao.item_id == status.item_atual_id,
-                                    ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                                    ApontamentoProducao.tipo_acao.in_(['pausa', 'stop']),
-                                    ApontamentoProducao.data_hora >= inicio_prod.data_hora,
-                                    ApontamentoProducao.data_fim == None
-                                ).order_by(ApontamentoProducao.data_hora.desc()).first()
-
-                                if pausa_aberta:
-                                    # produção até início da pausa + tempo da pausa até agora
-                                    tempo_producao_util = int((pausa_aberta.data_hora - inicio_prod.data_hora).total_seconds())
-                                    tempo_pausa_util = int((agora_utc - pausa_aberta.data_hora).total_seconds())
-                                    cronometro['tipo'] = 'pausa'
-                                    cronometro['inicio'] = to_brt_iso(pausa_aberta.data_hora)
-                                else:
-                                    # verificar se produção ainda aberta
-                                    fim_prod = ApontamentoProducao.query.filter(
-                                        ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                        ApontamentoProducao.item_id == status.item_atual_id,
-                                        ApontamentoProducao.trabalho_id == status.trabalho_atual_id,
-                                        ApontamentoProducao.tipo_acao == 'inicio_producao',
-                                        ApontamentoProducao.data_fim == None
-                                    ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                                    if fim_prod:
-                                        tempo_producao_util = int((agora_utc - inicio_prod.data_hora).total_seconds())
-                                        cronometro['tipo'] = 'producao'
-                                        cronometro['inicio'] = to_brt_iso(inicio_prod.data_hora)
-                                    else:
-                                        # produção encerrada; usar último tempo_decorrido se disponível
-                                        tempo_producao_util = int(getattr(inicio_prod, 'tempo_decorrido', 0) or 0)
-
-                            analytics['tempo_producao_utilizado'] = max(0, tempo_producao_util)
-                            analytics['tempo_pausas_utilizado'] = max(0, tempo_pausa_util)
-
-                            # Cronômetro de setup se em setup
-                            if status.status_atual == 'Setup em andamento' and not cronometro['tipo']:
-                                if 'inicio_acao' in status_info and status_info['inicio_acao']:
-                                    cronometro['tipo'] = 'setup'
-                                    # status_info['inicio_acao'] já está em BRT ISO
-                                    cronometro['inicio'] = status_info['inicio_acao']
-
-                            # Média por peça
-                            qtd = status_info.get('ultima_quantidade') or 0
-                            total_seg = (analytics['tempo_producao_utilizado'] or 0) + (analytics['tempo_pausas_utilizado'] or 0)
-                            if qtd and total_seg:
-                                media = int(total_seg / max(qtd, 1))
-                                analytics['media_seg_por_peca'] = media
-                                if analytics['tempo_peca_estimado']:
-                                    estp = analytics['tempo_peca_estimado']
-                                    if media <= estp * (1 - tolerancia):
-                                        analytics['producao_status'] = 'Excelente'
-                                    elif media <= estp * (1 + tolerancia):
-                                        analytics['producao_status'] = 'Dentro do esperado'
-                                    else:
-                                        analytics['producao_status'] = 'Abaixo do esperado'
-                        except Exception as e_prod:
-                            logger.error(f"Analytics produção: {e_prod}")
-
-                    status_info['analytics'] = analytics
-                    status_info['cronometro'] = cronometro
-                except Exception as e_an:
-                    logger.error(f"Falha ao montar analytics do status {getattr(status,'id',None)}: {e_an}")
-
-                # Nome da lista Kanban atual (ex.: MAZAK, GLM, SERRA) e normalização/canonização
-                try:
-                    # Primeiro, usar a OS já pré-carregada no joinedload (evita query extra)
-                    os_obj = getattr(status, 'ordem_servico', None)
-                    nome_lista_raw = None
-                    
-                    if os_obj and hasattr(os_obj, 'status') and getattr(os_obj, 'status'):
-                        os_status = getattr(os_obj, 'status')
-                        # Verificar se o status da OS corresponde a uma lista Kanban conhecida
-                        if os_status.strip().lower() in map_lista_por_lower:
-                            nome_lista_raw = os_status
-                            logger.debug(f"Status {status.id}: usando status da OS '{os_status}' como lista_kanban")
-                    
-                    # Se não conseguiu da OS, buscar do último apontamento
-                    if not nome_lista_raw:
-                        ap_last_list = ApontamentoProducao.query.filter(
-                            ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                            ApontamentoProducao.lista_kanban != None
-                        ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                        nome_lista_raw = getattr(ap_last_list, 'lista_kanban', None)
-                        logger.debug(f"Status {status.id}: usando apontamento '{nome_lista_raw}' como lista_kanban")
-                    
-                    if nome_lista_raw:
-                        nome_norm = nome_lista_raw.strip().lower()
-                        kl = map_lista_por_lower.get(nome_norm)
-                        if kl:
-                            status_info['lista_kanban'] = getattr(kl, 'nome', None)
-                            status_info['lista_tipo'] = getattr(kl, 'tipo_servico', None)
-                            status_info['lista_cor'] = getattr(kl, 'cor', None)
-                            logger.debug(f"Status {status.id}: normalizado para lista_kanban='{status_info['lista_kanban']}'")
-                        else:
-                            status_info['lista_kanban'] = nome_lista_raw
-                            logger.debug(f"Status {status.id}: usando raw lista_kanban='{nome_lista_raw}' (não encontrado no mapa)")
-                except Exception as e:
-                    logger.error(f"Falha ao determinar lista_kanban para status {status.id}: {e}")
-                    pass
-
-                # Posição atual da OS (quando disponível) para ordenação no dashboard
-                try:
-                    if os_obj:
-                        status_info['posicao'] = getattr(os_obj, 'posicao', None)
-                except Exception:
-                    pass
-
-                # Aplicar filtros (lista, lista_tipo, status) considerando cartões fantasma
-                try:
-                    logger.debug(f"Verificando filtros para status {status.id}: lista_kanban='{status_info.get('lista_kanban')}', lista_tipo='{status_info.get('lista_tipo')}', status_atual='{status_info.get('status_atual')}'")
-                    logger.debug(f"Filtros ativos: lista_filters_set={lista_filters_set}, lista_tipo_filter={lista_tipo_filter}, status_filter_set={status_filter_set}")
-                    
-                    # Aplicar filtro de lista kanban (considerando listas dos cartões fantasma desta OS)
-                    if lista_filters_set is not None:
-                        listas_ghost = ghost_por_os.get(status.ordem_servico_id, {}).get('listas_lower', set())
-                        lista_principal = status_info.get('lista_kanban')
-                        lista_principal_lower = lista_principal.lower() if lista_principal else None
-                        lista_principal_ok = (lista_principal_lower in lista_filters_set) if lista_principal_lower else False
-                        ghost_ok = bool(listas_ghost.intersection(lista_filters_set)) if listas_ghost else False
-                        if not (lista_principal_ok or ghost_ok):
-                            logger.debug(f"Status {status.id} excluído por filtro de lista (principal/ghost não correspondem)")
-                            continue
-                    
-                    # Aplicar filtro de tipo (considerando tipos das listas dos cartões fantasma)
-                    if lista_tipo_filter is not None:
-                        tipos_ghost = ghost_por_os.get(status.ordem_servico_id, {}).get('tipos_lower', set())
-                        tipo_principal = status_info.get('lista_tipo')
-                        tipo_principal_ok = tipo_principal and str(tipo_principal).strip().lower() == lista_tipo_filter
-                        ghost_tipo_ok = lista_tipo_filter in tipos_ghost if tipos_ghost else False
-                        if not (tipo_principal_ok or ghost_tipo_ok):
-                            logger.debug(f"Status {status.id} excluído por filtro de tipo (principal/ghost não correspondem)")
-                            continue
-                    
-                    # Aplicar filtro de status (inclui 'fantasma' se houver cartão fantasma associado)
-                    if status_filter_set is not None:
-                        st_atual = (status_info.get('status_atual') or '').strip().lower()
-                        tem_ghost = status.ordem_servico_id in ghost_por_os
-                        ok_status = (st_atual in status_filter_set) or ('fantasma' in status_filter_set and tem_ghost)
-                        if not ok_status:
-                            logger.debug(f"Status {status.id} excluído por filtro de status (sem correspondência nem fantasma associado)")
-                            continue
-                    
-                    logger.debug(f"Status {status.id} passou em todos os filtros, será incluído")
-                except Exception as e:
-                    logger.error(f"Erro ao aplicar filtros para status {status.id}: {e}")
-
-                # Mapear apontamentos ativos por (item, trabalho) para indicar múltiplos simultâneos
-                try:
-                    ativos = ApontamentoProducao.query.filter(
-                        ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                        ApontamentoProducao.data_fim == None,
-                        ApontamentoProducao.tipo_acao.in_(['inicio_setup', 'inicio_producao', 'pausa', 'stop'])
-                    ).order_by(ApontamentoProducao.data_hora.desc()).all()
-
-                    ativos_info = []
-                    vistos = set()
-                    for ap in ativos:
-                        chave = (ap.item_id, ap.trabalho_id)
-                        if chave in vistos:
-                            continue
-                        vistos.add(chave)
-
-                        # Coletar informações do item/trabalho
-                        item_nome = None
-                        item_codigo = None
-                        item_imagem_path = None
-                        trabalho_nome = None
-                        try:
-                            it = Item.query.get(ap.item_id) if ap.item_id else None
-                            if it:
-                                item_nome = getattr(it, 'nome', None)
-                                item_codigo = getattr(it, 'codigo_acb', None)
-                                item_imagem_path = getattr(it, 'imagem_path', None)
-                            tr = Trabalho.query.get(ap.trabalho_id) if ap.trabalho_id else None
-                            if tr:
-                                trabalho_nome = getattr(tr, 'nome', None)
-                        except Exception:
-                            pass
 
-                        # Calcular última quantidade para este par (item,trabalho)
-                        ultima_q_combo = 0
-                        try:
-                            ultimo_ap_combo = ApontamentoProducao.query.filter(
-                                ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                ApontamentoProducao.item_id == ap.item_id,
-                                ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                ApontamentoProducao.quantidade != None
-                            ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                            if ultimo_ap_combo and ultimo_ap_combo.quantidade is not None:
-                                ultima_q_combo = int(ultimo_ap_combo.quantidade)
-                        except Exception:
-                            pass
-
-                        # Operador e início
-                        operador_nome = None
-                        operador_codigo = None
-                        operador_id = getattr(ap, 'operador_id', None) or getattr(ap, 'usuario_id', None)
-                        try:
-                            if operador_id:
-                                op_user = Usuario.query.get(operador_id)
-                                if op_user:
-                                    operador_nome = getattr(op_user, 'nome', None)
-                                    operador_codigo = getattr(op_user, 'codigo_operador', None)
-                        except Exception:
-                            pass
-
-                        ativos_info.append({
-                            'item_id': ap.item_id,
-                            'item_codigo': item_codigo,
-                            'item_nome': item_nome,
-                            'item_imagem_path': item_imagem_path if 'item_imagem_path' in locals() else None,
-                            'trabalho_id': ap.trabalho_id,
-                            'trabalho_nome': trabalho_nome,
-                            'status': 'Setup em andamento' if ap.tipo_acao == 'inicio_setup' else ('Pausado' if ap.tipo_acao in ['pausa', 'stop'] else 'Produção em andamento'),
-                            'inicio_acao': to_brt_iso(ap.data_hora),
-                            'operador_id': operador_id,
-                            'operador_nome': operador_nome,
-                            'operador_codigo': operador_codigo,
-                            'ultima_quantidade': ultima_q_combo,
-                            # Motivo da pausa (somente quando tipo_acao == 'pausa')
-                            'motivo_pausa': getattr(ap, 'motivo_parada', None) if ap.tipo_acao in ['pausa', 'stop'] else None
-                        })
+        # Estágio de carga em lote: apontamentos, itens, trabalhos e operadores de todas as OS
+        t0 = time.perf_counter()
+        dados = _carregar_dados_status_ativos(
+            {s.ordem_servico_id for s in status_ativos},
+            {o.id for o in ordens_em_listas} | {cf.ordem_servico_id for cf in cartoes_fantasma},
+        )
+        timings['carga_lote_ms'] = int((time.perf_counter() - t0) * 1000)
+
+        entradas = {}
+
+        def _entrada(os_id):
+            bucket = ghost_por_os.get(os_id) or {}
+            return entradas.setdefault(os_id, {
+                'ordem_servico_id': os_id,
+                'principal': None,
+                'tipo_principal': None,
+                'fantasmas': [],
+                'tem_pedido_entregue': False,
+                'tem_ghost': os_id in ghost_por_os,
+                'listas_ghost': set(bucket.get('listas_lower', set())),
+                'tipos_ghost': set(bucket.get('tipos_lower', set())),
+                'construido_em': time.time(),
+            })
 
-                        # Analytics por trabalho (aproximação baseada no mesmo critério do cartão principal)
-                        try:
-                            analytics_t = {}
-
-                            # Estimativas (reutilizar do nível do status quando disponível)
-                            try:
-                                base_an = status_info.get('analytics', {}) if isinstance(status_info, dict) else {}
-                                analytics_t['tempo_setup_estimado'] = base_an.get('tempo_setup_estimado')
-                                analytics_t['tempo_peca_estimado'] = base_an.get('tempo_peca_estimado')
-                            except Exception:
-                                pass
-
-                            # Setup utilizado para este item/trabalho
-                            try:
-                                inicio_setup_t = ApontamentoProducao.query.filter(
-                                    ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                    ApontamentoProducao.item_id == ap.item_id,
-                                    ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                    ApontamentoProducao.tipo_acao == 'inicio_setup'
-                                ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                                if inicio_setup_t:
-                                    fim_setup_t = ApontamentoProducao.query.filter(
-                                        ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                        ApontamentoProducao.item_id == ap.item_id,
-                                        ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                        ApontamentoProducao.tipo_acao == 'fim_setup',
-                                        ApontamentoProducao.data_hora > inicio_setup_t.data_hora
-                                    ).order_by(ApontamentoProducao.data_hora.asc()).first()
-                                    if fim_setup_t:
-                                        analytics_t['tempo_setup_utilizado'] = int((fim_setup_t.data_hora - inicio_setup_t.data_hora).total_seconds())
-                                    else:
-                                        analytics_t['tempo_setup_utilizado'] = int((agora_utc - inicio_setup_t.data_hora).total_seconds())
-                            except Exception:
-                                pass
-
-                            # Produção utilizada e pausas para este item/trabalho
-                            tempo_producao_util_t = 0
-                            tempo_pausa_util_t = 0
-                            try:
-                                inicio_prod_t = ApontamentoProducao.query.filter(
-                                    ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                    ApontamentoProducao.item_id == ap.item_id,
-                                    ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                    ApontamentoProducao.tipo_acao == 'inicio_producao'
-                                ).order_by(ApontamentoProducao.data_hora.desc()).first()
-
-                                if inicio_prod_t:
-                                    pausa_aberta_t = ApontamentoProducao.query.filter(
-                                        ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                        ApontamentoProducao.item_id == ap.item_id,
-                                        ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                        ApontamentoProducao.tipo_acao.in_(['pausa', 'stop']),
-                                        ApontamentoProducao.data_hora >= inicio_prod_t.data_hora,
-                                        ApontamentoProducao.data_fim == None
-                                    ).order_by(ApontamentoProducao.data_hora.desc()).first()
-
-                                    if pausa_aberta_t:
-                                        tempo_producao_util_t = int((pausa_aberta_t.data_hora - inicio_prod_t.data_hora).total_seconds())
-                                        tempo_pausa_util_t = int((agora_utc - pausa_aberta_t.data_hora).total_seconds())
-                                    else:
-                                        fim_prod_t = ApontamentoProducao.query.filter(
-                                            ApontamentoProducao.ordem_servico_id == status.ordem_servico_id,
-                                            ApontamentoProducao.item_id == ap.item_id,
-                                            ApontamentoProducao.trabalho_id == ap.trabalho_id,
-                                            ApontamentoProducao.tipo_acao == 'inicio_producao',
-                                            ApontamentoProducao.data_fim == None
-                                        ).order_by(ApontamentoProducao.data_hora.desc()).first()
-                                        if fim_prod_t:
-                                            tempo_producao_util_t = int((agora_utc - inicio_prod_t.data_hora).total_seconds())
-                                        else:
-                                            tempo_producao_util_t = int(getattr(inicio_prod_t, 'tempo_decorrido', 0) or 0)
-                            except Exception:
-                                pass
-
-                            analytics_t['tempo_producao_utilizado'] = max(0, tempo_producao_util_t)
-                            analytics_t['tempo_pausas_utilizado'] = max(0, tempo_pausa_util_t)
-
-                            # Média por peça e status de performance
-                            try:
-                                qtd_t = ultima_q_combo or 0
-                                total_seg_t = (analytics_t.get('tempo_producao_utilizado') or 0) + (analytics_t.get('tempo_pausas_utilizado') or 0)
-                                if qtd_t and total_seg_t:
-                                    media_t = int(total_seg_t / max(qtd_t, 1))
-                                    analytics_t['media_seg_por_peca'] = media_t
-                                    if analytics_t.get('tempo_peca_estimado'):
-                                        estp_t = analytics_t['tempo_peca_estimado']
-                                        if media_t <= estp_t * (1 - tolerancia):
-                                            analytics_t['producao_status'] = 'Excelente'
-                                        elif media_t <= estp_t * (1 + tolerancia):
-                                            analytics_t['producao_status'] = 'Dentro do esperado'
-                                        else:
-                                            analytics_t['producao_status'] = 'Abaixo do esperado'
-                            except Exception:
-                                pass
-
-                            # Status de setup baseado na estimativa
-                            try:
-                                if analytics_t.get('tempo_setup_estimado') is not None and analytics_t.get('tempo_setup_utilizado') is not None:
-                                    est_t = analytics_t['tempo_setup_estimado']
-                                    usado_t = analytics_t['tempo_setup_utilizado']
-                                    if usado_t <= est_t * (1 - tolerancia):
-                                        analytics_t['setup_status'] = 'Excelente'
-                                    elif usado_t <= est_t * (1 + tolerancia):
-                                        analytics_t['setup_status'] = 'Dentro do esperado'
-                                    else:
-                                        analytics_t['setup_status'] = 'Abaixo do esperado'
-                            except Exception:
-                                pass
-
-                            # Anexar
-                            try:
-                                ativos_info[-1]['analytics'] = analytics_t
-                            except Exception:
-                                pass
-                        except Exception as e_an_t:
-                            logger.error(f"Analytics por trabalho (item={ap.item_id}, trab={ap.trabalho_id}): {e_an_t}")
-
-                    status_info['ativos_por_trabalho'] = ativos_info
-                    status_info['qtd_ativos'] = len(ativos_info)
-                    status_info['multiplo_ativos'] = len(ativos_info) > 1
-                except Exception as e_mult:
-                    logger.error(f"Falha ao montar ativos_por_trabalho: {e_mult}")
-
-                # Resumo de contagens por status (setup, pausa, producao)
-                try:
-                    counts = {'setup': 0, 'pausado': 0, 'producao': 0}
-                    for a in status_info.get('ativos_por_trabalho', []) or []:
-                        s = (a.get('status') or '').lower()
-                        if 'setup' in s:
-                            counts['setup'] += 1
-                        elif 'pausado' in s:
-                            counts['pausado'] += 1
-                        elif 'produção' in s or 'producao' in s:
-                            counts['producao'] += 1
-                    status_info['resumo_status'] = counts
-                except Exception as e_cnt:
-                    logger.error(f"Falha ao calcular resumo_status: {e_cnt}")
-
-                # Montar lista completa de trabalhos do item com status e tempos somados
-                try:
-                    trabalhos_list = []
-                    # Preferir item atual pré-carregado; fallback para item do primeiro pedido da OS
-                    item_obj = getattr(status, 'item_atual', None)
-                    if not item_obj:
-                        os_obj_local = getattr(status, 'ordem_servico', None)
-                        if os_obj_local and getattr(os_obj_local, 'pedidos', None):
-                            pedido_os = os_obj_local.pedidos[0]
-                            pedido_local = getattr(pedido_os, 'pedido', None)
-                            item_obj = getattr(pedido_local, 'item', None) if pedido_local else None
-                    if item_obj and getattr(item_obj, 'trabalhos', None):
-                        ativos_lista = status_info.get('ativos_por_trabalho', []) or []
-                        for it in item_obj.trabalhos:
-                            trab = getattr(it, 'trabalho', None)
-                            if not trab:
-                                continue
-                            trab_id = getattr(trab, 'id', None)
-                            trab_nome = getattr(trab, 'nome', '')
-                            relacionados = [a for a in ativos_lista if a.get('trabalho_id') == trab_id]
-                            # Agregar tempos
-                            tempo_setup = 0
-                            tempo_pausas = 0
-                            tempo_producao = 0
-                            ultima_q = 0
-                            status_trab = 'Aguardando'
-                            inicio_mais_recente = None
-                            for a in relacionados:
-                                an = a.get('analytics') or {}
-                                tempo_setup += int(an.get('tempo_setup_utilizado') or 0)
-                                tempo_pausas += int(an.get('tempo_pausas_utilizado') or 0)
-                                tempo_producao += int(an.get('tempo_producao_utilizado') or 0)
-                                # última quantidade: pegar da entrada mais recente
-                                try:
-                                    ini = a.get('inicio_acao')
-                                    if ini:
-                                        if not inicio_mais_recente or str(ini) > str(inicio_mais_recente):
-                                            inicio_mais_recente = ini
-                                            ultima_q = int(a.get('ultima_quantidade') or 0)
-                                            status_trab = a.get('status') or status_trab
-                                except Exception:
-                                    pass
-                            trabalhos_list.append({
-                                'trabalho_id': trab_id,
-                                'trabalho_nome': trab_nome,
-                                'status': status_trab,
-                                'ultima_quantidade': int(ultima_q or 0),
-                                'tempo_setup_utilizado': int(tempo_setup or 0),
-                                'tempo_pausas_utilizado': int(tempo_pausas or 0),
-                                'tempo_producao_utilizado': int(tempo_producao or 0)
-                            })
-                        status_info['trabalhos_do_item'] = trabalhos_list
-                except Exception as e_trabs:
-                    logger.error(f"Falha ao montar trabalhos_do_item: {e_trabs}")
+        def _anexar_ghost(status_info, os_id):
+            bucket = ghost_por_os.get(os_id)
+            if bucket:
+                status_info['ghost_cards'] = bucket.get('cards', [])
+                status_info['ghost_listas_kanban'] = sorted(bucket.get('listas_lower', set()))
 
-                # Anexar metadados de cartões fantasma (se houver) e adicionar ao resultado
-                try:
-                    if status.ordem_servico_id in ghost_por_os:
-                        bucket = ghost_por_os.get(status.ordem_servico_id) or {}
-                        # Listas únicas e cards
-                        status_info['ghost_cards'] = bucket.get('cards', [])
-                        status_info['ghost_listas_kanban'] = sorted(list(bucket.get('listas_lower', set())))
-                except Exception:
-                    pass
-                # Adicionar ao resultado
-                resultado['status_ativos'].append(status_info)
-                # Marcar esta OS como já processada
-                os_com_status_ativo.add(status.ordem_servico_id)
-                logger.debug(f"Status ID={status.id} processado com sucesso e adicionado ao resultado")
+        t0 = time.perf_counter()
+        for status in status_ativos:
+            try:
+                status_info = _montar_cartao_ativo(status, map_lista_por_lower, dados)
+                _anexar_ghost(status_info, status.ordem_servico_id)
+                entrada = _entrada(status.ordem_servico_id)
+                entrada['principal'] = status_info
+                entrada['tipo_principal'] = 'ativo'
+                entrada['tem_pedido_entregue'] = _tem_pedido_entregue(status.ordem_servico)
             except Exception as e_status:
                 logger.error(f"Falha ao montar status_info para status ID {getattr(status, 'id', None)}: {e_status}")
-                # Continua para o próximo status
-                continue
         timings['build_status_loop_ms'] = int((time.perf_counter() - t0) * 1000)
-        
-        # Adicionar OS que estão em máquinas mas NÃO têm status ativo (para mostrar todas as máquinas)
-        logger.debug("Adicionando OS sem status ativo...")
-        # Processar OS em máquinas sem status ativo
-        for ordem in todas_os_em_maquinas:
-            if ordem.id in os_com_status_ativo:
-                continue  # Já foi processada acima
-                
-            try:
-                # Criar status_info básico para OS sem apontamento ativo
-                status_info = {
-                    'id': f"os_{ordem.id}",
-                    'ordem_servico_id': ordem.id,
-                    'ordem_id': ordem.id,
-                    'status_atual': 'Aguardando'
-                }
-                # Posição da OS na lista/máquina (quando disponível)
-                try:
-                    status_info['posicao'] = getattr(ordem, 'posicao', None)
-                except Exception:
-                    pass
 
-                # Número da OS
-                try:
-                    os_num = getattr(ordem, 'numero', None) or getattr(ordem, 'codigo', None) or f"OS-{ordem.id}"
-                    status_info['os_numero'] = os_num
-                except Exception:
-                    status_info['os_numero'] = f"OS-{ordem.id}"
-                
-                # Lista Kanban (status da OS) com normalização/canonização
-                status_info['lista_kanban'] = getattr(ordem, 'status', None)
-                try:
-                    nome_raw = status_info.get('lista_kanban')
-                    if nome_raw:
-                        kl = map_lista_por_lower.get(nome_raw.strip().lower())
-                        if kl:
-                            status_info['lista_kanban'] = getattr(kl, 'nome', None)
-                            status_info['lista_tipo'] = getattr(kl, 'tipo_servico', None)
-                            status_info['lista_cor'] = getattr(kl, 'cor', None)
-                except Exception:
-                    pass
-                
-                # Aplicar filtros (considerando cartões fantasma associados à OS)
-                try:
-                    if lista_filters_set is not None:
-                        listas_ghost = ghost_por_os.get(ordem.id, {}).get('listas_lower', set())
-                        lista_principal = status_info.get('lista_kanban')
-                        lista_principal_lower = lista_principal.lower() if lista_principal else None
-                        lista_principal_ok = (lista_principal_lower in lista_filters_set) if lista_principal_lower else False
-                        ghost_ok = bool(listas_ghost.intersection(lista_filters_set)) if listas_ghost else False
-                        if not (lista_principal_ok or ghost_ok):
-                            continue
-                    
-                    if lista_tipo_filter is not None:
-                        tipos_ghost = ghost_por_os.get(ordem.id, {}).get('tipos_lower', set())
-                        tipo_principal = status_info.get('lista_tipo')
-                        tipo_principal_ok = tipo_principal and str(tipo_principal).strip().lower() == lista_tipo_filter
-                        ghost_tipo_ok = lista_tipo_filter in tipos_ghost if tipos_ghost else False
-                        if not (tipo_principal_ok or ghost_tipo_ok):
-                            continue
-                    
-                    if status_filter_set is not None:
-                        st_atual = (status_info.get('status_atual') or '').strip().lower()
-                        tem_ghost = ordem.id in ghost_por_os
-                        ok_status = (st_atual in status_filter_set) or ('fantasma' in status_filter_set and tem_ghost)
-                        if not ok_status:
-                            continue
-                except Exception:
-                    pass
-                
-                # Buscar último apontamento para mostrar progresso correto
-                try:
-                    ultimo_ap = (
-                        ApontamentoProducao.query
-                        .filter_by(ordem_servico_id=ordem.id)
-                        .filter(ApontamentoProducao.quantidade != None)
-                        .order_by(ApontamentoProducao.data_hora.desc())
-                        .first()
-                    )
-                    
-                    if ultimo_ap:
-                        status_info['ultima_quantidade'] = int(ultimo_ap.quantidade)
-                        status_info['item_atual_id'] = ultimo_ap.item_id
-                        status_info['trabalho_atual_id'] = ultimo_ap.trabalho_id
-                        
-                        # Calcular tempos históricos acumulados mesmo sem status ativo
-                        try:
-                            # Buscar todos os apontamentos desta OS/item/trabalho para calcular tempos totais
-                            apontamentos_historicos = ApontamentoProducao.query.filter(
-                                ApontamentoProducao.ordem_servico_id == ordem.id,
-                                ApontamentoProducao.item_id == ultimo_ap.item_id,
-                                ApontamentoProducao.trabalho_id == ultimo_ap.trabalho_id
-                            ).order_by(ApontamentoProducao.data_hora.asc()).all()
-                            
-                            tempo_setup_total = 0
-                            tempo_producao_total = 0 
-                            tempo_pausas_total = 0
-                            
-                            # Calcular tempos baseado nos apontamentos históricos
-                            for i, ap in enumerate(apontamentos_historicos):
-                                if ap.data_fim and ap.data_hora:
-                                    duracao = int((ap.data_fim - ap.data_hora).total_seconds())
-                                    if ap.tipo_acao in ['inicio_setup', 'fim_setup']:
-                                        tempo_setup_total += duracao
-                                    elif ap.tipo_acao in ['inicio_producao', 'fim_producao']:
-                                        tempo_producao_total += duracao
-                                    elif ap.tipo_acao in ['pausa', 'stop']:
-                                        tempo_pausas_total += duracao
-                            
-                            # Adicionar analytics históricos
-                            status_info['analytics'] = {
-                                'tempo_setup_utilizado': tempo_setup_total,
-                                'tempo_producao_utilizado': tempo_producao_total,
-                                'tempo_pausas_utilizado': tempo_pausas_total,
-                                'tempo_setup_estimado': None,
-                                'tempo_peca_estimado': None,
-                                'setup_status': None,
-                                'producao_status': None,
-                                'media_seg_por_peca': None
-                            }
-                            
-                            # Calcular média por peça se houver quantidade
-                            if status_info['ultima_quantidade'] > 0 and tempo_producao_total > 0:
-                                media = int(tempo_producao_total / status_info['ultima_quantidade'])
-                                status_info['analytics']['media_seg_por_peca'] = media
-                                
-                            # Tempos históricos calculados
-                            
-                        except Exception as e_hist:
-                            logger.error(f"OS {ordem.id}: falha ao calcular tempos históricos: {e_hist}")
-                            status_info['analytics'] = {
-                                'tempo_setup_utilizado': 0,
-                                'tempo_producao_utilizado': 0,
-                                'tempo_pausas_utilizado': 0,
-                                'tempo_setup_estimado': None,
-                                'tempo_peca_estimado': None,
-                                'setup_status': None,
-                                'producao_status': None,
-                                'media_seg_por_peca': None
-                            }
-                    else:
-                        status_info['ultima_quantidade'] = 0
-                        status_info['analytics'] = {
-                            'tempo_setup_utilizado': 0,
-                            'tempo_producao_utilizado': 0,
-                            'tempo_pausas_utilizado': 0,
-                            'tempo_setup_estimado': None,
-                            'tempo_peca_estimado': None,
-                            'setup_status': None,
-                            'producao_status': None,
-                            'media_seg_por_peca': None
-                        }
-                        # Sem apontamentos com quantidade
-                except Exception as e_ultimo:
-                    logger.error(f"OS {ordem.id}: falha ao buscar último apontamento: {e_ultimo}")
-                    status_info['ultima_quantidade'] = 0
-                    status_info['analytics'] = {
-                        'tempo_setup_utilizado': 0,
-                        'tempo_producao_utilizado': 0,
-                        'tempo_pausas_utilizado': 0,
-                        'tempo_setup_estimado': None,
-                        'tempo_peca_estimado': None,
-                        'setup_status': None,
-                        'producao_status': None,
-                        'media_seg_por_peca': None
-                    }
-                
-                # Buscar item/trabalho da OS (mesmo sem apontamento ativo)
-                try:
-                    if ordem.pedidos:
-                        # Agregar clientes e total usando relações já carregadas
-                        try:
-                            clientes_map = {}
-                            total_q = 0
-                            for po in getattr(ordem, 'pedidos', []) or []:
-                                ped = getattr(po, 'pedido', None)
-                                if not ped:
-                                    continue
-                                q = int(getattr(ped, 'quantidade', 0) or 0)
-                                total_q += q
-                                cli = getattr(ped, 'cliente', None)
-                                nome_cli = getattr(cli, 'nome', None) or 'Cliente'
-                                clientes_map[nome_cli] = clientes_map.get(nome_cli, 0) + q
-                            status_info['quantidade_total'] = int(total_q)
-                            if clientes_map:
-                                status_info['clientes_quantidades'] = [
-                                    {'cliente_nome': k, 'quantidade': v} for k, v in clientes_map.items()
-                                ]
-                                status_info['cliente_nome'] = next(iter(clientes_map.keys()))
-                        except Exception as e_cli2:
-                            logger.error(f"OS {ordem.id}: falha ao agregar clientes/quantidades: {e_cli2}")
-
-                        pedido_os = ordem.pedidos[0]
-                        pedido = pedido_os.pedido
-                        item = pedido.item if pedido else None
-                        if item:
-                            status_info['item_id'] = item.id
-                            status_info['item_nome'] = item.nome
-                            status_info['item_codigo'] = item.codigo_acb
-                            status_info['item_imagem_path'] = getattr(item, 'imagem_path', None)
-                            
-                            # Buscar trabalho do item
-                            if item.trabalhos:
-                                trabalho_rel = item.trabalhos[0]
-                                trabalho = trabalho_rel.trabalho
-                                if trabalho:
-                                    status_info['trabalho_id'] = trabalho.id
-                                    status_info['trabalho_nome'] = trabalho.nome
-                                
-                                # clientes_quantidades e quantidade_total já definidos acima
-                                # Montar trabalhos_do_item mesmo sem ativos, usando último apontamento
-                                try:
-                                    trabalhos_list = []
-                                    for it in item.trabalhos:
-                                        trab = it.trabalho
-                                        if not trab:
-                                            continue
-                                        
-                                        # Buscar último apontamento para este trabalho específico
-                                        ultima_qtd_trabalho = 0
-                                        try:
-                                            ultimo_ap_trab = (
-                                                ApontamentoProducao.query
-                                                .filter_by(
-                                                    ordem_servico_id=ordem.id,
-                                                    item_id=item.id,
-                                                    trabalho_id=trab.id
-                                                )
-                                                .filter(ApontamentoProducao.quantidade != None)
-                                                .order_by(ApontamentoProducao.data_hora.desc())
-                                                .first()
-                                            )
-                                            if ultimo_ap_trab:
-                                                ultima_qtd_trabalho = int(ultimo_ap_trab.quantidade)
-                                        except Exception:
-                                            pass
-                                        
-                                        trabalhos_list.append({
-                                            'trabalho_id': trab.id,
-                                            'trabalho_nome': trab.nome,
-                                            'status': 'Aguardando',
-                                            'ultima_quantidade': ultima_qtd_trabalho,
-                                            'tempo_setup_utilizado': 0,
-                                            'tempo_pausas_utilizado': 0,
-                                            'tempo_producao_utilizado': 0
-                                        })
-                                    if trabalhos_list:
-                                        status_info['trabalhos_do_item'] = trabalhos_list
-                                except Exception as e_trabs2:
-                                    logger.error(f"OS {ordem.id}: falha ao montar trabalhos_do_item sem ativos: {e_trabs2}")
-                            else:
-                                logger.debug(f"OS {ordem.id}: item com ID {pedido.item_id} não encontrado no banco")
-                        else:
-                            logger.debug(f"OS {ordem.id}: pedido não encontrado ou sem item_id")
-                    else:
-                        logger.debug(f"OS {ordem.id}: sem pedidos associados")
-                except Exception as e:
-                    logger.error(f"OS {ordem.id}: falha ao buscar item via pedidos: {e}")
-                
-                # Valores padrão para campos obrigatórios
-                status_info.setdefault('ultima_quantidade', 0)
-                status_info.setdefault('ativos_por_trabalho', [])
-                status_info.setdefault('qtd_ativos', 0)
-                status_info.setdefault('multiplo_ativos', False)
-                status_info.setdefault('analytics', {})
-                status_info.setdefault('quantidade_total', 0)
-                status_info.setdefault('cliente_nome', None)
-                status_info.setdefault('resumo_status', {'setup': 0, 'pausado': 0, 'producao': 0})
-                status_info.setdefault('trabalhos_do_item', [])
-                
-                # Anexar metadados de cartões fantasma (se houver) e adicionar ao resultado
-                try:
-                    if ordem.id in ghost_por_os:
-                        bucket = ghost_por_os.get(ordem.id) or {}
-                        status_info['ghost_cards'] = bucket.get('cards', [])
-                        status_info['ghost_listas_kanban'] = sorted(list(bucket.get('listas_lower', set())))
-                except Exception:
-                    pass
-                # Adicionar ao resultado
-                resultado['status_ativos'].append(status_info)
-                
+        t0 = time.perf_counter()
+        for ordem in ordens_em_listas:
+            if ordem.id in entradas and entradas[ordem.id]['principal'] is not None:
+                continue
+            try:
+                status_info = _montar_cartao_os_sem_ativos(ordem, map_lista_por_lower, dados)
+                _anexar_ghost(status_info, ordem.id)
+                entrada = _entrada(ordem.id)
+                entrada['principal'] = status_info
+                entrada['tipo_principal'] = 'aguardando'
+                entrada['tem_pedido_entregue'] = _tem_pedido_entregue(ordem)
             except Exception as e_os:
                 logger.error(f"Falha ao processar OS {ordem.id}: {e_os}")
-                continue
         timings['build_os_sem_ativos_loop_ms'] = int((time.perf_counter() - t0) * 1000)
-        
-        # Adicionar cartões fantasma ativos como entradas separadas
-        logger.debug("Adicionando cartões fantasma ativos...")
+
+        # Cartões fantasma ativos como entradas separadas; usam o status real quando houver
         t0 = time.perf_counter()
-        try:
-            cartoes_fantasma_ativos = (
-                CartaoFantasma.query.options(
-                    joinedload(CartaoFantasma.ordem_servico)
-                        .joinedload(OrdemServico.pedidos)
-                        .joinedload(PedidoOrdemServico.pedido)
-                        .joinedload(Pedido.cliente),
-                    joinedload(CartaoFantasma.ordem_servico)
-                        .joinedload(OrdemServico.pedidos)
-                        .joinedload(PedidoOrdemServico.pedido)
-                        .joinedload(Pedido.item)
-                )
-                .filter_by(ativo=True)
-                .all()
-            )
-        except Exception as e_cf_query:
-            logger.error(f"[status_ativos] Falha ao buscar cartoes_fantasma_ativos: {e_cf_query}")
-            cartoes_fantasma_ativos = []
-
-        ghost_os_ids = list({cf.ordem_servico_id for cf in cartoes_fantasma_ativos if getattr(cf, 'ordem_servico_id', None)})
-        status_ativos_por_os = {}
-        if ghost_os_ids:
-            status_rows = (
-                StatusProducaoOS.query
-                .filter(StatusProducaoOS.ordem_servico_id.in_(ghost_os_ids))
-                .all()
-            )
-            status_ativos_por_os = {
-                row.ordem_servico_id: row
-                for row in status_rows
-                if row and getattr(row, 'status_atual', None) != 'Finalizado'
-            }
-        
-        for cf in cartoes_fantasma_ativos:
+        for cf in cartoes_fantasma:
             try:
-                # Cartões fantasma devem sempre aparecer, independente de status ativo
-                # CORREÇÃO: Permitir cartões fantasma mesmo com status ativo para mostrar no dashboard
-                
-                # Buscar OS do cartão fantasma
-                os_fantasma = getattr(cf, 'ordem_servico', None)
-                if not os_fantasma:
+                if not getattr(cf, 'ordem_servico', None):
                     continue
-                
-                # Verificar filtros - CORREÇÃO: Sempre mostrar cartões fantasma no dashboard
-                try:
-                    if lista_filters_set is not None:
-                        lista_fantasma_lower = cf.lista_kanban.lower() if cf.lista_kanban else None
-                        # Se filtro não inclui "todas", verificar se a lista do fantasma está incluída
-                        if 'todas' not in lista_filters_set and lista_fantasma_lower not in lista_filters_set:
-                            continue
-                    
-                    # CORREÇÃO: Não filtrar por status "fantasma" - sempre mostrar cartões fantasma
-                    # if status_filter_set is not None:
-                    #     if 'fantasma' not in status_filter_set:
-                    #         continue
-                except Exception:
-                    pass
-                
-                # Verificar se há apontamento ativo para esta OS
-                status_ativo_os = status_ativos_por_os.get(cf.ordem_servico_id)
-                status_atual_real = 'Fantasma'
-                
-                # Se há status ativo, usar o status real em vez de "Fantasma"
-                if status_ativo_os and status_ativo_os.status_atual != 'Finalizado':
-                    status_atual_real = status_ativo_os.status_atual
-                
-                # Criar status_info para cartão fantasma
-                status_info_fantasma = {
-                    'id': f"fantasma_{cf.id}",
-                    'ordem_servico_id': cf.ordem_servico_id,
-                    'ordem_id': cf.ordem_servico_id,
-                    'status_atual': status_atual_real,
-                    'lista_kanban': cf.lista_kanban,
-                    'is_fantasma': True,
-                    'fantasma_id': cf.id,
-                    # Compatibilidade com frontend
-                    'is_ghost_card': True,
-                    'ghost_card_id': cf.id
-                }
-                # Usar posicao_fila do cartão fantasma para ordenação
-                try:
-                    status_info_fantasma['posicao'] = getattr(cf, 'posicao_fila', None)
-                    status_info_fantasma['posicao_fila'] = getattr(cf, 'posicao_fila', None)
-                except Exception:
-                    pass
-                
-                # Número da OS
-                try:
-                    os_num = getattr(os_fantasma, 'numero', None) or f"OS-{os_fantasma.id}"
-                    status_info_fantasma['os_numero'] = os_num
-                except Exception:
-                    status_info_fantasma['os_numero'] = f"OS-{os_fantasma.id}"
-                
-                # Buscar informações do item via pedidos
-                try:
-                    if os_fantasma.pedidos:
-                        pedido_os = os_fantasma.pedidos[0]
-                        pedido = pedido_os.pedido
-                        item = pedido.item if pedido else None
-                        
-                        if item:
-                            status_info_fantasma['item_id'] = item.id
-                            status_info_fantasma['item_nome'] = item.nome
-                            status_info_fantasma['item_codigo'] = item.codigo_acb
-                            status_info_fantasma['item_imagem_path'] = getattr(item, 'imagem_path', None)
-                            
-                            # Buscar último apontamento
-                            try:
-                                ultimo_ap = (
-                                    ApontamentoProducao.query
-                                    .filter_by(ordem_servico_id=cf.ordem_servico_id)
-                                    .filter(ApontamentoProducao.quantidade != None)
-                                    .order_by(ApontamentoProducao.data_hora.desc())
-                                    .first()
-                                )
-                                if ultimo_ap:
-                                    status_info_fantasma['ultima_quantidade'] = int(ultimo_ap.quantidade)
-                                else:
-                                    status_info_fantasma['ultima_quantidade'] = 0
-                            except Exception:
-                                status_info_fantasma['ultima_quantidade'] = 0
-                            
-                            # Agregar clientes e quantidades
-                            try:
-                                clientes_map = {}
-                                total_q = 0
-                                for po in os_fantasma.pedidos:
-                                    ped = po.pedido
-                                    if not ped:
-                                        continue
-                                    q = int(getattr(ped, 'quantidade', 0) or 0)
-                                    total_q += q
-                                    cli = getattr(ped, 'cliente', None)
-                                    nome_cli = getattr(cli, 'nome', None) or 'Cliente'
-                                    clientes_map[nome_cli] = clientes_map.get(nome_cli, 0) + q
-                                
-                                status_info_fantasma['quantidade_total'] = int(total_q)
-                                if clientes_map:
-                                    status_info_fantasma['clientes_quantidades'] = [
-                                        {'cliente_nome': k, 'quantidade': v} for k, v in clientes_map.items()
-                                    ]
-                                    status_info_fantasma['cliente_nome'] = next(iter(clientes_map.keys()))
-                            except Exception:
-                                pass
-                except Exception:
-                    pass
-                
-                # Valores padrão
-                status_info_fantasma.setdefault('ultima_quantidade', 0)
-                status_info_fantasma.setdefault('ativos_por_trabalho', [])
-                status_info_fantasma.setdefault('qtd_ativos', 0)
-                status_info_fantasma.setdefault('multiplo_ativos', False)
-                status_info_fantasma.setdefault('analytics', {})
-                status_info_fantasma.setdefault('quantidade_total', 0)
-                status_info_fantasma.setdefault('cliente_nome', None)
-                status_info_fantasma.setdefault('resumo_status', {'setup': 0, 'pausado': 0, 'producao': 0})
-                status_info_fantasma.setdefault('trabalhos_do_item', [])
-                
-                # Adicionar ao resultado
-                resultado['status_ativos'].append(status_info_fantasma)
-                
+                status_os = status_por_os.get(cf.ordem_servico_id)
+                status_atual_real = status_os.status_atual if status_os else 'Fantasma'
+                _entrada(cf.ordem_servico_id)['fantasmas'].append(_montar_cartao_fantasma(cf, status_atual_real, dados))
             except Exception as e_cf:
                 logger.error(f"Falha ao processar cartão fantasma {cf.id}: {e_cf}")
-                continue
-        
         timings['build_cartoes_fantasma_ms'] = int((time.perf_counter() - t0) * 1000)
-        
-        logger.debug(f"Status ativos formatados (com cartões fantasma mesclados): {len(resultado['status_ativos'])}")
+
+    return entradas
+
+
+def _detectar_alteracoes_chao_fabrica(marca_anterior):
+    """
+    Marca d'água usada pelo estado do chão de fábrica para enxergar gravações
+    feitas por outros workers: o seq do log de alterações do Kanban, que recebe
+    inserções, fechamentos e exclusões de apontamentos, cartões fantasma, OS e
+    status de produção na mesma transação. Retorna ``(marca, os_ids)``;
+    ``os_ids`` ``None`` pede reconstrução completa.
+    """
+    if marca_anterior is None:
+        return kanban_changelog.seq_atual(db.session), set()
+
+    resultado = kanban_changelog.buscar_alteracoes(db.session, marca_anterior, LIMITE_ALTERACOES_MARCA_DAGUA)
+    if resultado['reset'] or resultado['has_more']:
+        return kanban_changelog.seq_atual(db.session), None
+
+    alteradas = set()
+    ids_por_entidade = defaultdict(set)
+    for (entidade, entidade_id), _ in resultado['alteracoes'].items():
+        if entidade == 'lista':
+            return resultado['seq'], None
+        if entidade == 'cartao':
+            alteradas.add(entidade_id)
+        else:
+            ids_por_entidade[entidade].add(entidade_id)
+
+    for entidade, modelo in (('apontamento', ApontamentoProducao), ('fantasma', CartaoFantasma)):
+        ids = ids_por_entidade.get(entidade)
+        if not ids:
+            continue
+        rows = db.session.query(modelo.id, modelo.ordem_servico_id).filter(modelo.id.in_(ids)).all()
+        # Registro apagado: a OS dele não é mais conhecida, remonta tudo
+        if len(rows) < len(ids):
+            return resultado['seq'], None
+        alteradas.update(row.ordem_servico_id for row in rows)
+
+    alteradas.discard(None)
+    return resultado['seq'], alteradas
+
+
+def _ler_filtros_status_ativos(args):
+    filtros = {
+        'excluir_entregues': str(args.get('excluir_entregues', '')).strip().lower() in ('1', 'true', 'yes'),
+        'listas': None,
+        'lista_tipo': None,
+        'status': None,
+    }
+    lista_raw = (args.get('lista') or '').strip().lower()
+    if lista_raw and lista_raw != 'todas':
+        lista_filters = [s.strip() for s in lista_raw.split(',') if s.strip() and s.strip() != 'todas']
+        if lista_filters:
+            filtros['listas'] = set(lista_filters)
+    if args.get('lista_tipo') and args.get('lista_tipo').strip():
+        filtros['lista_tipo'] = args.get('lista_tipo').strip().lower()
+    status_filter_raw = args.get('status', '').strip().lower()
+    if status_filter_raw and status_filter_raw != 'todos':
+        filtros['status'] = set(s.strip() for s in status_filter_raw.split(',') if s.strip())
+    return filtros
+
+
+def _cartao_principal_passa_filtros(entrada, filtros):
+    """Filtros de lista/tipo/status do cartão principal, considerando os cartões fantasma da OS"""
+    cartao = entrada['principal']
+    if filtros['excluir_entregues'] and entrada['tem_pedido_entregue']:
+        return False
+    if filtros['listas'] is not None:
+        lista_principal = cartao.get('lista_kanban')
+        lista_principal_ok = lista_principal.lower() in filtros['listas'] if lista_principal else False
+        if not (lista_principal_ok or entrada['listas_ghost'].intersection(filtros['listas'])):
+            return False
+    if filtros['lista_tipo'] is not None:
+        tipo_principal = cartao.get('lista_tipo')
+        tipo_principal_ok = bool(tipo_principal) and str(tipo_principal).strip().lower() == filtros['lista_tipo']
+        if not (tipo_principal_ok or filtros['lista_tipo'] in entrada['tipos_ghost']):
+            return False
+    if filtros['status'] is not None:
+        st_atual = (cartao.get('status_atual') or '').strip().lower()
+        if not (st_atual in filtros['status'] or ('fantasma' in filtros['status'] and entrada['tem_ghost'])):
+            return False
+    return True
+
+
+def _serializar_cartao(cartao, segundos_decorridos):
+    """
+    Prepara o cartão materializado para resposta. Cartões com cronômetros em
+    andamento são copiados e têm os tempos avançados até agora.
+    """
+    if not cartao.get('_relogios'):
+        return cartao
+    cartao = copy.deepcopy(cartao)
+    cartao.pop('_relogios', None)
+    delta = max(0, int(segundos_decorridos))
+
+    def _avancar(analytics, qtd):
+        campos = analytics.pop('_relogio', None) if analytics else None
+        if not campos:
+            return
+        for campo in campos:
+            analytics[campo] = int(analytics.get(campo) or 0) + delta
+        _classificar_analytics(analytics, qtd)
+
+    _avancar(cartao.get('analytics'), cartao.get('ultima_quantidade') or 0)
+    ativos = cartao.get('ativos_por_trabalho') or []
+    for ativo in ativos:
+        _avancar(ativo.get('analytics'), ativo.get('ultima_quantidade') or 0)
+    if cartao.get('trabalhos_do_item') and ativos:
+        _somar_tempos_trabalhos(cartao['trabalhos_do_item'], ativos)
+    return cartao
+
+
+@apontamento_bp.route('/status-ativos', methods=['GET'])
+def status_ativos():
+    """Retorna todos os status de produção ativos para apontamentos (usado para persistência frontend)"""
+    try:
+        t_start = time.perf_counter()
+        timings = {}
+        filtros = _ler_filtros_status_ativos(request.args)
+
+        # Cartões vêm do estado materializado; só as OS alteradas desde a última leitura são remontadas
+        t0 = time.perf_counter()
+        entradas, info_estado = estado_chao_fabrica.obter(
+            lambda os_ids: _construir_entradas_status_ativos(os_ids, timings),
+            _detectar_alteracoes_chao_fabrica
+        )
+        timings['estado_ms'] = int((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        agora = time.time()
+        ativos, aguardando, fantasmas = [], [], []
+        for entrada in entradas:
+            decorrido = agora - entrada['construido_em']
+            principal = entrada['principal']
+            if principal is not None and _cartao_principal_passa_filtros(entrada, filtros):
+                destino = ativos if entrada['tipo_principal'] == 'ativo' else aguardando
+                destino.append(_serializar_cartao(principal, decorrido))
+            for cartao_fantasma in entrada['fantasmas']:
+                # Cartões fantasma sempre aparecem; apenas o filtro de lista se aplica
+                if filtros['listas'] is not None:
+                    lista_fantasma = cartao_fantasma.get('lista_kanban')
+                    if (lista_fantasma.lower() if lista_fantasma else None) not in filtros['listas']:
+                        continue
+                fantasmas.append(cartao_fantasma)
+        resultado = {'status_ativos': ativos + aguardando + fantasmas}
+        timings['serializacao_ms'] = int((time.perf_counter() - t0) * 1000)
+
         # Ordenar por lista_kanban (case-insensitive) e posicao (asc)
         try:
             resultado['status_ativos'].sort(
@@ -1984,22 +1706,14 @@ def status_ativos():
             logger.error(f"Falha ao ordenar status_ativos: {e_sort}")
 
         # Anexar timings apenas quando explicitamente solicitado
-        try:
-            if (request.args.get('timing') or '').strip().lower() in ['1', 'true', 'yes']:
-                timings['total_ms'] = int((time.perf_counter() - t_start) * 1000)
-                resultado['timings'] = timings
-                logger.info(f"/status-ativos timings: {timings}")
-        except Exception:
-            pass
-        
-        # Cachear resultado por 5 segundos
-        try:
-            if hasattr(current_app, 'cache_store'):
-                current_app.cache_store.set(cache_key, resultado, timeout=5)
-                logger.debug(f"[CACHE SET] status-ativos cacheado por 5s")
-        except:
-            pass
-        
+        if (request.args.get('timing') or '').strip().lower() in ['1', 'true', 'yes']:
+            timings['total_ms'] = int((time.perf_counter() - t_start) * 1000)
+            timings['estado_versao'] = info_estado.get('versao')
+            timings['estado_reconstrucao'] = info_estado.get('reconstrucao')
+            timings['estado_os_reconstruidas'] = info_estado.get('os_reconstruidas')
+            resultado['timings'] = timings
+            logger.info(f"/status-ativos timings: {timings}")
+
         return jsonify(resultado)
     except Exception as e:
         import traceback
@@ -2138,6 +1852,16 @@ def detalhes_ordem_servico(ordem_id):
             
             # Converter set para lista
             dados['operadores'] = list(dados['operadores'])
+
+        # Totais por trabalho a partir do resumo (mesma fonte dos cartões do dashboard)
+        resumos = carregar_resumos(db.session, [ordem_id])
+        if resumos:
+            for dados in trabalhos_analytics.values():
+                resumo = resumos.get((ordem_id, dados['item_id'], dados['trabalho_id']))
+                if resumo:
+                    dados['setup_total'] = resumo.tempo_setup_s
+                    dados['producao_total'] = resumo.tempo_producao_s
+                    dados['pausas_total'] = resumo.tempo_pausas_s
         
         # Calcular analytics gerais
         total_setup = sum(t['setup_total'] for t in trabalhos_analytics.values())
@@ -2824,6 +2548,21 @@ def registrar_apontamento():
         
         db.session.add(apontamento)
         db.session.commit()
+        invalidar_cache_dashboard(ordem.status)
+
+        # Diff do cartão para as telas conectadas via SSE (/tempo-real/stream)
+        publicar_tempo_real(
+            'apontamento', tipo_acao,
+            ordem_servico_id=ordem_servico_id,
+            item_id=item_id,
+            trabalho_id=trabalho_id,
+            apontamento_id=apontamento.id,
+            status=status_os.status_atual,
+            quantidade=apontamento.quantidade,
+            operador_codigo=usuario.codigo_operador,
+            operador_nome=usuario.nome,
+            lista=ordem.status,
+        )
 
         try:
             from notificacoes.eventos import registrar_evento_apontamento
@@ -2924,6 +2663,7 @@ def registrar_apontamento():
             
             db.session.add(apontamento_emergencia)
             db.session.commit()
+            invalidar_cache_dashboard(apontamento_emergencia.lista_kanban)
             
             logger.info("Fallback de emergência bem-sucedido!")
             
@@ -2989,6 +2729,8 @@ def reset_apontamentos_os(ordem_id):
             status_os.motivo_pausa = None
 
         db.session.commit()
+        invalidar_cache_dashboard()
+        publicar_tempo_real('apontamento', 'reset', ordem_servico_id=ordem_id, status='Aguardando')
 
         return jsonify({
             'success': True,
@@ -3228,6 +2970,10 @@ def fechar_apontamento(apontamento_id):
             apontamento.tempo_decorrido = int(delta.total_seconds())
         
         db.session.commit()
+        invalidar_cache_dashboard(apontamento.lista_kanban)
+        publicar_tempo_real('apontamento', 'fechado', ordem_servico_id=apontamento.ordem_servico_id,
+                            item_id=apontamento.item_id, trabalho_id=apontamento.trabalho_id,
+                            apontamento_id=apontamento.id)
         
         return jsonify({
             'success': True,
@@ -3285,6 +3031,7 @@ def editar_apontamento(apontamento_id):
                 return jsonify({'success': False, 'message': 'Formato de data fim inválido'}), 400
         
         db.session.commit()
+        invalidar_cache_dashboard(apontamento.lista_kanban)
         
         return jsonify({
             'success': True,
@@ -9,8 +9,12 @@ arquivos = Blueprint('arquivos', __name__)
 def uploaded_imagem(filename):
     """Rota para acessar imagens enviadas"""
     filepath = os.path.join(current_app.config['UPLOAD_FOLDER_IMAGENS'], filename)
+    if not os.path.exists(filepath):
+        # Miniatura de imagem enviada antes das derivadas: gera a partir do original
+        from utils.imagens_derivadas import derivada_local
+        filepath = derivada_local(filepath) or filepath
     if os.path.exists(filepath):
-        return send_file(filepath)
+        return send_file(filepath, max_age=86400 if filename.endswith(('.webp', '.avif')) else None)
     else:
         flash(f'Arquivo de imagem não encontrado: {filename}', 'danger')
         return render_template('error.html', message=f'Arquivo de imagem {filename} não encontrado'), 404
@@ -1,6 +1,16 @@
+import json
+import logging
+
 from flask import Blueprint, render_template, request, redirect, url_for, flash, g
-from sqlalchemy import or_
-from models import AuditLog
+from sqlalchemy import func, inspect, or_
+from models import db, AuditLog
+from utils.auditoria import escritor_auditoria
+from utils.auditoria_arquivo import arquivar, is_postgres, tabela_arquivo
+
+logger = logging.getLogger(__name__)
+
+# Acima disso o total da listagem é estimado (PostgreSQL) ou limitado (SQLite)
+LIMITE_CONTAGEM_EXATA = 10000
 
 
 auditoria = Blueprint('auditoria', __name__)
@@ -14,6 +24,46 @@ def _require_admin():
     return True
 
 
+def _estimativa_postgres(consulta):
+    """Linhas estimadas pelo planejador (EXPLAIN), sem executar a consulta."""
+    try:
+        compilado = consulta.order_by(None).statement.compile(dialect=db.engine.dialect)
+        plano = db.session.connection().exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + str(compilado), compilado.params
+        ).scalar()
+        if isinstance(plano, str):
+            plano = json.loads(plano)
+        return int(plano[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        logger.debug(f"[auditoria] Estimativa indisponível: {e}")
+        return None
+
+
+def _contar(consulta, exata=False):
+    """
+    (total, estimativa): ``None`` para total exato, ``'aproximado'`` para a
+    estimativa do planejador (PostgreSQL) ou ``'minimo'`` quando a contagem
+    parou em ``LIMITE_CONTAGEM_EXATA`` (SQLite).
+    """
+    consulta = consulta.order_by(None)
+    if exata:
+        return consulta.count(), None
+    if is_postgres(db.engine):
+        estimativa = _estimativa_postgres(consulta)
+        if estimativa is not None and estimativa > LIMITE_CONTAGEM_EXATA:
+            return estimativa, 'aproximado'
+        return consulta.count(), None
+    limitada = consulta.limit(LIMITE_CONTAGEM_EXATA + 1).subquery()
+    total = db.session.query(func.count()).select_from(limitada).scalar() or 0
+    if total > LIMITE_CONTAGEM_EXATA:
+        return LIMITE_CONTAGEM_EXATA, 'minimo'
+    return total, None
+
+
+def _tabela_arquivo_disponivel():
+    return not is_postgres(db.engine) and inspect(db.engine).has_table(tabela_arquivo().name)
+
+
 @auditoria.route('/auditoria')
 def listar_auditoria():
     if not _require_admin():
@@ -40,33 +90,42 @@ def listar_auditoria():
         per_page = 50
     per_page = max(10, min(200, per_page))
 
-    query = AuditLog.query
+    # Registros ainda no spool entram antes da consulta
+    escritor_auditoria.descarregar()
+
+    tem_arquivo = _tabela_arquivo_disponivel()
+    arquivo = tem_arquivo and request.args.get('arquivo') == '1'
+    contagem_exata = request.args.get('contagem') == 'exata'
+    tabela = tabela_arquivo() if arquivo else AuditLog.__table__
+    c = tabela.c
+
+    query = db.session.query(tabela)
 
     if acao:
-        query = query.filter(AuditLog.acao == acao)
+        query = query.filter(c.acao == acao)
 
     if entidade_tipo:
-        query = query.filter(AuditLog.entidade_tipo == entidade_tipo)
+        query = query.filter(c.entidade_tipo == entidade_tipo)
 
     if entidade_id:
-        query = query.filter(AuditLog.entidade_id == entidade_id)
+        query = query.filter(c.entidade_id == entidade_id)
 
     if usuario:
         if usuario.isdigit():
-            query = query.filter(or_(AuditLog.usuario_nome.ilike(f'%{usuario}%'), AuditLog.usuario_id == int(usuario)))
+            query = query.filter(or_(c.usuario_nome.ilike(f'%{usuario}%'), c.usuario_id == int(usuario)))
         else:
-            query = query.filter(AuditLog.usuario_nome.ilike(f'%{usuario}%'))
+            query = query.filter(c.usuario_nome.ilike(f'%{usuario}%'))
 
     if q:
         query = query.filter(
             or_(
-                AuditLog.usuario_nome.ilike(f'%{q}%'),
-                AuditLog.acao.ilike(f'%{q}%'),
-                AuditLog.entidade_tipo.ilike(f'%{q}%'),
-                AuditLog.entidade_id.ilike(f'%{q}%'),
-                AuditLog.endpoint.ilike(f'%{q}%'),
-                AuditLog.ip.ilike(f'%{q}%'),
-                AuditLog.mudancas_json.ilike(f'%{q}%'),
+                c.usuario_nome.ilike(f'%{q}%'),
+                c.acao.ilike(f'%{q}%'),
+                c.entidade_tipo.ilike(f'%{q}%'),
+                c.entidade_id.ilike(f'%{q}%'),
+                c.endpoint.ilike(f'%{q}%'),
+                c.ip.ilike(f'%{q}%'),
+                c.mudancas_json.ilike(f'%{q}%'),
             )
         )
 
@@ -74,19 +133,22 @@ def listar_auditoria():
     # Para compatibilidade SQLite/Postgres sem dependências extras, vamos filtrar em Python se necessário no template.
     # Aqui tentamos filtrar via cast textual no formato ISO.
     if data_de:
-        query = query.filter(AuditLog.data_criacao >= f'{data_de} 00:00:00')
+        query = query.filter(c.data_criacao >= f'{data_de} 00:00:00')
     if data_ate:
-        query = query.filter(AuditLog.data_criacao <= f'{data_ate} 23:59:59')
+        query = query.filter(c.data_criacao <= f'{data_ate} 23:59:59')
 
-    total = query.count()
+    total, total_estimado = _contar(query, exata=contagem_exata)
+    # Uma linha a mais indica se existe próxima página sem depender do total
     logs = (
-        query.order_by(AuditLog.data_criacao.desc())
+        query.order_by(c.data_criacao.desc())
         .offset((page - 1) * per_page)
-        .limit(per_page)
+        .limit(per_page + 1)
         .all()
     )
+    tem_proxima = len(logs) > per_page
+    logs = logs[:per_page]
 
-    total_pages = (total + per_page - 1) // per_page if total else 1
+    total_pages = max((total + per_page - 1) // per_page if total else 1, page + (1 if tem_proxima else 0))
 
     return render_template(
         'auditoria/listar.html',
@@ -94,7 +156,10 @@ def listar_auditoria():
         page=page,
         per_page=per_page,
         total=total,
+        total_estimado=total_estimado,
         total_pages=total_pages,
+        tem_proxima=tem_proxima,
+        tem_arquivo=tem_arquivo,
         filtros={
             'q': q,
             'usuario': usuario,
@@ -103,6 +168,8 @@ def listar_auditoria():
             'acao': acao,
             'data_de': data_de,
             'data_ate': data_ate,
+            'arquivo': '1' if arquivo else '',
+            'contagem': 'exata' if contagem_exata else '',
         },
     )
 
@@ -112,15 +179,19 @@ def auditoria_entidade(entidade_tipo, entidade_id):
     if not _require_admin():
         return redirect(url_for('main.index'))
 
-    logs = (
-        AuditLog.query.filter(
-            AuditLog.entidade_tipo == entidade_tipo,
-            AuditLog.entidade_id == str(entidade_id),
+    escritor_auditoria.descarregar()
+
+    tabelas = [AuditLog.__table__] + ([tabela_arquivo()] if _tabela_arquivo_disponivel() else [])
+    logs = []
+    for tabela in tabelas:
+        logs += (
+            db.session.query(tabela)
+            .filter(tabela.c.entidade_tipo == entidade_tipo, tabela.c.entidade_id == str(entidade_id))
+            .order_by(tabela.c.data_criacao.desc())
+            .limit(500)
+            .all()
         )
-        .order_by(AuditLog.data_criacao.desc())
-        .limit(500)
-        .all()
-    )
+    logs = sorted(logs, key=lambda log: log.data_criacao, reverse=True)[:500]
 
     return render_template(
         'auditoria/entidade.html',
@@ -128,3 +199,25 @@ def auditoria_entidade(entidade_tipo, entidade_id):
         entidade_tipo=entidade_tipo,
         entidade_id=str(entidade_id),
     )
+
+
+@auditoria.route('/auditoria/arquivar', methods=['POST'])
+def arquivar_auditoria():
+    """Executa agora a retenção do audit_log (normalmente roda sozinho uma vez por dia)."""
+    if not _require_admin():
+        return redirect(url_for('main.index'))
+
+    escritor_auditoria.descarregar()
+    try:
+        resumo = arquivar(db.engine)
+        exportadas = sum(resumo['exportadas'].values())
+        flash(
+            f"Arquivamento concluído: {resumo['movidas_arquivo']} registro(s) movidos para o arquivo, "
+            f"{exportadas} exportado(s) para arquivos mensais compactados, "
+            f"{len(resumo['particoes_removidas'])} partição(ões) removida(s).",
+            'success',
+        )
+    except Exception as e:
+        logger.error(f"[auditoria] Falha no arquivamento: {e}")
+        flash(f'Falha no arquivamento: {e}', 'danger')
+    return redirect(url_for('auditoria.listar_auditoria'))
@@ -15,6 +15,10 @@ from sqlalchemy import create_engine, text
 from urllib.parse import urlparse
 import requests
 import json
+from utils.backup_paralelo import (
+    adicionar_diretorio, backup_com_copy, despejar_postgresql, despejar_sqlite, enviar_storage,
+    extrair_arquivos, restaurar_postgresql, sincronizar_storage,
+)
 
 try:
     import psycopg2  # type: ignore
@@ -50,6 +54,9 @@ try:
 except (PermissionError, OSError):
     pass  # Ignorar erros de permissão ou sistema de arquivos somente leitura
 
+# Espelho local do Supabase Storage: entre backups só baixa o que mudou
+STORAGE_ESPELHO_DIR = os.getenv('BACKUP_STORAGE_ESPELHO_DIR') or os.path.join(BACKUP_DIR, 'storage_espelho')
+
 def _detect_database_type():
     """Detecta o tipo de banco de dados sendo usado."""
     db_url = str(db.engine.url)
@@ -61,159 +68,6 @@ def _detect_database_type():
         return 'unknown'
 
 
-def _download_supabase_storage_files(tmpdir):
-    """Baixa todos os arquivos do Supabase Storage para o backup."""
-    try:
-        logger.info("Iniciando download dos arquivos do Supabase Storage...")
-        
-        # Configurar cliente Supabase - tentar diferentes nomes de variáveis
-        supabase_url = os.getenv('SUPABASE_URL')
-        # Tentar diferentes nomes para a chave
-        supabase_key = (
-            os.getenv('SUPABASE_SERVICE_KEY') or 
-            os.getenv('SUPABASE_ANON_KEY') or 
-            os.getenv('SUPABASE_KEY')
-        )
-        bucket_name = os.getenv('SUPABASE_BUCKET', 'uploads')
-        
-        logger.info(f"Configurações Supabase:")
-        logger.info(f"  URL: {supabase_url[:50] + '...' if supabase_url else 'Não configurado'}")
-        logger.info(f"  KEY: {'Configurado' if supabase_key else 'Não configurado'}")
-        logger.info(f"  BUCKET: {bucket_name}")
-        
-        auth_key = supabase_key
-        
-        if not all([supabase_url, auth_key]):
-            logger.warning("Credenciais do Supabase Storage não encontradas. Configure SUPABASE_URL e SUPABASE_ANON_KEY (ou SUPABASE_SERVICE_KEY) no .env")
-            return
-        
-        # Criar diretório para arquivos do storage
-        storage_dir = os.path.join(tmpdir, 'supabase_storage')
-        os.makedirs(storage_dir, exist_ok=True)
-        
-        # Listar todos os arquivos no bucket
-        headers = {
-            'Authorization': f'Bearer {auth_key}',
-            'apikey': auth_key
-        }
-        
-        # Função para listar arquivos recursivamente
-        def list_files_recursive(prefix=''):
-            """Lista arquivos recursivamente no bucket"""
-            all_files = []
-            list_url = f"{supabase_url}/storage/v1/object/list/{bucket_name}"
-            
-            try:
-                response = requests.post(list_url, headers=headers, json={'prefix': prefix}, timeout=30)
-                if response.status_code == 200:
-                    items = response.json()
-                    
-                    for item in items:
-                        if item.get('name'):
-                            item_name = item['name']
-                            full_path = f"{prefix}{item_name}" if prefix else item_name
-                            
-                            # Se é um diretório (sem extensão), listar recursivamente
-                            if '.' not in item_name and not item.get('metadata'):
-                                logger.debug(f"Explorando diretório: {full_path}")
-                                sub_files = list_files_recursive(f"{full_path}/")
-                                all_files.extend(sub_files)
-                            else:
-                                # É um arquivo
-                                all_files.append({
-                                    'name': full_path,
-                                    'size': item.get('metadata', {}).get('size', 0),
-                                    'last_modified': item.get('updated_at')
-                                })
-                                
-            except Exception as e:
-                logger.error(f"Erro ao listar {prefix}: {str(e)}")
-                
-            return all_files
-        
-        # Listar todos os arquivos recursivamente
-        logger.info("Listando arquivos recursivamente...")
-        files = list_files_recursive()
-        
-        if not files:
-            logger.warning("Nenhum arquivo encontrado no Supabase Storage")
-            return
-            
-        logger.info(f"Processando {len(files)} arquivos do Supabase Storage")
-        
-        # Baixar cada arquivo
-        downloaded = 0
-        failed = 0
-        total_size = 0
-        
-        for i, file_info in enumerate(files, 1):
-            file_path = file_info['name']
-            download_url = f"{supabase_url}/storage/v1/object/public/{bucket_name}/{file_path}"
-            
-            try:
-                logger.debug(f"[{i}/{len(files)}] Baixando: {file_path}")
-                
-                # Timeout maior para arquivos grandes (até 2 minutos por arquivo)
-                file_response = requests.get(download_url, timeout=120, stream=True)
-                
-                if file_response.status_code == 200:
-                    # Criar estrutura de diretórios
-                    local_file_path = os.path.join(storage_dir, file_path)
-                    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-                    
-                    # Salvar arquivo em chunks para arquivos grandes
-                    file_size = 0
-                    with open(local_file_path, 'wb') as f:
-                        for chunk in file_response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                file_size += len(chunk)
-                    
-                    downloaded += 1
-                    total_size += file_size
-                    logger.debug(f"✓ Baixado: {file_path} ({file_size / 1024:.1f} KB)")
-                    
-                    # Log de progresso a cada 5 arquivos
-                    if downloaded % 5 == 0:
-                        logger.info(f"Progresso Supabase: {downloaded}/{len(files)} arquivos ({total_size / 1024 / 1024:.1f} MB)")
-                else:
-                    failed += 1
-                    logger.warning(f"✗ Erro HTTP {file_response.status_code} ao baixar: {file_path}")
-            except requests.exceptions.Timeout:
-                failed += 1
-                logger.error(f"✗ Timeout ao baixar: {file_path}")
-            except Exception as e:
-                failed += 1
-                logger.error(f"✗ Erro ao baixar {file_path}: {str(e)}")
-        
-        logger.info(f"Download concluído: {downloaded}/{len(files)} arquivos baixados ({total_size / 1024 / 1024:.2f} MB)")
-        
-        if failed > 0:
-            logger.warning(f"⚠️  {failed} arquivo(s) falharam no download")
-        
-        if downloaded == 0:
-            logger.warning("❌ Nenhum arquivo foi baixado com sucesso!")
-        
-        # Criar arquivo de mapeamento
-        mapping_file = os.path.join(storage_dir, 'file_mapping.json')
-        with open(mapping_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                'bucket': bucket_name,
-                'files': files,
-                'download_date': datetime.now().isoformat(),
-                'supabase_url': supabase_url,
-                'total_files': len(files),
-                'downloaded_files': downloaded,
-                'failed_files': failed,
-                'total_size_bytes': total_size
-            }, f, indent=2, ensure_ascii=False)
-        
-        logger.info(f"Arquivo de mapeamento criado: {mapping_file}")
-            
-    except Exception as e:
-        logger.error(f"Erro no download do Supabase Storage: {str(e)}")
-
-
 def _create_restore_script(tmpdir):
     """Cria script de restauração automática."""
     script_content = '''#!/usr/bin/env python3
@@ -468,47 +322,36 @@ def _get_db_connection_info():
 
 
 def _criar_zip(arquivo_destino: str, db_path: str):
-    """Gera um ZIP contendo o banco de dados e a pasta uploads."""
+    """Gera um ZIP contendo o banco de dados e a pasta uploads, gravando direto no arquivo final."""
     try:
         # Verificar se o diretório de backup existe
         backup_dir = os.path.dirname(arquivo_destino)
         if not os.path.exists(backup_dir):
             logger.info(f"Criando diretório de backup: {backup_dir}")
             os.makedirs(backup_dir, exist_ok=True)
-            
-        with tempfile.TemporaryDirectory() as tmpdir:
-            logger.info(f"Diretório temporário criado: {tmpdir}")
-            
-            # Banco
-            tmp_db = os.path.join(tmpdir, os.path.basename(db_path))
-            logger.info(f"Copiando banco de dados: {db_path} -> {tmp_db}")
-            shutil.copy2(db_path, tmp_db)
-            
+
+        with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            # Banco (snapshot consistente mesmo com o app gravando)
+            logger.info(f"Copiando banco de dados: {db_path}")
+            despejar_sqlite(zipf, db_path)
+
             # Uploads locais
             if os.path.exists(UPLOADS_DIR):
-                uploads_tmp = os.path.join(tmpdir, 'uploads')
-                logger.info(f"Copiando uploads locais: {UPLOADS_DIR} -> {uploads_tmp}")
-                shutil.copytree(UPLOADS_DIR, uploads_tmp)
+                total = adicionar_diretorio(zipf, UPLOADS_DIR, 'uploads')
+                logger.info(f"Uploads locais incluídos: {total} arquivo(s)")
             else:
                 logger.warning(f"Diretório de uploads não encontrado: {UPLOADS_DIR}")
                 # Criar diretório vazio para uploads para manter a estrutura
-                os.makedirs(os.path.join(tmpdir, 'uploads'), exist_ok=True)
-            
-            # Baixar arquivos do Supabase Storage
-            _download_supabase_storage_files(tmpdir)
-            
+                zipf.writestr('uploads/', '')
+
+            # Arquivos do Supabase Storage (incremental)
+            try:
+                sincronizar_storage(zipf, STORAGE_ESPELHO_DIR)
+            except Exception as storage_error:
+                logger.error(f"Erro no download do Supabase Storage: {storage_error}")
+
             # Criar script de restauração
-            _create_restore_script(tmpdir)
-                
-            # Compacta
-            logger.info(f"Criando arquivo ZIP: {arquivo_destino}")
-            with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(tmpdir):
-                    for f in files:
-                        abs_path = os.path.join(root, f)
-                        rel_path = os.path.relpath(abs_path, tmpdir)
-                        zipf.write(abs_path, rel_path)
-                        logger.debug(f"Adicionado ao ZIP: {rel_path}")
+            _adicionar_script_restauracao(zipf)
     except Exception as e:
         logger.error(f"Erro ao criar ZIP: {str(e)}")
         # Em ambiente serverless, tentar usar o diretório /tmp diretamente
@@ -520,6 +363,13 @@ def _criar_zip(arquivo_destino: str, db_path: str):
         raise
 
 
+def _adicionar_script_restauracao(zipf):
+    """Grava restore.py e README.md no ZIP."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        _create_restore_script(tmpdir)
+        adicionar_diretorio(zipf, tmpdir, '')
+
+
 def _criar_backup_sqlite(caminho_arquivo, db_path):
     """Cria um backup do banco de dados SQLite e da pasta uploads."""
     logger.info(f"Criando backup SQLite: {db_path} -> {caminho_arquivo}")
@@ -528,95 +378,42 @@ def _criar_backup_sqlite(caminho_arquivo, db_path):
 
 
 def _criar_backup_supabase_alternativo(arquivo_destino: str, conn_info: dict):
-    """Backup alternativo para Supabase usando SQL queries diretas + Storage."""
+    """Backup sem pg_dump: COPY por tabela em paralelo + Storage incremental, direto no ZIP."""
     try:
         # Verificar se as credenciais estão disponíveis
         if not all([conn_info.get('username'), conn_info.get('password'), conn_info.get('host')]):
             raise Exception("Credenciais do Supabase não configuradas. Configure DATABASE_URL no arquivo .env com as credenciais corretas.")
-        
-        # Conectar ao banco Supabase
-        connection_string = f"postgresql://{conn_info['username']}:{conn_info['password']}@{conn_info['host']}:{conn_info['port']}/{conn_info['database']}"
-        engine = create_engine(connection_string)
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            sql_file = os.path.join(tmpdir, 'backup_supabase.sql')
-
-            with engine.connect() as conn:
-                # Obter lista de tabelas
-                result = conn.execute(text("SELECT tablename FROM pg_tables WHERE schemaname = 'public'"))
-                tables = [row[0] for row in result.fetchall()]
-
-                with open(sql_file, 'w', encoding='utf-8') as f:
-                    f.write("-- Backup Supabase - Gerado automaticamente\n")
-                    f.write(f"-- Data: {datetime.now()}\n\n")
-
-                    for table in tables:
-                        # Dump da estrutura da tabela
-                        result = conn.execute(text(f"SELECT * FROM {table} LIMIT 0"))
-                        columns = result.keys()
-
-                        f.write(f"-- Tabela: {table}\n")
-                        f.write(f"CREATE TABLE IF NOT EXISTS {table} (\n")
-                        f.write(",\n".join([f"  {col} TEXT" for col in columns]))
-                        f.write("\n);\n\n")
-
-                        # Dump dos dados
-                        result = conn.execute(text(f"SELECT * FROM {table}"))
-                        rows = result.fetchall()
-
-                        if rows:
-                            for row in rows:
-                                values = []
-                                for value in row:
-                                    if value is None:
-                                        values.append('NULL')
-                                    elif isinstance(value, str):
-                                        # Escapar aspas simples
-                                        values.append(f"'{value.replace("'", "''")}'")
-                                    elif isinstance(value, (datetime, date, datetime_time)):
-                                        # Normalizar datas/horas para string e citar
-                                        if isinstance(value, datetime):
-                                            formatted = value.strftime('%Y-%m-%d %H:%M:%S.%f')
-                                        else:
-                                            formatted = value.isoformat()
-                                        values.append(f"'{formatted}'")
-                                    elif isinstance(value, bool):
-                                        values.append('TRUE' if value else 'FALSE')
-                                    else:
-                                        # Números e outros tipos
-                                        values.append(str(value))
-                                f.write(f"INSERT INTO {table} VALUES ({', '.join(values)});\n")
-                        f.write("\n")
-
-            # Baixar arquivos do Supabase Storage
-            _download_supabase_storage_files(tmpdir)
-            
-            # Criar script de restauração
-            _create_restore_script(tmpdir)
+        with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            manifesto = despejar_postgresql(zipf, conn_info)
+
+            # Baixar arquivos do Supabase Storage (só novos/alterados desde o último backup)
+            try:
+                sincronizar_storage(zipf, STORAGE_ESPELHO_DIR)
+            except Exception as storage_error:
+                logger.warning(f"Falha no backup do Supabase Storage: {storage_error}")
+                zipf.writestr('storage_error.txt', f"Erro no backup do Supabase Storage: {storage_error}\n")
 
             # Uploads locais (fallback)
-            if os.path.exists(UPLOADS_DIR):
-                shutil.copytree(UPLOADS_DIR, os.path.join(tmpdir, 'uploads_local'))
+            adicionar_diretorio(zipf, UPLOADS_DIR, 'uploads_local')
 
             # README explicativo
-            readme_file = os.path.join(tmpdir, 'README.md')
-            with open(readme_file, 'w', encoding='utf-8') as f:
-                f.write("# Backup Supabase\n\n")
-                f.write("Este backup foi criado usando queries SQL diretas ao invés de pg_dump.\n")
-                f.write("Para restaurar, execute o arquivo backup_supabase.sql no seu banco PostgreSQL.\n\n")
-                f.write("## Conteúdo do Backup:\n")
-                f.write("- backup_supabase.sql: Dados das tabelas\n")
-                f.write("- supabase_storage/: Arquivos do Supabase Storage\n")
-                f.write("- uploads_local/: Arquivos locais (se existirem)\n\n")
-                f.write(f"Data do backup: {datetime.now()}\n")
-
-            # Compactar
-            with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(tmpdir):
-                    for f in files:
-                        abs_path = os.path.join(root, f)
-                        rel_path = os.path.relpath(abs_path, tmpdir)
-                        zipf.write(abs_path, rel_path)
+            zipf.writestr('README.md', (
+                "# Backup Supabase\n\n"
+                "Este backup foi criado com COPY por tabela (sem pg_dump).\n"
+                "Para restaurar, use a tela de restauração do sistema ou, manualmente: execute "
+                "banco/esquema.sql, carregue cada banco/dados/<tabela>.csv com COPY ... FROM "
+                "(FORMAT csv, HEADER) e por fim execute banco/pos_carga.sql.\n\n"
+                "## Conteúdo do Backup:\n"
+                "- banco/esquema.sql: Tabelas e sequências com os tipos originais\n"
+                "- banco/dados/: Um CSV por tabela\n"
+                "- banco/pos_carga.sql: Chaves, índices, FKs e ajuste das sequências\n"
+                "- banco/manifesto.json: Tabelas, colunas e quantidade de linhas\n"
+                "- supabase_storage/: Arquivos do Supabase Storage\n"
+                "- uploads_local/: Arquivos locais (se existirem)\n\n"
+                f"Data do backup: {datetime.now()}\n"
+                f"Tabelas: {len(manifesto['tabelas'])} em {manifesto['duracao_segundos']}s\n"
+            ))
 
     except Exception as e:
         error_msg = str(e)
@@ -628,170 +425,15 @@ def _criar_backup_supabase_alternativo(arquivo_destino: str, conn_info: dict):
             raise Exception(f"Erro no backup alternativo Supabase: {error_msg}")
 
 
-def _backup_supabase_storage(tmpdir: str):
-    """Faz backup dos arquivos do Supabase Storage."""
-    import requests
-    import os
-    from models import db
-    from sqlalchemy import text
-    
-    # Obter configurações do Supabase
-    supabase_url = os.environ.get('SUPABASE_URL')
-    supabase_key = os.environ.get('SUPABASE_KEY')
-    bucket = os.environ.get('SUPABASE_BUCKET', 'uploads')
-    
-    if not all([supabase_url, supabase_key]):
-        raise Exception("Configuração do Supabase Storage não encontrada")
-    
-    # Remover barra final da URL
-    if supabase_url.endswith('/'):
-        supabase_url = supabase_url[:-1]
-    
-    # Criar diretório para arquivos do storage
-    storage_dir = os.path.join(tmpdir, 'supabase_storage')
-    os.makedirs(storage_dir, exist_ok=True)
-    
-    # Headers para autenticação
-    headers = {
-        'Authorization': f'Bearer {supabase_key}',
-        'apikey': supabase_key
-    }
-    
-    try:
-        # Listar todos os arquivos no bucket
-        list_url = f"{supabase_url}/storage/v1/object/list/{bucket}"
-        response = requests.post(list_url, headers=headers, json={})
-        
-        if response.status_code != 200:
-            raise Exception(f"Erro ao listar arquivos: {response.status_code} - {response.text}")
-        
-        files = response.json()
-        downloaded_count = 0
-        
-        for file_info in files:
-            if file_info.get('name'):
-                file_path = file_info['name']
-                
-                # URL para download do arquivo
-                download_url = f"{supabase_url}/storage/v1/object/{bucket}/{file_path}"
-                
-                try:
-                    # Fazer download do arquivo
-                    file_response = requests.get(download_url, headers=headers)
-                    
-                    if file_response.status_code == 200:
-                        # Criar estrutura de diretórios se necessário
-                        local_file_path = os.path.join(storage_dir, file_path)
-                        os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
-                        
-                        # Salvar arquivo
-                        with open(local_file_path, 'wb') as f:
-                            f.write(file_response.content)
-                        
-                        downloaded_count += 1
-                        logger.debug(f"Arquivo baixado: {file_path}")
-                    else:
-                        logger.warning(f"Erro ao baixar {file_path}: {file_response.status_code}")
-                        
-                except Exception as e:
-                    logger.warning(f"Erro ao processar arquivo {file_path}: {e}")
-        
-        # Criar arquivo de log do backup
-        with open(os.path.join(storage_dir, 'backup_info.txt'), 'w') as f:
-            f.write(f"Backup do Supabase Storage\n")
-            f.write(f"Data: {datetime.now()}\n")
-            f.write(f"Bucket: {bucket}\n")
-            f.write(f"Arquivos baixados: {downloaded_count}\n")
-            f.write(f"Total de arquivos listados: {len(files)}\n")
-        
-        logger.info(f"Backup do Supabase Storage concluído: {downloaded_count} arquivos")
-        
-    except Exception as e:
-        raise Exception(f"Erro no backup do Supabase Storage: {str(e)}")
-
-
-def _restaurar_supabase_storage(tmpdir: str):
-    """Restaura arquivos do Supabase Storage a partir do backup."""
-    import requests
-    import os
-    
-    storage_dir = os.path.join(tmpdir, 'supabase_storage')
-    
-    if not os.path.exists(storage_dir):
-        logger.info("Nenhum backup do Supabase Storage encontrado")
-        return
-    
-    # Obter configurações do Supabase
-    supabase_url = os.environ.get('SUPABASE_URL')
-    supabase_key = os.environ.get('SUPABASE_KEY')
-    bucket = os.environ.get('SUPABASE_BUCKET', 'uploads')
-    
-    if not all([supabase_url, supabase_key]):
-        logger.warning("Configuração do Supabase Storage não encontrada para restauração")
-        return
-    
-    # Remover barra final da URL
-    if supabase_url.endswith('/'):
-        supabase_url = supabase_url[:-1]
-    
-    # Headers para autenticação
-    headers = {
-        'Authorization': f'Bearer {supabase_key}',
-        'apikey': supabase_key
-    }
-    
-    uploaded_count = 0
-    
-    # Percorrer todos os arquivos do backup
-    for root, dirs, files in os.walk(storage_dir):
-        for file_name in files:
-            if file_name == 'backup_info.txt':
-                continue
-                
-            local_file_path = os.path.join(root, file_name)
-            # Calcular caminho relativo no storage
-            rel_path = os.path.relpath(local_file_path, storage_dir)
-            storage_path = rel_path.replace('\\', '/')  # Normalizar para URL
-            
-            try:
-                # URL de upload
-                upload_url = f"{supabase_url}/storage/v1/object/{bucket}/{storage_path}"
-                
-                # Ler arquivo
-                with open(local_file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # Fazer upload
-                files_data = {
-                    'file': (file_name, file_content, 'application/octet-stream')
-                }
-                
-                response = requests.post(upload_url, headers=headers, files=files_data)
-                
-                if response.status_code in [200, 201]:
-                    uploaded_count += 1
-                    logger.debug(f"Arquivo restaurado: {storage_path}")
-                else:
-                    logger.warning(f"Erro ao restaurar {storage_path}: {response.status_code} - {response.text}")
-                    
-            except Exception as e:
-                logger.warning(f"Erro ao processar arquivo {storage_path}: {e}")
-    
-    logger.info(f"Restauração do Supabase Storage concluída: {uploaded_count} arquivos")
-
-
 def _criar_backup_postgresql(arquivo_destino: str, conn_info: dict):
     """Cria backup do PostgreSQL usando pg_dump ou método alternativo."""
     try:
         # Primeiro tentar pg_dump
         _criar_backup_postgresql_pg_dump(arquivo_destino, conn_info)
     except Exception as e:
-        if "pg_dump" in str(e) and ("not found" in str(e) or "não encontrado" in str(e)):
-            # Fallback para método alternativo
-            print("pg_dump não encontrado, usando método alternativo...")
-            _criar_backup_supabase_alternativo(arquivo_destino, conn_info)
-        else:
-            raise
+        # pg_dump ausente, de versão diferente do servidor ou em timeout: backup via COPY
+        logger.warning(f"pg_dump indisponível ({e}); usando backup via COPY...")
+        _criar_backup_supabase_alternativo(arquivo_destino, conn_info)
 
 
 def _criar_backup_postgresql_pg_dump(arquivo_destino: str, conn_info: dict):
@@ -826,40 +468,33 @@ def _criar_backup_postgresql_pg_dump(arquivo_destino: str, conn_info: dict):
                     raise Exception("pg_dump não encontrado. Para Supabase, considere usar o painel de administração do Supabase para backups, ou instalar PostgreSQL client tools.")
                 raise Exception(f"pg_dump falhou: {result.stderr}")
 
-            # Uploads locais (usar uploads_local para casar com a restauração)
-            if os.path.exists(UPLOADS_DIR):
-                shutil.copytree(UPLOADS_DIR, os.path.join(tmpdir, 'uploads_local'))
+            with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                # Dump custom já é comprimido
+                zipf.write(sql_file, 'backup.sql', compress_type=zipfile.ZIP_STORED)
 
-            # Incluir arquivos do Supabase Storage no pacote de backup (best effort)
-            try:
-                _backup_supabase_storage(tmpdir)
-            except Exception as storage_error:
-                logger.warning(f"Falha no backup do Supabase Storage (pg_dump path): {storage_error}")
-                # Registrar aviso no pacote
-                with open(os.path.join(tmpdir, 'storage_error.txt'), 'w', encoding='utf-8') as f:
-                    f.write(f"Erro no backup do Supabase Storage: {storage_error}\n")
-                    f.write("Apenas dados do banco foram salvos para o storage.\n")
-
-            # Adicionar README com instruções
-            readme_file = os.path.join(tmpdir, 'README.md')
-            try:
-                with open(readme_file, 'w', encoding='utf-8') as f:
-                    f.write("# Backup PostgreSQL (pg_dump)\n\n")
-                    f.write("Este backup foi criado com pg_dump.\n\n")
-                    f.write("## Conteúdo:\n")
-                    f.write("- backup.sql: Dump do banco via pg_dump (formato custom em arquivo)\n")
-                    f.write("- supabase_storage/: Arquivos do Supabase Storage (se configurado)\n")
-                    f.write("- uploads_local/: Uploads locais (se existirem)\n")
-            except Exception:
-                pass
+                # Uploads locais (usar uploads_local para casar com a restauração)
+                adicionar_diretorio(zipf, UPLOADS_DIR, 'uploads_local')
 
-            # Compacta tudo em ZIP
-            with zipfile.ZipFile(arquivo_destino, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(tmpdir):
-                    for f in files:
-                        abs_path = os.path.join(root, f)
-                        rel_path = os.path.relpath(abs_path, tmpdir)
-                        zipf.write(abs_path, rel_path)
+                # Incluir arquivos do Supabase Storage no pacote de backup (best effort, incremental)
+                try:
+                    sincronizar_storage(zipf, STORAGE_ESPELHO_DIR)
+                except Exception as storage_error:
+                    logger.warning(f"Falha no backup do Supabase Storage (pg_dump path): {storage_error}")
+                    # Registrar aviso no pacote
+                    zipf.writestr('storage_error.txt', (
+                        f"Erro no backup do Supabase Storage: {storage_error}\n"
+                        "Apenas dados do banco foram salvos para o storage.\n"
+                    ))
+
+                # Adicionar README com instruções
+                zipf.writestr('README.md', (
+                    "# Backup PostgreSQL (pg_dump)\n\n"
+                    "Este backup foi criado com pg_dump.\n\n"
+                    "## Conteúdo:\n"
+                    "- backup.sql: Dump do banco via pg_dump (formato custom em arquivo)\n"
+                    "- supabase_storage/: Arquivos do Supabase Storage (se configurado)\n"
+                    "- uploads_local/: Uploads locais (se existirem)\n"
+                ))
 
         except subprocess.TimeoutExpired:
             raise Exception("Timeout ao criar backup do PostgreSQL")
@@ -873,7 +508,10 @@ def _criar_backup_postgresql_pg_dump(arquivo_destino: str, conn_info: dict):
 
 
 def _restaurar_backup_postgresql(caminho_backup: str, conn_info: dict):
-    """Restaura backup do PostgreSQL usando pg_restore."""
+    """Restaura backup do PostgreSQL usando pg_restore (ou a carga via COPY, para backups nesse formato)."""
+    if backup_com_copy(caminho_backup):
+        return _restaurar_backup_copy(caminho_backup, conn_info)
+
     with tempfile.TemporaryDirectory() as tmpdir:
         # Extrai o backup
         with zipfile.ZipFile(caminho_backup, 'r') as zipf:
@@ -947,12 +585,68 @@ def _restaurar_backup_postgresql(caminho_backup: str, conn_info: dict):
                 shutil.copytree(uploads_local_dir, UPLOADS_DIR)
                 print(f"Uploads locais restaurados para {UPLOADS_DIR}")
 
+            _pos_restauracao()
             return "Backup PostgreSQL restaurado com sucesso!"
         except subprocess.TimeoutExpired:
             raise Exception("Timeout ao restaurar backup do PostgreSQL")
         except FileNotFoundError:
             # Fallback: restauração manual usando SQLAlchemy
-            return _restaurar_backup_supabase_manual(sql_file, conn_info)
+            resultado = _restaurar_backup_supabase_manual(sql_file, conn_info)
+            _pos_restauracao()
+            return resultado
+
+
+def _restaurar_backup_copy(caminho_backup: str, conn_info: dict):
+    """Restaura backup gerado via COPY: carga paralela do banco direto do ZIP + arquivos."""
+    resultado = restaurar_postgresql(caminho_backup, conn_info)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        extrair_arquivos(caminho_backup, tmpdir)
+
+        try:
+            _restaurar_supabase_storage(tmpdir)
+        except Exception as storage_error:
+            logger.warning(f"Erro ao restaurar Supabase Storage: {storage_error}")
+
+        uploads_local_dir = os.path.join(tmpdir, 'uploads_local')
+        if os.path.exists(uploads_local_dir):
+            if os.path.exists(UPLOADS_DIR):
+                shutil.rmtree(UPLOADS_DIR)
+            shutil.copytree(uploads_local_dir, UPLOADS_DIR)
+            logger.info(f"Uploads locais restaurados para {UPLOADS_DIR}")
+
+    _pos_restauracao()
+    mensagem = (f"Backup PostgreSQL restaurado com sucesso! {resultado['tabelas']} tabelas, "
+                f"{resultado['linhas']} linhas em {resultado['duracao_segundos']}s.")
+    if resultado['avisos']:
+        mensagem += f" {len(resultado['avisos'])} aviso(s) em índices/restrições (ver log)."
+    return mensagem
+
+
+def _pos_restauracao():
+    """Refaz o que a carga em massa não atualiza: resumo de apontamentos e índices de busca."""
+    try:
+        # Conexões do pool apontam para tabelas que foram recriadas
+        db.session.remove()
+        db.engine.dispose()
+    except Exception:
+        pass
+
+    try:
+        from sqlalchemy import inspect as sa_inspect
+        from utils.resumo_apontamentos import reconstruir
+        with db.engine.begin() as conn:
+            if sa_inspect(conn).has_table('apontamento_resumo'):
+                total = reconstruir(conn)
+                logger.info(f"Resumo de apontamentos reconstruído: {total} combinações")
+    except Exception as e:
+        logger.warning(f"Não foi possível reconstruir o resumo de apontamentos: {e}")
+
+    try:
+        from migrations.add_busca_indices import upgrade as criar_indices_busca
+        criar_indices_busca(db.engine, recriar=True)
+    except Exception as e:
+        logger.warning(f"Não foi possível recriar os índices de busca: {e}")
 
 
 def _restaurar_backup_supabase_manual(sql_file: str, conn_info: dict):
@@ -1013,29 +707,39 @@ def _restaurar_backup_completo(caminho_backup: str):
         with tempfile.TemporaryDirectory() as tmpdir:
             logger.info(f"Extraindo backup para: {tmpdir}")
             
-            # 1. Extrair ZIP
-            with zipfile.ZipFile(caminho_backup, 'r') as zipf:
-                zipf.extractall(tmpdir)
+            db_type = _detect_database_type()
+            formato_copy = db_type == 'postgresql' and backup_com_copy(caminho_backup)
+
+            # 1. Extrair ZIP (no formato COPY os dados são lidos direto do ZIP)
+            if formato_copy:
+                extrair_arquivos(caminho_backup, tmpdir)
+            else:
+                with zipfile.ZipFile(caminho_backup, 'r') as zipf:
+                    zipf.extractall(tmpdir)
             
             # Listar conteúdo extraído
             extracted_files = os.listdir(tmpdir)
             logger.info(f"Arquivos extraídos: {extracted_files}")
             
-            # 2. LIMPAR BANCO DE DADOS ATUAL
-            logger.info("Limpando banco de dados atual...")
-            db_type = _detect_database_type()
-            
-            if db_type == 'postgresql':
-                _limpar_banco_postgresql()
+            if formato_copy:
+                # 2+3. Recria o esquema e carrega as tabelas em paralelo
+                logger.info("Restaurando banco de dados (carga via COPY)...")
+                restaurar_postgresql(caminho_backup, _get_db_connection_info())
             else:
-                _limpar_banco_sqlite()
-            
-            # 3. RESTAURAR BANCO DE DADOS
-            logger.info("Restaurando banco de dados...")
-            if db_type == 'postgresql':
-                _restaurar_banco_postgresql(tmpdir)
-            else:
-                _restaurar_banco_sqlite_completo(tmpdir)
+                # 2. LIMPAR BANCO DE DADOS ATUAL
+                logger.info("Limpando banco de dados atual...")
+                if db_type == 'postgresql':
+                    _limpar_banco_postgresql()
+                else:
+                    _limpar_banco_sqlite()
+
+                # 3. RESTAURAR BANCO DE DADOS
+                logger.info("Restaurando banco de dados...")
+                if db_type == 'postgresql':
+                    _restaurar_banco_postgresql(tmpdir)
+                else:
+                    _restaurar_banco_sqlite_completo(tmpdir)
+            _pos_restauracao()
             
             # 4. LIMPAR E RESTAURAR UPLOADS LOCAIS
             logger.info("Restaurando uploads locais...")
@@ -1129,37 +833,20 @@ def _limpar_banco_postgresql():
                     if tables:
                         logger.info(f"Removendo {len(tables)} tabelas manualmente...")
                         
-                        # Remover foreign keys primeiro
+                        # Remover tabelas (um único DROP; o CASCADE leva as FKs junto)
                         conn.execute(text(
-                            "DO $$ DECLARE r RECORD; BEGIN "
-                            "FOR r IN (SELECT constraint_name, table_name FROM information_schema.table_constraints "
-                            "WHERE constraint_type = 'FOREIGN KEY' AND table_schema = 'public') LOOP "
-                            "EXECUTE 'ALTER TABLE ' || r.table_name || ' DROP CONSTRAINT IF EXISTS ' || r.constraint_name || ' CASCADE'; "
-                            "END LOOP; END $$"
+                            "DROP TABLE IF EXISTS " + ", ".join(f'"{table}"' for table in tables) + " CASCADE"
                         ))
-                        
-                        # Remover tabelas
-                        for table in tables:
-                            try:
-                                conn.execute(text(f"DROP TABLE IF EXISTS {table} CASCADE"))
-                            except Exception as te:
-                                logger.debug(f"Erro ao remover {table}: {str(te)[:50]}")
-                        
                         logger.info(f"✅ {len(tables)} tabelas processadas")
                     
-                    # Limpar sequences, views, functions, etc.
-                    cleanup_commands = [
-                        "DROP SEQUENCE IF EXISTS seq CASCADE" for seq in 
-                        [row[0] for row in conn.execute(text(
-                            "SELECT sequence_name FROM information_schema.sequences WHERE sequence_schema = 'public'"
-                        )).fetchall()]
-                    ]
-                    
-                    for cmd in cleanup_commands:
-                        try:
-                            conn.execute(text(cmd))
-                        except Exception as ce:
-                            logger.debug(f"Erro cleanup: {str(ce)[:50]}")
+                    # Limpar sequences restantes
+                    sequences = [row[0] for row in conn.execute(text(
+                        "SELECT sequence_name FROM information_schema.sequences WHERE sequence_schema = 'public'"
+                    )).fetchall()]
+                    if sequences:
+                        conn.execute(text(
+                            "DROP SEQUENCE IF EXISTS " + ", ".join(f'"{seq}"' for seq in sequences) + " CASCADE"
+                        ))
                     
                     logger.info("✅ Limpeza de fallback concluída")
                     
@@ -1422,101 +1109,16 @@ def _restaurar_supabase_storage(tmpdir):
             logger.error(f"❌ Erro de conectividade com Supabase: {str(e)}")
             return False
         
-        # Upload de cada arquivo
-        uploaded = 0
-        failed = 0
-        total_files = len(mapping.get('files', []))
-        
+        # Upload em paralelo (upsert: arquivo existente é sobrescrito)
+        nomes = [file_info['name'] for file_info in mapping.get('files', []) if file_info.get('name')]
+        total_files = len(nomes)
         logger.info(f"📤 Iniciando upload de {total_files} arquivos...")
-        
-        for i, file_info in enumerate(mapping.get('files', [])):
-            if file_info.get('name'):
-                file_path = file_info['name']
-                local_file = os.path.join(storage_dir, file_path)
-                
-                if os.path.exists(local_file):
-                    try:
-                        with open(local_file, 'rb') as f:
-                            files = {'file': f}
-                            upload_url = f"{supabase_url}/storage/v1/object/{bucket_name}/{file_path}"
-                            
 
-                            # Tentar upload com retry e tratamento de duplicatas
-                            max_retries = 3
-                            retry_count = 0
-                            upload_success = False
-                            
-                            while retry_count < max_retries and not upload_success:
-                                try:
-                                    response = requests.post(upload_url, headers=headers, files=files, timeout=60)
-                                    
-                                    if response.status_code in [200, 201]:
-                                        uploaded += 1
-                                        upload_success = True
-                                        if uploaded % 5 == 0 or uploaded == total_files:
-                                            logger.info(f"📤 Progresso: {uploaded}/{total_files} arquivos ({(uploaded/total_files)*100:.1f}%)")
-                                    
-                                    elif response.status_code == 409:  # Conflict - arquivo já existe
-                                        logger.debug(f"📄 Arquivo já existe: {file_path}")
-                                        # Tentar atualizar o arquivo existente
-                                        update_url = f"{supabase_url}/storage/v1/object/{bucket_name}/{file_path}"
-                                        update_response = requests.put(update_url, headers=headers, files={'file': f}, timeout=60)
-                                        
-                                        if update_response.status_code in [200, 201]:
-                                            uploaded += 1
-                                            upload_success = True
-                                            logger.debug(f"🔄 Arquivo atualizado: {file_path}")
-                                        else:
-                                            logger.debug(f"⚠️ Falha ao atualizar {file_path}: {update_response.status_code}")
-                                            # Considerar como sucesso se o arquivo já existe
-                                            uploaded += 1
-                                            upload_success = True
-                                    
-                                    elif response.status_code in [429, 503, 502, 504]:  # Rate limit ou server error
-                                        retry_count += 1
-                                        if retry_count < max_retries:
-                                            wait_time = 2 ** retry_count  # Exponential backoff
-                                            logger.debug(f"⏳ Rate limit/Server error, aguardando {wait_time}s... (tentativa {retry_count}/{max_retries})")
-                                            time.sleep(wait_time)
-                                            # Reabrir arquivo para nova tentativa
-                                            f.seek(0)
-                                        else:
-                                            failed += 1
-                                            logger.warning(f"❌ Falha após {max_retries} tentativas para {file_path}: HTTP {response.status_code}")
-                                    
-                                    else:
-                                        failed += 1
-                                        upload_success = True  # Para não tentar novamente
-                                        logger.warning(f"❌ Erro ao enviar {file_path}: HTTP {response.status_code}")
-                                        if response.text:
-                                            logger.debug(f"   Resposta: {response.text[:100]}")
-                                
-                                except requests.exceptions.Timeout:
-                                    retry_count += 1
-                                    if retry_count < max_retries:
-                                        logger.debug(f"⏰ Timeout, tentando novamente... ({retry_count}/{max_retries})")
-                                        f.seek(0)
-                                    else:
-                                        failed += 1
-                                        logger.warning(f"❌ Timeout após {max_retries} tentativas: {file_path}")
-                                        upload_success = True
-                                
-                                except Exception as upload_error:
-                                    retry_count += 1
-                                    if retry_count < max_retries:
-                                        logger.debug(f"🔄 Erro de upload, tentando novamente: {str(upload_error)[:50]}")
-                                        f.seek(0)
-                                    else:
-                                        failed += 1
-                                        logger.error(f"❌ Erro após {max_retries} tentativas para {file_path}: {str(upload_error)[:100]}")
-                                        upload_success = True
-                    except Exception as e:
-                        failed += 1
-                        logger.error(f"❌ Erro ao processar {file_path}: {str(e)}")
-                else:
-                    failed += 1
-                    logger.warning(f"❌ Arquivo local não encontrado: {file_path}")
-        
+        def _progresso_storage(etapa, feitos, total, _):
+            logger.info(f"📤 Progresso: {feitos}/{total} arquivos ({(feitos/total)*100:.1f}%)")
+
+        uploaded, failed = enviar_storage(storage_dir, nomes, supabase_url, supabase_key, bucket_name, _progresso_storage)
+
         # Relatório final
         success_rate = (uploaded / total_files * 100) if total_files > 0 else 0
         logger.info(f"📊 Restauração do Storage concluída:")
@@ -1540,6 +1142,7 @@ def _restaurar_backup_sqlite(caminho_backup: str, db_path: str):
         # Restaura DB
         extracted_db = os.path.join(tmpdir, os.path.basename(db_path))
         shutil.copy2(extracted_db, db_path)
+        _pos_restauracao()
         # Restaura uploads
         extracted_uploads = os.path.join(tmpdir, 'uploads')
         if os.path.exists(extracted_uploads):
@@ -1934,15 +1537,18 @@ def criar_backup_automatico():
         nome_arquivo = f"backup_auto_{timestamp}.zip"
         caminho_arquivo = os.path.join(BACKUP_DIR, nome_arquivo)
         
-        # Obter caminho do banco de dados atual
-        db_uri = db.engine.url.database
-        if db_uri.startswith('/'):
-            db_path = db_uri
+        if _detect_database_type() == 'postgresql':
+            _criar_backup_postgresql(caminho_arquivo, _get_db_connection_info())
         else:
-            db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), db_uri)
-        
-        # Criar arquivo ZIP contendo banco de dados e uploads
-        _criar_zip(caminho_arquivo, db_path)
+            # Obter caminho do banco de dados atual
+            db_uri = db.engine.url.database
+            if db_uri.startswith('/'):
+                db_path = db_uri
+            else:
+                db_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), db_uri)
+
+            # Criar arquivo ZIP contendo banco de dados e uploads
+            _criar_zip(caminho_arquivo, db_path)
         
         # Registrar backup no banco de dados
         tamanho = os.path.getsize(caminho_arquivo)
@@ -0,0 +1,65 @@
+from flask import Blueprint, request, jsonify, session, url_for
+import logging
+
+from utils.busca import buscar, FONTES
+
+logger = logging.getLogger(__name__)
+
+busca_bp = Blueprint('busca', __name__)
+
+# Permissão de sessão exigida por tipo de resultado (admin vê tudo)
+PERMISSOES_TIPO = {
+    'item': ('acesso_cadastros', 'acesso_kanban', 'acesso_estoque', 'acesso_pedidos'),
+    'pedido': ('acesso_pedidos',),
+    'os': ('acesso_pedidos', 'acesso_kanban'),
+    'orcamento': ('acesso_valores_itens',),
+}
+
+
+def _tipos_permitidos():
+    if session.get('usuario_nivel') == 'admin':
+        return list(FONTES)
+    return [tipo for tipo, flags in PERMISSOES_TIPO.items() if any(session.get(f) for f in flags)]
+
+
+def _url_resultado(resultado):
+    rotas = {
+        'item': ('itens.visualizar_item', 'item_id'),
+        'pedido': ('pedidos.editar_pedido', 'pedido_id'),
+        'os': ('ordens.visualizar_ordem_servico', 'ordem_id'),
+        'orcamento': ('orcamentos.visualizar', 'orcamento_id'),
+    }
+    endpoint, parametro = rotas[resultado['tipo']]
+    try:
+        return url_for(endpoint, **{parametro: resultado['id']})
+    except Exception:
+        return None
+
+
+@busca_bp.route('/api/busca')
+def api_busca():
+    """
+    Busca única para typeahead e leitor de código de barras.
+
+    ``?q=ACB-0012&tipos=item,os&limite=20``. Resultados de todos os tipos
+    ranqueados juntos: código exato, prefixo de código, trecho de código,
+    depois nome. Tipos sem permissão do usuário são ignorados.
+    """
+    q = (request.args.get('q') or '').strip()
+    if not q:
+        return jsonify({'success': True, 'resultados': []})
+
+    permitidos = _tipos_permitidos()
+    pedidos = [t.strip() for t in (request.args.get('tipos') or '').split(',') if t.strip()]
+    tipos = [t for t in (pedidos or permitidos) if t in permitidos]
+    limite = max(1, min(request.args.get('limite', 20, type=int) or 20, 100))
+
+    try:
+        resultados = buscar(q, tipos=tipos, limite=limite)
+    except Exception as e:
+        logger.error(f"Erro na busca: {str(e)}")
+        return jsonify({'success': False, 'message': 'Erro ao buscar'}), 500
+
+    for r in resultados:
+        r['url'] = _url_resultado(r)
+    return jsonify({'success': True, 'resultados': resultados})
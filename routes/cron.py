@@ -0,0 +1,70 @@
+"""
+Rotinas periódicas disparadas de fora (Vercel Cron, ver ``crons`` no vercel.json)
+
+Em serverless não há thread de fundo viva entre invocações: a caixa de saída
+de notificações, a poda do log do Kanban, as OS pendentes do resumo de
+apontamentos e o arquivamento da auditoria dependem desta rota para andar.
+Com workers contínuos (gunicorn) ela só adianta o que as threads já fazem.
+
+O agendamento de minuto em minuto exige plano Pro da Vercel (no Hobby o cron
+roda no máximo uma vez por dia). A Vercel chama com
+``Authorization: Bearer $CRON_SECRET``. Sem ``CRON_SECRET``
+configurado, só um administrador logado consegue disparar manualmente.
+"""
+import hmac
+import logging
+import os
+import time
+
+from flask import Blueprint, jsonify, request, session
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+cron_bp = Blueprint('cron', __name__)
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.getenv(nome, padrao))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _autorizado():
+    segredo = os.getenv('CRON_SECRET', '')
+    if segredo:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {segredo}')
+    return session.get('usuario_nivel') == 'admin'
+
+
+def _executar(resultado, nome, funcao):
+    try:
+        resultado[nome] = funcao()
+    except Exception as e:
+        logger.warning(f"[cron] Falha em {nome}: {e}")
+        resultado[nome] = {'erro': str(e)[:200]}
+
+
+@cron_bp.route('/cron/manutencao')
+def manutencao():
+    """Esvazia a fila de notificações e roda as manutenções que dependem de thread de fundo"""
+    if not _autorizado():
+        return jsonify({'success': False, 'error': 'Não autorizado'}), 401
+
+    from notificacoes.fila import processar_pendentes
+    from utils import kanban_changelog, resumo_apontamentos
+    from utils.auditoria_arquivo import executar_se_devido
+
+    inicio = time.time()
+    limite = _env_int('CRON_NOTIFICACOES_LIMITE', 200)
+    # Deixa folga para as demais rotinas dentro do tempo máximo da função
+    prazo_s = _env_int('CRON_NOTIFICACOES_PRAZO_S', 20)
+    resultado = {}
+    _executar(resultado, 'notificacoes_enviadas', lambda: processar_pendentes(limite=limite, prazo_s=prazo_s))
+    _executar(resultado, 'kanban_log_podadas', lambda: kanban_changelog.podar(db.engine))
+    _executar(resultado, 'resumo_os_reconstruidas', lambda: resumo_apontamentos.reconciliar(db.engine))
+    _executar(resultado, 'auditoria_arquivamento', lambda: executar_se_devido(db.engine))
+    resultado.update(success=True, duracao_ms=round((time.time() - inicio) * 1000, 1))
+    return jsonify(resultado)
@@ -7,11 +7,16 @@ from flask import Blueprint, render_template, jsonify, request, session, redirec
 from models import db, ApontamentoProducao, KanbanLista, OrdemServico, Item, Trabalho, Usuario, PedidoOrdemServico, Pedido, ItemTrabalho
 from sqlalchemy.orm import joinedload
 from datetime import datetime, timedelta
+from utils.cache_manager import cache, cached, make_key
 import logging
 import json
 
 logger = logging.getLogger(__name__)
 
+# Timeline do dia corrente muda a cada apontamento; dias anteriores quase nunca
+TTL_TIMELINE_HOJE_S = 60
+TTL_TIMELINE_PASSADO_S = 3600
+
 dashboard_apontamentos_bp = Blueprint('dashboard_apontamentos', __name__, url_prefix='/dashboard/apontamentos')
 
 
@@ -312,7 +317,7 @@ def _get_primeira_os_atual_lista(lista):
         'os_numero': ordem.numero or str(ordem.id),
         'item_codigo': item.codigo_acb if item else 'N/A',
         'item_nome': item.nome if item else (pedido.nome_item if pedido else 'N/A'),
-        'item_imagem_path': item.imagem_path if item else None,
+        'item_imagem_path': item.imagem_thumb_path if item else None,
         'cliente': cliente.nome if cliente else 'N/A',
         'servico': ', '.join(servicos[:3]) if servicos else 'N/A',
         'pecas_feitas': 0,
@@ -338,6 +343,38 @@ def _get_primeira_os_atual_lista(lista):
     }
 
 
+def _tags_lista(lista_nome):
+    return ['dashboard', f'lista:{lista_nome}']
+
+
+def invalidar_cache_dashboard(*listas):
+    """Após gravar apontamentos: descarta timeline/OS atual das listas (todas se nenhuma for informada)"""
+    listas = [l for l in listas if l]
+    if listas:
+        cache.invalidate_tags(*[f'lista:{nome}' for nome in listas])
+    else:
+        cache.invalidate_tags('dashboard')
+
+
+def _timeline_lista_em_cache(lista, data_str, data_inicio, data_fim):
+    hoje = data_str == datetime.now().strftime('%Y-%m-%d')
+    return cache.get_or_set(
+        make_key('dashboard:timeline', lista.id, data_str),
+        lambda: _calcular_timeline_lista(lista.id, data_inicio, data_fim),
+        # Sem Redis a invalidação só limpa o worker que gravou: nos outros o dia
+        # passado editado ficaria velho por uma hora, então vale o TTL curto
+        ttl=TTL_TIMELINE_PASSADO_S if cache.compartilhado and not hoje else TTL_TIMELINE_HOJE_S,
+        tags=_tags_lista(lista.nome),
+    )
+
+
+@cached('dashboard:primeira_os', ttl=TTL_TIMELINE_HOJE_S,
+        tags=lambda lista_id, lista_nome: _tags_lista(lista_nome) + ['kanban:quadro'])
+def _primeira_os_lista_em_cache(lista_id, lista_nome):
+    lista = KanbanLista.query.get(lista_id)
+    return _get_primeira_os_atual_lista(lista) if lista else None
+
+
 @dashboard_apontamentos_bp.route('/')
 def index():
     """Página principal do dashboard de apontamentos"""
@@ -415,7 +452,7 @@ def timeline():
             if not lista:
                 continue
             
-            timeline_lista = _calcular_timeline_lista(lista_id, data_inicio, data_fim)
+            timeline_lista = _timeline_lista_em_cache(lista, data_str, data_inicio, data_fim)
             resumo = _calcular_resumo_dia(timeline_lista)
             for chave in resumo_geral:
                 resumo_geral[chave] += resumo.get(chave, 0)
@@ -426,7 +463,7 @@ def timeline():
                 'lista_cor': lista.cor,
                 'timeline': timeline_lista,
                 'resumo_dia': resumo,
-                'primeira_os_atual': _get_primeira_os_atual_lista(lista)
+                'primeira_os_atual': _primeira_os_lista_em_cache(lista.id, lista.nome)
             })
         
         return jsonify({
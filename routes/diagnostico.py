@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, jsonify, session
+from flask import Blueprint, render_template, jsonify, session, request, redirect, url_for, flash
 from functools import wraps
 import time
 import os
@@ -27,6 +27,17 @@ def require_login(f):
     return decorated_function
 
 
+def require_admin(f):
+    """Decorator para páginas de diagnóstico restritas a administradores"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('usuario_nivel') != 'admin':
+            flash('Você não tem permissão para acessar esta página', 'danger')
+            return redirect(url_for('main.index'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
 @diagnostico_bp.route('/diagnostico')
 @require_login
 def index():
@@ -229,9 +240,12 @@ def test_database():
 @require_login
 def test_storage():
     """Testa acesso ao Supabase Storage"""
+    from utils.storage import get_stats as stats_cache_storage
+
     results = {
         'timestamp': datetime.now().isoformat(),
-        'tests': []
+        'tests': [],
+        'cache_local': stats_cache_storage(),
     }
     
     supabase_url = os.getenv('SUPABASE_URL')
@@ -453,3 +467,67 @@ def system_info():
     }
     
     return jsonify(info)
+
+
+@diagnostico_bp.route('/diagnostico/sql')
+@require_login
+@require_admin
+def perfis_sql():
+    """Perfis SQL por requisição: queries por endpoint, N+1 e queries lentas"""
+    from utils.query_monitor import query_monitor
+    from utils.consultor_indices import ultimo_relatorio
+
+    endpoint = (request.args.get('rota') or '').strip()
+    dados = query_monitor.get_perfis()
+    recentes = dados['recentes']
+    if endpoint:
+        recentes = [p for p in recentes if p['endpoint'] == endpoint]
+
+    if request.args.get('formato') == 'json':
+        return jsonify({**dados, 'recentes': recentes[:100], 'global': query_monitor.get_stats()})
+
+    return render_template(
+        'diagnostico/sql.html',
+        por_endpoint=dados['por_endpoint'],
+        recentes=recentes[:100],
+        orcamentos_excedidos=dados['orcamentos_excedidos'],
+        stats_globais=query_monitor.get_stats(),
+        endpoint=endpoint,
+        indices=ultimo_relatorio(),
+    )
+
+
+@diagnostico_bp.route('/diagnostico/notificacoes')
+@require_login
+@require_admin
+def fila_notificacoes():
+    """Profundidade da caixa de saída de notificações, contadores dos workers e tempos do monitoramento"""
+    from notificacoes.fila import get_stats as stats_fila_notificacoes
+    from notificacoes.monitoramento import get_stats as stats_monitoramento
+    return jsonify({**stats_fila_notificacoes(), 'monitoramento': stats_monitoramento()})
+
+
+@diagnostico_bp.route('/diagnostico/indices')
+@require_login
+@require_admin
+def consultor_indices():
+    """Reavalia os formatos de consulta dos caminhos quentes contra os índices do banco"""
+    from models import db
+    from utils.consultor_indices import analisar_indices
+
+    try:
+        return jsonify(analisar_indices(db.engine))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@diagnostico_bp.route('/diagnostico/sql/limpar', methods=['POST'])
+@require_login
+@require_admin
+def limpar_perfis_sql():
+    """Zera as estatísticas do profiler"""
+    from utils.query_monitor import query_monitor
+
+    query_monitor.reset_stats()
+    flash('Estatísticas de SQL zeradas', 'success')
+    return redirect(url_for('diagnostico.perfis_sql'))
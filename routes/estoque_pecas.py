@@ -5,12 +5,17 @@ import unicodedata
 from datetime import date, datetime
 
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session
-from sqlalchemy import or_
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.orm import contains_eager
 from sqlalchemy.exc import ProgrammingError
-from openpyxl import load_workbook
 
 from models import db, EstoquePecas, Item, MovimentacaoEstoquePecas, EstoquePecasSlotTemp, Usuario
 from utils import validate_form_data, generate_next_code, get_file_url
+from utils.busca import buscar_ids
+from utils.listagem import Listagem, CursorInvalido, responder_pagina, filtro_texto, filtro_ids, PRIMEIRA_PAGINA_LISTAGEM
+from utils.importacao_excel import (
+    PlanilhaInvalida, ler_planilha, em_lotes, salvar_linhas, carregar_linhas, marcar_confirmadas, registrar_auditoria,
+)
 
 estoque_pecas = Blueprint('estoque_pecas', __name__)
 
@@ -135,10 +140,6 @@ def _canonical_estoque_excel_column(header: str) -> str:
     return h
 
 
-def _get_pending_import_rows():
-    return session.get('import_estoque_excel_rows') or []
-
-
 def _build_import_print_context(rows):
     existentes = [r for r in rows if not r.get('criar_item')]
     novos = [r for r in rows if r.get('criar_item')]
@@ -152,8 +153,8 @@ def _build_import_print_context(rows):
     }
 
 
-def _next_import_preview_code(counter):
-    base = generate_next_code(Item, 'ACB', 'codigo_acb')
+def _codigo_deslocado(base, counter):
+    """Código ``counter`` posições depois de ``base`` (ACB-00010 + 2 = ACB-00012)."""
     try:
         prefix, number = base.split('-', 1)
         return f"{prefix}-{int(number) + counter:05d}"
@@ -161,6 +162,24 @@ def _next_import_preview_code(counter):
         return base
 
 
+def _next_import_preview_code(counter, base=None):
+    return _codigo_deslocado(base or generate_next_code(Item, 'ACB', 'codigo_acb'), counter)
+
+
+def _itens_por_nome(nomes):
+    """{nome: item} para os nomes exatos da planilha (menor id em caso de repetição)"""
+    encontrados = {}
+    for lote in em_lotes(sorted(nomes)):
+        for item in (
+            db.session.query(Item.id, Item.nome, Item.codigo_acb)
+            .filter(Item.nome.in_(lote))
+            .order_by(Item.id.desc())
+            .all()
+        ):
+            encontrados[item.nome] = item
+    return encontrados
+
+
 def _normalize_slots(slots, estante_padrao=None):
     out = []
     seen = set()
@@ -212,23 +231,85 @@ def _slots_from_entity(entity):
         }])
     return []
 
+def _mostrar_zerados():
+    return (request.args.get('show_zero') or '').strip().lower() in ('1', 'true', 'yes', 'sim')
+
+
+def _listagem_estoque(show_zero=False):
+    """Listagem paginada do estoque (tela /estoque-pecas e /api/estoque-pecas/lista)"""
+    def consulta():
+        q = EstoquePecas.query.join(Item, EstoquePecas.item_id == Item.id)
+        if not show_zero:
+            q = q.filter(EstoquePecas.quantidade > 0)
+        return q
+
+    return Listagem(
+        consulta=consulta,
+        chave=EstoquePecas.id,
+        ordenacoes={
+            # Organizar estoque por prateleira (sem endereço primeiro)
+            'endereco': [
+                (func.coalesce(EstoquePecas.estante, 0), 'asc'),
+                (func.coalesce(EstoquePecas.secao, 0), 'asc'),
+                (func.coalesce(EstoquePecas.linha, 0), 'asc'),
+                (func.coalesce(EstoquePecas.coluna, 0), 'asc'),
+            ],
+            'codigo': [(func.coalesce(Item.codigo_acb, ''), 'asc')],
+            'quantidade': [(func.coalesce(EstoquePecas.quantidade, 0), 'desc')],
+        },
+        ordem_padrao='endereco',
+        campos={
+            'id': EstoquePecas.id,
+            'item_id': EstoquePecas.item_id,
+            'codigo_acb': Item.codigo_acb,
+            'nome': Item.nome,
+            'quantidade': EstoquePecas.quantidade,
+            'data_entrada': EstoquePecas.data_entrada,
+            'estante': EstoquePecas.estante,
+            'secao': EstoquePecas.secao,
+            'linha': EstoquePecas.linha,
+            'coluna': EstoquePecas.coluna,
+            'linha_fim': EstoquePecas.linha_fim,
+            'coluna_fim': EstoquePecas.coluna_fim,
+            'observacao': EstoquePecas.observacao,
+        },
+        filtros={
+            'busca': filtro_texto(Item.codigo_acb, Item.nome, EstoquePecas.observacao),
+            'estante': filtro_ids(EstoquePecas.estante),
+        },
+        opcoes_carga=(contains_eager(EstoquePecas.item),),
+    )
+
+
 @estoque_pecas.route('/estoque-pecas')
 def index():
     """Rota para a página principal do estoque de peças"""
-    # Organizar estoque por prateleira
-    show_zero = (request.args.get('show_zero') or '').strip().lower() in ('1', 'true', 'yes', 'sim')
-    q = EstoquePecas.query
-    if not show_zero:
-        q = q.filter(EstoquePecas.quantidade > 0)
-    estoque = q.order_by(EstoquePecas.estante, EstoquePecas.secao, EstoquePecas.linha, EstoquePecas.coluna).all()
+    show_zero = _mostrar_zerados()
+    # Só a primeira página vem no HTML; o restante é carregado pela API
+    try:
+        pagina = _listagem_estoque(show_zero).paginar(request.args, limite=PRIMEIRA_PAGINA_LISTAGEM)
+    except CursorInvalido:
+        return redirect(url_for('estoque_pecas.index', show_zero=1 if show_zero else None))
     return render_template(
         'estoque_pecas/index.html',
-        estoque=estoque,
+        estoque=pagina.registros,
+        proximo_cursor=pagina.proximo_cursor,
         show_zero=show_zero,
         pode_ver_valores=_usuario_pode_ver_valores()
     )
 
 
+@estoque_pecas.route('/api/estoque-pecas/lista')
+def api_listar_estoque():
+    """Estoque paginado por cursor (JSON com colunas projetadas ou linhas HTML)"""
+    return responder_pagina(
+        _listagem_estoque(_mostrar_zerados()),
+        'estoque_pecas/_linhas.html',
+        'estoque',
+        templates_extras={'modais': 'estoque_pecas/_modais.html'},
+    )
+
+
 # ============================================================================
 # ROTAS DE LISTA DE RETIRADA REMOVIDAS
 # ============================================================================
@@ -242,7 +323,6 @@ def index():
 @estoque_pecas.route('/estoque-pecas/importar-excel', methods=['GET', 'POST'])
 def importar_estoque_excel():
     if request.method == 'GET':
-        session.pop('import_estoque_excel_rows', None)
         return render_template('estoque_pecas/importar_excel.html')
 
     arquivo = request.files.get('arquivo')
@@ -251,100 +331,100 @@ def importar_estoque_excel():
         return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
     try:
-        wb = load_workbook(arquivo, data_only=True)
-        ws = wb.active
-    except Exception as e:
-        flash(f'Erro ao ler XLSX: {e}', 'danger')
+        headers, col_index, linhas_planilha = ler_planilha(arquivo, _canonical_estoque_excel_column)
+    except PlanilhaInvalida as e:
+        flash(str(e), 'danger')
         return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
-    header_row = None
-    for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
-        header_row = row
-        break
-    if not header_row:
-        flash('XLSX vazio ou sem cabeçalho.', 'danger')
-        return redirect(url_for('estoque_pecas.importar_estoque_excel'))
-
-    headers = [_canonical_estoque_excel_column(h) for h in header_row]
-    col_index = {}
-    for i, h in enumerate(headers):
-        if not h:
-            continue
-        col_index.setdefault(h, i)
-
     if 'nome' not in col_index and 'item' in col_index:
         col_index['nome'] = col_index['item']
 
     required = ['nome', 'quantidade']
     missing = [c for c in required if c not in col_index]
     if missing:
+        linhas_planilha.close()
         encontrados = [h for h in headers if h]
         flash('Colunas obrigatórias ausentes no Excel: ' + ', '.join(missing), 'danger')
         flash('Cabeçalhos encontrados: ' + ', '.join(encontrados[:30]) + ('...' if len(encontrados) > 30 else ''), 'warning')
         return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
-    preview_rows = []
-    ok_rows = []
-    ok_count = 0
-    err_count = 0
-    warn_count = 0
     skipped_empty_name_count = 0
     used_names = set()
-    novos_counter = 0
-
     obs_col = col_index.get('observacao')
     data_col = col_index.get('data_entrada')
 
-    for row_number, values in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        nome_val = values[col_index['nome']] if col_index.get('nome') is not None else None
-        quantidade_val = values[col_index['quantidade']] if col_index.get('quantidade') is not None else None
-        observacao_val = values[obs_col] if obs_col is not None else None
+    # 1ª passada: leitura e validação do conteúdo de cada linha
+    linhas = []
+    for row_number, values in linhas_planilha:
+        quantidade_val = values[col_index['quantidade']]
         data_val = values[data_col] if data_col is not None else None
-
-        errors = []
-        warnings = []
-        nome_s = str(nome_val or '').strip()
-        nome_key = nome_s.casefold()
-        observacao_s = str(observacao_val or '').strip()
-        data_entrada = _parse_date_cell(data_val)
-
-        if not any([nome_s, str(quantidade_val or '').strip(), observacao_s, data_val]):
+        linha = {
+            'row_number': row_number,
+            'nome': str(values[col_index['nome']] or '').strip(),
+            'observacao': str((values[obs_col] if obs_col is not None else None) or '').strip(),
+            'data_entrada': _parse_date_cell(data_val),
+            'quantidade': None,
+            'errors': [],
+            'warnings': [],
+        }
+
+        if not any([linha['nome'], str(quantidade_val or '').strip(), linha['observacao'], data_val]):
             continue
 
-        if not nome_s:
+        if not linha['nome']:
             skipped_empty_name_count += 1
             continue
 
         try:
             if isinstance(quantidade_val, float) and quantidade_val.is_integer():
                 quantidade_val = int(quantidade_val)
-            quantidade_int = int(str(quantidade_val).strip())
-            if quantidade_int <= 0:
-                errors.append('Quantidade deve ser > 0')
+            linha['quantidade'] = int(str(quantidade_val).strip())
+            if linha['quantidade'] <= 0:
+                linha['errors'].append('Quantidade deve ser > 0')
         except Exception:
-            quantidade_int = None
-            errors.append('Quantidade inválida')
+            linha['errors'].append('Quantidade inválida')
 
-        if nome_key and nome_key in used_names:
-            warnings.append('Nome repetido na planilha: as quantidades serão importadas em linhas separadas')
-        elif nome_key:
+        nome_key = linha['nome'].casefold()
+        if nome_key in used_names:
+            linha['warnings'].append('Nome repetido na planilha: as quantidades serão importadas em linhas separadas')
+        else:
             used_names.add(nome_key)
+        linhas.append(linha)
 
-        item = Item.query.filter(Item.nome == nome_s).first() if nome_s else None
-        codigo_previsto = item.codigo_acb if item else _next_import_preview_code(novos_counter)
-        if not item and len(errors) == 0:
-            novos_counter += 1
+    # 2ª passada: itens resolvidos contra o dicionário carregado de uma vez
+    itens_por_nome = _itens_por_nome({l['nome'] for l in linhas})
+    base_codigo = generate_next_code(Item, 'ACB', 'codigo_acb')
 
+    preview_rows = []
+    ok_rows = []
+    ok_count = 0
+    err_count = 0
+    warn_count = 0
+    novos_counter = 0
+
+    codigos_previstos = {}
+    for linha in linhas:
+        errors, warnings = linha['errors'], linha['warnings']
+        item = itens_por_nome.get(linha['nome'])
+        if item:
+            codigo_previsto = item.codigo_acb
+        else:
+            codigo_previsto = codigos_previstos.get(linha['nome']) or _next_import_preview_code(novos_counter, base_codigo)
+            if len(errors) == 0 and linha['nome'] not in codigos_previstos:
+                codigos_previstos[linha['nome']] = codigo_previsto
+                novos_counter += 1
+
+        data_entrada = linha['data_entrada']
         ok = len(errors) == 0
         if ok:
             ok_count += 1
             if warnings:
                 warn_count += 1
             ok_rows.append({
-                'row_number': row_number,
-                'nome': nome_s,
-                'quantidade': quantidade_int,
-                'observacao': observacao_s,
+                'row_number': linha['row_number'],
+                'nome': linha['nome'],
+                'quantidade': linha['quantidade'],
+                'observacao': linha['observacao'],
                 'data_entrada': data_entrada.isoformat() if data_entrada else None,
                 'item_id': item.id if item else None,
                 'codigo_acb': item.codigo_acb if item else None,
@@ -357,10 +437,10 @@ def importar_estoque_excel():
             err_count += 1
 
         preview_rows.append({
-            'row_number': row_number,
-            'nome': nome_s,
-            'quantidade': '' if quantidade_int is None else quantidade_int,
-            'observacao': observacao_s,
+            'row_number': linha['row_number'],
+            'nome': linha['nome'],
+            'quantidade': '' if linha['quantidade'] is None else linha['quantidade'],
+            'observacao': linha['observacao'],
             'data_entrada': data_entrada.strftime('%d/%m/%Y') if data_entrada else '',
             'ok': ok,
             'errors': errors,
@@ -373,11 +453,12 @@ def importar_estoque_excel():
             'selecionado': True,
         })
 
-    session['import_estoque_excel_rows'] = ok_rows
+    import_id = salvar_linhas('estoque', ok_rows) if ok_rows else None
     if skipped_empty_name_count:
         flash(f'{skipped_empty_name_count} linha(s) sem nome foram ignoradas automaticamente na importação.', 'warning')
     return render_template(
         'estoque_pecas/importar_excel.html',
+        import_id=import_id,
         preview_rows=preview_rows,
         preview_ok_count=ok_count,
         preview_error_count=err_count,
@@ -385,21 +466,57 @@ def importar_estoque_excel():
     )
 
 
+def _criar_itens_importacao(linhas):
+    """Cadastra em lote os itens novos (um por nome) e preenche item_id/codigo_acb nas linhas."""
+    base = generate_next_code(Item, 'ACB', 'codigo_acb')
+    codigos = {}
+    for r in linhas:
+        if r['nome'] not in codigos:
+            codigos[r['nome']] = _codigo_deslocado(base, len(codigos))
+        r['codigo_acb'] = codigos[r['nome']]
+
+    for lote in em_lotes(list(codigos.items())):
+        db.session.execute(insert(Item), [
+            {'nome': nome, 'codigo_acb': codigo, 'tipo_item': 'producao', 'criado_via_importacao_estoque': True}
+            for nome, codigo in lote
+        ])
+
+    ids = {}
+    for lote in em_lotes(list(codigos.values())):
+        ids.update(db.session.query(Item.codigo_acb, Item.id).filter(Item.codigo_acb.in_(lote)).all())
+    for r in linhas:
+        r['item_id'] = ids[r['codigo_acb']]
+
+
+def _estoques_por_item(item_ids):
+    """{item_id: id do primeiro registro de estoque do item}"""
+    estoques = {}
+    for lote in em_lotes(sorted(item_ids)):
+        for estoque_id, item_id in (
+            db.session.query(EstoquePecas.id, EstoquePecas.item_id)
+            .filter(EstoquePecas.item_id.in_(lote))
+            .order_by(EstoquePecas.id.desc())
+            .all()
+        ):
+            estoques[item_id] = estoque_id
+    return estoques
+
+
 @estoque_pecas.route('/estoque-pecas/importar-excel/confirmar', methods=['POST'])
 def confirmar_importacao_estoque_excel():
-    ok_rows = _get_pending_import_rows()
-    if not ok_rows:
+    import_id = request.form.get('import_id')
+    ok_rows, confirmado = carregar_linhas(import_id, 'estoque')
+    if not ok_rows or confirmado:
         flash('Nenhuma importação pendente. Faça o upload do Excel novamente.', 'warning')
         return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
     try:
-        importados = 0
         selecionados = []
-        for idx, r in enumerate(ok_rows):
-            marcado = request.form.get(f'selecionar_{idx}')
+        for r in ok_rows:
+            marcado = request.form.get(f"selecionar_{r['row_number']}")
             if not marcado:
                 continue
-            acao = (request.form.get(f'acao_{idx}') or request.form.get('acao_global') or r.get('acao_sugerida') or '').strip()
+            acao = (request.form.get(f"acao_{r['row_number']}") or request.form.get('acao_global') or r.get('acao_sugerida') or '').strip()
             if acao == 'pular':
                 continue
 
@@ -411,59 +528,86 @@ def confirmar_importacao_estoque_excel():
             flash('Nenhuma linha foi selecionada para importação.', 'warning')
             return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
+        ids_existentes = set()
+        for lote in em_lotes(sorted({r['item_id'] for r in selecionados if r.get('item_id')})):
+            ids_existentes.update(i for (i,) in db.session.query(Item.id).filter(Item.id.in_(lote)).all())
+
         for r in selecionados:
-            item = Item.query.get(r.get('item_id')) if r.get('item_id') else None
-            if r.get('acao_confirmada') == 'usar_existente' and not item:
+            if r.get('acao_confirmada') == 'usar_existente' and r.get('item_id') not in ids_existentes:
                 flash(f"A linha {r.get('row_number')} não possui item cadastrado para usar.", 'danger')
                 return redirect(url_for('estoque_pecas.importar_estoque_excel'))
 
-            if not item:
-                item = Item(
-                    nome=r['nome'],
-                    codigo_acb=generate_next_code(Item, 'ACB', 'codigo_acb'),
-                    tipo_item='producao',
-                    criado_via_importacao_estoque=True,
-                )
-                db.session.add(item)
-                db.session.flush()
-
-            estoque_existente = EstoquePecas.query.filter_by(item_id=item.id).first()
-            data_entrada = None
-            if r.get('data_entrada'):
-                data_entrada = datetime.strptime(r['data_entrada'], '%Y-%m-%d').date()
-            if not data_entrada:
-                data_entrada = datetime.now().date()
-
-            if estoque_existente:
-                estoque_existente.quantidade += int(r['quantidade'])
-                if r.get('observacao'):
-                    estoque_existente.observacao = r['observacao']
-                estoque_row = estoque_existente
-            else:
-                estoque_row = EstoquePecas(
-                    item_id=item.id,
-                    quantidade=int(r['quantidade']),
-                    data_entrada=data_entrada,
-                    observacao=r.get('observacao') or None,
-                )
-                db.session.add(estoque_row)
-                db.session.flush()
+        novos_itens = [r for r in selecionados if r.get('item_id') not in ids_existentes]
+        for r in novos_itens:
+            r['item_id'] = None
+        if novos_itens:
+            _criar_itens_importacao(novos_itens)
 
-            movimentacao = MovimentacaoEstoquePecas(
-                estoque_pecas_id=estoque_row.id,
-                tipo='entrada',
-                quantidade=int(r['quantidade']),
-                data=data_entrada,
-                referencia='IMPORTACAO_EXCEL_ESTOQUE',
-                observacao=r.get('observacao') or 'Importação por Excel',
-            )
-            db.session.add(movimentacao)
-            importados += 1
+        hoje = datetime.now().date()
+        for r in selecionados:
+            data_entrada = datetime.strptime(r['data_entrada'], '%Y-%m-%d').date() if r.get('data_entrada') else None
+            r['_data'] = data_entrada or hoje
 
-        session['import_estoque_excel_rows'] = selecionados
+        # Linhas do mesmo item somam no mesmo registro de estoque; a última observação prevalece
+        estoques = _estoques_por_item({r['item_id'] for r in selecionados})
+        acrescimos = {}
+        novos_estoques = {}
+        for r in selecionados:
+            item_id = r['item_id']
+            quantidade = int(r['quantidade'])
+            observacao = r.get('observacao') or None
+            if item_id in estoques:
+                atual = acrescimos.setdefault(estoques[item_id], {'b_id': estoques[item_id], 'b_quantidade': 0, 'b_observacao': None})
+                atual['b_quantidade'] += quantidade
+                atual['b_observacao'] = observacao or atual['b_observacao']
+            elif item_id in novos_estoques:
+                novos_estoques[item_id]['quantidade'] += quantidade
+                novos_estoques[item_id]['observacao'] = observacao or novos_estoques[item_id]['observacao']
+            else:
+                novos_estoques[item_id] = {
+                    'item_id': item_id,
+                    'quantidade': quantidade,
+                    'data_entrada': r['_data'],
+                    'observacao': observacao,
+                }
+
+        if acrescimos:
+            tabela = EstoquePecas.__table__
+            db.session.execute(
+                update(tabela)
+                .where(tabela.c.id == bindparam('b_id'))
+                .values(
+                    quantidade=func.coalesce(tabela.c.quantidade, 0) + bindparam('b_quantidade'),
+                    observacao=func.coalesce(bindparam('b_observacao'), tabela.c.observacao),
+                ),
+                list(acrescimos.values()),
+            )
+        for lote in em_lotes(list(novos_estoques.values())):
+            db.session.execute(insert(EstoquePecas), lote)
+        if novos_estoques:
+            estoques.update(_estoques_por_item(novos_estoques))
+
+        for lote in em_lotes(selecionados):
+            db.session.execute(insert(MovimentacaoEstoquePecas), [
+                {
+                    'estoque_pecas_id': estoques[r['item_id']],
+                    'tipo': 'entrada',
+                    'quantidade': int(r['quantidade']),
+                    'data': r.pop('_data'),
+                    'referencia': 'IMPORTACAO_EXCEL_ESTOQUE',
+                    'observacao': r.get('observacao') or 'Importação por Excel',
+                }
+                for r in lote
+            ])
+
+        registrar_auditoria('EstoquePecas', import_id, len(selecionados), {
+            'itens_criados': len(novos_itens),
+            'quantidade_total': sum(int(r['quantidade']) for r in selecionados),
+        })
+        marcar_confirmadas(import_id, 'estoque', selecionados)
         db.session.commit()
-        flash(f'Importação concluída com sucesso! Linhas importadas: {importados}', 'success')
-        return redirect(url_for('estoque_pecas.imprimir_importacao_estoque_excel'))
+        flash(f'Importação concluída com sucesso! Linhas importadas: {len(selecionados)}', 'success')
+        return redirect(url_for('estoque_pecas.imprimir_importacao_estoque_excel', import_id=import_id))
     except Exception as e:
         db.session.rollback()
         flash(f'Erro ao importar estoque: {e}', 'danger')
@@ -472,7 +616,7 @@ def confirmar_importacao_estoque_excel():
 
 @estoque_pecas.route('/estoque-pecas/importar-excel/imprimir')
 def imprimir_importacao_estoque_excel():
-    rows = _get_pending_import_rows()
+    rows, _ = carregar_linhas(request.args.get('import_id'), 'estoque')
     if not rows:
         flash('Nenhuma importação disponível para impressão.', 'warning')
         return redirect(url_for('estoque_pecas.importar_estoque_excel'))
@@ -800,16 +944,14 @@ def mapa_search():
     if not q:
         return jsonify({'results': []})
 
-    like = f"%{q}%"
+    # Itens por código/nome pelo índice de busca (utils/busca.py)
+    item_ids = buscar_ids('item', q, limite=200)
+    if not item_ids:
+        return jsonify({'results': []})
     rows = (
         EstoquePecas.query
         .join(Item, EstoquePecas.item_id == Item.id)
-        .filter(
-            or_(
-                Item.codigo_acb.ilike(like),
-                Item.nome.ilike(like),
-            )
-        )
+        .filter(EstoquePecas.item_id.in_(item_ids))
         .filter(EstoquePecas.estante.isnot(None))
         .filter(EstoquePecas.secao.isnot(None))
         .filter(EstoquePecas.linha.isnot(None))
@@ -826,7 +968,7 @@ def mapa_search():
             'item_id': e.item.id if e.item else None,
             'codigo': (e.item.codigo_acb if e.item else '') or '',
             'nome': (e.item.nome if e.item else '') or '',
-            'imagem': (e.item.imagem_path if e.item and e.item.imagem_path else '') or '',
+            'imagem': (e.item.imagem_thumb_path if e.item and e.item.imagem else '') or '',
             'pdf': url_for('itens.desenho_pdf_item', item_id=e.item.id) if e.item and e.item.desenho_tecnico else '',
             'estante': e.estante,
             'secao': e.secao,
@@ -2,20 +2,24 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from werkzeug.utils import secure_filename
 import os
 import json
+import logging
 import io
-import threading
 import uuid
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
 import requests
 from models import db, Item, Material, Trabalho, ItemMaterial, ItemTrabalho, Pedido, ArquivoCNC, ItemComposto, EstoquePecas, ItemClasse, Protecao, TrabalhoProtecao, ItemTrabalhoProtecao
-from utils import validate_form_data, save_file, generate_next_code, parse_json_field
+from utils import validate_form_data, save_file, save_files, generate_next_code, parse_json_field
+from utils.listagem import Listagem, CursorInvalido, responder_pagina, filtro_texto, PRIMEIRA_PAGINA_LISTAGEM
+from utils.cache_desenhos import obter_pdf_carimbado, invalidar_item as invalidar_desenho_carimbado
+from utils.storage import ler as ler_storage
+from utils.exportacao_xlsx import (
+    Coluna, LOTE_LINHAS, MIMETYPE_XLSX, gravar_planilha, iniciar_exportacao, obter_exportacao, status_exportacao,
+)
 from flask import current_app, g
-from sqlalchemy import func
+from sqlalchemy import func, select
 from sqlalchemy.orm import selectinload
-from openpyxl import Workbook, load_workbook
-from openpyxl.styles import Font, PatternFill, Alignment
-from openpyxl.utils import get_column_letter
+from openpyxl import load_workbook
 from openpyxl.drawing.image import Image as OpenpyxlImage
 
 try:
@@ -24,9 +28,8 @@ except Exception:
     Image = None
 
 itens = Blueprint('itens', __name__)
+logger = logging.getLogger(__name__)
 ADMIN_MASTER_EMAIL = 'admin@acbusinagem.com.br'
-_EXPORTACOES_VALORES_ITENS = {}
-_EXPORTACOES_VALORES_ITENS_LOCK = threading.Lock()
 
 
 def _usuario_pode_ver_valores(usuario=None):
@@ -202,6 +205,32 @@ def _build_preview_valores_rows(rows):
     }
 
 
+# Campos de arquivo dos formulários de item e a pasta de cada um
+_ARQUIVOS_FORM_ITEM = (
+    ('desenho_tecnico', 'desenhos'),
+    ('imagem', 'imagens'),
+    ('instrucoes_trabalho', 'instrucoes'),
+    ('blank_laser', 'blank_laser'),
+)
+
+
+def _blank_laser_invalido():
+    arquivo = request.files.get('blank_laser')
+    return bool(arquivo and arquivo.filename and not arquivo.filename.lower().endswith('.dxf'))
+
+
+def _salvar_arquivos_item(item):
+    """Envia os arquivos preenchidos no formulário numa só chamada e devolve os campos alterados."""
+    campos = [
+        (campo, pasta) for campo, pasta in _ARQUIVOS_FORM_ITEM
+        if campo in request.files and request.files[campo].filename
+    ]
+    caminhos = save_files([(request.files[campo], pasta) for campo, pasta in campos])
+    for (campo, _), caminho in zip(campos, caminhos):
+        setattr(item, campo, caminho)
+    return {campo for campo, _ in campos}
+
+
 def _get_item_imagem_bytes(item):
     file_path = getattr(item, 'imagem', None)
     if not file_path:
@@ -209,19 +238,19 @@ def _get_item_imagem_bytes(item):
 
     try:
         if file_path.startswith('http://') or file_path.startswith('https://'):
-            resp = requests.get(file_path, timeout=(3, 5))
-            if resp.status_code != 200:
+            conteudo = ler_storage(file_path, timeout=(3, 5))
+            if conteudo is None:
                 return None, None
-            return resp.content, file_path
+            return conteudo, file_path
 
         if file_path.startswith('supabase://') or file_path.startswith('supabase:/'):
             public_url = _build_supabase_public_url_from_file_path(file_path)
             if not public_url:
                 return None, None
-            resp = requests.get(public_url, timeout=(3, 5))
-            if resp.status_code != 200:
+            conteudo = ler_storage(public_url, timeout=(3, 5))
+            if conteudo is None:
                 return None, public_url
-            return resp.content, public_url
+            return conteudo, public_url
 
         normalized = file_path.replace('\\', '/').lstrip('/')
         if normalized.startswith('uploads/'):
@@ -259,136 +288,57 @@ def _build_excel_safe_image_stream(image_bytes):
         return None
 
 
-def _set_exportacao_valores_status(export_id, **kwargs):
-    with _EXPORTACOES_VALORES_ITENS_LOCK:
-        exportacao = _EXPORTACOES_VALORES_ITENS.get(export_id)
-        if not exportacao:
-            return
-        exportacao.update(kwargs)
+COLUNAS_VALORES_ITENS = [
+    Coluna('item', 38),
+    Coluna('codigo_acb', 14, 'centro'),
+    Coluna('tipo', 16, 'centro'),
+    Coluna('quantidade_estoque', 18, 'centro'),
+    Coluna('valor_item', 14, 'moeda'),
+    Coluna('valor_material', 16, 'moeda'),
+    Coluna('outros_custos', 16, 'moeda'),
+    Coluna('imposto_percentual', 14, 'percentual'),
+]
+
+
+def _linhas_valores_itens(consulta):
+    for linha in consulta.yield_per(LOTE_LINHAS):
+        tipo_item = 'Composto' if linha.eh_composto else ('Montagem' if (linha.tipo_item or '') == 'montagem' else 'Produção')
+        yield (
+            (linha.nome or '').strip().replace('\n', '').replace('\r', ''),
+            linha.codigo_acb,
+            tipo_item,
+            int(linha.quantidade_estoque or 0),
+            float(linha.valor_item or 0),
+            float(linha.valor_material or 0),
+            float(linha.outros_custos or 0),
+            float(linha.imposto_percentual or 0),
+        )
 
 
-def _carregar_quantidades_estoque_por_item():
-    rows = (
+def _gerar_planilha_valores_itens(caminho, progress_callback=None):
+    """Planilha de valores dos itens (ordem alfabética), lida e gravada em lotes."""
+    estoque = (
         db.session.query(
-            EstoquePecas.item_id,
-            func.coalesce(func.sum(EstoquePecas.quantidade), 0)
+            EstoquePecas.item_id.label('item_id'),
+            func.coalesce(func.sum(EstoquePecas.quantidade), 0).label('quantidade'),
         )
         .group_by(EstoquePecas.item_id)
-        .all()
+        .subquery()
+    )
+    consulta = (
+        db.session.query(
+            Item.nome, Item.codigo_acb, Item.eh_composto, Item.tipo_item,
+            func.coalesce(estoque.c.quantidade, 0).label('quantidade_estoque'),
+            Item.valor_item, Item.valor_material, Item.outros_custos, Item.imposto_percentual,
+        )
+        .outerjoin(estoque, estoque.c.item_id == Item.id)
+        .order_by(Item.nome.asc(), Item.id.asc())
+    )
+    total = db.session.query(func.count(Item.id)).scalar() or 0
+    return gravar_planilha(
+        caminho, 'Valores Itens', COLUNAS_VALORES_ITENS, _linhas_valores_itens(consulta),
+        total=total, progresso=progress_callback,
     )
-    return {item_id: int(quantidade or 0) for item_id, quantidade in rows}
-
-
-def _gerar_planilha_valores_itens(progress_callback=None):
-    wb = Workbook()
-    ws = wb.active
-    ws.title = 'Valores Itens'
-    headers = ['item', 'codigo_acb', 'tipo', 'quantidade_estoque', 'valor_item', 'valor_material', 'outros_custos', 'imposto_percentual']
-    ws.append(headers)
-
-    header_fill = PatternFill(fill_type='solid', fgColor='1F4E78')
-    header_font = Font(color='FFFFFF', bold=True)
-    currency_fmt = 'R$ #,##0.00'
-    percent_fmt = '0.00'
-
-    for idx, header in enumerate(headers, start=1):
-        cell = ws.cell(row=1, column=idx)
-        cell.fill = header_fill
-        cell.font = header_font
-        cell.alignment = Alignment(horizontal='center', vertical='center')
-
-    ws.freeze_panes = 'B2'
-    ws.auto_filter.ref = f"A1:{get_column_letter(len(headers))}1"
-
-    itens_cadastrados = Item.query.order_by(Item.nome.asc()).all()
-    quantidades_estoque = _carregar_quantidades_estoque_por_item()
-    total_itens = max(len(itens_cadastrados), 1)
-
-    if progress_callback:
-        progress_callback(percentual=5, mensagem='Preparando planilha...')
-
-    for index, item in enumerate(itens_cadastrados, start=1):
-        tipo_item = 'Composto' if item.eh_composto else ('Montagem' if (item.tipo_item or '') == 'montagem' else 'Produção')
-        quantidade_estoque = quantidades_estoque.get(item.id, 0)
-        ws.append([
-            (item.nome or '').strip().replace('\n', '').replace('\r', ''),
-            item.codigo_acb,
-            tipo_item,
-            quantidade_estoque,
-            float(item.valor_item or 0),
-            float(item.valor_material or 0),
-            float(item.outros_custos or 0),
-            float(item.imposto_percentual or 0),
-        ])
-
-        current_row = ws.max_row
-        ws.cell(row=current_row, column=1).alignment = Alignment(horizontal='left', vertical='center')
-        ws.cell(row=current_row, column=2).alignment = Alignment(horizontal='center', vertical='center')
-        ws.cell(row=current_row, column=3).alignment = Alignment(horizontal='center', vertical='center')
-        ws.cell(row=current_row, column=4).alignment = Alignment(horizontal='center', vertical='center')
-
-        for col in [5, 6, 7]:
-            ws.cell(row=current_row, column=col).number_format = currency_fmt
-            ws.cell(row=current_row, column=col).alignment = Alignment(horizontal='right', vertical='center')
-
-        ws.cell(row=current_row, column=8).number_format = percent_fmt
-        ws.cell(row=current_row, column=8).alignment = Alignment(horizontal='right', vertical='center')
-
-        if progress_callback:
-            percentual_item = 5 + int((index / total_itens) * 85)
-            progress_callback(percentual=min(percentual_item, 95), mensagem=f'Processando item {index} de {total_itens}...')
-
-    column_widths = {
-        'A': 38,
-        'B': 14,
-        'C': 16,
-        'D': 18,
-        'E': 14,
-        'F': 16,
-        'G': 16,
-        'H': 14,
-    }
-    for column, width in column_widths.items():
-        ws.column_dimensions[column].width = width
-
-    if progress_callback:
-        progress_callback(percentual=97, mensagem='Finalizando arquivo...')
-
-    output = io.BytesIO()
-    wb.save(output)
-    output.seek(0)
-
-    if progress_callback:
-        progress_callback(percentual=100, mensagem='Planilha pronta para download.')
-
-    return output
-
-
-def _executar_exportacao_valores_job(app, export_id):
-    with app.app_context():
-        try:
-            output = _gerar_planilha_valores_itens(
-                progress_callback=lambda percentual, mensagem: _set_exportacao_valores_status(
-                    export_id,
-                    status='processando',
-                    percentual=percentual,
-                    mensagem=mensagem,
-                )
-            )
-            _set_exportacao_valores_status(
-                export_id,
-                status='pronto',
-                percentual=100,
-                mensagem='Planilha pronta para download.',
-                arquivo=output.getvalue(),
-                nome_arquivo='valores_itens.xlsx',
-            )
-        except Exception as exc:
-            _set_exportacao_valores_status(
-                export_id,
-                status='erro',
-                mensagem=f'Falha ao gerar planilha: {exc}',
-            )
 
 
 def _require_valores_access():
@@ -397,27 +347,78 @@ def _require_valores_access():
         return redirect(url_for('main.index'))
     return None
 
+def _filtro_classe_itens(query, valores):
+    """Classe selecionada e todas as subclasses"""
+    try:
+        classe = ItemClasse.query.get(int(valores[0]))
+    except ValueError:
+        return query
+    if not classe:
+        return query
+    ids_classes = {classe.id}
+    ids_classes.update(_classe_descendente_ids(classe))
+    return query.filter(Item.item_classe_id.in_(ids_classes))
+
+
+def _listagem_itens():
+    """Listagem paginada de itens (tela /itens e /api/itens/lista)"""
+    campos = {
+        'id': Item.id,
+        'codigo_acb': Item.codigo_acb,
+        'nome': Item.nome,
+        'tipo_item': Item.tipo_item,
+        'eh_composto': Item.eh_composto,
+        'item_classe_id': Item.item_classe_id,
+        'criado_via_importacao_estoque': Item.criado_via_importacao_estoque,
+        'imagem': Item.imagem,
+        'desenho_tecnico': Item.desenho_tecnico,
+        'materiais': select(func.count(ItemMaterial.id)).where(ItemMaterial.item_id == Item.id).scalar_subquery(),
+        'componentes': select(func.count(ItemComposto.id)).where(ItemComposto.item_pai_id == Item.id).scalar_subquery(),
+        'trabalhos': select(func.count(ItemTrabalho.id)).where(ItemTrabalho.item_id == Item.id).scalar_subquery(),
+    }
+    if _usuario_pode_ver_valores():
+        campos['valor_item'] = Item.valor_item
+
+    return Listagem(
+        consulta=lambda: Item.query,
+        chave=Item.id,
+        ordenacoes={
+            'codigo': [(func.coalesce(Item.codigo_acb, ''), 'asc')],
+            'nome': [(Item.nome, 'asc')],
+            'recentes': [(Item.id, 'desc')],
+        },
+        ordem_padrao='codigo',
+        campos=campos,
+        filtros={
+            'classe_id': _filtro_classe_itens,
+            'busca': filtro_texto(Item.codigo_acb, Item.nome),
+            'tipo_item': lambda query, valores: query.filter(Item.tipo_item.in_(valores)),
+        },
+        opcoes_carga=(
+            selectinload(Item.materiais),
+            selectinload(Item.trabalhos),
+            selectinload(Item.componentes),
+            selectinload(Item.classe),
+        ),
+    )
+
+
 @itens.route('/itens')
 def listar_itens():
     """Rota para listar todos os itens"""
     classe_id = request.args.get('classe_id', type=int)
     classe_selecionada = ItemClasse.query.get(classe_id) if classe_id else None
 
-    query = Item.query.options(
-        selectinload(Item.materiais),
-        selectinload(Item.trabalhos),
-        selectinload(Item.classe),
-    )
-    if classe_selecionada:
-        ids_classes = {classe_selecionada.id}
-        ids_classes.update(_classe_descendente_ids(classe_selecionada))
-        query = query.filter(Item.item_classe_id.in_(ids_classes))
-
-    itens = query.all()
+    # Só a primeira página vem no HTML; o restante é carregado pela API
+    try:
+        pagina = _listagem_itens().paginar(request.args, limite=PRIMEIRA_PAGINA_LISTAGEM)
+    except CursorInvalido:
+        return redirect(url_for('itens.listar_itens', classe_id=classe_id))
     classes_item = _classes_item_ordenadas(apenas_ativas=False)
     return render_template(
         'itens/listar.html',
-        itens=itens,
+        itens=pagina.registros,
+        proximo_cursor=pagina.proximo_cursor,
         classes_item=classes_item,
         classes_item_payload=_classes_item_payload(classes_item),
         classe_selecionada=classe_selecionada,
@@ -425,6 +426,12 @@ def listar_itens():
     )
 
 
+@itens.route('/api/itens/lista')
+def api_listar_itens():
+    """Itens paginados por cursor (JSON com colunas projetadas ou linhas HTML)"""
+    return responder_pagina(_listagem_itens(), 'itens/_linhas.html', 'itens')
+
+
 @itens.route('/itens/classes', methods=['GET', 'POST'])
 def listar_classes_itens():
     if request.method == 'POST':
@@ -621,22 +628,12 @@ def exportar_planilha_valores_itens():
     if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
         return redirect(url_for('itens.listar_valores_itens'))
 
-    export_id = uuid.uuid4().hex
-    with _EXPORTACOES_VALORES_ITENS_LOCK:
-        _EXPORTACOES_VALORES_ITENS[export_id] = {
-            'status': 'processando',
-            'percentual': 0,
-            'mensagem': 'Iniciando exportação...',
-            'arquivo': None,
-            'nome_arquivo': 'valores_itens.xlsx',
-        }
-
-    worker = threading.Thread(
-        target=_executar_exportacao_valores_job,
-        args=(current_app._get_current_object(), export_id),
-        daemon=True,
+    export_id = iniciar_exportacao(
+        current_app._get_current_object(),
+        _gerar_planilha_valores_itens,
+        'valores_itens.xlsx',
+        usuario_id=session.get('usuario_id'),
     )
-    worker.start()
 
     return jsonify({
         'ok': True,
@@ -652,20 +649,11 @@ def status_exportacao_planilha_valores_itens(export_id):
     if acesso_negado:
         return acesso_negado
 
-    with _EXPORTACOES_VALORES_ITENS_LOCK:
-        exportacao = _EXPORTACOES_VALORES_ITENS.get(export_id)
-
-    if not exportacao:
+    exportacao = obter_exportacao(export_id)
+    if not exportacao or exportacao.get('usuario_id') != session.get('usuario_id'):
         return jsonify({'ok': False, 'mensagem': 'Exportação não encontrada.'}), 404
 
-    return jsonify({
-        'ok': True,
-        'status': exportacao.get('status'),
-        'percentual': exportacao.get('percentual', 0),
-        'mensagem': exportacao.get('mensagem', ''),
-        'pronto': exportacao.get('status') == 'pronto',
-        'erro': exportacao.get('status') == 'erro',
-    })
+    return jsonify(status_exportacao(exportacao))
 
 
 @itens.route('/itens/valores/exportar/download/<export_id>')
@@ -674,24 +662,20 @@ def download_exportacao_planilha_valores_itens(export_id):
     if acesso_negado:
         return acesso_negado
 
-    with _EXPORTACOES_VALORES_ITENS_LOCK:
-        exportacao = _EXPORTACOES_VALORES_ITENS.get(export_id)
-
-    if not exportacao:
-        flash('Exportação não encontrada.', 'danger')
+    exportacao = obter_exportacao(export_id)
+    if not exportacao or exportacao.get('usuario_id') != session.get('usuario_id'):
+        flash('Exportação não encontrada ou expirada.', 'danger')
         return redirect(url_for('itens.listar_valores_itens'))
 
-    if exportacao.get('status') != 'pronto' or not exportacao.get('arquivo'):
+    if exportacao.get('status') != 'pronto' or not os.path.exists(exportacao.get('caminho') or ''):
         flash('A planilha ainda não está pronta para download.', 'warning')
         return redirect(url_for('itens.listar_valores_itens'))
 
-    output = io.BytesIO(exportacao['arquivo'])
-    output.seek(0)
     return send_file(
-        output,
+        exportacao['caminho'],
         as_attachment=True,
         download_name=exportacao.get('nome_arquivo', 'valores_itens.xlsx'),
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=MIMETYPE_XLSX,
     )
 
 
@@ -1057,27 +1041,15 @@ def novo_item():
             trabalhos = Trabalho.query.all()
             return render_template('itens/novo.html', materiais=materiais, trabalhos=trabalhos, item=None, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores)
         
-        # Upload de arquivos
-        if 'desenho_tecnico' in request.files:
-            item.desenho_tecnico = save_file(request.files['desenho_tecnico'], 'desenhos')
-        
-        if 'imagem' in request.files:
-            item.imagem = save_file(request.files['imagem'], 'imagens')
-        
-        if 'instrucoes_trabalho' in request.files:
-            item.instrucoes_trabalho = save_file(request.files['instrucoes_trabalho'], 'instrucoes')
-        
-        # Upload do blank de laser (se for tipo LASER)
-        if 'blank_laser' in request.files and request.files['blank_laser'].filename:
-            blank_laser_file = request.files['blank_laser']
-            # Validar extensão DXF
-            if blank_laser_file.filename.lower().endswith('.dxf'):
-                item.blank_laser = save_file(blank_laser_file, 'blank_laser')
-            else:
-                flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
-                materiais = Material.query.all()
-                trabalhos = Trabalho.query.all()
-                return render_template('itens/novo.html', materiais=materiais, trabalhos=trabalhos, item=None, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores)
+        # Blank de laser (se for tipo LASER) precisa ser DXF: validar antes de enviar qualquer arquivo
+        if _blank_laser_invalido():
+            flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
+            materiais = Material.query.all()
+            trabalhos = Trabalho.query.all()
+            return render_template('itens/novo.html', materiais=materiais, trabalhos=trabalhos, item=None, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores)
+
+        # Upload de arquivos (enviados juntos; em paralelo quando vão para o Storage)
+        _salvar_arquivos_item(item)
         
         db.session.add(item)
         db.session.commit()
@@ -1137,9 +1109,9 @@ def novo_item():
             if not criador_id:
                 flash('Por favor, faça login para adicionar arquivos CNC.', 'warning')
                 return redirect(url_for('auth.login', next=request.url))
-            for file in cnc_files:
-                if file and file.filename.endswith(('.txt', '.nc')):
-                    filename = save_file(file, 'cnc_files')
+            cnc_validos = [file for file in cnc_files if file and file.filename.endswith(('.txt', '.nc'))]
+            for filename in save_files([(file, 'cnc_files') for file in cnc_validos]):
+                if filename:
                     arquivo_cnc = ArquivoCNC(
                         item_id=item.id,
                         nome_arquivo=filename,
@@ -1265,25 +1237,14 @@ def editar_item(item_id):
             flash('O peso deve ser um número válido', 'danger')
             return render_template('itens/editar.html', item=item, materiais=materiais, trabalhos=trabalhos, protecoes=protecoes_payload, trabalho_protecoes=trabalho_protecoes, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores, item_materiais=item_materiais, item_trabalhos=item_trabalhos)
         
-        # Upload de arquivos
-        if 'desenho_tecnico' in request.files and request.files['desenho_tecnico'].filename:
-            item.desenho_tecnico = save_file(request.files['desenho_tecnico'], 'desenhos')
-        
-        if 'imagem' in request.files and request.files['imagem'].filename:
-            item.imagem = save_file(request.files['imagem'], 'imagens')
-        
-        if 'instrucoes_trabalho' in request.files and request.files['instrucoes_trabalho'].filename:
-            item.instrucoes_trabalho = save_file(request.files['instrucoes_trabalho'], 'instrucoes')
-        
-        # Upload do blank de laser (se for tipo LASER)
-        if 'blank_laser' in request.files and request.files['blank_laser'].filename:
-            blank_laser_file = request.files['blank_laser']
-            # Validar extensão DXF
-            if blank_laser_file.filename.lower().endswith('.dxf'):
-                item.blank_laser = save_file(blank_laser_file, 'blank_laser')
-            else:
-                flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
-                return render_template('itens/editar.html', item=item, materiais=materiais, trabalhos=trabalhos, protecoes=protecoes_payload, trabalho_protecoes=trabalho_protecoes, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores, item_materiais=item_materiais, item_trabalhos=item_trabalhos)
+        # Blank de laser (se for tipo LASER) precisa ser DXF: validar antes de enviar qualquer arquivo
+        if _blank_laser_invalido():
+            flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
+            return render_template('itens/editar.html', item=item, materiais=materiais, trabalhos=trabalhos, protecoes=protecoes_payload, trabalho_protecoes=trabalho_protecoes, classes_item=classes_item, classes_item_payload=_classes_item_payload(classes_item), pode_ver_valores=pode_ver_valores, item_materiais=item_materiais, item_trabalhos=item_trabalhos)
+
+        # Upload de arquivos (enviados juntos; em paralelo quando vão para o Storage)
+        if 'desenho_tecnico' in _salvar_arquivos_item(item):
+            invalidar_desenho_carimbado(item.id)
 
         if getattr(item, 'criado_via_importacao_estoque', False):
             item.criado_via_importacao_estoque = False
@@ -1361,9 +1322,9 @@ def editar_item(item_id):
             if not criador_id:
                 flash('Por favor, faça login para adicionar arquivos CNC.', 'warning')
                 return redirect(url_for('auth.login', next=request.url))
-            for file in cnc_files:
-                if file and file.filename.endswith(('.txt', '.nc')):
-                    filename = save_file(file, 'cnc_files')
+            cnc_validos = [file for file in cnc_files if file and file.filename.endswith(('.txt', '.nc'))]
+            for filename in save_files([(file, 'cnc_files') for file in cnc_validos]):
+                if filename:
                     arquivo_cnc = ArquivoCNC(
                         item_id=item.id,
                         nome_arquivo=filename,
@@ -1558,21 +1519,19 @@ def _get_item_desenho_pdf_bytes(item: Item) -> tuple[bytes | None, str | None]:
         return None, None
 
     if file_path.startswith('http://') or file_path.startswith('https://'):
-        import requests
-        resp = requests.get(file_path, timeout=10)  # Reduzido de 30s para 10s
-        if resp.status_code != 200:
+        conteudo = ler_storage(file_path, timeout=10)
+        if conteudo is None:
             return None, None
-        return resp.content, 'application/pdf'
+        return conteudo, 'application/pdf'
 
     if file_path.startswith('supabase://') or file_path.startswith('supabase:/'):
-        import requests
         public_url = _build_supabase_public_url_from_file_path(file_path)
         if not public_url:
             return None, None
-        resp = requests.get(public_url, timeout=10)  # Reduzido de 30s para 10s
-        if resp.status_code != 200:
+        conteudo = ler_storage(public_url, timeout=10)
+        if conteudo is None:
             return None, None
-        return resp.content, 'application/pdf'
+        return conteudo, 'application/pdf'
 
     normalized = file_path.replace('\\', '/').lstrip('/')
     if normalized.startswith('uploads/'):
@@ -1658,26 +1617,36 @@ def desenho_pdf_item(item_id):
     if not item.desenho_aprovado_em:
         return redirect(item.desenho_tecnico_path)
 
-    # Se o PDF está no Supabase e precisa carimbo, fazer download e carimbar
-    pdf_bytes, _mime = _get_item_desenho_pdf_bytes(item)
-    if not pdf_bytes:
-        # Se falhar, redirecionar direto ao invés de erro
-        return redirect(item.desenho_tecnico_path)
-
+    # PDF carimbado em cache no disco (baixa e carimba só na primeira vez)
     try:
-        stamped = _stamp_pdf_approved(pdf_bytes, item.desenho_aprovado_por_nome, item.desenho_aprovado_em)
+        caminho, etag = obter_pdf_carimbado(
+            item,
+            lambda it: _get_item_desenho_pdf_bytes(it)[0],
+            _stamp_pdf_approved,
+        )
     except Exception as e:
         # Log do erro mas redireciona ao PDF original
         logger.error(f"Erro ao carimbar PDF do item {item_id}: {e}")
         return redirect(item.desenho_tecnico_path)
 
+    if not caminho:
+        # Se falhar, redirecionar direto ao invés de erro
+        return redirect(item.desenho_tecnico_path)
+
     filename = f"{(item.codigo_acb or 'DESENHO')}_{(item.nome or 'item')}.pdf".replace(' ', '_')
-    return send_file(
-        io.BytesIO(stamped),
+    # conditional=True atende If-None-Match (304) e Range (visualizadores de PDF)
+    response = send_file(
+        caminho,
         mimetype='application/pdf',
         as_attachment=False,
         download_name=filename,
+        conditional=True,
+        etag=etag,
+        max_age=0,
     )
+    response.cache_control.private = True
+    response.cache_control.public = False
+    return response
 
 
 @itens.route('/itens/imprimir-desenho/<int:item_id>')
@@ -1703,6 +1672,7 @@ def aprovar_desenho_item(item_id):
     item.desenho_aprovado_por_id = usuario.id
     item.desenho_aprovado_por_nome = getattr(usuario, 'nome', None)
     db.session.commit()
+    invalidar_desenho_carimbado(item.id)
     flash('Desenho aprovado.', 'success')
     return redirect(url_for('itens.visualizar_item', item_id=item.id))
 
@@ -1719,6 +1689,7 @@ def desaprovar_desenho_item(item_id):
     item.desenho_aprovado_por_id = None
     item.desenho_aprovado_por_nome = None
     db.session.commit()
+    invalidar_desenho_carimbado(item.id)
     flash('Aprovação do desenho removida.', 'success')
     return redirect(url_for('itens.visualizar_item', item_id=item.id))
 
@@ -1788,27 +1759,15 @@ def novo_item_composto():
                 itens_disponiveis = Item.query.filter_by(eh_composto=False).all()
                 return render_template('itens/composto_novo.html', itens_disponiveis=itens_disponiveis, pode_ver_valores=pode_ver_valores)
         
-        # Upload de arquivos
-        if 'desenho_tecnico' in request.files:
-            item.desenho_tecnico = save_file(request.files['desenho_tecnico'], 'desenhos')
-        
-        if 'imagem' in request.files:
-            item.imagem = save_file(request.files['imagem'], 'imagens')
-        
-        if 'instrucoes_trabalho' in request.files:
-            item.instrucoes_trabalho = save_file(request.files['instrucoes_trabalho'], 'instrucoes')
-        
-        # Upload do blank de laser (se for tipo LASER)
-        if 'blank_laser' in request.files and request.files['blank_laser'].filename:
-            blank_laser_file = request.files['blank_laser']
-            # Validar extensão DXF
-            if blank_laser_file.filename.lower().endswith('.dxf'):
-                item.blank_laser = save_file(blank_laser_file, 'blank_laser')
-            else:
-                flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
-                materiais = Material.query.all()
-                trabalhos = Trabalho.query.all()
-                return render_template('itens/novo.html', materiais=materiais, trabalhos=trabalhos, item=None, pode_ver_valores=pode_ver_valores)
+        # Blank de laser (se for tipo LASER) precisa ser DXF: validar antes de enviar qualquer arquivo
+        if _blank_laser_invalido():
+            flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
+            materiais = Material.query.all()
+            trabalhos = Trabalho.query.all()
+            return render_template('itens/novo.html', materiais=materiais, trabalhos=trabalhos, item=None, pode_ver_valores=pode_ver_valores)
+
+        # Upload de arquivos (enviados juntos; em paralelo quando vão para o Storage)
+        _salvar_arquivos_item(item)
         
         db.session.add(item)
         db.session.commit()
@@ -1937,29 +1896,18 @@ def editar_item_composto(item_id):
                 itens_disponiveis = Item.query.filter_by(eh_composto=False).all()
                 return render_template('itens/composto_editar.html', item=item, itens_disponiveis=itens_disponiveis, pode_ver_valores=pode_ver_valores)
         
-        # Upload de arquivos
-        if 'desenho_tecnico' in request.files and request.files['desenho_tecnico'].filename:
-            item.desenho_tecnico = save_file(request.files['desenho_tecnico'], 'desenhos')
-        
-        if 'imagem' in request.files and request.files['imagem'].filename:
-            item.imagem = save_file(request.files['imagem'], 'imagens')
-        
-        if 'instrucoes_trabalho' in request.files and request.files['instrucoes_trabalho'].filename:
-            item.instrucoes_trabalho = save_file(request.files['instrucoes_trabalho'], 'instrucoes')
-        
-        # Upload do blank de laser (se for tipo LASER)
-        if 'blank_laser' in request.files and request.files['blank_laser'].filename:
-            blank_laser_file = request.files['blank_laser']
-            # Validar extensão DXF
-            if blank_laser_file.filename.lower().endswith('.dxf'):
-                item.blank_laser = save_file(blank_laser_file, 'blank_laser')
-            else:
-                flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
-                protecoes = Protecao.query.order_by(Protecao.tipo.asc(), Protecao.nome.asc()).all()
-                trabalho_protecoes = {}
-                for rel in TrabalhoProtecao.query.all():
-                    trabalho_protecoes.setdefault(rel.trabalho_id, []).append(rel.protecao_id)
-                return render_template('itens/editar.html', item=item, materiais=materiais, trabalhos=trabalhos, protecoes=protecoes_payload, trabalho_protecoes=trabalho_protecoes, pode_ver_valores=pode_ver_valores, item_materiais=item_materiais, item_trabalhos=item_trabalhos)
+        # Blank de laser (se for tipo LASER) precisa ser DXF: validar antes de enviar qualquer arquivo
+        if _blank_laser_invalido():
+            flash('O arquivo de blank de laser deve estar no formato DXF', 'danger')
+            protecoes = Protecao.query.order_by(Protecao.tipo.asc(), Protecao.nome.asc()).all()
+            trabalho_protecoes = {}
+            for rel in TrabalhoProtecao.query.all():
+                trabalho_protecoes.setdefault(rel.trabalho_id, []).append(rel.protecao_id)
+            return render_template('itens/editar.html', item=item, materiais=materiais, trabalhos=trabalhos, protecoes=protecoes_payload, trabalho_protecoes=trabalho_protecoes, pode_ver_valores=pode_ver_valores, item_materiais=item_materiais, item_trabalhos=item_trabalhos)
+
+        # Upload de arquivos (enviados juntos; em paralelo quando vão para o Storage)
+        if 'desenho_tecnico' in _salvar_arquivos_item(item):
+            invalidar_desenho_carimbado(item.id)
         
         # Remover componentes existentes
         ItemComposto.query.filter_by(item_pai_id=item.id).delete()
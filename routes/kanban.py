@@ -1,6 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, current_app, make_response, abort
 from models import db, Usuario, OrdemServico, Pedido, PedidoOrdemServico, Item, Trabalho, ItemTrabalho, RegistroMensal, KanbanLista, CartaoFantasma, ApontamentoProducao, local_now_naive
+from sqlalchemy.orm import joinedload, selectinload
 from utils import validate_form_data, get_kanban_lists, get_kanban_categories, format_seconds_to_time
+from utils.estado_chao_fabrica import estado_chao_fabrica
+from utils.kanban_snapshot import snapshot_quadro
+from utils import kanban_changelog
+from utils.resumo_apontamentos import carregar_resumos, ultimo_com_quantidade as ultimo_resumo_com_quantidade
+from utils.barramento import publicar as publicar_tempo_real
 from datetime import datetime, timezone, timedelta
 from collections import defaultdict
 import json
@@ -8,7 +14,7 @@ import re
 
 # Imports opcionais para otimizações (não quebrar se não disponíveis)
 try:
-    from utils.cache_manager import cache
+    from utils.cache_manager import cache, make_key as make_cache_key
     CACHE_AVAILABLE = True
 except ImportError:
     CACHE_AVAILABLE = False
@@ -25,6 +31,14 @@ except ImportError:
 
 kanban = Blueprint('kanban', __name__)
 
+
+def _quadro_alterado(tipo, **dados):
+    """Após o commit: invalida o snapshot do quadro e os caches que dependem dele e avisa as telas conectadas (SSE)"""
+    snapshot_quadro.incrementar_versao()
+    if CACHE_AVAILABLE:
+        cache.invalidate_tags('kanban:quadro')
+    publicar_tempo_real('kanban', tipo, **dados)
+
 # Listas Kanban que nunca podem ser removidas, renomeadas ou movimentadas
 PROTECTED_LISTS = ['Entrada', 'Expedição']
 
@@ -49,16 +63,13 @@ def verificar_permissao_kanban():
         flash('Você não tem permissão para acessar a área Kanban', 'danger')
         return redirect(url_for('main.index'))
 
-# Cache em memória simples para desenvolvimento (TTL: 5 minutos via chave temporal)
-_kanban_memory_cache = {}
-
 @kanban.route('/kanban')
 @monitor_route_performance
 def index():
     """Rota para a página principal do Kanban"""
     # Limpar cache se solicitado
     if request.args.get('clear_cache') == '1':
-        _kanban_memory_cache.clear()
+        snapshot_quadro.limpar()
         current_app.logger.info('🧹 Cache do Kanban limpo manualmente')
 
     listas = get_kanban_lists()
@@ -78,19 +89,14 @@ def index():
             Item=Item
         )
 
-    # Tentar buscar do cache (TTL: 5 minutos) se disponível
-    # Usar chave global baseada no timestamp (blocos de 5 minutos)
-    import time
-    cache_key_global = f"kanban:global:{int(time.time() / 300)}"  # Muda a cada 5 minutos
-    cached_data = None
-    
-    # Cache em memória primeiro (mais rápido)
-    cached_data = _kanban_memory_cache.get(cache_key_global)
+    # Snapshot do quadro: reaproveitado enquanto nenhuma rota alterar a versão
+    versao_quadro = snapshot_quadro.versao_atual()
+    cached_data = snapshot_quadro.obter(versao_quadro)
     if cached_data:
-        current_app.logger.info(f"📦 Memory Cache HIT para Kanban")
+        current_app.logger.info(f"📦 Snapshot do Kanban HIT (versão {versao_quadro})")
         return render_template('kanban/index.html', **cached_data, Item=Item)
     
-    current_app.logger.info(f"🔄 Cache MISS para Kanban")
+    current_app.logger.info(f"🔄 Snapshot do Kanban MISS (versão {versao_quadro})")
     
     categorias = get_kanban_categories()
     
@@ -394,9 +400,9 @@ def index():
         'metricas_listas_json': json.dumps(metricas_listas)
     }
     
-    # Cachear dados por 5 minutos (300 segundos) - chave global
-    _kanban_memory_cache[cache_key_global] = template_data
-    current_app.logger.info(f" Dados do Kanban cacheados (chave: {cache_key_global})")
+    # Guardar snapshot da versão lida no início (descartado se houve alteração no meio)
+    snapshot_quadro.guardar(versao_quadro, template_data)
+    current_app.logger.info(f" Snapshot do Kanban guardado (versão {versao_quadro})")
     
     return render_template('kanban/index.html', **template_data, Item=Item)
 
@@ -497,6 +503,7 @@ def mover_kanban():
                 pass
         
         db.session.commit()
+        _quadro_alterado('cartao_movido', ordem_id=ordem.id, lista_origem=old_status, lista_destino=nova_lista, posicao=ordem.posicao)
         
         return jsonify({'success': True})
     except Exception as e:
@@ -543,6 +550,7 @@ def reordenar_kanban():
             card_by_id[oid].data_atualizacao = local_now_naive()
         
         db.session.commit()
+        _quadro_alterado('cartao_reordenado', ordem_id=int(ordem_id), lista=lista, posicao=nova_posicao)
         
         return jsonify({
             'success': True,
@@ -597,6 +605,7 @@ def enviar_para_lista():
             card.data_atualizacao = local_now_naive()
     
     db.session.commit()
+    _quadro_alterado('cartao_movido', ordem_id=ordem.id, lista_origem=old_status, lista_destino=lista_destino, posicao=ordem.posicao)
 
     try:
         from notificacoes.eventos import registrar_evento
@@ -631,7 +640,10 @@ def finalizar_kanban():
         ordem.data_atualizacao = local_now_naive()
         
         # Desativar cartões fantasma associados a esta OS
+        fantasmas_ids = [row[0] for row in db.session.query(CartaoFantasma.id).filter_by(ordem_servico_id=ordem.id, ativo=True).all()]
         CartaoFantasma.query.filter_by(ordem_servico_id=ordem.id, ativo=True).update({'ativo': False})
+        # O update em massa não passa pelos eventos da sessão: registrar no log do sync
+        kanban_changelog.registrar_alteracoes(db.session, 'fantasma', fantasmas_ids)
         
         # Atualizar data de entrega dos pedidos associados
         pedidos_originais_ids = set()
@@ -693,7 +705,11 @@ def finalizar_kanban():
             db.session.add(registro)
         
         db.session.commit()
-        
+        _quadro_alterado('cartao_finalizado', ordem_id=ordem.id, lista_destino='Finalizado')
+
+        # O update em massa dos cartões fantasma não passa pelos eventos da sessão
+        estado_chao_fabrica.marcar_os(ordem.id)
+
         return jsonify({'success': True, 'message': f'OS {ordem.numero} finalizada com sucesso.'})
     
     except Exception as e:
@@ -721,7 +737,17 @@ def atualizar_tempo_real():
     
     item_trabalho = ItemTrabalho.query.get_or_404(item_trabalho_id)
     item_trabalho.tempo_real = tempo_real
+    # ItemTrabalho não entra no log de alterações: registra as OS do item (versão do quadro e sync do PWA)
+    ordens_do_item = (
+        db.session.query(PedidoOrdemServico.ordem_servico_id)
+        .join(Pedido, Pedido.id == PedidoOrdemServico.pedido_id)
+        .filter(Pedido.item_id == item_trabalho.item_id)
+        .distinct()
+        .all()
+    )
+    kanban_changelog.registrar_alteracoes(db.session, 'cartao', [row[0] for row in ordens_do_item])
     db.session.commit()
+    _quadro_alterado('tempo_atualizado', item_trabalho_id=item_trabalho.id)
     
     return jsonify({'success': True})
 
@@ -768,8 +794,10 @@ def sincronizar_quantidade_pedido():
                                 
                                 if pedido_os:
                                     pedido_os.quantidade_snapshot = nova_quantidade
+                                kanban_changelog.registrar_alteracoes(db.session, 'cartao', [ordem.id])
                                 
                                 db.session.commit()
+                                _quadro_alterado('quantidade_sincronizada', ordem_id=ordem.id, quantidade=nova_quantidade)
                                 
                                 quantidade_total = sum(po.pedido.quantidade for po in ordem.pedidos)
                                 
@@ -867,6 +895,7 @@ def criar_lista():
     
     db.session.add(nova_lista)
     db.session.commit()
+    _quadro_alterado('lista_criada', lista_id=nova_lista.id)
     
     flash(f'Lista "{nome}" criada com sucesso!', 'success')
     return redirect(url_for('kanban.gerenciar_listas'))
@@ -904,6 +933,7 @@ def editar_lista(lista_id):
     lista.data_atualizacao = datetime.utcnow()
     
     db.session.commit()
+    _quadro_alterado('lista_editada', lista_id=lista.id)
     
     flash(f'Lista "{nome}" atualizada com sucesso!', 'success')
     return redirect(url_for('kanban.gerenciar_listas'))
@@ -951,8 +981,8 @@ def reordenar_listas():
 
         db.session.commit()
 
-        # Invalidar cache do Kanban para refletir a nova ordem imediatamente
-        _kanban_memory_cache.clear()
+        # Nova versão do quadro e aviso às telas conectadas
+        _quadro_alterado('listas_reordenadas')
         return jsonify({'success': True, 'message': 'Ordem das listas atualizada com sucesso!'})
 
     except Exception as e:
@@ -978,6 +1008,7 @@ def excluir_lista(lista_id):
     nome_lista = lista.nome
     db.session.delete(lista)
     db.session.commit()
+    _quadro_alterado('lista_excluida', lista_id=lista_id)
     
     flash(f'Lista "{nome_lista}" excluída com sucesso!', 'success')
     return redirect(url_for('kanban.gerenciar_listas'))
@@ -1060,6 +1091,7 @@ def criar_cartao_fantasma():
         
         db.session.add(cartao_fantasma)
         db.session.commit()
+        _quadro_alterado('fantasma_criado', fantasma_id=cartao_fantasma.id, ordem_id=cartao_fantasma.ordem_servico_id, lista_destino=lista_destino)
         
         return jsonify({
             'success': True,
@@ -1078,6 +1110,7 @@ def remover_cartao_fantasma(cartao_id):
         cartao = CartaoFantasma.query.get_or_404(cartao_id)
         cartao.ativo = False
         db.session.commit()
+        _quadro_alterado('fantasma_removido', fantasma_id=cartao.id, ordem_id=cartao.ordem_servico_id)
         
         return jsonify({
             'success': True,
@@ -1143,6 +1176,7 @@ def mover_cartao_fantasma():
                 c.posicao_fila = idx
 
         db.session.commit()
+        _quadro_alterado('fantasma_movido', fantasma_id=cartao.id, lista_origem=lista_origem, lista_destino=lista_destino, posicao=nova_posicao)
         
         return jsonify({
             'success': True,
@@ -1244,48 +1278,19 @@ def full_data():
         return jsonify({'success': False, 'message': 'Não autorizado'}), 401
     
     try:
-        # Buscar todas as listas ativas
-        listas = KanbanLista.query.filter_by(ativa=True).order_by(KanbanLista.ordem).all()
-        current_app.logger.info(f'[PWA] Encontradas {len(listas)} listas')
-        
-        # Buscar todos os cartões (OS) ativos
-        cartoes = []
-        for lista in listas:
-            try:
-                # Cartões reais
-                ordens = OrdemServico.query.filter_by(status=lista.nome).order_by(OrdemServico.posicao).all()
-                for ordem in ordens:
-                    try:
-                        cartoes.append(_serialize_cartao(ordem, lista.id, False))
-                    except Exception as e:
-                        current_app.logger.error(f'[PWA] Erro ao serializar cartão {ordem.id}: {str(e)}')
-                
-                # Cartões fantasma
-                fantasmas = CartaoFantasma.query.filter_by(
-                    lista_kanban=lista.nome,
-                    ativo=True
-                ).order_by(CartaoFantasma.posicao_fila.asc(), CartaoFantasma.id.asc()).all()
-                for fantasma in fantasmas:
-                    try:
-                        cartoes.append(_serialize_cartao_fantasma(fantasma))
-                    except Exception as e:
-                        current_app.logger.error(f'[PWA] Erro ao serializar fantasma {fantasma.id}: {str(e)}')
-            except Exception as e:
-                current_app.logger.error(f'[PWA] Erro ao processar lista {lista.nome}: {str(e)}')
-        
-        # Buscar apontamentos ativos (últimas 24h)
-        data_limite = datetime.now() - timedelta(days=1)
-        apontamentos = ApontamentoProducao.query.filter(
-            ApontamentoProducao.data_hora >= data_limite
-        ).all()
-        
-        return jsonify({
-            'success': True,
-            'listas': [_serialize_lista(l) for l in listas],
-            'cartoes': cartoes,
-            'apontamentos': [_serialize_apontamento(a) for a in apontamentos],
-            'timestamp': local_now_naive().isoformat()
-        })
+        # Seq lido antes dos dados: alterações durante a carga são reaplicadas no próximo sync
+        seq = kanban_changelog.seq_atual(db.session)
+        # Retenção do log roda fora da requisição (thread com conexão própria)
+        kanban_changelog.podar_em_segundo_plano(current_app._get_current_object())
+
+        # O mesmo seq serve a mesma carga para todos os workers (Redis) e um só recálculo atende acessos simultâneos
+        if seq is not None and CACHE_AVAILABLE:
+            dados = cache.get_or_set(make_cache_key('kanban:full-data', seq), _montar_full_data,
+                                     ttl=300, tags=['kanban:quadro'])
+        else:
+            dados = _montar_full_data()
+
+        return jsonify(dict(dados, success=True, seq=seq, timestamp=local_now_naive().isoformat()))
         
     except Exception as e:
         import traceback
@@ -1294,14 +1299,236 @@ def full_data():
         return jsonify({'success': False, 'message': f'Erro ao carregar dados: {str(e)}'}), 500
 
 
+def _montar_full_data():
+    """Listas, cartões e apontamentos recentes do quadro (corpo de /kanban/full-data)"""
+    # Buscar todas as listas ativas
+    listas = KanbanLista.query.filter_by(ativa=True).order_by(KanbanLista.ordem).all()
+    current_app.logger.info(f'[PWA] Encontradas {len(listas)} listas')
+    listas_por_nome = {l.nome: l for l in listas}
+
+    # Todos os cartões (OS) e fantasmas das listas ativas em uma query cada
+    ordens = []
+    fantasmas = []
+    if listas_por_nome:
+        ordens = (
+            _query_ordens_serializacao()
+            .filter(OrdemServico.status.in_(list(listas_por_nome)))
+            .order_by(OrdemServico.posicao)
+            .all()
+        )
+        fantasmas = (
+            _query_fantasmas_serializacao()
+            .filter(CartaoFantasma.lista_kanban.in_(list(listas_por_nome)), CartaoFantasma.ativo == True)
+            .order_by(CartaoFantasma.posicao_fila.asc(), CartaoFantasma.id.asc())
+            .all()
+        )
+
+    ordens_por_lista = defaultdict(list)
+    for ordem in ordens:
+        ordens_por_lista[ordem.status].append(ordem)
+    fantasmas_por_lista = defaultdict(list)
+    for fantasma in fantasmas:
+        fantasmas_por_lista[fantasma.lista_kanban].append(fantasma)
+
+    tempos = _tempos_por_os([ordem.id for ordem in ordens])
+
+    cartoes = []
+    for lista in listas:
+        for ordem in ordens_por_lista.get(lista.nome, []):
+            try:
+                cartoes.append(_serialize_cartao(ordem, lista.id, False, tempos.get(ordem.id)))
+            except Exception as e:
+                current_app.logger.error(f'[PWA] Erro ao serializar cartão {ordem.id}: {str(e)}')
+        for fantasma in fantasmas_por_lista.get(lista.nome, []):
+            try:
+                cartoes.append(_serialize_cartao_fantasma(fantasma, listas_por_nome))
+            except Exception as e:
+                current_app.logger.error(f'[PWA] Erro ao serializar fantasma {fantasma.id}: {str(e)}')
+
+    # Apontamentos em aberto (índices parciais data_fim IS NULL); os tempos acumulados vêm de apontamento_resumo
+    apontamentos = ApontamentoProducao.query.filter(
+        ApontamentoProducao.data_fim.is_(None)
+    ).all()
+
+    return {
+        'listas': [_serialize_lista(l) for l in listas],
+        'cartoes': cartoes,
+        'apontamentos': [_serialize_apontamento(a) for a in apontamentos],
+    }
+
+
+def _tempos_por_os(os_ids):
+    """Tempos acumulados por OS a partir de apontamento_resumo (vazio se a tabela não existir)"""
+    resumos = carregar_resumos(db.session, os_ids)
+    if not resumos:
+        return {}
+    tempos = {}
+    for (os_id, _, _), resumo in resumos.items():
+        t = tempos.setdefault(os_id, {'tempo_setup_s': 0, 'tempo_producao_s': 0, 'tempo_pausas_s': 0,
+                                      'total_apontamentos': 0, 'ultimo_apontamento_em': None})
+        t['tempo_setup_s'] += resumo.tempo_setup_s or 0
+        t['tempo_producao_s'] += resumo.tempo_producao_s or 0
+        t['tempo_pausas_s'] += resumo.tempo_pausas_s or 0
+        t['total_apontamentos'] += resumo.total_apontamentos or 0
+        if resumo.ultimo_apontamento_em:
+            ultimo = resumo.ultimo_apontamento_em.isoformat()
+            if not t['ultimo_apontamento_em'] or ultimo > t['ultimo_apontamento_em']:
+                t['ultimo_apontamento_em'] = ultimo
+    for os_id, t in tempos.items():
+        resumo = ultimo_resumo_com_quantidade(resumos, os_id)
+        t['ultima_quantidade'] = resumo.ultima_quantidade if resumo else None
+    return tempos
+
+
+def _query_ordens_serializacao():
+    return OrdemServico.query.options(
+        selectinload(OrdemServico.pedidos).selectinload(PedidoOrdemServico.pedido).joinedload(Pedido.cliente),
+        selectinload(OrdemServico.pedidos).selectinload(PedidoOrdemServico.pedido).joinedload(Pedido.item),
+    )
+
+
+def _query_fantasmas_serializacao():
+    return CartaoFantasma.query.options(
+        joinedload(CartaoFantasma.trabalho),
+        joinedload(CartaoFantasma.ordem_servico)
+            .selectinload(OrdemServico.pedidos).selectinload(PedidoOrdemServico.pedido).joinedload(Pedido.cliente),
+        joinedload(CartaoFantasma.ordem_servico)
+            .selectinload(OrdemServico.pedidos).selectinload(PedidoOrdemServico.pedido).joinedload(Pedido.item),
+    )
+
+
 @kanban.route('/kanban/sync')
 def sync():
     """
-    Retorna apenas mudanças desde last_update (sync incremental)
+    Retorna apenas mudanças desde ``since`` (seq do log de alterações).
+
+    Resposta paginada (``limit``, padrão 500): o cliente repete com o ``seq``
+    devolvido enquanto ``has_more`` for verdadeiro. ``reset`` indica que o
+    cursor é anterior à retenção do log e o cliente deve refazer o full-data.
+    Sem alterações responde 304 quando o cliente envia ``If-None-Match``.
+
+    ``last_update`` (timestamp) continua aceito para clientes antigos.
     """
     if 'usuario_id' not in session:
         return jsonify({'success': False, 'message': 'Não autorizado'}), 401
-    
+
+    if request.args.get('since') is None:
+        return _sync_por_timestamp()
+
+    try:
+        try:
+            since = max(0, int(request.args.get('since')))
+            limite = max(1, min(int(request.args.get('limit', 500)), 2000))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Parâmetros since/limit inválidos'}), 400
+
+        seq_max = kanban_changelog.seq_atual(db.session)
+        if seq_max is None:
+            return jsonify({'success': False, 'reset': True, 'message': 'Log de alterações indisponível'}), 503
+
+        etag = f'kanban-sync-{since}-{seq_max}-{limite}'
+        if since >= seq_max:
+            if request.if_none_match.contains_weak(etag):
+                resp = make_response('', 304)
+                resp.set_etag(etag, weak=True)
+                return resp
+            resp = jsonify({
+                'success': True,
+                'has_changes': False,
+                'has_more': False,
+                'reset': False,
+                'seq': since,
+                'updated_cards': [],
+                'deleted_cards': [],
+                'new_cards': [],
+                'new_apontamentos': [],
+                'deleted_apontamentos': [],
+                'timestamp': local_now_naive().isoformat()
+            })
+            resp.set_etag(etag, weak=True)
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+
+        resultado = kanban_changelog.buscar_alteracoes(db.session, since, limite)
+        if resultado['reset']:
+            return jsonify({'success': True, 'reset': True, 'has_changes': True, 'seq': since})
+
+        ids_por_entidade = defaultdict(set)
+        for (entidade, entidade_id), _ in resultado['alteracoes'].items():
+            ids_por_entidade[entidade].add(entidade_id)
+
+        listas = KanbanLista.query.filter_by(ativa=True).order_by(KanbanLista.ordem).all()
+        listas_por_nome = {l.nome: l for l in listas}
+
+        updated_cards = []
+        deleted_cards = []
+
+        new_apontamentos = []
+        deleted_apontamentos = []
+        ids_apontamentos = ids_por_entidade.get('apontamento', set())
+        apontamentos = {}
+        if ids_apontamentos:
+            apontamentos = {a.id: a for a in ApontamentoProducao.query.filter(ApontamentoProducao.id.in_(ids_apontamentos)).all()}
+            for apontamento_id in sorted(ids_apontamentos):
+                apontamento = apontamentos.get(apontamento_id)
+                if apontamento:
+                    new_apontamentos.append(_serialize_apontamento(apontamento))
+                else:
+                    deleted_apontamentos.append(apontamento_id)
+
+        # Cartões (OS): estado atual decide entre atualizar e remover; apontamentos mudam os tempos do cartão
+        ids_cartoes = set(ids_por_entidade.get('cartao', set()))
+        ids_cartoes.update(a.ordem_servico_id for a in apontamentos.values() if a.ordem_servico_id)
+        if ids_cartoes:
+            ordens = {o.id: o for o in _query_ordens_serializacao().filter(OrdemServico.id.in_(ids_cartoes)).all()}
+            tempos = _tempos_por_os(ordens)
+            for ordem_id in sorted(ids_cartoes):
+                ordem = ordens.get(ordem_id)
+                lista = listas_por_nome.get(ordem.status) if ordem else None
+                if lista:
+                    updated_cards.append(_serialize_cartao(ordem, lista.id, False, tempos.get(ordem.id)))
+                else:
+                    # OS removida, finalizada ou fora das listas ativas
+                    deleted_cards.append(ordem_id)
+
+        ids_fantasmas = ids_por_entidade.get('fantasma', set())
+        if ids_fantasmas:
+            fantasmas = {f.id: f for f in _query_fantasmas_serializacao().filter(CartaoFantasma.id.in_(ids_fantasmas)).all()}
+            for fantasma_id in sorted(ids_fantasmas):
+                fantasma = fantasmas.get(fantasma_id)
+                if fantasma and fantasma.ativo and fantasma.ordem_servico:
+                    updated_cards.append(_serialize_cartao_fantasma(fantasma, listas_por_nome))
+                else:
+                    deleted_cards.append(f"fantasma-{fantasma_id}")
+
+        payload = {
+            'success': True,
+            'has_changes': bool(resultado['alteracoes']),
+            'has_more': resultado['has_more'],
+            'reset': False,
+            'seq': resultado['seq'],
+            'updated_cards': updated_cards,
+            'deleted_cards': deleted_cards,
+            'new_cards': [],
+            'new_apontamentos': new_apontamentos,
+            'deleted_apontamentos': deleted_apontamentos,
+            'timestamp': local_now_naive().isoformat()
+        }
+        if ids_por_entidade.get('lista'):
+            payload['listas'] = [_serialize_lista(l) for l in listas]
+
+        resp = jsonify(payload)
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
+
+    except Exception as e:
+        current_app.logger.error(f'Erro no sync: {str(e)}')
+        return jsonify({'success': False, 'message': f'Erro ao sincronizar: {str(e)}'}), 500
+
+
+def _sync_por_timestamp():
+    """Sync legado por ``last_update`` (clientes com JS antigo em cache)"""
     try:
         last_update_str = request.args.get('last_update')
         if not last_update_str:
@@ -1315,29 +1542,27 @@ def sync():
         new_cards = []
         
         # Buscar cartões modificados desde last_update
-        ordens_modificadas = OrdemServico.query.filter(
+        ordens_modificadas = _query_ordens_serializacao().filter(
             OrdemServico.data_atualizacao >= last_update
         ).all()
-        if ordens_modificadas:
-            listas_map = {l.nome: l.id for l in KanbanLista.query.filter_by(ativa=True).all()}
-            for ordem in ordens_modificadas:
-                lista_id = listas_map.get(ordem.status)
-                if lista_id:
-                    updated_cards.append(_serialize_cartao(ordem, lista_id, False))
-                elif ordem.status == 'Finalizado':
-                    # OS finalizada deve ser removida do cache do cliente
-                    deleted_cards.append(ordem.id)
+        listas_por_nome = {l.nome: l for l in KanbanLista.query.filter_by(ativa=True).all()}
+        for ordem in ordens_modificadas:
+            lista = listas_por_nome.get(ordem.status)
+            if lista:
+                updated_cards.append(_serialize_cartao(ordem, lista.id, False))
+            elif ordem.status == 'Finalizado':
+                # OS finalizada deve ser removida do cache do cliente
+                deleted_cards.append(ordem.id)
 
         # Buscar cartões fantasma modificados desde last_update
-        fantasmas_modificados = CartaoFantasma.query.filter(
+        fantasmas_modificados = _query_fantasmas_serializacao().filter(
             CartaoFantasma.data_atualizacao >= last_update
         ).all()
-        if fantasmas_modificados:
-            for fantasma in fantasmas_modificados:
-                if fantasma.ativo:
-                    updated_cards.append(_serialize_cartao_fantasma(fantasma))
-                else:
-                    deleted_cards.append(f"fantasma-{fantasma.id}")
+        for fantasma in fantasmas_modificados:
+            if fantasma.ativo:
+                updated_cards.append(_serialize_cartao_fantasma(fantasma, listas_por_nome))
+            else:
+                deleted_cards.append(f"fantasma-{fantasma.id}")
 
         # Buscar novos apontamentos
         new_apontamentos = ApontamentoProducao.query.filter(
@@ -1375,8 +1600,8 @@ def _serialize_lista(lista):
     }
 
 
-def _serialize_cartao(ordem, lista_id, is_fantasma):
-    """Serializa um cartão (OS) para JSON"""
+def _serialize_cartao(ordem, lista_id, is_fantasma, tempos=None):
+    """Serializa um cartão (OS) para JSON (``tempos``: acumulados de ``_tempos_por_os``)"""
     # Buscar primeiro pedido
     pedido_info = None
     item_id = None
@@ -1416,8 +1641,8 @@ def _serialize_cartao(ordem, lista_id, is_fantasma):
 
         if pedido.item and not item_id:
             item_id = pedido.item.id
-        if pedido.item and getattr(pedido.item, 'imagem_path', None) and not item_imagem_path:
-            item_imagem_path = pedido.item.imagem_path
+        if pedido.item and pedido.item.imagem and not item_imagem_path:
+            item_imagem_path = pedido.item.imagem_thumb_path
 
         item_key = pedido.item_id if pedido.item_id else (pedido.nome_item or f'pedido-{pedido.id}')
         item_label = f"{item_codigo} - {item_nome}".strip(' -') or pedido.nome_item or 'Item sem nome'
@@ -1453,14 +1678,18 @@ def _serialize_cartao(ordem, lista_id, is_fantasma):
         'item_id': item_id,
         'item_imagem_path': item_imagem_path,
         'itens': itens,
+        'tempos': tempos,
         'search_text': ' '.join([part for part in search_parts if part]).strip()
     }
 
 
-def _serialize_cartao_fantasma(fantasma):
+def _serialize_cartao_fantasma(fantasma, listas_por_nome=None):
     """Serializa um cartão fantasma para JSON"""
     ordem = fantasma.ordem_servico
-    lista = KanbanLista.query.filter_by(nome=fantasma.lista_kanban).first()
+    if listas_por_nome is not None:
+        lista = listas_por_nome.get(fantasma.lista_kanban)
+    else:
+        lista = KanbanLista.query.filter_by(nome=fantasma.lista_kanban).first()
     lista_id = lista.id if lista else None
     lista_nome = lista.nome if lista else fantasma.lista_kanban
     base = _serialize_cartao(ordem, lista_id, True)
@@ -9,6 +9,7 @@ from sqlalchemy import desc
 from decimal import Decimal, InvalidOperation
 from models import db, Orcamento, OrcamentoItem, Cliente, Item, Usuario, EstoquePecas, ListaRetirada, ListaRetiradaItem, Pedido, UnidadeEntrega
 from utils import get_file_url
+from utils.busca import buscar_ids
 
 orcamentos_bp = Blueprint('orcamentos', __name__)
 
@@ -160,12 +161,8 @@ def index():
         query = query.filter(Orcamento.status == status_filtro)
     
     if busca:
-        query = query.filter(
-            or_(
-                Orcamento.numero.ilike(f'%{busca}%'),
-                Orcamento.cliente_nome.ilike(f'%{busca}%')
-            )
-        )
+        # Número/cliente pelo índice de busca (utils/busca.py)
+        query = query.filter(Orcamento.id.in_(buscar_ids('orcamento', busca, limite=1000)))
     
     if cliente_id:
         query = query.filter(Orcamento.cliente_id == cliente_id)
@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
-from models import db, OrdemServico, Pedido, PedidoOrdemServico, Item, ItemTrabalho, ItemTrabalhoProtecao, Protecao, Trabalho, TrabalhoProtecao
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, session, current_app
+from models import db, OrdemServico, Pedido, PedidoOrdemServico, Item, ItemTrabalho, ItemTrabalhoProtecao, Protecao, Trabalho, TrabalhoProtecao, KanbanLista
 from utils import validate_form_data, generate_next_code
-from datetime import datetime
+from utils.listagem import Listagem, CursorInvalido, responder_pagina, filtro_texto, filtro_data, PRIMEIRA_PAGINA_LISTAGEM
+from utils.exportacao_xlsx import iniciar_exportacao, obter_exportacao, status_exportacao
+from utils.impressao_lote import MIMETYPE_PDF, carregar_ordens, gerar_pdf_lote
+from datetime import datetime, date
+from sqlalchemy import func, select
+from sqlalchemy.orm import selectinload
 from sqlalchemy.exc import IntegrityError
+import os
 import re
 from flask import g
 
@@ -149,11 +155,53 @@ def _precisa_reconciliar_os_componente_por_composto(ordem_servico):
     # Se já há 1 AUTO por pedido original, não precisa.
     return len(pedidos_auto) < len(original_ids)
 
+def _listagem_ordens_servico():
+    """Listagem paginada de OS (tela /ordens-servico e /api/ordens-servico/lista)"""
+    return Listagem(
+        consulta=lambda: OrdemServico.query,
+        chave=OrdemServico.id,
+        ordenacoes={
+            'recentes': [(OrdemServico.id, 'desc')],
+            'numero': [(func.coalesce(OrdemServico.numero, ''), 'desc')],
+            'data_criacao': [(func.coalesce(OrdemServico.data_criacao, date(1900, 1, 1)), 'desc')],
+        },
+        ordem_padrao='recentes',
+        campos={
+            'id': OrdemServico.id,
+            'numero': OrdemServico.numero,
+            'data_criacao': OrdemServico.data_criacao,
+            'status': OrdemServico.status,
+            'pedidos': select(func.count(PedidoOrdemServico.id))
+                .where(PedidoOrdemServico.ordem_servico_id == OrdemServico.id)
+                .scalar_subquery(),
+        },
+        filtros={
+            'status': lambda query, valores: query.filter(OrdemServico.status.in_(valores)),
+            'numero': filtro_texto(OrdemServico.numero),
+            'data_inicio': filtro_data(OrdemServico.data_criacao, '>='),
+            'data_fim': filtro_data(OrdemServico.data_criacao, '<='),
+        },
+        opcoes_carga=(selectinload(OrdemServico.pedidos),),
+    )
+
+
 @ordens.route('/ordens-servico')
 def listar_ordens_servico():
     """Rota para listar todas as ordens de serviço"""
-    ordens = OrdemServico.query.all()
-    return render_template('ordens/listar.html', ordens=ordens)
+    # Só a primeira página vem no HTML; o restante é carregado pela API
+    try:
+        pagina = _listagem_ordens_servico().paginar(request.args, limite=PRIMEIRA_PAGINA_LISTAGEM)
+    except CursorInvalido:
+        return redirect(url_for('ordens.listar_ordens_servico'))
+    listas_kanban = KanbanLista.query.order_by(KanbanLista.ordem).all()
+    return render_template('ordens/listar.html', ordens=pagina.registros, proximo_cursor=pagina.proximo_cursor,
+                           listas_kanban=listas_kanban)
+
+
+@ordens.route('/api/ordens-servico/lista')
+def api_listar_ordens_servico():
+    """OS paginadas por cursor (JSON com colunas projetadas ou linhas HTML)"""
+    return responder_pagina(_listagem_ordens_servico(), 'ordens/_linhas.html', 'ordens')
 
 
 @ordens.route('/ordens-servico/visualizar/<int:ordem_id>')
@@ -308,3 +356,76 @@ def imprimir_desenho(ordem_id):
     """Rota para imprimir desenhos técnicos de uma ordem de serviço"""
     ordem = OrdemServico.query.get_or_404(ordem_id)
     return render_template('ordens/imprimir_desenho.html', ordem=ordem)
+
+
+@ordens.route('/ordens-servico/imprimir-lote', methods=['POST'])
+def imprimir_lote_ordens_servico():
+    """Gera em segundo plano um único PDF com várias OS (ids ou uma lista do Kanban) e seus desenhos"""
+    if request.headers.get('X-Requested-With') != 'XMLHttpRequest':
+        return redirect(url_for('ordens.listar_ordens_servico'))
+
+    lista = (request.form.get('lista') or '').strip() or None
+    try:
+        ordem_ids = [int(i) for i in request.form.getlist('ordem_ids[]') or request.form.getlist('ordem_ids')]
+    except ValueError:
+        return jsonify({'ok': False, 'mensagem': 'IDs de OS inválidos.'}), 400
+    if not lista and not ordem_ids:
+        return jsonify({'ok': False, 'mensagem': 'Selecione as OS ou uma lista do Kanban.'}), 400
+
+    def _gerar(caminho, progresso):
+        # Importação tardia: routes.itens concentra o acesso aos desenhos
+        from routes.itens import _get_item_desenho_pdf_bytes, _stamp_pdf_approved
+
+        progresso(percentual=1, mensagem='Carregando ordens de serviço...')
+        ordens_lote = carregar_ordens(ordem_ids=ordem_ids, lista=lista)
+        if not ordens_lote:
+            raise ValueError('nenhuma OS encontrada')
+        gerar_pdf_lote(caminho, ordens_lote, lambda item: _get_item_desenho_pdf_bytes(item)[0],
+                       _stamp_pdf_approved, progresso)
+
+    nome = re.sub(r'[^A-Za-z0-9_-]+', '_', lista or 'selecionadas').strip('_') or 'lote'
+    export_id = iniciar_exportacao(
+        current_app._get_current_object(),
+        _gerar,
+        f'ordens_servico_{nome}.pdf',
+        sufixo='.pdf',
+        descricao='PDF',
+        mensagem_pronto='PDF pronto para download.',
+        usuario_id=session.get('usuario_id'),
+    )
+
+    return jsonify({
+        'ok': True,
+        'export_id': export_id,
+        'status_url': url_for('ordens.status_imprimir_lote_ordens_servico', export_id=export_id),
+        'download_url': url_for('ordens.download_imprimir_lote_ordens_servico', export_id=export_id),
+    })
+
+
+@ordens.route('/ordens-servico/imprimir-lote/status/<export_id>')
+def status_imprimir_lote_ordens_servico(export_id):
+    exportacao = obter_exportacao(export_id)
+    if not exportacao or exportacao.get('usuario_id') != session.get('usuario_id'):
+        return jsonify({'ok': False, 'mensagem': 'Impressão não encontrada.'}), 404
+
+    return jsonify(status_exportacao(exportacao))
+
+
+@ordens.route('/ordens-servico/imprimir-lote/download/<export_id>')
+def download_imprimir_lote_ordens_servico(export_id):
+    exportacao = obter_exportacao(export_id)
+    if not exportacao or exportacao.get('usuario_id') != session.get('usuario_id'):
+        flash('Impressão não encontrada ou expirada.', 'danger')
+        return redirect(url_for('ordens.listar_ordens_servico'))
+
+    if exportacao.get('status') != 'pronto' or not os.path.exists(exportacao.get('caminho') or ''):
+        flash('O PDF ainda não está pronto para download.', 'warning')
+        return redirect(url_for('ordens.listar_ordens_servico'))
+
+    # inline: abre no visualizador do navegador, de onde o planejador imprime
+    return send_file(
+        exportacao['caminho'],
+        mimetype=MIMETYPE_PDF,
+        as_attachment=False,
+        download_name=exportacao.get('nome_arquivo', 'ordens_servico.pdf'),
+    )
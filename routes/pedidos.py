@@ -1,11 +1,15 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, session
 from models import db, Pedido, Cliente, UnidadeEntrega, Item, PedidoOrdemServico, OrdemServico, Material, Trabalho, PedidoMaterial, ItemPedidoMaterial, ItemMaterial, ItemComposto, PedidoMontagem, ItemPedidoMontagem
 from utils import validate_form_data, parse_json_field, generate_next_code, generate_next_os_code
+from utils.listagem import Listagem, CursorInvalido, responder_pagina, filtro_texto, filtro_data, filtro_ids, PRIMEIRA_PAGINA_LISTAGEM
+from utils.importacao_excel import (
+    PlanilhaInvalida, ler_planilha, chave_texto, em_lotes, mapa_por_texto,
+    salvar_linhas, carregar_linhas, remover_linhas, registrar_auditoria,
+)
 from datetime import datetime
 import logging
-from sqlalchemy import and_
-from sqlalchemy.orm import joinedload
-from openpyxl import load_workbook
+from sqlalchemy import and_, or_, func, insert
+from sqlalchemy.orm import joinedload, contains_eager
 from datetime import date
 import re
 import unicodedata
@@ -87,10 +91,43 @@ def _generate_next_pedido_code():
     return "PED-00001"
 
 
+def _normalizar_codigo_item_excel(item_s):
+    """Itens/códigos podem vir como número no Excel (ex.: 123 vira 123.0)"""
+    if item_s.endswith('.0'):
+        try:
+            return str(int(float(item_s)))
+        except Exception:
+            pass
+    return item_s
+
+
+def _carregar_referencias_importacao(linhas):
+    """Clientes, unidades e itens citados na planilha, em poucas consultas."""
+    clientes = {}
+    for cliente in db.session.query(Cliente.id, Cliente.nome).order_by(Cliente.id).all():
+        clientes.setdefault(chave_texto(cliente.nome), cliente.id)
+
+    ids_clientes = {clientes[chave_texto(l['cliente'])] for l in linhas if chave_texto(l['cliente']) in clientes}
+    unidades = {}
+    if ids_clientes:
+        for unidade in (
+            db.session.query(UnidadeEntrega.id, UnidadeEntrega.cliente_id, UnidadeEntrega.nome)
+            .filter(UnidadeEntrega.cliente_id.in_(ids_clientes))
+            .order_by(UnidadeEntrega.id)
+            .all()
+        ):
+            unidades.setdefault((unidade.cliente_id, chave_texto(unidade.nome)), unidade.id)
+
+    textos_itens = {l['item'] for l in linhas if l['item']}
+    consulta_itens = db.session.query(Item.id, Item.codigo_acb, Item.nome)
+    itens_por_codigo = mapa_por_texto(consulta_itens, Item.codigo_acb, textos_itens)
+    itens_por_nome = mapa_por_texto(consulta_itens, Item.nome, textos_itens - set(itens_por_codigo))
+    return clientes, unidades, itens_por_codigo, itens_por_nome
+
+
 @pedidos.route('/pedidos/importar-excel', methods=['GET', 'POST'])
 def importar_pedidos_excel():
     if request.method == 'GET':
-        session.pop('import_pedidos_excel_rows', None)
         return render_template('pedidos/importar_excel.html')
 
     arquivo = request.files.get('arquivo')
@@ -99,151 +136,134 @@ def importar_pedidos_excel():
         return redirect(url_for('pedidos.importar_pedidos_excel'))
 
     try:
-        wb = load_workbook(arquivo, data_only=True)
-        ws = wb.active
-    except Exception as e:
-        flash(f'Erro ao ler XLSX: {e}', 'danger')
-        return redirect(url_for('pedidos.importar_pedidos_excel'))
-
-    header_row = None
-    for row in ws.iter_rows(min_row=1, max_row=1, values_only=True):
-        header_row = row
-        break
-    if not header_row:
-        flash('XLSX vazio ou sem cabeçalho.', 'danger')
+        headers, col_index, linhas_planilha = ler_planilha(arquivo, _canonical_column_name)
+    except PlanilhaInvalida as e:
+        flash(str(e), 'danger')
         return redirect(url_for('pedidos.importar_pedidos_excel'))
 
-    headers = [_canonical_column_name(h) for h in header_row]
-    col_index = {}
-    for i, h in enumerate(headers):
-        if not h:
-            continue
-        # Não sobrescrever primeira ocorrência (evita confusão se existir coluna repetida)
-        col_index.setdefault(h, i)
-
     required = ['cliente', 'unidade', 'item', 'quantidade', 'numero_pedido_cliente']
     missing = [c for c in required if c not in col_index]
     if missing:
+        linhas_planilha.close()
         encontrados = [h for h in headers if h]
         flash('Colunas obrigatórias ausentes no Excel: ' + ', '.join(missing), 'danger')
         flash('Cabeçalhos encontrados: ' + ', '.join(encontrados[:30]) + ('...' if len(encontrados) > 30 else ''), 'warning')
         return redirect(url_for('pedidos.importar_pedidos_excel'))
 
-    preview_rows = []
-    ok_rows = []
-    ok_count = 0
-    err_count = 0
-    warn_count = 0
-
     prazo_col = col_index.get('prazo_entrega')
 
-    for row_number, values in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
-        cliente_nome = (values[col_index['cliente']] or '')
-        unidade_nome = (values[col_index['unidade']] or '')
-        item_val = (values[col_index['item']] or '')
+    # 1ª passada: leitura e validação do conteúdo de cada linha
+    linhas = []
+    for row_number, values in linhas_planilha:
         quantidade_val = values[col_index['quantidade']]
-        numero_pedido_cliente = (values[col_index['numero_pedido_cliente']] or '')
         prazo_entrega_val = values[prazo_col] if prazo_col is not None else None
-
-        errors = []
-        warnings = []
-        cliente_nome_s = str(cliente_nome).strip()
-        unidade_nome_s = str(unidade_nome).strip()
-        item_s = str(item_val).strip()
-        numero_pedido_cliente_s = str(numero_pedido_cliente).strip()
-        prazo = _parse_date_cell(prazo_entrega_val)
+        linha = {
+            'row_number': row_number,
+            'cliente': str(values[col_index['cliente']] or '').strip(),
+            'unidade': str(values[col_index['unidade']] or '').strip(),
+            'item': str(values[col_index['item']] or '').strip(),
+            'numero_pedido_cliente': str(values[col_index['numero_pedido_cliente']] or '').strip(),
+            'prazo': _parse_date_cell(prazo_entrega_val),
+            'quantidade': None,
+            'errors': [],
+            'warnings': [],
+        }
 
         # Pular linhas totalmente vazias
-        if not any([cliente_nome_s, unidade_nome_s, item_s, numero_pedido_cliente_s, str(quantidade_val or '').strip(), prazo_entrega_val]):
+        if not any([linha['cliente'], linha['unidade'], linha['item'], linha['numero_pedido_cliente'],
+                    str(quantidade_val or '').strip(), prazo_entrega_val]):
             continue
 
-        if not cliente_nome_s:
+        errors = linha['errors']
+        if not linha['cliente']:
             errors.append('Cliente vazio')
-        if not unidade_nome_s:
+        if not linha['unidade']:
             errors.append('Unidade vazia')
-        if not item_s:
+        if not linha['item']:
             errors.append('Item vazio')
-        if not numero_pedido_cliente_s:
+        if not linha['numero_pedido_cliente']:
             errors.append('Nº pedido cliente vazio')
         # Prazo de entrega é opcional (pode ficar em branco)
-        if prazo_entrega_val not in (None, '') and prazo is None:
+        if prazo_entrega_val not in (None, '') and linha['prazo'] is None:
             errors.append('Prazo entrega inválido')
 
         try:
             if isinstance(quantidade_val, float) and quantidade_val.is_integer():
                 quantidade_val = int(quantidade_val)
-            quantidade_int = int(str(quantidade_val).strip())
-            if quantidade_int <= 0:
+            linha['quantidade'] = int(str(quantidade_val).strip())
+            if linha['quantidade'] <= 0:
                 errors.append('Quantidade deve ser > 0')
         except Exception:
-            quantidade_int = None
             errors.append('Quantidade inválida')
 
-        cliente = None
-        unidade = None
-        item = None
+        linha['item'] = _normalizar_codigo_item_excel(linha['item'])
+        linhas.append(linha)
+
+    # 2ª passada: referências resolvidas contra os dicionários carregados de uma vez
+    clientes, unidades, itens_por_codigo, itens_por_nome = _carregar_referencias_importacao(linhas)
 
-        if cliente_nome_s:
-            cliente = Cliente.query.filter(Cliente.nome.ilike(cliente_nome_s)).first()
-            if not cliente:
-                errors.append('Cliente não encontrado')
-
-        if cliente and unidade_nome_s:
-            unidade = UnidadeEntrega.query.filter(
-                UnidadeEntrega.cliente_id == cliente.id,
-                UnidadeEntrega.nome.ilike(unidade_nome_s)
-            ).first()
-            if not unidade:
+    preview_rows = []
+    ok_rows = []
+    ok_count = 0
+    err_count = 0
+    warn_count = 0
+
+    for linha in linhas:
+        errors, warnings = linha['errors'], linha['warnings']
+        cliente_id = clientes.get(chave_texto(linha['cliente'])) if linha['cliente'] else None
+        if linha['cliente'] and not cliente_id:
+            errors.append('Cliente não encontrado')
+
+        unidade_id = None
+        if cliente_id and linha['unidade']:
+            unidade_id = unidades.get((cliente_id, chave_texto(linha['unidade'])))
+            if not unidade_id:
                 errors.append('Unidade não encontrada para o cliente')
 
-        if item_s:
-            # Itens/códigos podem vir como número no Excel (ex.: 123 vira 123.0)
-            if item_s.endswith('.0'):
-                try:
-                    item_s = str(int(float(item_s)))
-                except Exception:
-                    pass
-            item = Item.query.filter(Item.codigo_acb.ilike(item_s)).first()
-            if not item:
-                item = Item.query.filter(Item.nome.ilike(item_s)).first()
+        item = None
+        if linha['item']:
+            chave_item = chave_texto(linha['item'])
+            item = itens_por_codigo.get(chave_item) or itens_por_nome.get(chave_item)
             # Item pode não existir no cadastro: nesse caso, vamos importar como nome_item
             if not item:
                 warnings.append('Item não cadastrado: será importado como texto (cadastre depois)')
 
-        prazo_str = prazo.strftime('%d/%m/%Y') if prazo else ''
+        prazo = linha['prazo']
         ok = len(errors) == 0
         if ok:
             ok_count += 1
             if warnings:
                 warn_count += 1
             ok_rows.append({
-                'cliente_id': cliente.id,
-                'unidade_entrega_id': unidade.id,
+                'row_number': linha['row_number'],
+                'cliente_id': cliente_id,
+                'unidade_entrega_id': unidade_id,
                 'item_id': item.id if item else None,
-                'nome_item': None if item else item_s,
-                'quantidade': quantidade_int,
-                'numero_pedido_cliente': numero_pedido_cliente_s,
+                'nome_item': None if item else linha['item'],
+                'quantidade': linha['quantidade'],
+                'numero_pedido_cliente': linha['numero_pedido_cliente'],
                 'previsao_entrega': prazo.isoformat() if prazo else None,
             })
         else:
             err_count += 1
 
         preview_rows.append({
-            'row_number': row_number,
-            'cliente': cliente_nome_s,
-            'unidade': unidade_nome_s,
-            'item': item_s,
-            'quantidade': '' if quantidade_int is None else quantidade_int,
-            'numero_pedido_cliente': numero_pedido_cliente_s,
-            'prazo_entrega': prazo_str,
+            'row_number': linha['row_number'],
+            'cliente': linha['cliente'],
+            'unidade': linha['unidade'],
+            'item': linha['item'],
+            'quantidade': '' if linha['quantidade'] is None else linha['quantidade'],
+            'numero_pedido_cliente': linha['numero_pedido_cliente'],
+            'prazo_entrega': prazo.strftime('%d/%m/%Y') if prazo else '',
             'ok': ok,
             'errors': errors,
             'warnings': warnings,
         })
 
-    session['import_pedidos_excel_rows'] = ok_rows
+    import_id = salvar_linhas('pedidos', ok_rows) if ok_rows and not err_count else None
     return render_template(
         'pedidos/importar_excel.html',
+        import_id=import_id,
         preview_rows=preview_rows,
         preview_ok_count=ok_count,
         preview_error_count=err_count,
@@ -253,7 +273,8 @@ def importar_pedidos_excel():
 
 @pedidos.route('/pedidos/importar-excel/confirmar', methods=['POST'])
 def confirmar_importacao_pedidos_excel():
-    ok_rows = session.get('import_pedidos_excel_rows')
+    import_id = request.form.get('import_id')
+    ok_rows, _ = carregar_linhas(import_id, 'pedidos')
     if not ok_rows:
         flash('Nenhuma importação pendente. Faça o upload do Excel novamente.', 'warning')
         return redirect(url_for('pedidos.importar_pedidos_excel'))
@@ -266,33 +287,48 @@ def confirmar_importacao_pedidos_excel():
             k = (r['cliente_id'], r['unidade_entrega_id'], r['numero_pedido_cliente'], r.get('previsao_entrega'))
             grupos.setdefault(k, []).append(r)
 
-        for _, linhas in grupos.items():
-            numero_interno = _generate_next_pedido_code()
+        # Um número interno por grupo, sequenciais a partir do próximo livre
+        proximo = _generate_next_pedido_code()
+        prefixo, _, inicial = proximo.rpartition('-')
+        inicial = int(inicial)
+
+        novos = []
+        for indice, linhas in enumerate(grupos.values()):
+            numero_interno = f"{prefixo}-{str(inicial + indice).zfill(5)}"
             for r in linhas:
                 previsao_entrega = None
                 if r.get('previsao_entrega'):
                     previsao_entrega = datetime.strptime(r['previsao_entrega'], '%Y-%m-%d').date()
+                novos.append({
+                    'numero_pedido': numero_interno,
+                    'numero_pedido_cliente': r['numero_pedido_cliente'],
+                    'cliente_id': r['cliente_id'],
+                    'unidade_entrega_id': r['unidade_entrega_id'],
+                    'item_id': r.get('item_id'),
+                    'nome_item': r.get('nome_item'),
+                    'quantidade': r['quantidade'],
+                    'data_entrada': data_entrada,
+                    'previsao_entrega': previsao_entrega,
+                    'descricao': None,
+                })
 
-                novo_pedido = Pedido(
-                    numero_pedido=numero_interno,
-                    numero_pedido_cliente=r['numero_pedido_cliente'],
-                    cliente_id=r['cliente_id'],
-                    unidade_entrega_id=r['unidade_entrega_id'],
-                    item_id=r.get('item_id'),
-                    nome_item=r.get('nome_item'),
-                    quantidade=r['quantidade'],
-                    data_entrada=data_entrada,
-                    previsao_entrega=previsao_entrega,
-                    descricao=None,
-                )
-                db.session.add(novo_pedido)
+        for lote in em_lotes(novos):
+            db.session.execute(insert(Pedido), lote)
 
+        registrar_auditoria('Pedido', import_id, len(novos), {
+            'numeros_pedido': [f"{prefixo}-{str(inicial).zfill(5)}", f"{prefixo}-{str(inicial + len(grupos) - 1).zfill(5)}"],
+        })
+        remover_linhas(import_id, 'pedidos')
         db.session.commit()
-        session.pop('import_pedidos_excel_rows', None)
         flash(f'Importação concluída com sucesso! Itens importados: {len(ok_rows)}', 'success')
         return redirect(url_for('pedidos.listar_pedidos'))
     except Exception as e:
         db.session.rollback()
+        logger.error(f"Erro ao importar pedidos: {str(e)}")
+        flash(f'Erro ao importar pedidos: {e}', 'danger')
+        return redirect(url_for('pedidos.importar_pedidos_excel'))
+
+
 @pedidos.route('/pedidos/gerar-os-multipla', methods=['POST'])
 def gerar_ordem_servico_multipla():
     """Rota para gerar ordens de serviço para vários pedidos selecionados"""
@@ -1117,29 +1153,112 @@ def novo_pedido():
     itens = Item.query.all()
     return render_template('pedidos/novo.html', clientes=clientes, itens=itens)
 
+def _nao_cancelado():
+    return (Pedido.cancelado == False) | (Pedido.cancelado == None)
+
+
+def _filtro_status_pedidos(query, valores):
+    """Mesmas regras da property Pedido.status, em SQL."""
+    hoje = date.today()
+    em_aberto = and_(_nao_cancelado(), Pedido.data_entrega == None)
+    condicoes = {
+        'cancelado': Pedido.cancelado == True,
+        'entregue': and_(_nao_cancelado(), Pedido.data_entrega != None),
+        'atrasado': and_(em_aberto, Pedido.previsao_entrega < hoje),
+        'pendente': and_(em_aberto, or_(Pedido.previsao_entrega == None, Pedido.previsao_entrega >= hoje)),
+    }
+    selecionadas = [condicoes[v.lower()] for v in valores if v.lower() in condicoes]
+    return query.filter(or_(*selecionadas)) if selecionadas else query
+
+
+def _listagem_pedidos(mostrar_todos=False):
+    """Listagem paginada de pedidos (tela /pedidos e /api/pedidos/lista)"""
+    def consulta():
+        query = (
+            Pedido.query
+            .outerjoin(Cliente, Pedido.cliente_id == Cliente.id)
+            .outerjoin(UnidadeEntrega, Pedido.unidade_entrega_id == UnidadeEntrega.id)
+            .outerjoin(Item, Pedido.item_id == Item.id)
+            .filter((Pedido.numero_pedido == None) | (~Pedido.numero_pedido.like('AUTO-%')))
+        )
+        if not mostrar_todos:
+            # Ocultar entregues e cancelados por padrão
+            query = query.filter(_nao_cancelado(), Pedido.data_entrega == None)
+        return query
+
+    return Listagem(
+        consulta=consulta,
+        chave=Pedido.id,
+        ordenacoes={
+            'data_entrada': [(Pedido.data_entrada, 'desc')],
+            'previsao': [(func.coalesce(Pedido.previsao_entrega, date(9999, 12, 31)), 'asc')],
+            'cliente': [(func.coalesce(Cliente.nome, ''), 'asc')],
+            'id': [],
+        },
+        ordem_padrao='data_entrada',
+        campos={
+            'id': Pedido.id,
+            'numero_pedido': Pedido.numero_pedido,
+            'numero_pedido_cliente': Pedido.numero_pedido_cliente,
+            'cliente': Cliente.nome,
+            'unidade_entrega': UnidadeEntrega.nome,
+            'item_id': Pedido.item_id,
+            'item_codigo': Item.codigo_acb,
+            'item_nome': func.coalesce(Item.nome, Pedido.nome_item),
+            'quantidade': Pedido.quantidade,
+            'data_entrada': Pedido.data_entrada,
+            'numero_oc': Pedido.numero_oc,
+            'numero_pedido_material': Pedido.numero_pedido_material,
+            'numero_pedido_montagem': Pedido.numero_pedido_montagem,
+            'previsao_entrega': Pedido.previsao_entrega,
+            'data_entrega': Pedido.data_entrega,
+            'cancelado': Pedido.cancelado,
+        },
+        filtros={
+            'cliente': filtro_texto(Cliente.nome),
+            'cliente_id': filtro_ids(Pedido.cliente_id),
+            'item': filtro_texto(Item.codigo_acb, Item.nome, Pedido.nome_item),
+            'numero_pedido': filtro_texto(Pedido.numero_pedido_cliente, Pedido.numero_pedido),
+            'status': _filtro_status_pedidos,
+            'data_inicio': filtro_data(Pedido.data_entrada, '>='),
+            'data_fim': filtro_data(Pedido.data_entrada, '<='),
+            'previsao_inicio': filtro_data(Pedido.previsao_entrega, '>='),
+            'previsao_fim': filtro_data(Pedido.previsao_entrega, '<='),
+        },
+        opcoes_carga=(
+            contains_eager(Pedido.cliente),
+            contains_eager(Pedido.unidade_entrega),
+            contains_eager(Pedido.item),
+        ),
+    )
+
+
 @pedidos.route('/pedidos')
 def listar_pedidos():
     """Rota para listar todos os pedidos"""
     # Por padrão, ocultar pedidos entregues e cancelados (melhor visualização)
     # O usuário pode usar filtros para vê-los
     mostrar_todos = request.args.get('mostrar_todos', '0') == '1'
-    
-    query = Pedido.query.options(joinedload(Pedido.item)).filter(
-        (Pedido.numero_pedido == None) | (~Pedido.numero_pedido.like('AUTO-%'))
-    )
-    
-    if not mostrar_todos:
-        # Ocultar entregues e cancelados por padrão
-        query = query.filter(
-            (Pedido.cancelado == False) | (Pedido.cancelado == None),
-            (Pedido.data_entrega == None)
-        )
-    
-    pedidos = query.all()
-    for pedido in pedidos:
-        logger.debug("Pedido ID %s: numero_pedido_material = %s", pedido.id, pedido.numero_pedido_material if pedido.numero_pedido_material else 'N/A')
+
+    # Só a primeira página vem no HTML; o restante é carregado pela API
+    try:
+        pagina = _listagem_pedidos(mostrar_todos).paginar(request.args, limite=PRIMEIRA_PAGINA_LISTAGEM)
+    except CursorInvalido:
+        return redirect(url_for('pedidos.listar_pedidos', mostrar_todos=1 if mostrar_todos else None))
     clientes = Cliente.query.all()
-    return render_template('pedidos/listar.html', pedidos=pedidos, clientes=clientes)
+    return render_template(
+        'pedidos/listar.html',
+        pedidos=pagina.registros,
+        proximo_cursor=pagina.proximo_cursor,
+        clientes=clientes,
+    )
+
+
+@pedidos.route('/api/pedidos/lista')
+def api_listar_pedidos():
+    """Pedidos paginados por cursor (JSON com colunas projetadas ou linhas HTML)"""
+    mostrar_todos = request.args.get('mostrar_todos', '0') == '1'
+    return responder_pagina(_listagem_pedidos(mostrar_todos), 'pedidos/_linhas.html', 'pedidos')
 
 @pedidos.route('/pedidos/editar/<int:pedido_id>', methods=['GET', 'POST'])
 def editar_pedido(pedido_id):
@@ -1,5 +1,6 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, g, jsonify
 from models import db, PedidoConsumo, ItemPedidoConsumo, ItemConsumo, Item
+from utils.busca import buscar_ids
 from datetime import datetime
 import logging
 
@@ -167,15 +168,14 @@ def api_buscar_itens():
             })
 
     if tipo in ('sistema', 'todos'):
-        query = Item.query
         if q:
-            query = query.filter(
-                db.or_(
-                    Item.nome.ilike(f'%{q}%'),
-                    Item.codigo_acb.ilike(f'%{q}%'),
-                )
-            )
-        for it in query.order_by(Item.nome).limit(30).all():
+            # Índice de busca: código exato primeiro, depois prefixo e nome
+            ids = buscar_ids('item', q, limite=30)
+            por_id = {it.id: it for it in Item.query.filter(Item.id.in_(ids)).all()} if ids else {}
+            itens_sistema = [por_id[i] for i in ids if i in por_id]
+        else:
+            itens_sistema = Item.query.order_by(Item.nome).limit(30).all()
+        for it in itens_sistema:
             resultados.append({
                 'tipo': 'sistema',
                 'id': it.id,
@@ -0,0 +1,126 @@
+from flask import Blueprint, Response, request, jsonify, session
+import json
+import os
+import time
+import logging
+import threading
+
+from utils.barramento import barramento
+
+logger = logging.getLogger(__name__)
+
+tempo_real_bp = Blueprint('tempo_real', __name__)
+
+CANAIS_PERMITIDOS = {'kanban', 'apontamento', 'notificacoes'}
+
+# Cada stream ocupa um worker/thread enquanto estiver aberto: limite por processo
+_conexoes = {'abertas': 0, 'recusadas': 0}
+_conexoes_lock = threading.Lock()
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(1, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _sse_habilitado():
+    """SSE desligado por env ou em serverless (conexões longas não cabem no limite de execução)"""
+    if os.getenv('SSE_ATIVO', '1').strip().lower() in ('0', 'false', 'nao', 'não', 'no'):
+        return False
+    return not bool(os.getenv('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+
+
+def _reservar_conexao():
+    limite = _env_int('SSE_MAX_CONEXOES', 2)
+    with _conexoes_lock:
+        if _conexoes['abertas'] >= limite:
+            _conexoes['recusadas'] += 1
+            return False
+        _conexoes['abertas'] += 1
+        return True
+
+
+def _liberar_conexao():
+    with _conexoes_lock:
+        _conexoes['abertas'] = max(0, _conexoes['abertas'] - 1)
+
+
+def _formatar(evento):
+    linhas = []
+    if evento.get('id') is not None:
+        linhas.append(f"id: {evento['id']}")
+    linhas.append(f"event: {evento.get('canal', 'message')}")
+    linhas.append('data: ' + json.dumps({'tipo': evento.get('tipo'), 'dados': evento.get('dados') or {}}, default=str))
+    return '\n'.join(linhas) + '\n\n'
+
+
+@tempo_real_bp.route('/tempo-real/stream')
+def stream():
+    """
+    Canal Server-Sent Events com atualizações do chão de fábrica.
+
+    ``?canais=kanban,apontamento`` escolhe os canais. A conexão é encerrada após
+    ``SSE_MAX_DURACAO_S`` (padrão 120s) e o EventSource reconecta sozinho, o que
+    libera o worker periodicamente. Com SSE desabilitado responde 204, que faz o
+    EventSource desistir e o cliente voltar ao polling.
+
+    Cada stream prende um worker (sync) ou uma thread (gthread/gevent, ver
+    ``gunicorn.conf.py``). Acima de ``SSE_MAX_CONEXOES`` streams abertos no
+    processo (padrão 2) a resposta é só o evento ``ocupado`` com ``retry`` de
+    ``SSE_RETRY_OCUPADO_S`` (padrão 60s): o cliente segue no polling do
+    ``/kanban/sync`` e tenta o canal de novo depois.
+    """
+    if not session.get('usuario_id'):
+        return jsonify({'success': False, 'message': 'Não autorizado'}), 401
+    if not _sse_habilitado():
+        return Response(status=204)
+
+    canais = {c.strip() for c in (request.args.get('canais') or 'kanban,apontamento').split(',') if c.strip()}
+    canais &= CANAIS_PERMITIDOS
+    if not canais:
+        return jsonify({'success': False, 'message': 'Nenhum canal válido'}), 400
+
+    duracao_max = _env_int('SSE_MAX_DURACAO_S', 120)
+    intervalo_ping = _env_int('SSE_PING_S', 15)
+    retry_ocupado_ms = _env_int('SSE_RETRY_OCUPADO_S', 60) * 1000
+
+    def gerar():
+        if not _reservar_conexao():
+            yield f"retry: {retry_ocupado_ms}\nevent: ocupado\ndata: {{}}\n\n"
+            return
+        assinatura = barramento.assinar(canais)
+        fim = time.time() + duracao_max
+        try:
+            # retry: tempo de reconexão do EventSource; evento inicial confirma a conexão
+            yield f"retry: 3000\nevent: conectado\ndata: {json.dumps({'canais': sorted(canais)})}\n\n"
+            proximo_ping = time.time() + intervalo_ping
+            while time.time() < fim:
+                evento = assinatura.proximo(timeout=max(0.1, min(proximo_ping, fim) - time.time()))
+                if evento is not None:
+                    yield _formatar(evento)
+                if time.time() >= proximo_ping:
+                    yield ': ping\n\n'
+                    proximo_ping = time.time() + intervalo_ping
+        except GeneratorExit:
+            pass
+        finally:
+            assinatura.fechar()
+            _liberar_conexao()
+
+    resp = Response(gerar(), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@tempo_real_bp.route('/tempo-real/status')
+def status():
+    """Estatísticas do barramento (assinantes conectados, eventos publicados)"""
+    if not session.get('usuario_id'):
+        return jsonify({'success': False, 'message': 'Não autorizado'}), 401
+    with _conexoes_lock:
+        conexoes = dict(_conexoes, limite=_env_int('SSE_MAX_CONEXOES', 2))
+    return jsonify({'success': True, 'sse_habilitado': _sse_habilitado(), 'conexoes': conexoes,
+                    **barramento.get_stats()})
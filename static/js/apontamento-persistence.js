@@ -1567,6 +1567,7 @@ function iniciarPollingAutomatico() {
     
     // Polling automático iniciado silenciosamente
     
+    const conectadoSSE = Boolean(window.tempoReal && window.tempoReal.conectado);
     _pollingInterval = setInterval(() => {
         try {
             // Recarregar estado silenciosamente
@@ -1574,7 +1575,7 @@ function iniciarPollingAutomatico() {
         } catch (e) {
             console.warn('Erro no polling automático:', e);
         }
-    }, POLLING_INTERVAL_MS);
+    }, conectadoSSE ? POLLING_INTERVAL_TEMPO_REAL_MS : POLLING_INTERVAL_MS);
 }
 
 function pararPollingAutomatico() {
@@ -1584,6 +1585,40 @@ function pararPollingAutomatico() {
     }
 }
 
+// Canal SSE: aplica o status recebido na hora e recarrega o estado completo logo em seguida.
+// Enquanto conectado o polling fica espaçado; ao cair volta a POLLING_INTERVAL_MS.
+const POLLING_INTERVAL_TEMPO_REAL_MS = 60000;
+let _recarregarEstadoTimer = null;
+
+function agendarRecargaEstado() {
+    if (_recarregarEstadoTimer) {
+        clearTimeout(_recarregarEstadoTimer);
+    }
+    _recarregarEstadoTimer = setTimeout(() => {
+        _recarregarEstadoTimer = null;
+        carregarEstadoApontamentos();
+    }, 500);
+}
+
+if (window.tempoReal) {
+    window.tempoReal.on('apontamento', function(mensagem) {
+        const dados = (mensagem && mensagem.dados) || {};
+        if (dados.ordem_servico_id != null && dados.status && typeof atualizarStatusCartao === 'function') {
+            try { atualizarStatusCartao(dados.ordem_servico_id, dados.status); } catch (e) {}
+        }
+        agendarRecargaEstado();
+    });
+    window.tempoReal.onEstado(function(conectado) {
+        if (!_pollingInterval) {
+            return;
+        }
+        iniciarPollingAutomatico();
+        if (!conectado) {
+            agendarRecargaEstado();
+        }
+    });
+}
+
 // Inicializar ao carregar a página
 document.addEventListener('DOMContentLoaded', function() {
     // Pequeno delay para evitar conflitos com outros scripts
@@ -86,6 +86,11 @@ class KanbanCache {
             key: 'last_sync',
             timestamp: data.timestamp || new Date().toISOString()
         });
+        // Cursor do log de alterações (null quando o servidor não suporta sync por seq)
+        metadataStore.put({
+            key: 'last_seq',
+            seq: Number.isInteger(data.seq) ? data.seq : null
+        });
 
         return new Promise((resolve, reject) => {
             transaction.oncomplete = () => {
@@ -115,12 +120,14 @@ class KanbanCache {
         const cartoes = await this.getAllFromStore(transaction.objectStore('cartoes'));
         const apontamentos = await this.getAllFromStore(transaction.objectStore('apontamentos'));
         const metadata = await this.getFromStore(transaction.objectStore('metadata'), 'last_sync');
+        const seqMeta = await this.getFromStore(transaction.objectStore('metadata'), 'last_seq');
         
         return {
             listas,
             cartoes,
             apontamentos,
-            last_sync: metadata ? metadata.timestamp : null
+            last_sync: metadata ? metadata.timestamp : null,
+            last_seq: seqMeta && Number.isInteger(seqMeta.seq) ? seqMeta.seq : null
         };
     }
     
@@ -175,6 +182,57 @@ class KanbanCache {
         });
     }
     
+    /**
+     * Aplica um delta do /kanban/sync em uma única transação e grava o novo seq
+     */
+    async applyDelta(delta) {
+        if (!this.db) await this.init();
+
+        const transaction = this.db.transaction(
+            ['listas', 'cartoes', 'apontamentos', 'metadata'],
+            'readwrite'
+        );
+        const cartoesStore = transaction.objectStore('cartoes');
+        const apontamentosStore = transaction.objectStore('apontamentos');
+
+        if (Array.isArray(delta.listas)) {
+            const listasStore = transaction.objectStore('listas');
+            await this.clearStore(listasStore);
+            for (const lista of delta.listas) {
+                listasStore.put(lista);
+            }
+        }
+        for (const cartao of [...(delta.updated_cards || []), ...(delta.new_cards || [])]) {
+            if (cartao.status === 'Finalizado') {
+                cartoesStore.delete(cartao.id);
+            } else {
+                cartoesStore.put(cartao);
+            }
+        }
+        for (const cartaoId of delta.deleted_cards || []) {
+            cartoesStore.delete(cartaoId);
+        }
+        for (const apontamento of delta.new_apontamentos || []) {
+            apontamentosStore.put(apontamento);
+        }
+        for (const apontamentoId of delta.deleted_apontamentos || []) {
+            apontamentosStore.delete(apontamentoId);
+        }
+
+        const metadataStore = transaction.objectStore('metadata');
+        if (delta.timestamp) {
+            metadataStore.put({ key: 'last_sync', timestamp: delta.timestamp });
+        }
+        if (Number.isInteger(delta.seq)) {
+            metadataStore.put({ key: 'last_seq', seq: delta.seq });
+        }
+
+        return new Promise((resolve, reject) => {
+            transaction.oncomplete = () => resolve();
+            transaction.onerror = () => reject(transaction.error);
+        });
+    }
+    
     /**
      * Limpa todo o cache
      */
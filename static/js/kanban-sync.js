@@ -6,9 +6,14 @@
 class KanbanSync {
     constructor() {
         this.syncInterval = 10000; // 10 segundos
+        this.syncIntervalPolling = 10000;
+        this.syncIntervalTempoReal = 60000; // Com SSE conectado o polling é só rede de segurança
+        this.syncDebounceTimer = null;
         this.syncTimer = null;
         this.isSyncing = false;
         this.lastSync = null;
+        this.lastSeq = null;   // Cursor do log de alterações do servidor
+        this.etag = null;      // ETag da última resposta sem mudanças (304 quando nada mudou)
         this.onUpdateCallback = null;
         this.autoSyncEnabled = false;
     }
@@ -29,6 +34,7 @@ class KanbanSync {
 
         if (hasCache) {
             this.lastSync = cached.last_sync;
+            this.lastSeq = cached.last_seq;
         }
 
         if (hasCache) {
@@ -58,6 +64,43 @@ class KanbanSync {
         
         // Iniciar sync automático
         this.startAutoSync();
+        this.escutarTempoReal();
+    }
+
+    /**
+     * Eventos do canal SSE disparam um sync incremental imediato
+     * (agrupado em 300ms para rajadas de movimentações)
+     */
+    escutarTempoReal() {
+        if (!window.tempoReal) {
+            return;
+        }
+        window.tempoReal.on('kanban', () => this.agendarSyncImediato());
+        window.tempoReal.on('apontamento', () => this.agendarSyncImediato());
+        window.tempoReal.onEstado((conectado) => {
+            const intervalo = conectado ? this.syncIntervalTempoReal : this.syncIntervalPolling;
+            if (intervalo === this.syncInterval) {
+                return;
+            }
+            this.syncInterval = intervalo;
+            if (this.autoSyncEnabled) {
+                this.startAutoSync();
+            }
+            if (!conectado) {
+                // Pode ter perdido eventos durante a queda
+                this.agendarSyncImediato();
+            }
+        });
+    }
+
+    agendarSyncImediato() {
+        if (this.syncDebounceTimer) {
+            clearTimeout(this.syncDebounceTimer);
+        }
+        this.syncDebounceTimer = setTimeout(() => {
+            this.syncDebounceTimer = null;
+            this.incrementalSync();
+        }, 300);
     }
     
     /**
@@ -84,6 +127,8 @@ class KanbanSync {
             // Salvar no cache
             await window.kanbanCache.saveAll(data);
             this.lastSync = data.timestamp;
+            this.lastSeq = Number.isInteger(data.seq) ? data.seq : null;
+            this.etag = null;
             
             // Notificar UI
             if (this.onUpdateCallback) {
@@ -121,18 +166,53 @@ class KanbanSync {
             return;
         }
         
-        if (!this.lastSync) {
-            console.log('[Sync] Sem timestamp, fazendo full sync...');
+        if (!Number.isInteger(this.lastSeq) && !this.lastSync) {
+            console.log('[Sync] Sem cursor, fazendo full sync...');
             return await this.fullSync();
         }
         
-        console.log('[Sync] Incremental sync iniciado...');
         this.isSyncing = true;
+        let precisaFullSync = false;
         
         try {
-            const url = `/kanban/sync?last_update=${encodeURIComponent(this.lastSync)}`;
-            const response = await fetch(url);
+            if (Number.isInteger(this.lastSeq)) {
+                precisaFullSync = await this.syncPorSeq();
+            } else {
+                await this.syncPorTimestamp();
+            }
+        } catch (error) {
+            console.error('[Sync] Erro no incremental sync:', error);
+            
+            console.log('[Sync] Incremental falhou; mantendo cache local e tentando novamente no próximo ciclo.');
+        } finally {
+            this.isSyncing = false;
+        }
+
+        if (precisaFullSync) {
+            console.log('[Sync] Cursor fora da retenção do servidor, fazendo full sync...');
+            await this.fullSync();
+        }
+    }
+
+    /**
+     * Sync pelo log de alterações: pagina até has_more=false.
+     * Retorna true quando o servidor pede recarga completa (reset).
+     */
+    async syncPorSeq() {
+        let pagina = 0;
+        let continuar = true;
+        
+        while (continuar && pagina < 20) {
+            pagina += 1;
+            const headers = {};
+            if (this.etag) {
+                headers['If-None-Match'] = this.etag;
+            }
+            const response = await fetch(`/kanban/sync?since=${this.lastSeq}`, { headers, cache: 'no-store' });
             
+            if (response.status === 304) {
+                return false;
+            }
             if (!response.ok) {
                 throw new Error(`HTTP ${response.status}`);
             }
@@ -142,16 +222,16 @@ class KanbanSync {
             if (!delta.success) {
                 throw new Error(delta.message || 'Erro ao sincronizar');
             }
+            if (delta.reset) {
+                return true;
+            }
             
             if (delta.has_changes) {
                 console.log('[Sync] Mudanças detectadas:', delta);
+                this.etag = null;
                 
-                // Aplicar mudanças no cache
-                await this.applyDelta(delta);
-                
-                // Atualizar timestamp
-                this.lastSync = delta.timestamp;
-                await window.kanbanCache.updateLastSync(delta.timestamp);
+                // Aplicar mudanças e o novo seq no cache em uma transação
+                await window.kanbanCache.applyDelta(delta);
                 
                 // Notificar UI
                 if (this.onUpdateCallback) {
@@ -161,48 +241,65 @@ class KanbanSync {
                     });
                 }
             } else {
-                console.log('[Sync] Nenhuma mudança detectada');
+                // Nada mudou: guardar ETag para receber 304 nas próximas consultas
+                this.etag = response.headers.get('ETag');
             }
             
-        } catch (error) {
-            console.error('[Sync] Erro no incremental sync:', error);
-            
-            console.log('[Sync] Incremental falhou; mantendo cache local e tentando novamente no próximo ciclo.');
-        } finally {
-            this.isSyncing = false;
+            if (Number.isInteger(delta.seq)) {
+                this.lastSeq = delta.seq;
+            }
+            this.lastSync = delta.timestamp || this.lastSync;
+            continuar = Boolean(delta.has_more);
         }
+        return false;
     }
-    
+
     /**
-     * Aplica mudanças incrementais no cache
+     * Sync legado por timestamp (servidor sem log de alterações)
      */
-    async applyDelta(delta) {
-        // Atualizar cartões modificados (OS finalizada -> remover do cache)
-        if (delta.updated_cards && delta.updated_cards.length > 0) {
-            for (const cartao of delta.updated_cards) {
-                if (cartao.status === 'Finalizado') {
-                    await window.kanbanCache.deleteCartao(cartao.id);
-                } else {
-                    await window.kanbanCache.updateCartao(cartao);
-                }
-            }
+    async syncPorTimestamp() {
+        const url = `/kanban/sync?last_update=${encodeURIComponent(this.lastSync)}`;
+        const response = await fetch(url);
+        
+        if (!response.ok) {
+            throw new Error(`HTTP ${response.status}`);
         }
         
-        // Remover cartões deletados
-        if (delta.deleted_cards && delta.deleted_cards.length > 0) {
-            for (const cartaoId of delta.deleted_cards) {
-                await window.kanbanCache.deleteCartao(cartaoId);
-            }
+        const delta = await response.json();
+        
+        if (!delta.success) {
+            throw new Error(delta.message || 'Erro ao sincronizar');
         }
         
-        // Adicionar novos cartões
-        if (delta.new_cards && delta.new_cards.length > 0) {
-            for (const cartao of delta.new_cards) {
-                await window.kanbanCache.updateCartao(cartao);
+        if (delta.has_changes) {
+            console.log('[Sync] Mudanças detectadas:', delta);
+            
+            // Aplicar mudanças no cache
+            await this.applyDelta(delta);
+            
+            // Atualizar timestamp
+            this.lastSync = delta.timestamp;
+            await window.kanbanCache.updateLastSync(delta.timestamp);
+            
+            // Notificar UI
+            if (this.onUpdateCallback) {
+                this.onUpdateCallback({
+                    type: 'incremental_update',
+                    delta: delta
+                });
             }
+        } else {
+            console.log('[Sync] Nenhuma mudança detectada');
         }
     }
     
+    /**
+     * Aplica mudanças incrementais no cache
+     */
+    async applyDelta(delta) {
+        await window.kanbanCache.applyDelta(delta);
+    }
+    
     /**
      * Inicia sincronização automática
      */
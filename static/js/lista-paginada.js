@@ -0,0 +1,85 @@
+/**
+ * Lista Paginada - carrega as páginas seguintes de uma listagem por cursor
+ *
+ * A página renderiza só o primeiro lote de linhas; este script busca os
+ * lotes seguintes na API (formato=html) e anexa as linhas ao DataTable,
+ * mantendo os mesmos filtros da URL atual (mostrar_todos, classe_id, ...).
+ *
+ * Uso:
+ *   carregarListaPaginada({
+ *       url: '/api/pedidos/lista',
+ *       cursor: '{{ proximo_cursor or "" }}',
+ *       tabela: table,                 // instância do DataTable
+ *       modais: '#estoqueModais',      // opcional: destino dos modais por linha (extras.modais)
+ *       aoCarregar: function(linhas) {} // opcional: após cada lote
+ *   });
+ */
+function carregarListaPaginada(opcoes) {
+    const tabela = opcoes.tabela;
+    const limite = opcoes.limite || 200;
+    let cursor = opcoes.cursor || '';
+    let cancelado = false;
+
+    if (!cursor || !tabela) {
+        return { cancelar: function() {} };
+    }
+
+    const params = new URLSearchParams(window.location.search);
+    Object.keys(opcoes.parametros || {}).forEach(function(chave) {
+        params.set(chave, opcoes.parametros[chave]);
+    });
+    params.set('formato', 'html');
+    params.set('limite', limite);
+
+    function mostrarProgresso(ativo) {
+        const container = $(tabela.table().container());
+        let aviso = container.find('.lista-paginada-carregando');
+        if (ativo && !aviso.length) {
+            aviso = $('<div class="lista-paginada-carregando text-muted small mt-2"><i class="fas fa-spinner fa-spin"></i> Carregando mais registros...</div>');
+            container.append(aviso);
+        } else if (!ativo) {
+            aviso.remove();
+        }
+    }
+
+    function proximaPagina() {
+        if (cancelado || !cursor) {
+            mostrarProgresso(false);
+            return;
+        }
+        params.set('cursor', cursor);
+        mostrarProgresso(true);
+
+        fetch(opcoes.url + '?' + params.toString(), { credentials: 'same-origin', headers: { 'Accept': 'application/json' } })
+            .then(function(resp) { return resp.json(); })
+            .then(function(dados) {
+                if (cancelado) return;
+                if (!dados.success) {
+                    throw new Error(dados.message || 'Falha ao carregar registros');
+                }
+                const linhas = $($.parseHTML((dados.html || '').trim(), document, false)).filter('tr');
+                if (opcoes.modais && dados.extras && dados.extras.modais) {
+                    $(opcoes.modais).append($.parseHTML(dados.extras.modais, document, false));
+                }
+                if (linhas.length) {
+                    // draw(false) preserva página, ordenação e busca atuais
+                    tabela.rows.add(linhas).draw(false);
+                }
+                if (typeof opcoes.aoCarregar === 'function') {
+                    opcoes.aoCarregar(linhas);
+                }
+                cursor = dados.tem_mais ? dados.proximo_cursor : '';
+                proximaPagina();
+            })
+            .catch(function(erro) {
+                console.error('[ListaPaginada] Erro ao carregar página:', erro);
+                mostrarProgresso(false);
+                if (typeof showToast === 'function') {
+                    showToast('Não foi possível carregar todos os registros. Recarregue a página.', 'warning');
+                }
+            });
+    }
+
+    proximaPagina();
+    return { cancelar: function() { cancelado = true; } };
+}
@@ -0,0 +1,183 @@
+/**
+ * Tempo Real (SSE)
+ * Recebe eventos do chão de fábrica via /tempo-real/stream.
+ *
+ * Os scripts de sync continuam com polling; enquanto o canal estiver
+ * conectado eles apenas espaçam as consultas. Se o servidor responder 204
+ * (SSE desabilitado/serverless) ou falhar repetidamente, o canal desiste e o
+ * polling volta ao intervalo normal. Com o limite de streams do processo
+ * atingido o servidor manda o evento "ocupado": o polling segue normal e o
+ * EventSource tenta de novo após o retry informado.
+ */
+
+class TempoReal {
+    constructor(canais) {
+        this.canais = canais;
+        this.fonte = null;
+        this.conectado = false;
+        this.desistiu = false;
+        this.falhas = 0;
+        this.maxFalhas = 5;
+        this.reconexaoTimer = null;
+        this.ouvintes = {};       // canal -> [callbacks]
+        this.ouvintesEstado = []; // callbacks(conectado)
+    }
+
+    /**
+     * Registra callback para um canal (kanban, apontamento, notificacoes).
+     * O callback recebe {tipo, dados}.
+     */
+    on(canal, callback) {
+        if (!this.ouvintes[canal]) {
+            this.ouvintes[canal] = [];
+            if (this.fonte) {
+                this._escutarCanal(canal);
+            }
+        }
+        this.ouvintes[canal].push(callback);
+        return this;
+    }
+
+    /**
+     * Registra callback para mudanças de conexão (true/false)
+     */
+    onEstado(callback) {
+        this.ouvintesEstado.push(callback);
+        return this;
+    }
+
+    disponivel() {
+        return typeof window.EventSource === 'function' && !this.desistiu;
+    }
+
+    conectar() {
+        if (!this.disponivel() || this.fonte) {
+            return;
+        }
+
+        const fonte = new EventSource(`/tempo-real/stream?canais=${encodeURIComponent(this.canais.join(','))}`);
+        this.fonte = fonte;
+        let confirmou = false;
+        let ocupado = false;
+
+        fonte.addEventListener('conectado', () => {
+            confirmou = true;
+            this.falhas = 0;
+            this._definirEstado(true);
+        });
+
+        fonte.addEventListener('ocupado', () => {
+            ocupado = true;
+            this._definirEstado(false);
+        });
+
+        fonte.onerror = () => {
+            this._definirEstado(false);
+
+            if (ocupado && fonte.readyState === EventSource.CONNECTING) {
+                // Servidor cheio: não conta como falha, o EventSource reconecta após o retry
+                ocupado = false;
+                return;
+            }
+
+            if (fonte.readyState === EventSource.CLOSED) {
+                // Resposta não-SSE (204/401/erro): o navegador não reconecta sozinho
+                this.fonte = null;
+                if (!confirmou) {
+                    this._desistir('servidor recusou o canal');
+                    return;
+                }
+                this._agendarReconexao();
+                return;
+            }
+
+            // CONNECTING: o próprio EventSource reconecta (inclusive ao fim de SSE_MAX_DURACAO_S)
+            if (!confirmou) {
+                this.falhas += 1;
+                if (this.falhas >= this.maxFalhas) {
+                    fonte.close();
+                    this.fonte = null;
+                    this._desistir('falhas repetidas');
+                }
+            }
+            confirmou = false;
+        };
+
+        Object.keys(this.ouvintes).forEach(canal => this._escutarCanal(canal));
+    }
+
+    desconectar() {
+        if (this.reconexaoTimer) {
+            clearTimeout(this.reconexaoTimer);
+            this.reconexaoTimer = null;
+        }
+        if (this.fonte) {
+            this.fonte.close();
+            this.fonte = null;
+        }
+        this._definirEstado(false);
+    }
+
+    _escutarCanal(canal) {
+        this.fonte.addEventListener(canal, (evento) => {
+            let mensagem;
+            try {
+                mensagem = JSON.parse(evento.data);
+            } catch (e) {
+                console.warn('[TempoReal] Evento inválido:', e);
+                return;
+            }
+            (this.ouvintes[canal] || []).forEach(callback => {
+                try {
+                    callback(mensagem);
+                } catch (e) {
+                    console.warn(`[TempoReal] Erro no ouvinte de ${canal}:`, e);
+                }
+            });
+        });
+    }
+
+    _agendarReconexao() {
+        this.falhas += 1;
+        if (this.falhas >= this.maxFalhas) {
+            this._desistir('falhas repetidas');
+            return;
+        }
+        // Backoff exponencial: 2s, 4s, 8s... até 60s
+        const espera = Math.min(60000, 1000 * Math.pow(2, this.falhas));
+        this.reconexaoTimer = setTimeout(() => {
+            this.reconexaoTimer = null;
+            this.conectar();
+        }, espera);
+    }
+
+    _desistir(motivo) {
+        this.desistiu = true;
+        console.log(`[TempoReal] Canal SSE indisponível (${motivo}); mantendo polling.`);
+        this._definirEstado(false);
+    }
+
+    _definirEstado(conectado) {
+        if (this.conectado === conectado) {
+            return;
+        }
+        this.conectado = conectado;
+        this.ouvintesEstado.forEach(callback => {
+            try {
+                callback(conectado);
+            } catch (e) {
+                console.warn('[TempoReal] Erro no ouvinte de estado:', e);
+            }
+        });
+    }
+}
+
+// Instância global
+window.tempoReal = new TempoReal(['kanban', 'apontamento']);
+
+document.addEventListener('DOMContentLoaded', () => {
+    // Pequeno atraso para os scripts registrarem os ouvintes antes da conexão
+    setTimeout(() => window.tempoReal.conectar(), 500);
+});
+
+window.addEventListener('online', () => window.tempoReal.conectar());
@@ -3,7 +3,7 @@
  * Cache de assets estáticos e stale-while-revalidate para páginas
  */
 
-const CACHE_VERSION = 'v12';
+const CACHE_VERSION = 'v15';
 const CACHE_STATIC = `linhamestre-static-${CACHE_VERSION}`;
 const CACHE_PAGES  = `linhamestre-pages-${CACHE_VERSION}`;
 const CACHE_MEDIA  = `linhamestre-media-${CACHE_VERSION}`;
@@ -29,6 +29,7 @@ const STATIC_ASSETS = [
     '/static/css/kanban-pwa.css',
     '/static/css/kanban-sortable.css',
     '/static/js/kanban-cache.js',
+    '/static/js/tempo-real.js',
     '/static/js/kanban-sync.js',
     '/static/js/kanban-pwa.js',
     '/static/js/kanban-card-click.js'
@@ -53,6 +54,7 @@ const BYPASS_PATTERNS = [
     '/apontamento/validar-codigo',
     '/apontamento/status-ativos',
     '/apontamento/status-cronometro',
+    '/tempo-real/',
     '/auth/'
 ];
 
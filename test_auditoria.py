@@ -0,0 +1,93 @@
+"""
+Testes da auditoria assíncrona (utils/auditoria.py)
+
+Captura no flush, gravação após o commit (direto e pelo spool) e descarte
+só no rollback da transação externa.
+
+Uso:
+    python -m pytest -q test_auditoria.py
+"""
+import json
+import os
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+
+from models import db, AuditLog, KanbanLista, Usuario
+from utils.auditoria import EscritorAuditoria, registrar_eventos_sessao
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'auditoria.db'}")
+    db.metadata.create_all(engine, tables=[Usuario.__table__, AuditLog.__table__, KanbanLista.__table__])
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def escritor(engine):
+    escritor = EscritorAuditoria()
+    escritor._engine = engine  # sem spool: grava direto após o commit
+    return escritor
+
+
+@pytest.fixture
+def Sessao(engine, escritor):
+    fabrica = sessionmaker(bind=engine)
+    registrar_eventos_sessao(fabrica, escritor)
+    return fabrica
+
+
+def _registros(engine):
+    tabela = AuditLog.__table__
+    with engine.connect() as conn:
+        return [
+            (linha.acao, linha.entidade_tipo, json.loads(linha.mudancas_json or '{}').get('nome', {}).get('new'))
+            for linha in conn.execute(select(tabela).order_by(tabela.c.id))
+        ]
+
+
+def test_commit_grava_registros(Sessao, engine):
+    with Sessao() as sessao:
+        sessao.add(KanbanLista(nome='Torno', ordem=1))
+        sessao.commit()
+    assert _registros(engine) == [('create', 'KanbanLista', 'Torno')]
+
+
+def test_rollback_descarta_registros(Sessao, engine):
+    with Sessao() as sessao:
+        sessao.add(KanbanLista(nome='Torno', ordem=1))
+        sessao.flush()
+        sessao.rollback()
+        sessao.add(KanbanLista(nome='Fresa', ordem=2))
+        sessao.commit()
+    assert _registros(engine) == [('create', 'KanbanLista', 'Fresa')]
+
+
+def test_savepoint_com_erro_nao_descarta_auditoria_da_transacao(Sessao, engine):
+    with Sessao() as sessao:
+        sessao.add(KanbanLista(nome='Torno', ordem=1))
+        sessao.flush()
+        with pytest.raises(IntegrityError):
+            with sessao.begin_nested():
+                sessao.add(KanbanLista(nome='Torno', ordem=9))  # nome duplicado
+                sessao.flush()
+        sessao.add(KanbanLista(nome='Fresa', ordem=2))
+        sessao.commit()
+    assert _registros(engine) == [('create', 'KanbanLista', 'Torno'), ('create', 'KanbanLista', 'Fresa')]
+
+
+def test_spool_grava_em_lote_ao_descarregar(Sessao, engine, escritor, tmp_path):
+    escritor.diretorio = str(tmp_path / 'spool')
+    os.makedirs(escritor.diretorio)
+    with Sessao() as sessao:
+        for n in range(3):
+            sessao.add(KanbanLista(nome=f'Lista {n}', ordem=n))
+            sessao.commit()
+    assert _registros(engine) == []  # ainda no spool
+    assert escritor.descarregar()
+    assert [nome for _, _, nome in _registros(engine)] == ['Lista 0', 'Lista 1', 'Lista 2']
+    assert escritor.pendentes() == 0
@@ -0,0 +1,80 @@
+"""
+Testes do arquivamento do audit_log no SQLite (utils/auditoria_arquivo.py)
+
+Meses antigos saem da tabela viva para audit_log_arquivo; o que passa da
+retenção vai para o .jsonl.gz do mês só depois do commit da remoção.
+
+Uso:
+    python -m pytest -q test_auditoria_arquivo.py
+"""
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, select
+
+from models import db, AuditLog, Usuario
+from utils import auditoria_arquivo
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'arquivo.db'}")
+    db.metadata.create_all(engine, tables=[Usuario.__table__, AuditLog.__table__])
+    recente = datetime.utcnow() - timedelta(days=1)
+    with engine.begin() as conn:
+        conn.execute(AuditLog.__table__.insert(), [
+            {'acao': 'update', 'entidade_tipo': 'Item', 'entidade_id': str(i), 'data_criacao': data}
+            for i, data in enumerate([datetime(2020, 1, 5), datetime(2020, 1, 20), datetime(2020, 2, 3), recente])
+        ])
+    yield engine
+    engine.dispose()
+
+
+def _contar(engine, tabela):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(tabela)).scalar()
+
+
+def _linhas_gz(caminho):
+    with gzip.open(caminho, 'rt', encoding='utf-8') as f:
+        return len(f.read().splitlines())
+
+
+def test_move_para_arquivo_e_exporta_alem_da_retencao(engine, tmp_path):
+    diretorio = str(tmp_path / 'auditoria')
+    os.makedirs(diretorio)
+
+    resumo = auditoria_arquivo.arquivar(engine, meses_ativos=1, meses_retencao=24, diretorio=diretorio)
+
+    assert resumo['movidas_arquivo'] == 3
+    assert resumo['exportadas'] == {'2020-01': 2, '2020-02': 1}
+    assert _contar(engine, AuditLog.__table__) == 1
+    assert _contar(engine, auditoria_arquivo.tabela_arquivo()) == 0
+    assert sorted(os.listdir(diretorio)) == ['audit_log_2020-01.jsonl.gz', 'audit_log_2020-02.jsonl.gz']
+    assert _linhas_gz(os.path.join(diretorio, 'audit_log_2020-01.jsonl.gz')) == 2
+
+
+def test_rollback_nao_publica_exportacao(engine, tmp_path, monkeypatch):
+    diretorio = str(tmp_path / 'auditoria')
+    os.makedirs(diretorio)
+    original = auditoria_arquivo._arquivar_periodo
+    chamadas = []
+
+    def falhar_na_segunda(conn, tabela, *args):
+        original(conn, tabela, *args)
+        chamadas.append(tabela.name)
+        if len(chamadas) == 2:
+            raise RuntimeError('falha simulada')
+
+    monkeypatch.setattr(auditoria_arquivo, '_arquivar_periodo', falhar_na_segunda)
+    with pytest.raises(RuntimeError):
+        auditoria_arquivo.arquivar(engine, meses_ativos=1, meses_retencao=24, diretorio=diretorio)
+    assert os.listdir(diretorio) == []
+    assert _contar(engine, auditoria_arquivo.tabela_arquivo()) == 3
+
+    monkeypatch.setattr(auditoria_arquivo, '_arquivar_periodo', original)
+    auditoria_arquivo.arquivar(engine, meses_ativos=1, meses_retencao=24, diretorio=diretorio)
+    assert _linhas_gz(os.path.join(diretorio, 'audit_log_2020-01.jsonl.gz')) == 2
+    assert _contar(engine, auditoria_arquivo.tabela_arquivo()) == 0
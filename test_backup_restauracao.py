@@ -0,0 +1,141 @@
+"""
+Testes da ordem da restauração (utils/backup_paralelo.py)
+
+Sem PostgreSQL disponível, as conexões são trocadas por um registro dos
+comandos enviados: o que importa aqui é que restrições, índices e FKs rodam
+no schema de carga antes da troca, e que uma falha neles descarta a carga
+sem tocar no public.
+
+Uso:
+    python -m pytest -q test_backup_restauracao.py
+"""
+import json
+import threading
+import zipfile
+
+import pytest
+
+from utils import backup_paralelo
+from utils.backup_paralelo import FORMATO, PASTA_BANCO, SCHEMA_CARGA, identificador
+
+CARGA = identificador(SCHEMA_CARGA)
+
+
+class _Cursor:
+    def __init__(self, banco):
+        self.banco = banco
+        self.rowcount = 0
+        self._resultado = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, parametros=None):
+        with self.banco['lock']:
+            self.banco['comandos'].append(sql)
+        if self.banco['falhar_em'] and self.banco['falhar_em'] in sql:
+            raise RuntimeError(f"could not create unique index: {sql[:40]}")
+        self._resultado = [('"cliente"',)] if "schemaname = 'public'" in sql else []
+
+    def fetchone(self):
+        return self._resultado[0] if self._resultado else (None,)
+
+    def fetchall(self):
+        return []
+
+    def copy_expert(self, sql, arquivo, size=None):
+        self.execute(sql)
+        self.rowcount = len(arquivo.read().decode('utf-8').splitlines()) - 1
+
+
+class _Conexao:
+    def __init__(self, banco):
+        self.banco = banco
+        self.autocommit = False
+
+    def cursor(self):
+        return _Cursor(self.banco)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def banco(monkeypatch):
+    banco = {'comandos': [], 'falhar_em': None, 'lock': threading.Lock()}
+    monkeypatch.setattr(backup_paralelo, 'conectar_postgresql', lambda conn_info: _Conexao(banco))
+    return banco
+
+
+@pytest.fixture
+def backup(tmp_path):
+    caminho = tmp_path / 'backup.zip'
+    manifesto = {
+        'formato': FORMATO,
+        'tabelas': [
+            {'nome': 'cliente', 'colunas': ['id', 'nome'], 'linhas': 2, 'arquivo': 'dados/cliente.csv'},
+            {'nome': 'pedido', 'colunas': ['id', 'cliente_id'], 'linhas': 1, 'arquivo': 'dados/pedido.csv'},
+        ],
+        'pos_carga': {
+            'extensoes': [],
+            'por_tabela': {
+                'cliente': [
+                    'ALTER TABLE cliente ADD CONSTRAINT cliente_pkey PRIMARY KEY (id)',
+                    'CREATE INDEX ix_cliente_nome ON public.cliente USING btree (nome)',
+                ],
+                'pedido': ['ALTER TABLE pedido ADD CONSTRAINT pedido_pkey PRIMARY KEY (id)'],
+            },
+            'chaves_estrangeiras': [
+                'ALTER TABLE pedido ADD CONSTRAINT pedido_cliente_id_fkey FOREIGN KEY (cliente_id) REFERENCES public.cliente(id)',
+            ],
+            'sequencias': [],
+        },
+    }
+    with zipfile.ZipFile(caminho, 'w') as zipf:
+        zipf.writestr(f'{PASTA_BANCO}/manifesto.json', json.dumps(manifesto))
+        zipf.writestr(f'{PASTA_BANCO}/esquema.sql', 'CREATE TABLE IF NOT EXISTS cliente (id integer, nome text);')
+        zipf.writestr(f'{PASTA_BANCO}/dados/cliente.csv', 'id,nome\n1,A\n2,B\n')
+        zipf.writestr(f'{PASTA_BANCO}/dados/pedido.csv', 'id,cliente_id\n1,1\n')
+    return str(caminho)
+
+
+def _posicao(comandos, trecho):
+    return next(i for i, sql in enumerate(comandos) if trecho in sql)
+
+
+def test_restricoes_e_indices_no_schema_de_carga_antes_da_troca(banco, backup):
+    resultado = backup_paralelo.restaurar_postgresql(backup, {})
+    comandos = banco['comandos']
+
+    assert resultado['linhas'] == 3
+    troca = _posicao(comandos, 'DROP TABLE IF EXISTS "cliente" CASCADE')
+    assert _posicao(comandos, 'cliente_pkey PRIMARY KEY') < troca
+    assert _posicao(comandos, f'ON {CARGA}.cliente USING btree') < troca
+    assert _posicao(comandos, f'REFERENCES {CARGA}.cliente(id)') < troca
+    assert all('ON public.' not in sql and 'REFERENCES public.' not in sql for sql in comandos)
+
+
+def test_chave_duplicada_descarta_carga_sem_tocar_no_public(banco, backup):
+    banco['falhar_em'] = 'cliente_pkey PRIMARY KEY'
+    with pytest.raises(Exception, match='cliente'):
+        backup_paralelo.restaurar_postgresql(backup, {})
+    comandos = banco['comandos']
+
+    assert not any(sql.startswith('DROP TABLE') for sql in comandos)
+    assert not any('SET SCHEMA public' in sql for sql in comandos)
+    assert comandos[-1] == f'DROP SCHEMA IF EXISTS {CARGA} CASCADE'
+
+
+def test_indice_de_tabela_particionada_sem_only():
+    definicao = 'CREATE INDEX ix_audit_log_data ON ONLY public.audit_log USING btree (data_criacao)'
+    assert backup_paralelo.definicao_indice(definicao) == \
+        'CREATE INDEX ix_audit_log_data ON public.audit_log USING btree (data_criacao)'
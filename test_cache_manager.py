@@ -0,0 +1,69 @@
+"""
+Testes do cache em memória (utils/cache_manager.py)
+
+Single-flight entre threads, invalidação por tags e recálculo aninhado de
+chaves que caem na mesma faixa de lock.
+
+Uso:
+    python -m pytest -q test_cache_manager.py
+"""
+import threading
+import time
+
+import pytest
+
+from utils.cache_manager import CacheManager, _N_LOCKS
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.delenv('REDIS_URL', raising=False)
+    monkeypatch.delenv('REDIS_TLS_URL', raising=False)
+    return CacheManager(max_entries=100)
+
+
+def test_single_flight_entre_threads(cache):
+    chamadas = []
+    inicio = threading.Barrier(8)
+
+    def calcular():
+        chamadas.append(1)
+        time.sleep(0.1)
+        return {'valor': 42}
+
+    resultados = []
+
+    def requisicao():
+        inicio.wait()
+        resultados.append(cache.get_or_set('dashboard:timeline:1', calcular, ttl=60))
+
+    threads = [threading.Thread(target=requisicao) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(chamadas) == 1
+    assert resultados == [{'valor': 42}] * 8
+
+
+def test_invalidacao_por_tag(cache):
+    cache.set('dashboard:timeline:1', 'a', ttl=60, tags=['lista:Torno'])
+    cache.set('dashboard:timeline:2', 'b', ttl=60, tags=['lista:Fresa'])
+
+    assert cache.invalidate_tags('lista:Torno') == 1
+    assert cache.get('dashboard:timeline:1') is None
+    assert cache.get('dashboard:timeline:2') == 'b'
+
+
+def test_recalculo_aninhado_na_mesma_faixa(cache):
+    externa = 'k:0'
+    interna = next(f'k:{n}' for n in range(1, 10_000) if hash(f'k:{n}') % _N_LOCKS == hash(externa) % _N_LOCKS)
+
+    valor = cache.get_or_set(externa, lambda: cache.get_or_set(interna, lambda: 'interna', ttl=60) + '+externa', ttl=60)
+
+    assert valor == 'interna+externa'
+
+
+def test_sem_redis_nao_e_compartilhado(cache):
+    assert not cache.compartilhado
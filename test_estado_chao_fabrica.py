@@ -0,0 +1,110 @@
+"""
+Testes do estado materializado do chão de fábrica (utils/estado_chao_fabrica.py)
+
+Reconstrução parcial pela marca d'água, reconstrução total e concorrência
+entre leituras (a consulta da marca não é serializada; a reconstrução é).
+
+Uso:
+    python -m pytest -q test_estado_chao_fabrica.py
+"""
+import threading
+import time
+
+from utils.estado_chao_fabrica import EstadoChaoFabrica
+
+
+class _Fonte:
+    """OS em memória + log de alterações com seq, no papel do banco"""
+
+    def __init__(self, os_ids, atraso_s=0.0):
+        self.dados = {os_id: f'OS {os_id} v0' for os_id in os_ids}
+        self.log = []
+        self.atraso_s = atraso_s
+        self.construcoes = []
+        self.lock = threading.Lock()
+
+    def alterar(self, os_id):
+        self.dados[os_id] = self.dados[os_id].rsplit(' v', 1)[0] + f' v{len(self.log) + 1}'
+        self.log.append(os_id)
+
+    def construtor(self, os_ids):
+        with self.lock:
+            self.construcoes.append(None if os_ids is None else set(os_ids))
+        time.sleep(self.atraso_s)
+        ids = self.dados if os_ids is None else os_ids
+        return {os_id: self.dados[os_id] for os_id in ids if os_id in self.dados}
+
+    def detectar(self, marca):
+        time.sleep(self.atraso_s)
+        seq = len(self.log)
+        if marca is None:
+            return seq, set()
+        return seq, set(self.log[marca:])
+
+
+def test_marca_dagua_reconstroi_so_as_os_alteradas():
+    fonte = _Fonte([1, 2, 3])
+    estado = EstadoChaoFabrica(max_idade_s=0)
+
+    entradas, info = estado.obter(fonte.construtor, fonte.detectar)
+    assert info['reconstrucao'] == 'total' and sorted(entradas) == ['OS 1 v0', 'OS 2 v0', 'OS 3 v0']
+
+    fonte.alterar(2)
+    entradas, info = estado.obter(fonte.construtor, fonte.detectar)
+    assert info['reconstrucao'] == 'parcial'
+    assert fonte.construcoes[-1] == {2}
+    assert 'OS 2 v1' in entradas
+
+    _, info = estado.obter(fonte.construtor, fonte.detectar)
+    assert info['reconstrucao'] is None
+
+
+def test_alteracao_global_reconstroi_tudo():
+    fonte = _Fonte([1, 2])
+    estado = EstadoChaoFabrica(max_idade_s=0)
+    estado.obter(fonte.construtor, fonte.detectar)
+
+    _, info = estado.obter(fonte.construtor, lambda marca: (marca, None))
+    assert info['reconstrucao'] == 'total'
+
+
+def test_leituras_concorrentes_nao_esperam_umas_pelas_outras():
+    fonte = _Fonte([1, 2, 3])
+    estado = EstadoChaoFabrica(max_idade_s=0)
+    estado.obter(fonte.construtor, fonte.detectar)
+    fonte.atraso_s = 0.2
+    largada = threading.Barrier(5)
+
+    def ler():
+        largada.wait()
+        estado.obter(fonte.construtor, fonte.detectar)
+
+    threads = [threading.Thread(target=ler) for _ in range(5)]
+    inicio = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # Serializadas seriam 5 × 0,2 s
+    assert time.monotonic() - inicio < 0.6
+
+
+def test_reconstrucao_total_concorrente_roda_uma_vez():
+    fonte = _Fonte([1, 2, 3], atraso_s=0.1)
+    estado = EstadoChaoFabrica(max_idade_s=0)
+    largada = threading.Barrier(5)
+    resultados = []
+
+    def ler():
+        largada.wait()
+        resultados.append(sorted(estado.obter(fonte.construtor, fonte.detectar)[0]))
+
+    threads = [threading.Thread(target=ler) for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert fonte.construcoes.count(None) == 1
+    assert resultados == [['OS 1 v0', 'OS 2 v0', 'OS 3 v0']] * 5
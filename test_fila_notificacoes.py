@@ -0,0 +1,87 @@
+"""
+Testes da caixa de saída de notificações (notificacoes/fila.py)
+
+Entrega pelo ``processar_pendentes`` (caminho do cron em serverless),
+intervalo mínimo por destino e reagendamento com backoff. O envio ao
+WhatsApp é substituído por um registro local.
+
+Uso:
+    python -m pytest -q test_fila_notificacoes.py
+"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import insert, select
+
+from models import db, NotificacaoSaida
+from notificacoes import fila, whatsapp
+from notificacoes.configuracao import ConfiguracaoNotificacoes
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'fila.db'}"
+    db.init_app(app)
+    with app.app_context():
+        NotificacaoSaida.__table__.create(db.engine)
+    monkeypatch.setattr(ConfiguracaoNotificacoes, 'FILA_INTERVALO_DESTINO_MS', 100)
+    monkeypatch.setattr(fila, '_destino_livre_em', {})
+    monkeypatch.setattr(fila, '_destinos_ocupados', set())
+    monkeypatch.setattr(fila, '_ultima_limpeza', 0.0)
+    return app
+
+
+def _enfileirar(destinos):
+    agora = datetime.utcnow() - timedelta(seconds=1)
+    with db.engine.begin() as conn:
+        for n, destino in enumerate(destinos):
+            conn.execute(insert(NotificacaoSaida.__table__).values(
+                tipo='teste', destino=destino, mensagem=f'mensagem {n}', eventos=1,
+                status='pendente', tentativas=0, proxima_tentativa_em=agora, criado_em=agora,
+            ))
+
+
+def _status():
+    tabela = NotificacaoSaida.__table__
+    with db.engine.connect() as conn:
+        return conn.execute(select(tabela.c.destino, tabela.c.status, tabela.c.tentativas).order_by(tabela.c.id)).all()
+
+
+def test_cron_esvazia_fila_respeitando_intervalo_do_destino(app, monkeypatch):
+    envios = []
+    monkeypatch.setattr(whatsapp, 'enviar_para_destino',
+                        lambda mensagem, destino, tentativa=1: envios.append((destino, time.monotonic())) or {'success': True})
+    with app.app_context():
+        _enfileirar(['a', 'a', 'a', 'b'])
+        processadas = fila.processar_pendentes(limite=10, prazo_s=5)
+
+        assert processadas == 4
+        assert [s for _, s, _ in _status()] == ['enviado'] * 4
+        horarios_a = [t for destino, t in envios if destino == 'a']
+        assert len(horarios_a) == 3
+        assert all(b - a >= 0.09 for a, b in zip(horarios_a, horarios_a[1:]))
+
+
+def test_prazo_curto_deixa_o_restante_na_fila(app, monkeypatch):
+    monkeypatch.setattr(ConfiguracaoNotificacoes, 'FILA_INTERVALO_DESTINO_MS', 10_000)
+    monkeypatch.setattr(whatsapp, 'enviar_para_destino', lambda mensagem, destino, tentativa=1: {'success': True})
+    with app.app_context():
+        _enfileirar(['a', 'a'])
+        inicio = time.monotonic()
+        assert fila.processar_pendentes(limite=10, prazo_s=1) == 1
+        assert time.monotonic() - inicio < 1
+        assert [s for _, s, _ in _status()] == ['enviado', 'pendente']
+
+
+def test_falha_temporaria_reagenda_com_backoff(app, monkeypatch):
+    monkeypatch.setattr(whatsapp, 'enviar_para_destino',
+                        lambda mensagem, destino, tentativa=1: {'success': False, 'error': 'timeout', 'permanente': False})
+    with app.app_context():
+        _enfileirar(['a'])
+        assert fila.processar_pendentes(limite=10, prazo_s=1) == 1
+        assert _status() == [('a', 'pendente', 1)]
+        linha, _ = fila._reservar(db.engine)
+        assert linha is None  # próxima tentativa só depois do backoff
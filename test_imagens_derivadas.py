@@ -0,0 +1,101 @@
+"""
+Testes das miniaturas sob demanda no Supabase (utils/imagens_derivadas.py)
+
+A miniatura que falta não é gerada dentro da requisição: ``garantir_supabase``
+agenda a geração e a rota serve o original; uma falha fica em cache negativo.
+Rede e Storage são trocados por dublês.
+
+Uso:
+    python -m pytest -q test_imagens_derivadas.py
+"""
+import threading
+import time
+
+import pytest
+
+from utils import imagens_derivadas, storage
+
+DERIVADA = 'imagens/ab12_polia.jpg.thumb.webp'
+ORIGINAL = 'imagens/ab12_polia.jpg'
+
+
+class _Resposta:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+class _Sessao:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.heads = 0
+
+    def head(self, url, timeout=None):
+        self.heads += 1
+        return _Resposta(200 if url.rsplit('/', 1)[1] in self.bucket else 404)
+
+
+@pytest.fixture
+def supabase(monkeypatch):
+    monkeypatch.setenv('SUPABASE_URL', 'https://exemplo.supabase.co')
+    monkeypatch.setenv('SUPABASE_KEY', 'chave')
+    monkeypatch.setattr(imagens_derivadas, '_confirmadas', set())
+    monkeypatch.setattr(imagens_derivadas, '_em_andamento', set())
+    monkeypatch.setattr(imagens_derivadas, '_falhas', {})
+
+    estado = {'bucket': set(), 'original': b'jpeg', 'liberar': threading.Event(), 'downloads': 0}
+    estado['sessao'] = _Sessao(estado['bucket'])
+    estado['liberar'].set()
+
+    def ler(url, timeout=10):
+        estado['liberar'].wait(5)
+        estado['downloads'] += 1
+        return estado['original']
+
+    def enviar(bucket, caminho, conteudo):
+        estado['bucket'].add(caminho.rsplit('/', 1)[1] + '.thumb.webp')
+
+    monkeypatch.setattr(storage, 'sessao', lambda: estado['sessao'])
+    monkeypatch.setattr(storage, 'ler', ler)
+    monkeypatch.setattr(imagens_derivadas, 'enviar_supabase', enviar)
+    return estado
+
+
+def _aguardar_fila():
+    inicio = time.monotonic()
+    while imagens_derivadas._em_andamento and time.monotonic() - inicio < 5:
+        time.sleep(0.01)
+
+
+def test_miniatura_ausente_agenda_geracao_sem_esperar(supabase):
+    supabase['liberar'].clear()  # download "lento" até liberar
+
+    inicio = time.monotonic()
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is False
+    assert time.monotonic() - inicio < 1
+    # Enquanto a geração está na fila, não agenda de novo nem consulta o Storage
+    heads = supabase['sessao'].heads
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is False
+    assert supabase['sessao'].heads == heads
+
+    supabase['liberar'].set()
+    _aguardar_fila()
+    assert supabase['downloads'] == 1
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is True
+
+
+def test_falha_fica_em_cache_negativo(supabase, monkeypatch):
+    supabase['original'] = None  # original sumiu do bucket
+
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is False
+    _aguardar_fila()
+    heads = supabase['sessao'].heads
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is False
+    assert supabase['sessao'].heads == heads
+    assert supabase['downloads'] == 1
+
+    # Expirado o cache negativo, tenta de novo
+    imagens_derivadas._falhas[f'uploads/{ORIGINAL}'] = time.monotonic() - 1
+    supabase['original'] = b'jpeg'
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is False
+    _aguardar_fila()
+    assert imagens_derivadas.garantir_supabase('uploads', DERIVADA) is True
@@ -0,0 +1,76 @@
+"""
+Testes do staging das importações por Excel (utils/importacao_excel.py)
+
+Cada importação só é lida pelo usuário que a gravou, e a confirmação mantém
+as linhas importadas com um DELETE e um UPDATE em lote, sem carregar os
+registros no ORM.
+
+Uso:
+    python -m pytest -q test_importacao_excel.py
+"""
+import pytest
+from flask import Flask, session
+from sqlalchemy import event
+
+from models import db, ImportacaoExcelTemp
+from utils import importacao_excel
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'importacao.db'}"
+    app.secret_key = 'teste'
+    db.init_app(app)
+    with app.app_context():
+        db.metadata.create_all(db.engine, tables=[ImportacaoExcelTemp.__table__])
+    return app
+
+
+def _linhas(n):
+    return [{'row_number': i, 'nome': f'Peça {i}', 'quantidade': i} for i in range(2, n + 2)]
+
+
+def _como(app, usuario_id):
+    contexto = app.test_request_context()
+    contexto.push()
+    if usuario_id is not None:
+        session['usuario_id'] = usuario_id
+    return contexto
+
+
+def test_importacao_so_e_visivel_para_o_dono(app):
+    with app.app_context():
+        contexto = _como(app, 1)
+        import_id = importacao_excel.salvar_linhas('estoque', _linhas(3))
+        contexto.pop()
+
+        for usuario_id in (2, None):
+            contexto = _como(app, usuario_id)
+            assert importacao_excel.carregar_linhas(import_id, 'estoque') == ([], False)
+            importacao_excel.remover_linhas(import_id, 'estoque')
+            db.session.commit()
+            contexto.pop()
+
+        contexto = _como(app, 1)
+        linhas, confirmado = importacao_excel.carregar_linhas(import_id, 'estoque')
+        contexto.pop()
+        assert [l['row_number'] for l in linhas] == [2, 3, 4] and not confirmado
+
+
+def test_confirmacao_em_lote(app):
+    with app.app_context():
+        contexto = _como(app, 1)
+        import_id = importacao_excel.salvar_linhas('estoque', _linhas(5))
+        mantidas = [dict(l, acao_confirmada='criar_novo') for l in _linhas(5) if l['row_number'] in (3, 5)]
+
+        comandos = []
+        event.listen(db.engine, 'before_cursor_execute', lambda conn, cur, sql, *a: comandos.append(sql.split()[0]))
+        importacao_excel.marcar_confirmadas(import_id, 'estoque', mantidas)
+        db.session.commit()
+        assert comandos.count('DELETE') == 1 and comandos.count('UPDATE') == 1
+
+        linhas, confirmado = importacao_excel.carregar_linhas(import_id, 'estoque')
+        contexto.pop()
+    assert confirmado
+    assert [(l['row_number'], l['acao_confirmada']) for l in linhas] == [(3, 'criar_novo'), (5, 'criar_novo')]
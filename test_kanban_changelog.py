@@ -0,0 +1,57 @@
+"""
+Testes do log de alterações do Kanban (utils/kanban_changelog.py)
+
+Os eventos da sessão gravam o log na transação do usuário; uma falha no log
+não pode derrubar o commit da alteração em si.
+
+Uso:
+    python -m pytest -q test_kanban_changelog.py
+"""
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from models import db, KanbanAlteracao, KanbanLista
+from utils import kanban_changelog
+
+
+@pytest.fixture
+def Sessao(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'changelog.db'}")
+    db.metadata.create_all(engine, tables=[KanbanLista.__table__, KanbanAlteracao.__table__])
+    monkeypatch.setattr(kanban_changelog, '_tabela_ok', {'valor': None, 'verificado_em': 0.0})
+    fabrica = sessionmaker(bind=engine)
+    kanban_changelog.registrar_eventos_sessao(fabrica)
+    yield fabrica
+    engine.dispose()
+
+
+def test_flush_grava_alteracao_e_sync_devolve(Sessao):
+    with Sessao() as sessao:
+        lista = KanbanLista(nome='Torno', ordem=1)
+        sessao.add(lista)
+        sessao.commit()
+        lista.ordem = 2
+        sessao.commit()
+
+        resultado = kanban_changelog.buscar_alteracoes(sessao, 0)
+        assert resultado['alteracoes'] == {('lista', lista.id): 'upsert'}
+        assert resultado['seq'] == kanban_changelog.seq_atual(sessao) == 2
+        assert not resultado['reset']
+
+
+def test_falha_no_log_nao_derruba_o_commit(Sessao):
+    with Sessao() as sessao:
+        sessao.execute(text(
+            "CREATE TRIGGER falha_log BEFORE INSERT ON kanban_alteracao "
+            "BEGIN SELECT RAISE(ABORT, 'falha simulada'); END"
+        ))
+        sessao.commit()
+
+        sessao.add(KanbanLista(nome='Fresa', ordem=1))
+        kanban_changelog.registrar_alteracoes(sessao, 'lista', [99])
+        sessao.commit()
+
+    with Sessao() as sessao:
+        assert [l.nome for l in sessao.query(KanbanLista)] == ['Fresa']
+        assert sessao.query(KanbanAlteracao).count() == 0
@@ -0,0 +1,50 @@
+"""
+Teste da listagem de pedidos como primeiro uso do ORM num processo novo
+
+Com ``SKIP_DB_CHECKS=1`` o create_app() não toca o ORM, então a primeira
+requisição do worker é quem monta as opções de carga. Os relacionamentos
+criados por ``backref`` (Pedido.cliente etc.) precisam existir nesse ponto.
+
+Uso:
+    python -m pytest -q test_listagem_primeiro_uso.py
+"""
+import os
+import subprocess
+import sys
+import textwrap
+
+RAIZ = os.path.dirname(os.path.abspath(__file__))
+
+SCRIPT = textwrap.dedent('''
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()  # só metadata, não configura os mappers
+
+    cliente = app.test_client()
+    with cliente.session_transaction() as sessao:
+        sessao['usuario_id'] = 1
+        sessao['usuario_nivel'] = 'admin'
+        sessao['usuario_nome'] = 'teste'
+        sessao['acesso_pedidos'] = True
+    resposta = cliente.get('/api/pedidos/lista?formato=json')
+    print(resposta.status_code)
+''')
+
+
+def test_listagem_pedidos_primeira_requisicao(tmp_path):
+    env = dict(
+        os.environ,
+        SKIP_DB_CHECKS='1',
+        DATABASE_URL=f"sqlite:///{tmp_path / 'primeiro_uso.db'}",
+        NOTIFICACOES_SCHEDULER_ATIVO='0',
+    )
+    env.pop('FORCE_SQLITE', None)
+    proc = subprocess.run(
+        [sys.executable, '-c', SCRIPT], cwd=RAIZ, env=env,
+        capture_output=True, text=True, timeout=120,
+    )
+    assert proc.returncode == 0, proc.stderr[-2000:]
+    assert proc.stdout.strip().splitlines()[-1] == '200', proc.stdout[-2000:] + proc.stderr[-2000:]
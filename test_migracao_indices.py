@@ -0,0 +1,105 @@
+"""
+Testes das migrações de índices que rodam a cada start
+(migrations/add_apontamento_indexes.py)
+
+No SQLite a segunda execução não pode emitir DDL. O caminho PostgreSQL
+(advisory lock e índices inválidos) roda contra uma conexão falsa que só
+registra os comandos.
+
+Uso:
+    python -m pytest -q test_migracao_indices.py
+"""
+import pytest
+from sqlalchemy import create_engine, event
+
+from models import db, ApontamentoProducao
+from migrations import add_apontamento_indexes as migracao
+
+
+class _Resultado:
+    def __init__(self, linhas):
+        self.linhas = linhas
+
+    def scalar(self):
+        return self.linhas[0][0] if self.linhas else None
+
+    def fetchall(self):
+        return self.linhas
+
+
+class _ConexaoPostgres:
+    def __init__(self, banco):
+        self.banco = banco
+
+    def execution_options(self, **opcoes):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, parametros=None):
+        sql = str(sql)
+        self.banco['comandos'].append(' '.join(sql.split()))
+        if 'pg_try_advisory_lock' in sql:
+            return _Resultado([(self.banco['lock_livre'],)])
+        if 'NOT i.indisvalid' in sql:
+            return _Resultado([(nome,) for nome in self.banco['invalidos']])
+        if 'i.indisvalid' in sql:
+            return _Resultado([(nome,) for nome in self.banco['validos']])
+        return _Resultado([])
+
+
+class _EnginePostgres:
+    class dialect:
+        name = 'postgresql'
+
+    def __init__(self, banco):
+        self.banco = banco
+
+    def connect(self):
+        return _ConexaoPostgres(self.banco)
+
+
+def _ddl(comandos):
+    return [sql for sql in comandos if sql.startswith(('CREATE', 'DROP', 'ANALYZE'))]
+
+
+@pytest.fixture
+def banco():
+    todos = [nome for nome, _, _, _ in migracao.INDICES]
+    return {'comandos': [], 'lock_livre': True, 'validos': todos[1:], 'invalidos': todos[:1]}
+
+
+def test_sqlite_segunda_execucao_sem_ddl(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'indices.db'}")
+    db.metadata.create_all(engine, tables=[ApontamentoProducao.__table__])
+    assert migracao.upgrade(engine)
+
+    comandos = []
+    event.listen(engine, 'before_cursor_execute', lambda conn, cur, sql, *a: comandos.append(sql))
+    assert migracao.upgrade(engine)
+    assert _ddl(comandos) == []
+    engine.dispose()
+
+
+def test_postgres_recria_indice_invalido(banco):
+    assert migracao.upgrade(_EnginePostgres(banco))
+    nome = migracao.INDICES[0][0]
+
+    assert _ddl(banco['comandos']) == [
+        f"DROP INDEX CONCURRENTLY IF EXISTS {nome}",
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {migracao.TABELA} "
+        "(ordem_servico_id, item_id, trabalho_id, tipo_acao) INCLUDE (usuario_id, data_hora) WHERE data_fim IS NULL",
+        f"ANALYZE {migracao.TABELA}",
+    ]
+    assert 'pg_advisory_unlock' in banco['comandos'][-1]
+
+
+def test_postgres_sem_lock_nao_cria_nada(banco):
+    banco['lock_livre'] = False
+    assert migracao.upgrade(_EnginePostgres(banco))
+    assert _ddl(banco['comandos']) == []
+    assert not any('pg_advisory_unlock' in sql for sql in banco['comandos'])
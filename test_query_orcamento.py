@@ -0,0 +1,58 @@
+"""
+Teste do orçamento de queries por endpoint (utils/query_monitor.py)
+
+O modo ``erro`` vale quando o teste liga ``app.testing`` depois de instalar o
+profiler, como faz o ``bench_fabrica.py`` com ``create_app()``.
+
+Uso:
+    python -m pytest -q test_query_orcamento.py
+"""
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+from models import db
+from utils.query_monitor import OrcamentoQueriesExcedido, instalar_profiler
+
+
+@pytest.fixture
+def app(monkeypatch):
+    monkeypatch.delenv('SQL_ORCAMENTO_MODO', raising=False)
+    monkeypatch.setenv('SQL_ORCAMENTOS', 'consultas_demais=3,consultas_poucas=3')
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    instalar_profiler(app)
+
+    @app.route('/consultas-demais')
+    def consultas_demais():
+        for _ in range(5):
+            db.session.execute(text('SELECT 1'))
+        return 'ok'
+
+    @app.route('/consultas-poucas')
+    def consultas_poucas():
+        db.session.execute(text('SELECT 1'))
+        return 'ok'
+
+    # Ligado depois da instalação, como nos scripts que chamam create_app()
+    app.testing = True
+    return app
+
+
+def test_endpoint_acima_do_orcamento_levanta(app):
+    with pytest.raises(OrcamentoQueriesExcedido):
+        app.test_client().get('/consultas-demais')
+
+
+def test_endpoint_dentro_do_orcamento(app):
+    resposta = app.test_client().get('/consultas-poucas')
+    assert resposta.status_code == 200
+    assert 'Server-Timing' in resposta.headers
+
+
+def test_fora_de_testes_apenas_loga(app):
+    app.testing = False
+    resposta = app.test_client().get('/consultas-demais')
+    assert resposta.status_code == 200
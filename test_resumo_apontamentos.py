@@ -0,0 +1,101 @@
+"""
+Testes do resumo de tempos por OS/item/trabalho (utils/resumo_apontamentos.py)
+e do Stop que mostra os outros serviços da OS (routes/apontamento.py)
+
+Uma falha no upsert do resumo não derruba o apontamento: a OS fica pendente e
+``reconciliar`` a reconstrói. O Stop soma os outros serviços só nas últimas
+24h, como o serviço atual, e não o acumulado do resumo.
+
+Uso:
+    python -m pytest -q test_resumo_apontamentos.py
+"""
+from datetime import timedelta
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from models import db, ApontamentoProducao, ItemTrabalho, ResumoApontamento, Trabalho, local_now_naive
+from utils import resumo_apontamentos
+
+TABELAS = [ApontamentoProducao.__table__, ResumoApontamento.__table__, Trabalho.__table__, ItemTrabalho.__table__]
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'resumo.db'}")
+    db.metadata.create_all(engine, tables=TABELAS)
+    monkeypatch.setattr(resumo_apontamentos, '_tabela_ok', {'valor': None, 'verificado_em': 0.0})
+    monkeypatch.setattr(resumo_apontamentos, '_pendentes', set())
+    yield engine
+    engine.dispose()
+
+
+def _apontamento(trabalho_id, tipo_acao, inicio, minutos=None, quantidade=None):
+    fim = inicio + timedelta(minutes=minutos) if minutos is not None else None
+    return ApontamentoProducao(
+        ordem_servico_id=1, usuario_id=1, item_id=1, trabalho_id=trabalho_id, tipo_acao=tipo_acao,
+        data_hora=inicio, data_fim=fim, quantidade=quantidade,
+        tempo_decorrido=minutos * 60 if minutos is not None else None,
+    )
+
+
+def _resumo(engine, trabalho_id):
+    with engine.connect() as conn:
+        return conn.execute(text(
+            "SELECT tempo_producao_s, ultima_quantidade FROM apontamento_resumo WHERE trabalho_id = :t"
+        ), {'t': trabalho_id}).first()
+
+
+def test_falha_no_resumo_nao_derruba_o_apontamento_e_reconcilia(engine):
+    Sessao = sessionmaker(bind=engine)
+    resumo_apontamentos.registrar_eventos_sessao(Sessao)
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TRIGGER falha_resumo BEFORE INSERT ON apontamento_resumo "
+            "BEGIN SELECT RAISE(ABORT, 'falha simulada'); END"
+        ))
+
+    with Sessao() as sessao:
+        sessao.add(_apontamento(10, 'inicio_producao', local_now_naive() - timedelta(hours=1), minutos=30, quantidade=5))
+        sessao.commit()
+        assert sessao.query(ApontamentoProducao).count() == 1
+    assert _resumo(engine, 10) is None
+    assert resumo_apontamentos.pendentes() == [1]
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TRIGGER falha_resumo"))
+    assert resumo_apontamentos.reconciliar(engine) == 1
+    assert tuple(_resumo(engine, 10)) == (30 * 60, 5)
+    assert resumo_apontamentos.pendentes() == []
+
+
+def test_stop_soma_outros_servicos_so_nas_ultimas_24h(engine, tmp_path):
+    from routes.apontamento import _calcular_metricas_stop_completo
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'resumo.db'}"
+    db.init_app(app)
+    agora = local_now_naive()
+    with app.app_context():
+        db.session.add_all([
+            Trabalho(id=10, nome='Torno'), Trabalho(id=20, nome='Fresa'),
+            ItemTrabalho(item_id=1, trabalho_id=10), ItemTrabalho(item_id=1, trabalho_id=20),
+            _apontamento(10, 'inicio_producao', agora - timedelta(hours=2), minutos=20, quantidade=3),
+            # Outro serviço: um trecho de ontem (fora da janela) e um de hoje
+            _apontamento(20, 'inicio_producao', agora - timedelta(days=2), minutos=600, quantidade=50),
+            _apontamento(20, 'inicio_setup', agora - timedelta(hours=3), minutos=15),
+            _apontamento(20, 'inicio_producao', agora - timedelta(hours=1), minutos=45, quantidade=8),
+        ])
+        db.session.commit()
+
+        metricas = _calcular_metricas_stop_completo(1, 1, 10, 3)
+
+    assert metricas['outros_servicos'] == [{
+        'nome': 'Fresa',
+        'ultima_quantidade': 8,
+        'tempo_setup_minutos': 15,
+        'tempo_producao_minutos': 45,
+        'tempo_total_minutos': 60,
+    }]
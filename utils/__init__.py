@@ -15,19 +15,36 @@ def allowed_file(filename, allowed_extensions):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
+def _usar_supabase():
+    """Produção (Vercel/serverless), configuração completa do Supabase ou FORCE_SUPABASE_STORAGE"""
+    is_production = os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME") 
+    use_supabase = os.environ.get('SUPABASE_URL') and os.environ.get('SUPABASE_KEY') and os.environ.get('SUPABASE_BUCKET')
+    force_supabase = os.environ.get('FORCE_SUPABASE_STORAGE', '').lower() in ['true', '1', 'yes']
+    return bool(is_production or use_supabase or force_supabase)
+
+
+def _conteudo_imagem(file):
+    """Imagens: bytes guardados para gerar as miniaturas fora da requisição"""
+    if not _eh_imagem(file.filename):
+        return None
+    file.seek(0)
+    conteudo = file.read()
+    file.seek(0)
+    return conteudo
+
+
 def save_file(file, folder):
     """Salva um arquivo enviado no diretório local ou Supabase Storage e retorna o caminho/URL"""
     if not file or not file.filename:
         return None
         
-    # Verifica se estamos em ambiente de produção (Vercel/serverless)
-    is_production = os.environ.get("VERCEL") or os.environ.get("AWS_LAMBDA_FUNCTION_NAME") 
-    use_supabase = os.environ.get('SUPABASE_URL') and os.environ.get('SUPABASE_KEY') and os.environ.get('SUPABASE_BUCKET')
-    force_supabase = os.environ.get('FORCE_SUPABASE_STORAGE', '').lower() in ['true', '1', 'yes']
-    
+    conteudo_imagem = _conteudo_imagem(file)
+
     # Se estamos em produção OU configuração do Supabase está completa OU forçado, usar Storage
-    if is_production or use_supabase or force_supabase:
-        return upload_to_supabase(file, folder)
+    if _usar_supabase():
+        caminho = upload_to_supabase(file, folder)
+        _agendar_derivadas(caminho, conteudo_imagem)
+        return caminho
     else:
         # Modo de desenvolvimento local - salvar em disco local
         filename = secure_filename(file.filename)
@@ -48,125 +65,73 @@ def save_file(file, folder):
         
         filepath = os.path.join(upload_folder, filename)
         file.save(filepath)
+        _agendar_derivadas(f"{folder}/{filename}", conteudo_imagem, filepath)
         # Retornar caminho relativo com separadores POSIX para uso em URL
         return f"{folder}/{filename}"
 
+
+def save_files(arquivos):
+    """Salva vários arquivos de um formulário de uma vez.
+
+    ``arquivos`` é uma lista de ``(file, folder)``; devolve os caminhos na
+    mesma ordem (None para arquivo vazio ou que falhou, como ``save_file``).
+    No Supabase Storage os uploads rodam em paralelo.
+    """
+    validos = [i for i, (file, _) in enumerate(arquivos) if file and file.filename]
+    if len(validos) < 2 or not _usar_supabase():
+        return [save_file(file, folder) for file, folder in arquivos]
+
+    from utils.storage import ErroUpload, enviar_varios
+
+    conteudos = {i: _conteudo_imagem(arquivos[i][0]) for i in validos}
+    enviados = enviar_varios([arquivos[i] for i in validos])
+
+    caminhos = [None] * len(arquivos)
+    for i, resultado in zip(validos, enviados):
+        if isinstance(resultado, Exception):
+            logger.error("Erro ao fazer upload de %s para o Supabase: %s", arquivos[i][0].filename, resultado)
+            if isinstance(resultado, ErroUpload):
+                flash(f"{arquivos[i][0].filename}: {resultado}", 'danger')
+            else:
+                flash(f"Erro ao fazer upload para o Supabase: {str(resultado)}", 'danger')
+            continue
+        caminhos[i] = resultado
+        _agendar_derivadas(resultado, conteudos[i])
+    return caminhos
+
+
+def _eh_imagem(filename):
+    from utils.imagens_derivadas import eh_imagem
+    return eh_imagem(filename)
+
+
+def _agendar_derivadas(caminho, conteudo, caminho_local=None):
+    """Miniaturas WebP do upload (utils/imagens_derivadas.py); falha aqui não impede o upload."""
+    if not caminho or not conteudo:
+        return
+    try:
+        from utils.imagens_derivadas import agendar
+        agendar(caminho, conteudo, caminho_local)
+    except Exception as e:
+        logger.warning("Falha ao agendar miniaturas de %s: %s", caminho, e)
+
 def upload_to_supabase(file, folder):
-    """Faz upload de um arquivo para o Supabase Storage usando a API Storage REST"""
+    """Faz upload de um arquivo para o Supabase Storage usando a API Storage REST
+
+    O envio fica em ``utils.storage.enviar`` (bucket verificado uma vez por
+    processo, sessão HTTP compartilhada, corpo enviado em blocos).
+    """
+    from utils.storage import ErroUpload, enviar
+
     try:
-        import requests
-        import json
-        from urllib.parse import quote
-        
-        # Obter configurações do Supabase do ambiente
-        supabase_url = os.environ.get('SUPABASE_URL')
-        supabase_key = os.environ.get('SUPABASE_KEY')
-        bucket = os.environ.get('SUPABASE_BUCKET', 'uploads')
-        
-        logger.debug("Iniciando upload para Supabase. Bucket: %s, Folder: %s", bucket, folder)
-        logger.debug("SUPABASE_URL: %s", 'Definido' if supabase_url else 'Não definido')
-        logger.debug("SUPABASE_KEY: %s", 'Definido' if supabase_key else 'Não definido (truncado)')
-        if supabase_key:
-            logger.debug("SUPABASE_KEY começa com: %s... e termina com: ...%s (truncado)", supabase_key[:10], supabase_key[-10:])
-        
-        if not all([supabase_url, supabase_key]):
-            error_msg = 'Configuração do Supabase Storage incompleta. Verifique as variáveis de ambiente SUPABASE_URL e SUPABASE_KEY.'
-            logger.error(error_msg)
-            flash(error_msg, 'danger')
-            return None
-            
-        # Remover possível barra no final da URL
-        if supabase_url.endswith('/'):
-            supabase_url = supabase_url[:-1]
-            
-        # Primeiro, verificar se o bucket existe
-        list_buckets_url = f"{supabase_url}/storage/v1/bucket"
-        logger.debug("Verificando buckets disponíveis: %s", list_buckets_url)
-        
-        headers = {
-            'Authorization': f'Bearer {supabase_key}',
-            'apikey': f'{supabase_key}',
-            'Content-Type': 'application/json'
-        }
-        
-        try:
-            bucket_response = requests.get(list_buckets_url, headers=headers)
-            logger.debug("Status da verificação de buckets: %s", bucket_response.status_code)
-            
-            if bucket_response.status_code != 200:
-                logger.error("Falha ao listar buckets: %s", bucket_response.text)
-                # Se não conseguirmos listar buckets, tentamos criar um
-                create_bucket_url = list_buckets_url
-                bucket_data = {
-                    'id': bucket,
-                    'name': bucket,
-                    'public': True
-                }
-                create_response = requests.post(
-                    create_bucket_url, 
-                    headers=headers, 
-                    data=json.dumps(bucket_data)
-                )
-                logger.debug("Tentativa de criar bucket: %s - %s", create_response.status_code, create_response.text)
-        except Exception as e:
-            logger.exception("Erro ao verificar/criar bucket")
-        
-        # Gerar um nome de arquivo único para evitar colisões
-        original_filename = secure_filename(file.filename)
-        unique_id = str(uuid.uuid4())[:8]
-        storage_path = f"{folder}/{unique_id}_{original_filename}"
-        
-        logger.debug("Arquivo original: %s, Nome seguro: %s, Caminho no storage: %s", file.filename, original_filename, storage_path)
-        
-        try:
-            # Reset do arquivo para leitura (pode ter sido lido anteriormente)
-            file.seek(0)
-            
-            # URL de upload do Supabase Storage REST API
-            upload_url = f"{supabase_url}/storage/v1/object/{bucket}/{quote(storage_path)}"
-            logger.debug("URL de upload: %s", upload_url)
-            
-            # Cabeçalhos para o upload
-            upload_headers = {
-                'Authorization': f'Bearer {supabase_key}',
-                'apikey': f'{supabase_key}'
-                # Não defina Content-Type aqui - o multipart/form-data será definido pelo requests
-            }
-            
-            # Preparar arquivo para upload
-            files = {
-                'file': (original_filename, file, file.mimetype or 'application/octet-stream')
-            }
-            
-            logger.debug("Iniciando upload do arquivo para o bucket '%s'...", bucket)
-            
-            # Fazer o upload via HTTP POST
-            response = requests.post(upload_url, headers=upload_headers, files=files)
-            
-            # Verificar se o upload foi bem-sucedido
-            logger.debug("Resposta do upload: %s %s", response.status_code, response.reason)
-            logger.debug("Resposta completa: %s", response.text)
-            
-            if response.status_code in [200, 201]:
-                logger.debug("Upload concluído com sucesso!")
-                
-                # Construir URL pública do arquivo
-                public_url = f"{supabase_url}/storage/v1/object/public/{bucket}/{quote(storage_path)}"
-                logger.debug("URL pública do arquivo: %s", public_url)
-                
-                # Retornar caminho do arquivo no formato supabase://<bucket>/<path> para referência futura
-                return f"supabase://{bucket}/{storage_path}"
-            else:
-                error_msg = f"Erro ao fazer upload para o Supabase: {response.status_code} {response.reason} - {response.text}"
-                logger.error(error_msg)
-                flash(f"Erro no upload: {response.status_code} {response.reason}", 'danger')
-                return None
-                
-        except Exception as e:
-            error_msg = f"Erro ao fazer upload para o Supabase: {str(e)}"
-            logger.exception("Erro ao fazer upload para o Supabase")
-            flash(error_msg, 'danger')
-            return None
+        logger.debug("Iniciando upload para Supabase. Folder: %s, Arquivo: %s", folder, file.filename)
+        caminho = enviar(file, folder)
+        logger.debug("Upload concluído com sucesso: %s", caminho)
+        return caminho
+    except ErroUpload as e:
+        logger.error("Erro ao fazer upload para o Supabase: %s", e)
+        flash(str(e), 'danger')
+        return None
     except Exception as e:
         error_msg = f"Erro ao fazer upload para Supabase: {str(e)}"
         logger.exception("Erro ao fazer upload para Supabase")
@@ -222,14 +187,23 @@ def test_supabase_auth():
     except Exception as e:
         return f"Erro em ambos testes: {str(e)}"
 
-def get_file_url(file_path):
-    """Converte um caminho de arquivo em URL, seja local ou do Supabase"""
+def get_file_url(file_path, size=None):
+    """Converte um caminho de arquivo em URL, seja local ou do Supabase
+
+    ``size`` ('thumb' ou 'medio') aponta para a miniatura WebP da imagem
+    (gerada no upload ou sob demanda); arquivos que não são imagem ignoram.
+    """
     if not file_path:
         return None
     
     # Verificar se já é uma URL completa (evitar loop infinito)
     if file_path.startswith('http://') or file_path.startswith('https://'):
         return file_path
+
+    if size:
+        from utils.imagens_derivadas import TAMANHOS, caminho_derivada, eh_imagem
+        if size in TAMANHOS and eh_imagem(file_path):
+            file_path = caminho_derivada(file_path, size)
         
     # Se for arquivo do Supabase Storage (suportar 'supabase://' e legado 'supabase:/')
     if file_path.startswith('supabase://') or file_path.startswith('supabase:/'):
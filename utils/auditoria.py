@@ -0,0 +1,599 @@
+"""
+Auditoria assíncrona (audit_log) com gravação em lote
+
+O flush só anota o que mudou: as alterações de cada objeto ficam em
+``session.info`` com os valores crus, sem JSON e sem inserir nada na
+transação do usuário. Depois do commit os registros são serializados e
+anexados ao spool local; um rollback descarta o que foi anotado.
+
+Spool: arquivos JSONL em ``AUDITORIA_SPOOL_DIR`` (padrão:
+<tmp>/linhamestre_auditoria/<hash do banco>). O segmento ativo de cada
+processo é fechado a cada ``AUDITORIA_INTERVALO_S`` segundos (padrão 1) e a
+thread gravadora insere os segmentos fechados em lotes de
+``AUDITORIA_LOTE`` linhas (padrão 500) com um único INSERT por lote. O
+arquivo só é apagado depois do insert, então um crash do processo ou do banco
+não perde registros: segmentos abandonados por processos que morreram são
+retomados por qualquer worker após ``AUDITORIA_SPOOL_ORFAO_S`` (padrão 300).
+A memória usada pela gravação fica limitada a um lote. A mesma thread dispara
+o arquivamento periódico (utils/auditoria_arquivo.py).
+
+Serverless (``VERCEL``/``AWS_LAMBDA_FUNCTION_NAME``): a instância é congelada
+entre invocações, então nem a thread nem o spool em /tmp são confiáveis. Lá
+não há spool: os registros são inseridos direto logo após o commit.
+
+Regras por entidade:
+- ``_ENTIDADES_IGNORADAS`` (+ ``AUDITORIA_IGNORAR``, nomes separados por
+  vírgula) não são auditadas: tabelas derivadas, de controle ou temporárias;
+- ``_REORDENACAO``: updates que só mexem na posição (reordenar o Kanban)
+  viram um único registro ``reordenar`` por entidade e transação, com
+  ``{id: [posição antiga, nova]}``;
+- ``AUDITORIA_AMOSTRAGEM`` (ex.: ``ApontamentoProducao:0.2``) guarda só a
+  fração indicada dos updates da entidade. Criações e exclusões sempre entram.
+
+``session.info['_audit_logging_disabled'] = True`` desliga a captura (scripts
+de correção), como antes.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import tempfile
+import threading
+import atexit
+from datetime import datetime
+
+from flask import g, has_request_context, request, session
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
+
+logger = logging.getLogger(__name__)
+
+_CHAVE_SESSAO = '_auditoria_pendente'
+
+# Entidades mantidas por outros módulos ou temporárias: não vale auditar
+_ENTIDADES_IGNORADAS = {
+    'AuditLog',
+    'KanbanAlteracao',
+    'ResumoApontamento',
+    'ImportacaoExcelTemp',
+    'EstoquePecasSlotTemp',
+    'CacheAlerta',
+}
+
+# Colunas de posição: updates só nelas são resumidos num registro 'reordenar'
+_REORDENACAO = {
+    'OrdemServico': {'posicao'},
+    'KanbanLista': {'ordem'},
+    'CartaoFantasma': {'posicao_fila'},
+}
+
+# Carimbos de data atualizados junto com qualquer alteração
+_COLUNAS_CARIMBO = {'data_atualizacao', 'atualizado_em'}
+
+# Limite de ids detalhados num registro de reordenação
+_MAX_IDS_REORDENACAO = 500
+
+# Tamanhos das colunas de audit_log (um valor maior derrubaria o lote inteiro)
+_TAMANHOS = {
+    'usuario_nome': 100,
+    'acao': 20,
+    'entidade_tipo': 100,
+    'entidade_id': 64,
+    'endpoint': 200,
+    'metodo': 10,
+    'ip': 64,
+    'user_agent': 255,
+}
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(1, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _env_float(nome, padrao):
+    try:
+        return max(0.05, float(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _serverless():
+    return bool(os.getenv('VERCEL') or os.getenv('AWS_LAMBDA_FUNCTION_NAME'))
+
+
+def _entidades_ignoradas():
+    extras = {nome.strip() for nome in (os.getenv('AUDITORIA_IGNORAR') or '').split(',') if nome.strip()}
+    return _ENTIDADES_IGNORADAS | extras
+
+
+def _taxas_amostragem():
+    """``{entidade: fração de updates mantida}`` a partir de ``AUDITORIA_AMOSTRAGEM``."""
+    taxas = {}
+    for parte in (os.getenv('AUDITORIA_AMOSTRAGEM') or '').split(','):
+        nome, _, taxa = parte.partition(':')
+        try:
+            taxas[nome.strip()] = min(1.0, max(0.0, float(taxa)))
+        except ValueError:
+            continue
+    return taxas
+
+
+def _ator():
+    usuario = getattr(g, 'usuario', None) if has_request_context() else None
+    if usuario is not None:
+        return usuario.id, getattr(usuario, 'nome', None)
+    if has_request_context() and 'usuario_id' in session:
+        return session.get('usuario_id'), session.get('usuario_nome')
+    return None, None
+
+
+def _meta_requisicao():
+    if not has_request_context():
+        return None, None, None, None
+    try:
+        endpoint = request.endpoint
+    except Exception:
+        endpoint = None
+    try:
+        metodo = request.method
+    except Exception:
+        metodo = None
+    try:
+        ip = request.headers.get('X-Forwarded-For', request.remote_addr)
+    except Exception:
+        ip = None
+    try:
+        ua = request.headers.get('User-Agent')
+    except Exception:
+        ua = None
+    return endpoint, metodo, ip, ua
+
+
+def _contexto():
+    usuario_id, usuario_nome = _ator()
+    endpoint, metodo, ip, ua = _meta_requisicao()
+    return {
+        'usuario_id': usuario_id,
+        'usuario_nome': usuario_nome,
+        'endpoint': endpoint,
+        'metodo': metodo,
+        'ip': ip,
+        'user_agent': ua,
+    }
+
+
+def _identidade(obj, state):
+    try:
+        pks = [col.key for col in state.mapper.primary_key]
+        if not pks:
+            return None
+        if len(pks) == 1:
+            return str(getattr(obj, pks[0], None))
+        return json.dumps({k: getattr(obj, k, None) for k in pks}, ensure_ascii=False, default=str)
+    except Exception:
+        return None
+
+
+def _mudancas(obj, state, acao):
+    """``{coluna: {'old', 'new'}}`` com os valores crus (serializados só após o commit)."""
+    mudancas = {}
+    for attr in state.mapper.column_attrs:
+        chave = attr.key
+        if chave == 'id':
+            continue
+        if acao == 'update':
+            hist = state.attrs[chave].history
+            if not hist.has_changes():
+                continue
+            antigo = hist.deleted[0] if hist.deleted else None
+            novo = hist.added[0] if hist.added else getattr(obj, chave, None)
+            mudancas[chave] = {'old': antigo, 'new': novo}
+            continue
+        valor = getattr(obj, chave, None)
+        if valor is not None:
+            mudancas[chave] = {'old': None, 'new': valor} if acao == 'create' else {'old': valor, 'new': None}
+    return mudancas or None
+
+
+def _so_reordenacao(tipo, mudancas):
+    campos = _REORDENACAO.get(tipo)
+    if not campos:
+        return False
+    alteradas = set(mudancas) - _COLUNAS_CARIMBO
+    return bool(alteradas) and alteradas <= campos
+
+
+def _capturar(session_, escritor):
+    acumulado = session_.info.setdefault(_CHAVE_SESSAO, {'registros': [], 'reordenacoes': {}, 'contexto': None})
+    if acumulado['contexto'] is None:
+        acumulado['contexto'] = _contexto()
+    contexto = acumulado['contexto']
+    ignoradas = escritor.ignoradas
+    taxas = escritor.taxas
+
+    def anotar(acao, obj):
+        tipo = obj.__class__.__name__
+        if tipo in ignoradas:
+            escritor.contar('ignorados')
+            return
+        state = inspect(obj)
+        if acao == 'update' and not session_.is_modified(obj, include_collections=False):
+            return
+        mudancas = _mudancas(obj, state, acao)
+        if acao == 'update':
+            if not mudancas:
+                return
+            if _so_reordenacao(tipo, mudancas):
+                # Vários flushes na mesma transação: fica a primeira posição antiga e a última nova
+                posicoes = acumulado['reordenacoes'].setdefault(tipo, {}).setdefault(_identidade(obj, state), {})
+                for campo in _REORDENACAO[tipo] & set(mudancas):
+                    antigo = posicoes[campo][0] if campo in posicoes else mudancas[campo]['old']
+                    posicoes[campo] = [antigo, mudancas[campo]['new']]
+                escritor.contar('colapsados')
+                return
+            taxa = taxas.get(tipo)
+            if taxa is not None and random.random() >= taxa:
+                escritor.contar('amostragem_descartados')
+                return
+        acumulado['registros'].append({
+            'acao': acao,
+            'entidade_tipo': tipo,
+            'entidade_id': _identidade(obj, state),
+            'mudancas': mudancas,
+            'contexto': contexto,
+        })
+
+    for acao, objetos in (('create', session_.new), ('update', session_.dirty), ('delete', session_.deleted)):
+        for obj in list(objetos):
+            try:
+                anotar(acao, obj)
+            except Exception as e:
+                logger.debug(f"[auditoria] Falha ao capturar {obj.__class__.__name__}: {e}")
+
+
+def registrar(session_, acao, entidade_tipo, entidade_id=None, mudancas=None):
+    """
+    Anota um registro de auditoria explícito (ex.: resumo de uma importação em
+    lote, que não passa pelo flush objeto a objeto). É gravado junto com os
+    demais após o commit da sessão e descartado no rollback.
+    """
+    acumulado = session_.info.setdefault(_CHAVE_SESSAO, {'registros': [], 'reordenacoes': {}, 'contexto': None})
+    if acumulado['contexto'] is None:
+        acumulado['contexto'] = _contexto()
+    acumulado['registros'].append({
+        'acao': acao,
+        'entidade_tipo': entidade_tipo,
+        'entidade_id': entidade_id,
+        'mudancas': mudancas,
+        'contexto': acumulado['contexto'],
+    })
+
+
+def _linha(registro, data_criacao):
+    """Linha de audit_log pronta para o spool (JSON), com os tamanhos das colunas respeitados."""
+    mudancas_json = None
+    if registro['mudancas'] is not None:
+        try:
+            mudancas_json = json.dumps(registro['mudancas'], ensure_ascii=False, default=str)
+        except Exception:
+            mudancas_json = None
+    linha = dict(registro['contexto'])
+    linha.update(
+        data_criacao=data_criacao,
+        acao=registro['acao'],
+        entidade_tipo=registro['entidade_tipo'],
+        entidade_id=registro['entidade_id'],
+        mudancas_json=mudancas_json,
+    )
+    for coluna, tamanho in _TAMANHOS.items():
+        valor = linha.get(coluna)
+        if valor is not None:
+            linha[coluna] = str(valor)[:tamanho]
+    return json.dumps(linha, ensure_ascii=False, default=str)
+
+
+def _linhas_do_commit(acumulado):
+    data_criacao = datetime.utcnow().isoformat()
+    linhas = [_linha(registro, data_criacao) for registro in acumulado['registros']]
+    for tipo, posicoes in acumulado['reordenacoes'].items():
+        detalhes = dict(list(posicoes.items())[:_MAX_IDS_REORDENACAO])
+        linhas.append(_linha({
+            'acao': 'reordenar',
+            'entidade_tipo': tipo,
+            'entidade_id': None,
+            'mudancas': {'quantidade': len(posicoes), 'posicoes': detalhes},
+            'contexto': acumulado['contexto'],
+        }, data_criacao))
+    return linhas
+
+
+class EscritorAuditoria:
+    """Spool em disco + thread que grava os segmentos fechados em lote"""
+
+    def __init__(self):
+        self.lote = _env_int('AUDITORIA_LOTE', 500)
+        self.intervalo_s = _env_float('AUDITORIA_INTERVALO_S', 1.0)
+        self.orfao_s = _env_int('AUDITORIA_SPOOL_ORFAO_S', 300)
+        self.fsync = os.getenv('AUDITORIA_SPOOL_FSYNC', '0').lower() in ('1', 'true', 'sim')
+        self.ignoradas = _entidades_ignoradas()
+        self.taxas = _taxas_amostragem()
+        self.diretorio = None
+        self._engine = None
+        self._lock = threading.Lock()
+        self._lock_gravacao = threading.Lock()
+        self._evento = threading.Event()
+        self._thread = None
+        self._ativo = None
+        self._ativo_desde = 0.0
+        self._seq = 0
+        self._falhas_seguidas = 0
+        self._proxima_tentativa = 0.0
+        self._proxima_manutencao = time.time() + 60
+        self.stats = {
+            'enfileirados': 0, 'ignorados': 0, 'colapsados': 0, 'amostragem_descartados': 0,
+            'gravados': 0, 'lotes': 0, 'falhas': 0, 'rejeitados': 0, 'gravacoes_diretas': 0,
+            'ultimo_erro': None,
+        }
+
+    def contar(self, chave, quantidade=1):
+        self.stats[chave] = self.stats.get(chave, 0) + quantidade
+
+    def iniciar(self, app):
+        """Prepara o spool do banco do app, retoma segmentos pendentes e liga a thread gravadora."""
+        from models import db
+
+        with app.app_context():
+            self._engine = db.engine
+        if _serverless():
+            self.diretorio = None
+            logger.info("[auditoria] Ambiente serverless: registros gravados direto após o commit (sem spool)")
+            return
+        url = self._engine.url.render_as_string(hide_password=True)
+        base = os.getenv('AUDITORIA_SPOOL_DIR') or os.path.join(tempfile.gettempdir(), 'linhamestre_auditoria')
+        try:
+            diretorio = os.path.join(base, hashlib.sha1(url.encode('utf-8')).hexdigest()[:12])
+            os.makedirs(diretorio, exist_ok=True)
+            self.diretorio = diretorio
+        except OSError as e:
+            # Sem disco gravável a auditoria é inserida direto após o commit
+            logger.warning(f"[auditoria] Spool indisponível em {base}: {e}")
+            self.diretorio = None
+
+        if self.diretorio and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._executar, name='auditoria-gravador', daemon=True)
+            self._thread.start()
+            self._evento.set()
+            atexit.register(self.descarregar)
+
+    # ---- spool ----
+
+    def enfileirar(self, linhas):
+        """Anexa as linhas (JSON) ao segmento ativo; sem spool grava direto no banco."""
+        if not linhas:
+            return
+        self.contar('enfileirados', len(linhas))
+        if not self.diretorio:
+            self._gravar_direto(linhas)
+            return
+        conteudo = ''.join(f'{linha}\n' for linha in linhas).encode('utf-8')
+        try:
+            with self._lock:
+                if self._ativo is None:
+                    self._seq += 1
+                    self._ativo = open(os.path.join(self.diretorio, f'{os.getpid()}-{int(time.time() * 1000)}-{self._seq}.ativo'), 'ab')
+                    self._ativo_desde = time.time()
+                self._ativo.write(conteudo)
+                self._ativo.flush()
+                if self.fsync:
+                    os.fsync(self._ativo.fileno())
+        except OSError as e:
+            logger.warning(f"[auditoria] Falha ao escrever no spool: {e}")
+            self._gravar_direto(linhas)
+            return
+        if time.time() - self._ativo_desde >= self.intervalo_s:
+            self._evento.set()
+
+    def _fechar_ativo(self, forcar=False):
+        with self._lock:
+            if self._ativo is None or (not forcar and time.time() - self._ativo_desde < self.intervalo_s):
+                return
+            caminho = self._ativo.name
+            self._ativo.close()
+            self._ativo = None
+        os.replace(caminho, caminho[:-len('.ativo')] + '.jsonl')
+
+    def _liberar_orfaos(self):
+        """Devolve à fila segmentos ativos/em gravação largados por processos que morreram."""
+        limite = time.time() - self.orfao_s
+        for nome in os.listdir(self.diretorio):
+            if not nome.endswith(('.ativo', '.gravando')):
+                continue
+            caminho = os.path.join(self.diretorio, nome)
+            try:
+                if os.path.getmtime(caminho) < limite:
+                    os.replace(caminho, os.path.join(self.diretorio, nome.split('.', 1)[0] + '.jsonl'))
+                    logger.info(f"[auditoria] Segmento órfão retomado: {nome}")
+            except OSError:
+                continue
+
+    def _segmentos(self):
+        return sorted(nome for nome in os.listdir(self.diretorio) if nome.endswith('.jsonl'))
+
+    def pendentes(self):
+        """Segmentos aguardando gravação (inclui os de outros workers)."""
+        if not self.diretorio:
+            return 0
+        try:
+            return len(self._segmentos()) + (1 if self._ativo is not None else 0)
+        except OSError:
+            return 0
+
+    # ---- gravação ----
+
+    def _inserir(self, linhas):
+        from models import AuditLog
+
+        registros = []
+        for linha in linhas:
+            registro = json.loads(linha)
+            registro['data_criacao'] = datetime.fromisoformat(registro['data_criacao'])
+            registros.append(registro)
+        with self._engine.begin() as conn:
+            conn.execute(AuditLog.__table__.insert(), registros)
+
+    def _inserir_separado(self, linhas):
+        """Lote recusado pelo banco (dado inválido): grava linha a linha e separa as recusadas."""
+        recusadas = []
+        for linha in linhas:
+            try:
+                self._inserir([linha])
+                self.contar('gravados')
+            except (OperationalError, InterfaceError):
+                raise
+            except Exception as e:
+                logger.error(f"[auditoria] Registro recusado pelo banco: {e}")
+                recusadas.append(linha)
+        if recusadas:
+            self.contar('rejeitados', len(recusadas))
+            with open(os.path.join(self.diretorio, 'rejeitados.log'), 'a', encoding='utf-8') as f:
+                f.writelines(f'{linha}\n' for linha in recusadas)
+
+    def _gravar_segmento(self, nome):
+        caminho = os.path.join(self.diretorio, nome)
+        gravando = f'{caminho[:-len(".jsonl")]}.{os.getpid()}.gravando'
+        try:
+            os.replace(caminho, gravando)
+        except FileNotFoundError:
+            return  # outro worker pegou o segmento
+        with open(gravando, 'r', encoding='utf-8') as f:
+            linhas = [linha for linha in f.read().splitlines() if linha.strip()]
+
+        feitas = 0
+        try:
+            while feitas < len(linhas):
+                lote = linhas[feitas:feitas + self.lote]
+                try:
+                    self._inserir(lote)
+                    self.contar('gravados', len(lote))
+                except (OperationalError, InterfaceError):
+                    raise
+                except DBAPIError:
+                    self._inserir_separado(lote)
+                feitas += len(lote)
+                self.contar('lotes')
+        except Exception:
+            # Banco fora do ar: o que faltou volta para o spool sem duplicar o que já entrou
+            restantes = ''.join(f'{linha}\n' for linha in linhas[feitas:])
+            with open(gravando, 'w', encoding='utf-8') as f:
+                f.write(restantes)
+            os.replace(gravando, caminho)
+            raise
+        os.remove(gravando)
+
+    def _processar(self, forcar=False):
+        with self._lock_gravacao:
+            self._fechar_ativo(forcar=forcar)
+            self._liberar_orfaos()
+            for nome in self._segmentos():
+                self._gravar_segmento(nome)
+
+    def _executar(self):
+        while True:
+            self._evento.wait(self.intervalo_s)
+            self._evento.clear()
+            if time.time() < self._proxima_tentativa:
+                continue
+            try:
+                self._processar()
+                self._falhas_seguidas = 0
+                self._manutencao()
+            except Exception as e:
+                self._falhas_seguidas += 1
+                self.contar('falhas')
+                self.stats['ultimo_erro'] = str(e)[:300]
+                espera = min(60, 2 ** self._falhas_seguidas)
+                self._proxima_tentativa = time.time() + espera
+                logger.warning(f"[auditoria] Gravação adiada por {espera}s: {e}")
+
+    def _manutencao(self):
+        """Arquivamento/partições do audit_log (utils/auditoria_arquivo.py), verificado a cada hora."""
+        if time.time() < self._proxima_manutencao:
+            return
+        self._proxima_manutencao = time.time() + 3600
+        try:
+            from utils.auditoria_arquivo import executar_se_devido
+            executar_se_devido(self._engine)
+        except Exception as e:
+            logger.warning(f"[auditoria] Falha no arquivamento do audit_log: {e}")
+
+    def descarregar(self):
+        """Grava agora tudo o que está no spool (ex.: antes de listar a auditoria). Devolve True se zerou."""
+        if not self.diretorio:
+            return True
+        try:
+            self._processar(forcar=True)
+            return True
+        except Exception as e:
+            logger.warning(f"[auditoria] Falha ao descarregar spool: {e}")
+            return False
+
+    def _gravar_direto(self, linhas):
+        try:
+            for inicio in range(0, len(linhas), self.lote):
+                self._inserir(linhas[inicio:inicio + self.lote])
+            self.contar('gravados', len(linhas))
+            self.contar('gravacoes_diretas')
+        except Exception as e:
+            self.contar('falhas')
+            self.stats['ultimo_erro'] = str(e)[:300]
+            logger.error(f"[auditoria] Falha ao gravar {len(linhas)} registro(s) de auditoria: {e}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update(
+            spool=self.diretorio,
+            segmentos_pendentes=self.pendentes(),
+            lote=self.lote,
+            intervalo_s=self.intervalo_s,
+            entidades_ignoradas=sorted(self.ignoradas),
+            amostragem=dict(self.taxas),
+        )
+        return stats
+
+
+def registrar_eventos_sessao(session_cls, escritor):
+    """Captura no flush, envia ao spool no commit e descarta no rollback"""
+
+    @event.listens_for(session_cls, 'after_flush')
+    def _auditoria_after_flush(session_, flush_context):
+        if session_.info.get('_audit_logging_disabled'):
+            return
+        try:
+            _capturar(session_, escritor)
+        except Exception as e:
+            logger.debug(f"[auditoria] Falha ao capturar alterações do flush: {e}")
+
+    @event.listens_for(session_cls, 'after_commit')
+    def _auditoria_after_commit(session_):
+        acumulado = session_.info.pop(_CHAVE_SESSAO, None)
+        if not acumulado or not (acumulado['registros'] or acumulado['reordenacoes']):
+            return
+        try:
+            escritor.enfileirar(_linhas_do_commit(acumulado))
+        except Exception as e:
+            logger.error(f"[auditoria] Falha ao enviar auditoria do commit: {e}")
+
+    @event.listens_for(session_cls, 'after_soft_rollback')
+    def _auditoria_after_soft_rollback(session_, previous_transaction):
+        # after_rollback também dispara no ROLLBACK TO SAVEPOINT: só a externa descarta
+        if previous_transaction.parent is None:
+            session_.info.pop(_CHAVE_SESSAO, None)
+
+
+# Instância global (uma por processo)
+escritor_auditoria = EscritorAuditoria()
@@ -0,0 +1,404 @@
+"""
+Particionamento e arquivamento do audit_log
+
+PostgreSQL: ``audit_log`` vira uma tabela particionada por mês em
+``data_criacao`` (``audit_log_AAAA_MM``). O histórico que já existia é
+anexado como a partição ``audit_log_historico`` (sem copiar linhas) e a
+partição ``audit_log_padrao`` (DEFAULT, mesmo nome usado pela restauração de
+backup) recebe o que cair fora das partições criadas. As partições dos
+próximos meses são criadas com antecedência.
+
+SQLite: a tabela viva guarda só os últimos ``AUDITORIA_MESES_ATIVOS`` meses
+(padrão 3); o restante vai para ``audit_log_arquivo``, consultável pela tela
+de auditoria.
+
+Nos dois bancos, o que passa de ``AUDITORIA_MESES_RETENCAO`` meses (padrão
+24; 0 desliga) é exportado para ``audit_log_AAAA-MM.jsonl.gz`` em
+``AUDITORIA_ARQUIVO_DIR`` (padrão: backups/auditoria) e removido do banco. O
+.gz só recebe as linhas depois do commit da remoção (um rollback não deixa
+linhas exportadas que continuam no banco). No
+PostgreSQL, um mês inteiro numa partição própria sai com DROP TABLE. O
+arquivamento roda no máximo a cada ``AUDITORIA_ARQUIVAR_INTERVALO_H`` horas
+(padrão 24) pela thread da auditoria; em ambiente serverless só roda com
+``AUDITORIA_ARQUIVO_DIR`` configurado (o disco local é descartado).
+"""
+import os
+import json
+import gzip
+import time
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import Column, MetaData, Table, func, select, text
+
+logger = logging.getLogger(__name__)
+
+TABELA = 'audit_log'
+TABELA_ARQUIVO = 'audit_log_arquivo'
+PARTICAO_HISTORICO = 'audit_log_historico'
+PARTICAO_PADRAO = 'audit_log_padrao'
+MESES_A_FRENTE = 2
+
+# Chave do advisory lock que serializa conversão/arquivamento entre workers
+_CHAVE_LOCK = 730_019_020
+
+# nome -> colunas (os mesmos índices valem para a tabela de arquivo)
+INDICES = [
+    # Histórico de uma entidade (/auditoria/<tipo>/<id>)
+    ('entidade_data', ['entidade_tipo', 'entidade_id', 'data_criacao']),
+    # Filtro por usuário
+    ('usuario_data', ['usuario_id', 'data_criacao']),
+    # Listagem padrão (mais recentes primeiro) e filtros por período
+    ('data_criacao', ['data_criacao']),
+]
+
+_tabela_arquivo = None
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(0, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def is_postgres(db_engine):
+    return db_engine.dialect.name.startswith('postgres')
+
+
+def diretorio_arquivo():
+    base = os.getenv('AUDITORIA_ARQUIVO_DIR') or os.path.join(
+        os.path.abspath(os.path.join(os.path.dirname(__file__), '..')), 'backups', 'auditoria'
+    )
+    os.makedirs(base, exist_ok=True)
+    return base
+
+
+def tabela_arquivo():
+    """Tabela ``audit_log_arquivo`` (SQLite): mesmas colunas do audit_log, fora do metadata do app."""
+    global _tabela_arquivo
+    if _tabela_arquivo is None:
+        from models import AuditLog
+        metadata = MetaData()
+        _tabela_arquivo = Table(TABELA_ARQUIVO, metadata, *[
+            Column(c.name, c.type, primary_key=c.primary_key, nullable=c.nullable)
+            for c in AuditLog.__table__.columns
+        ])
+    return _tabela_arquivo
+
+
+def sql_indices(tabela):
+    return [
+        f"CREATE INDEX IF NOT EXISTS ix_{tabela}_{sufixo} ON {tabela} ({', '.join(colunas)})"
+        for sufixo, colunas in INDICES
+    ]
+
+
+def _inicio_mes(data):
+    return datetime(data.year, data.month, 1)
+
+
+def _somar_meses(data, meses):
+    indice = data.year * 12 + (data.month - 1) + meses
+    return datetime(indice // 12, indice % 12 + 1, 1)
+
+
+def _nome_particao(inicio):
+    return f'{TABELA}_{inicio.year:04d}_{inicio.month:02d}'
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL: particionamento
+# ---------------------------------------------------------------------------
+
+def particionada(conn):
+    return conn.execute(text(
+        "SELECT c.relkind = 'p' FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = current_schema() AND c.relname = :nome"
+    ), {'nome': TABELA}).scalar()
+
+
+def _existe(conn, nome):
+    return conn.execute(text("SELECT to_regclass(:nome) IS NOT NULL"), {'nome': nome}).scalar()
+
+
+def particionar(db_engine):
+    """
+    Converte audit_log em tabela particionada por mês. As linhas existentes
+    ficam onde estão: a tabela antiga é anexada como partição de histórico
+    até o fim do mês do registro mais recente.
+    """
+    with db_engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _CHAVE_LOCK})
+        if particionada(conn):
+            return False
+
+        maximo = conn.execute(text(f"SELECT max(data_criacao) FROM {TABELA}")).scalar()
+        limite = _somar_meses(_inicio_mes(max(maximo or datetime.utcnow(), datetime.utcnow())), 1)
+        sequencia = conn.execute(text("SELECT pg_get_serial_sequence(:tabela, 'id')"), {'tabela': TABELA}).scalar()
+        indices = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :tabela"
+        ), {'tabela': TABELA}).scalars().all()
+
+        logger.info(f"[auditoria] Particionando {TABELA} (histórico até {limite:%Y-%m-%d})...")
+        conn.execute(text(f"ALTER TABLE {TABELA} RENAME TO {PARTICAO_HISTORICO}"))
+        for indice in indices:
+            # Os nomes ficam livres para os índices da tabela particionada
+            conn.execute(text(f'ALTER INDEX "{indice}" RENAME TO "{indice[:50]}_historico"'))
+        conn.execute(text(
+            f"CREATE TABLE {TABELA} (LIKE {PARTICAO_HISTORICO} INCLUDING DEFAULTS) PARTITION BY RANGE (data_criacao)"
+        ))
+        conn.execute(text(f"ALTER TABLE {TABELA} ADD CONSTRAINT {TABELA}_pkey PRIMARY KEY (id, data_criacao)"))
+        conn.execute(text(
+            f"ALTER TABLE {TABELA} ATTACH PARTITION {PARTICAO_HISTORICO} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{limite:%Y-%m-%d}')"
+        ))
+        conn.execute(text(f"CREATE TABLE {PARTICAO_PADRAO} PARTITION OF {TABELA} DEFAULT"))
+        if sequencia:
+            conn.execute(text(f"ALTER SEQUENCE {sequencia} OWNED BY {TABELA}.id"))
+        for sql in sql_indices(TABELA):
+            conn.execute(text(sql))
+        _criar_particoes(conn, limite)
+
+    # LIKE não copia chaves estrangeiras; sem ela a auditoria continua funcionando
+    try:
+        with db_engine.begin() as conn:
+            conn.execute(text(
+                f"ALTER TABLE {TABELA} ADD CONSTRAINT {TABELA}_usuario_id_fkey "
+                f"FOREIGN KEY (usuario_id) REFERENCES usuario(id)"
+            ))
+    except Exception as e:
+        logger.warning(f"[auditoria] Chave estrangeira usuario_id não recriada: {e}")
+    logger.info(f"✅ {TABELA} particionada por mês")
+    return True
+
+
+def _criar_particao(conn, inicio):
+    nome = _nome_particao(inicio)
+    if _existe(conn, nome):
+        return False
+    fim = _somar_meses(inicio, 1)
+    faixa = {'inicio': inicio, 'fim': fim}
+    limites = f"FROM ('{inicio:%Y-%m-%d}') TO ('{fim:%Y-%m-%d}')"
+    possui_padrao = _existe(conn, PARTICAO_PADRAO)
+    linhas_no_padrao = possui_padrao and conn.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {PARTICAO_PADRAO} WHERE data_criacao >= :inicio AND data_criacao < :fim)"
+    ), faixa).scalar()
+    if not linhas_no_padrao:
+        conn.execute(text(f"CREATE TABLE {nome} PARTITION OF {TABELA} FOR VALUES {limites}"))
+        return True
+
+    # Linhas do mês na partição padrão (ex.: após restaurar backup): movê-las para a nova partição
+    conn.execute(text(f"ALTER TABLE {TABELA} DETACH PARTITION {PARTICAO_PADRAO}"))
+    conn.execute(text(f"CREATE TABLE {nome} PARTITION OF {TABELA} FOR VALUES {limites}"))
+    conn.execute(text(
+        f"INSERT INTO {nome} SELECT * FROM {PARTICAO_PADRAO} WHERE data_criacao >= :inicio AND data_criacao < :fim"
+    ), faixa)
+    conn.execute(text(f"DELETE FROM {PARTICAO_PADRAO} WHERE data_criacao >= :inicio AND data_criacao < :fim"), faixa)
+    conn.execute(text(f"ALTER TABLE {TABELA} ATTACH PARTITION {PARTICAO_PADRAO} DEFAULT"))
+    return True
+
+
+def _criar_particoes(conn, a_partir_de=None):
+    atual = _inicio_mes(datetime.utcnow())
+    inicio = max(atual, a_partir_de or atual)
+    criadas = 0
+    for i in range(MESES_A_FRENTE + 1):
+        mes = _somar_meses(inicio, i)
+        if mes > _somar_meses(atual, MESES_A_FRENTE):
+            break
+        criadas += int(_criar_particao(conn, mes))
+    return criadas
+
+
+def garantir_particoes(db_engine):
+    """Cria as partições do mês atual e dos próximos ``MESES_A_FRENTE`` meses que faltarem."""
+    with db_engine.begin() as conn:
+        if not particionada(conn):
+            return 0
+        conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _CHAVE_LOCK})
+        limite_historico = conn.execute(text(
+            "SELECT pg_get_expr(c.relpartbound, c.oid) FROM pg_class c WHERE c.oid = to_regclass(:nome)"
+        ), {'nome': PARTICAO_HISTORICO}).scalar()
+        a_partir_de = None
+        if limite_historico and "TO ('" in limite_historico:
+            a_partir_de = datetime.fromisoformat(limite_historico.split("TO ('", 1)[1][:10])
+        return _criar_particoes(conn, a_partir_de)
+
+
+def _particoes_mensais(conn):
+    """{início do mês: nome} das partições mensais existentes."""
+    nomes = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:tabela)"
+    ), {'tabela': TABELA}).scalars().all()
+    particoes = {}
+    for nome in nomes:
+        sufixo = nome[len(TABELA) + 1:]
+        try:
+            particoes[datetime.strptime(sufixo, '%Y_%m')] = nome
+        except ValueError:
+            continue  # histórico/padrão
+    return particoes
+
+
+# ---------------------------------------------------------------------------
+# Arquivamento
+# ---------------------------------------------------------------------------
+
+def _exportar(conn, tabela, inicio, fim, diretorio, exportados):
+    """
+    Grava as linhas do período num .gz temporário e o registra em ``exportados``
+    (publicado por ``_transacao_exportando`` após o commit). Devolve a quantidade.
+    """
+    caminho = os.path.join(diretorio, f'{TABELA}_{inicio:%Y-%m}.jsonl.gz')
+    consulta = (
+        select(tabela)
+        .where(tabela.c.data_criacao >= inicio, tabela.c.data_criacao < fim)
+        .order_by(tabela.c.id)
+    )
+    descritor, temporario = tempfile.mkstemp(dir=diretorio, prefix=f'.{TABELA}_{inicio:%Y-%m}.', suffix='.parcial')
+    os.close(descritor)
+    quantidade = 0
+    try:
+        with gzip.open(temporario, 'wt', encoding='utf-8') as saida:
+            for linha in conn.execution_options(yield_per=2000).execute(consulta):
+                saida.write(json.dumps(dict(linha._mapping), ensure_ascii=False, default=str) + '\n')
+                quantidade += 1
+    except BaseException:
+        os.remove(temporario)
+        raise
+    if quantidade:
+        exportados.append((temporario, caminho))
+    else:
+        os.remove(temporario)
+    return quantidade
+
+
+def _publicar(exportados):
+    """Leva os temporários ao arquivo do mês (renomeia, ou anexa como novo membro gzip)."""
+    for temporario, caminho in exportados:
+        if not os.path.exists(caminho):
+            os.replace(temporario, caminho)
+            continue
+        # Membros gzip concatenados continuam válidos para gunzip/zcat
+        with open(temporario, 'rb') as origem, open(caminho, 'ab') as destino:
+            shutil.copyfileobj(origem, destino)
+            destino.flush()
+            os.fsync(destino.fileno())
+        os.remove(temporario)
+
+
+@contextmanager
+def _transacao_exportando(db_engine):
+    """
+    ``db_engine.begin()`` cujas exportações só chegam ao diretório de arquivo
+    depois do commit: num rollback os temporários são apagados, e a próxima
+    execução exporta as mesmas linhas sem duplicar o que já estava arquivado.
+    """
+    exportados = []
+    try:
+        with db_engine.begin() as conn:
+            yield conn, exportados
+    except BaseException:
+        for temporario, _ in exportados:
+            try:
+                os.remove(temporario)
+            except OSError:
+                pass
+        raise
+    _publicar(exportados)
+
+
+def _arquivar_periodo(conn, tabela, corte, diretorio, resumo, exportados):
+    """Exporta e remove de ``tabela`` as linhas anteriores a ``corte``, mês a mês."""
+    minimo = conn.execute(select(func.min(tabela.c.data_criacao))).scalar()
+    if minimo is None or minimo >= corte:
+        return
+    mes = _inicio_mes(minimo)
+    while mes < corte:
+        fim = min(_somar_meses(mes, 1), corte)
+        quantidade = _exportar(conn, tabela, mes, fim, diretorio, exportados)
+        if quantidade:
+            conn.execute(tabela.delete().where(tabela.c.data_criacao >= mes, tabela.c.data_criacao < fim))
+            chave = f'{mes:%Y-%m}'
+            resumo['exportadas'][chave] = resumo['exportadas'].get(chave, 0) + quantidade
+        mes = fim
+
+
+def arquivar(db_engine, meses_ativos=None, meses_retencao=None, diretorio=None):
+    """
+    Executa a retenção. Devolve ``{'movidas_arquivo', 'exportadas': {mês: linhas},
+    'particoes_removidas', 'duracao_segundos'}``.
+    """
+    from models import AuditLog
+
+    inicio_execucao = time.time()
+    meses_ativos = _env_int('AUDITORIA_MESES_ATIVOS', 3) if meses_ativos is None else meses_ativos
+    meses_retencao = _env_int('AUDITORIA_MESES_RETENCAO', 24) if meses_retencao is None else meses_retencao
+    agora = _inicio_mes(datetime.utcnow())
+    resumo = {'movidas_arquivo': 0, 'exportadas': {}, 'particoes_removidas': []}
+    tabela = AuditLog.__table__
+
+    if is_postgres(db_engine):
+        garantir_particoes(db_engine)
+        if meses_retencao:
+            corte = _somar_meses(agora, -meses_retencao)
+            diretorio = diretorio or diretorio_arquivo()
+            with _transacao_exportando(db_engine) as (conn, exportados):
+                conn.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {'chave': _CHAVE_LOCK})
+                if particionada(conn):
+                    for mes, nome in sorted(_particoes_mensais(conn).items()):
+                        if _somar_meses(mes, 1) > corte:
+                            continue
+                        _exportar(conn, tabela, mes, _somar_meses(mes, 1), diretorio, exportados)
+                        conn.execute(text(f"DROP TABLE {nome}"))
+                        resumo['particoes_removidas'].append(nome)
+                # Histórico, partição padrão ou tabela ainda não particionada
+                _arquivar_periodo(conn, tabela, corte, diretorio, resumo, exportados)
+    else:
+        arquivo = tabela_arquivo()
+        arquivo.create(db_engine, checkfirst=True)
+        if meses_ativos:
+            corte_ativo = _somar_meses(agora, -meses_ativos)
+            with db_engine.begin() as conn:
+                colunas = [c.name for c in arquivo.columns]
+                movidas = conn.execute(arquivo.insert().from_select(
+                    colunas, select(*[tabela.c[c] for c in colunas]).where(tabela.c.data_criacao < corte_ativo)
+                )).rowcount
+                conn.execute(tabela.delete().where(tabela.c.data_criacao < corte_ativo))
+                resumo['movidas_arquivo'] = max(movidas or 0, 0)
+        if meses_retencao:
+            corte = _somar_meses(agora, -meses_retencao)
+            diretorio = diretorio or diretorio_arquivo()
+            with _transacao_exportando(db_engine) as (conn, exportados):
+                _arquivar_periodo(conn, arquivo, corte, diretorio, resumo, exportados)
+                _arquivar_periodo(conn, tabela, corte, diretorio, resumo, exportados)
+
+    resumo['duracao_segundos'] = round(time.time() - inicio_execucao, 2)
+    if resumo['movidas_arquivo'] or resumo['exportadas'] or resumo['particoes_removidas']:
+        logger.info(f"[auditoria] Arquivamento: {resumo}")
+    return resumo
+
+
+def executar_se_devido(db_engine):
+    """Roda ``arquivar`` se a última execução (marcador no diretório de arquivo) passou do intervalo."""
+    serverless = bool(os.getenv('VERCEL') or os.environ.get('AWS_LAMBDA_FUNCTION_NAME'))
+    if serverless and not os.getenv('AUDITORIA_ARQUIVO_DIR'):
+        return None
+    intervalo_s = _env_int('AUDITORIA_ARQUIVAR_INTERVALO_H', 24) * 3600
+    if not intervalo_s:
+        return None
+    marcador = os.path.join(diretorio_arquivo(), '.ultima_execucao')
+    try:
+        if time.time() - os.path.getmtime(marcador) < intervalo_s:
+            return None
+    except OSError:
+        pass
+    # Marca antes de rodar: os outros workers não repetem enquanto este trabalha
+    with open(marcador, 'w') as f:
+        f.write(datetime.utcnow().isoformat())
+    return arquivar(db_engine)
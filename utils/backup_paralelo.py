@@ -0,0 +1,917 @@
+"""
+Backup em streaming e paralelo (PostgreSQL + Supabase Storage)
+
+Banco (PostgreSQL):
+- Cada tabela é exportada com ``COPY ... TO STDOUT (FORMAT csv, HEADER)``
+  direto para um arquivo temporário e entra no ZIP assim que termina; nada
+  passa por ``fetchall()``. A memória não cresce com o tamanho das tabelas.
+- As tabelas são divididas entre ``BACKUP_CONEXOES`` conexões (padrão 4),
+  maiores primeiro. Todas usam o mesmo snapshot (``pg_export_snapshot``),
+  então o backup é consistente como num pg_dump.
+- O esquema é lido do catálogo com os tipos reais das colunas. O ZIP leva
+  ``banco/esquema.sql`` (sequências e tabelas sem restrições),
+  ``banco/pos_carga.sql`` (PK/UNIQUE/CHECK, índices, FKs e sequências, para
+  rodar depois da carga) e ``banco/manifesto.json``.
+
+Tabelas transitórias (``importacao_excel_temp``) entram só no esquema; as
+tabelas FTS do SQLite (``busca_indice*``) nunca são exportadas, pois são
+derivadas e recriadas pela migração de busca.
+
+Storage: os arquivos do bucket ficam num espelho local com um manifesto
+``{caminho: etag, tamanho, sha256}``. A cada backup só são baixados os
+arquivos novos ou alterados (em paralelo, ``BACKUP_STORAGE_DOWNLOADS``
+threads), e os demais saem do espelho direto para o ZIP.
+
+Restauração (``restaurar_postgresql``): esquema sem restrições num schema de
+carga, tabelas em paralelo com ``COPY FROM`` lendo os CSVs do próprio ZIP,
+chaves, índices (em paralelo entre tabelas), FKs e sequências ainda nesse
+schema, e só então a troca pelo public numa transação. Os
+arquivos do Storage voltam em paralelo (``BACKUP_STORAGE_UPLOADS``).
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+try:
+    import psycopg2  # type: ignore
+except Exception:
+    psycopg2 = None
+
+logger = logging.getLogger(__name__)
+
+FORMATO = 'linhamestre-copy-v1'
+PASTA_BANCO = 'banco'
+PASTA_STORAGE = 'supabase_storage'
+# Schema onde a restauração carrega os dados antes de trocar pelo public
+SCHEMA_CARGA = 'restauracao_carga'
+ARQUIVO_MANIFESTO_ESPELHO = '_manifesto.json'
+
+# Dados transitórios: a estrutura vai no backup, as linhas não
+TABELAS_SEM_DADOS = {'importacao_excel_temp'}
+# Índice FTS do SQLite e suas tabelas internas (derivados das tabelas de origem)
+PREFIXOS_IGNORADOS = ('busca_indice',)
+
+# Arquivos já comprimidos vão sem deflate (só gastaria CPU)
+EXTENSOES_SEM_COMPRESSAO = {'.pdf', '.png', '.jpg', '.jpeg', '.webp', '.gif', '.zip', '.gz', '.7z', '.xlsx', '.docx'}
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(1, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def tabela_ignorada(nome):
+    return nome.startswith(PREFIXOS_IGNORADOS)
+
+
+def identificador(nome):
+    return '"' + str(nome).replace('"', '""') + '"'
+
+
+def definicao_indice(definicao):
+    """
+    ``pg_get_indexdef`` de tabela particionada sai como ``ON ONLY tabela``:
+    recriado assim, o índice fica só no pai (inválido) e nunca é construído
+    nas partições. Sem o ONLY o PostgreSQL cria e anexa o de cada partição.
+    """
+    return definicao.replace(' ON ONLY ', ' ON ', 1)
+
+
+def _compressao(caminho):
+    return zipfile.ZIP_STORED if os.path.splitext(caminho)[1].lower() in EXTENSOES_SEM_COMPRESSAO else zipfile.ZIP_DEFLATED
+
+
+def adicionar_diretorio(zipf, origem, prefixo):
+    """Coloca ``origem`` no ZIP sob ``prefixo`` sem cópia intermediária. Devolve o número de arquivos."""
+    total = 0
+    if not origem or not os.path.isdir(origem):
+        return total
+    for raiz, _, arquivos in os.walk(origem):
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            relativo = os.path.relpath(caminho, origem).replace('\\', '/')
+            zipf.write(caminho, f'{prefixo}/{relativo}' if prefixo else relativo, compress_type=_compressao(caminho))
+            total += 1
+    return total
+
+
+# ---------------------------------------------------------------------------
+# SQLite
+# ---------------------------------------------------------------------------
+
+def despejar_sqlite(zipf, db_path, nome_no_zip=None):
+    """Snapshot consistente do SQLite (API de backup) direto para o ZIP, mesmo com o app gravando."""
+    import sqlite3
+
+    fd, tmp = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    try:
+        origem = sqlite3.connect(db_path)
+        destino = sqlite3.connect(tmp)
+        try:
+            origem.backup(destino, pages=4096)
+        finally:
+            destino.close()
+            origem.close()
+        zipf.write(tmp, nome_no_zip or os.path.basename(db_path))
+    finally:
+        os.remove(tmp)
+
+
+# ---------------------------------------------------------------------------
+# PostgreSQL
+# ---------------------------------------------------------------------------
+
+def conectar_postgresql(conn_info):
+    if psycopg2 is None:
+        raise Exception("psycopg2 não instalado: necessário para o backup via COPY")
+    return psycopg2.connect(
+        host=conn_info['host'],
+        port=conn_info.get('port') or 5432,
+        dbname=conn_info['database'],
+        user=conn_info['username'],
+        password=conn_info['password'],
+        connect_timeout=30,
+    )
+
+
+def ler_esquema(cur):
+    """Tabelas, colunas (tipos reais), restrições, índices e sequências do schema public."""
+    cur.execute("""
+        SELECT c.relname, c.relkind = 'p', pg_get_partkeydef(c.oid), GREATEST(c.reltuples, 0)::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition
+        ORDER BY c.relname
+    """)
+    tabelas = {}
+    for nome, particionada, chave_particao, estimativa in cur.fetchall():
+        if tabela_ignorada(nome):
+            continue
+        tabelas[nome] = {
+            'nome': nome,
+            'colunas': [],
+            'particao': chave_particao if particionada else None,
+            'estimativa_linhas': int(estimativa or 0),
+            'somente_esquema': nome in TABELAS_SEM_DADOS,
+        }
+
+    cur.execute("""
+        SELECT c.relname, a.attname, format_type(a.atttypid, a.atttypmod), a.attnotnull,
+               pg_get_expr(d.adbin, d.adrelid), a.attidentity, a.attgenerated
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND a.attnum > 0 AND NOT a.attisdropped
+        ORDER BY c.relname, a.attnum
+    """)
+    for tabela, coluna, tipo, not_null, padrao, identidade, gerada in cur.fetchall():
+        if tabela in tabelas:
+            tabelas[tabela]['colunas'].append({
+                'nome': coluna,
+                'tipo': tipo,
+                'not_null': bool(not_null),
+                'padrao': padrao,
+                'identidade': identidade or '',
+                'gerada': gerada or '',
+            })
+
+    cur.execute("""
+        SELECT t.relname, k.conname, k.contype, pg_get_constraintdef(k.oid)
+        FROM pg_constraint k
+        JOIN pg_class t ON t.oid = k.conrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE n.nspname = 'public' AND k.contype IN ('p', 'u', 'c', 'f')
+        ORDER BY CASE k.contype WHEN 'p' THEN 0 WHEN 'u' THEN 1 WHEN 'c' THEN 2 ELSE 3 END, t.relname, k.conname
+    """)
+    restricoes = [
+        {'tabela': t, 'nome': nome, 'tipo': tipo, 'definicao': definicao}
+        for t, nome, tipo, definicao in cur.fetchall() if t in tabelas
+    ]
+
+    cur.execute("""
+        SELECT t.relname, ic.relname, pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        JOIN pg_class ic ON ic.oid = i.indexrelid
+        JOIN pg_class t ON t.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = t.relnamespace
+        WHERE n.nspname = 'public'
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid AND k.contype IN ('p', 'u', 'x'))
+        ORDER BY t.relname, ic.relname
+    """)
+    indices = [
+        {'tabela': t, 'nome': nome, 'definicao': definicao_indice(definicao)}
+        for t, nome, definicao in cur.fetchall() if t in tabelas
+    ]
+
+    # Sequências avulsas/serial (as de colunas IDENTITY nascem com a coluna)
+    cur.execute("""
+        SELECT s.relname, dono.relname, a.attname
+        FROM pg_class s
+        JOIN pg_namespace n ON n.oid = s.relnamespace
+        LEFT JOIN pg_depend d ON d.objid = s.oid AND d.deptype = 'a' AND d.classid = 'pg_class'::regclass
+        LEFT JOIN pg_class dono ON dono.oid = d.refobjid
+        LEFT JOIN pg_attribute a ON a.attrelid = d.refobjid AND a.attnum = d.refobjsubid
+        WHERE n.nspname = 'public' AND s.relkind = 'S'
+          AND NOT EXISTS (SELECT 1 FROM pg_depend i WHERE i.objid = s.oid AND i.deptype = 'i')
+        ORDER BY s.relname
+    """)
+    sequencias = [
+        {'nome': nome, 'tabela': tabela, 'coluna': coluna}
+        for nome, tabela, coluna in cur.fetchall()
+        if not tabela or tabela in tabelas
+    ]
+
+    return {'tabelas': tabelas, 'restricoes': restricoes, 'indices': indices, 'sequencias': sequencias}
+
+
+def _colunas_copiaveis(info):
+    return [c['nome'] for c in info['colunas'] if not c['gerada']]
+
+
+def sql_esquema(esquema):
+    """Sequências e tabelas (colunas, tipos, NOT NULL e defaults), sem restrições nem índices."""
+    linhas = [
+        f"-- Esquema gerado em {datetime.now().isoformat(timespec='seconds')} ({FORMATO})",
+        '',
+    ]
+    for seq in esquema['sequencias']:
+        linhas.append(f"CREATE SEQUENCE IF NOT EXISTS {identificador(seq['nome'])};")
+    linhas.append('')
+
+    for info in esquema['tabelas'].values():
+        definicoes = []
+        for col in info['colunas']:
+            partes = [identificador(col['nome']), col['tipo']]
+            if col['gerada'] == 's' and col['padrao']:
+                partes.append(f"GENERATED ALWAYS AS ({col['padrao']}) STORED")
+            elif col['identidade'] == 'a':
+                partes.append('GENERATED ALWAYS AS IDENTITY')
+            elif col['identidade'] == 'd':
+                partes.append('GENERATED BY DEFAULT AS IDENTITY')
+            elif col['padrao'] is not None:
+                partes.append(f"DEFAULT {col['padrao']}")
+            if col['not_null']:
+                partes.append('NOT NULL')
+            definicoes.append('    ' + ' '.join(partes))
+        particao = f" PARTITION BY {info['particao']}" if info['particao'] else ''
+        linhas.append(f"CREATE TABLE IF NOT EXISTS {identificador(info['nome'])} (\n" + ',\n'.join(definicoes) + f"\n){particao};")
+        if info['particao']:
+            # Partição padrão: a carga não depende de as partições por período já existirem
+            linhas.append(
+                f"CREATE TABLE IF NOT EXISTS {identificador(info['nome'] + '_padrao')} "
+                f"PARTITION OF {identificador(info['nome'])} DEFAULT;"
+            )
+        linhas.append('')
+    return '\n'.join(linhas) + '\n'
+
+
+def comandos_pos_carga(esquema):
+    """
+    Comandos para depois da carga, agrupados para a restauração:
+    ``extensoes``; ``por_tabela`` (PK/UNIQUE/CHECK e índices de cada tabela,
+    que podem rodar em paralelo entre tabelas); ``chaves_estrangeiras``;
+    ``sequencias`` (dono e próximo valor a partir do maior id carregado).
+    """
+    por_tabela = {}
+    for r in esquema['restricoes']:
+        if r['tipo'] != 'f':
+            por_tabela.setdefault(r['tabela'], []).append(
+                f"ALTER TABLE {identificador(r['tabela'])} ADD CONSTRAINT {identificador(r['nome'])} {r['definicao']}"
+            )
+    for i in esquema['indices']:
+        por_tabela.setdefault(i['tabela'], []).append(i['definicao'])
+
+    sequencias = [
+        f"ALTER SEQUENCE {identificador(seq['nome'])} OWNED BY {identificador(seq['tabela'])}.{identificador(seq['coluna'])}"
+        for seq in esquema['sequencias'] if seq['tabela'] and seq['coluna']
+    ]
+    for info in esquema['tabelas'].values():
+        for col in info['colunas']:
+            if col['identidade'] or (col['padrao'] or '').startswith('nextval('):
+                tabela, coluna = identificador(info['nome']), identificador(col['nome'])
+                sequencias.append(
+                    f"SELECT setval(pg_get_serial_sequence('{tabela}', '{col['nome']}'), "
+                    f"COALESCE((SELECT MAX({coluna}) FROM {tabela}), 0) + 1, false)"
+                )
+
+    return {
+        'extensoes': ['CREATE EXTENSION IF NOT EXISTS pg_trgm'] if any('gin_trgm_ops' in i['definicao'] for i in esquema['indices']) else [],
+        'por_tabela': por_tabela,
+        'chaves_estrangeiras': [
+            f"ALTER TABLE {identificador(r['tabela'])} ADD CONSTRAINT {identificador(r['nome'])} {r['definicao']}"
+            for r in esquema['restricoes'] if r['tipo'] == 'f'
+        ],
+        'sequencias': sequencias,
+    }
+
+
+def sql_pos_carga(comandos):
+    """``comandos_pos_carga`` como script SQL (restauração manual)."""
+    todos = list(comandos['extensoes'])
+    for lista in comandos['por_tabela'].values():
+        todos += lista
+    todos += comandos['chaves_estrangeiras'] + comandos['sequencias']
+    return '-- Restrições e índices (após a carga dos dados)\n\n' + ''.join(f'{comando};\n' for comando in todos)
+
+
+class _ConexoesPorThread:
+    """Uma conexão por thread do pool, todas no mesmo snapshot; fechadas ao final."""
+
+    def __init__(self, conn_info, snapshot):
+        self.conn_info = conn_info
+        self.snapshot = snapshot
+        self._local = threading.local()
+        self._abertas = []
+        self._lock = threading.Lock()
+
+    def obter(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        conn = conectar_postgresql(self.conn_info)
+        conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        if self.snapshot:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SET TRANSACTION SNAPSHOT %s', (self.snapshot,))
+            except Exception as e:
+                conn.rollback()
+                logger.warning(f"[backup] Snapshot compartilhado indisponível nesta conexão: {e}")
+        self._local.conn = conn
+        with self._lock:
+            self._abertas.append(conn)
+        return conn
+
+    def fechar(self):
+        for conn in self._abertas:
+            try:
+                conn.rollback()
+                conn.close()
+            except Exception:
+                pass
+
+
+def _copiar_tabela(conexoes, info, pasta_tmp):
+    """COPY da tabela para um CSV temporário. Devolve (nome, caminho, linhas)."""
+    colunas = ', '.join(identificador(c) for c in _colunas_copiaveis(info))
+    if info['particao']:
+        # COPY direto não aceita tabela particionada
+        origem = f"(SELECT {colunas} FROM {identificador(info['nome'])})"
+    else:
+        origem = f"{identificador(info['nome'])} ({colunas})"
+
+    fd, caminho = tempfile.mkstemp(prefix=f"{info['nome']}_", suffix='.csv', dir=pasta_tmp)
+    conn = conexoes.obter()
+    with os.fdopen(fd, 'wb') as arquivo, conn.cursor() as cur:
+        cur.copy_expert(f"COPY {origem} TO STDOUT WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')", arquivo, size=1024 * 1024)
+        linhas = cur.rowcount
+    return info['nome'], caminho, linhas
+
+
+def despejar_postgresql(zipf, conn_info, progresso=None):
+    """
+    Grava esquema, dados (CSV por tabela) e manifesto do banco sob ``banco/``
+    no ZIP aberto. ``progresso(feitas, total, tabela)`` a cada tabela.
+    Devolve o manifesto.
+    """
+    inicio = datetime.now()
+    coordenador = conectar_postgresql(conn_info)
+    conexoes = None
+    try:
+        coordenador.set_session(isolation_level='REPEATABLE READ', readonly=True)
+        with coordenador.cursor() as cur:
+            esquema = ler_esquema(cur)
+            try:
+                cur.execute('SELECT pg_export_snapshot()')
+                snapshot = cur.fetchone()[0]
+            except Exception as e:
+                coordenador.rollback()
+                snapshot = None
+                logger.warning(f"[backup] pg_export_snapshot indisponível, tabelas sem snapshot comum: {e}")
+
+        zipf.writestr(f'{PASTA_BANCO}/esquema.sql', sql_esquema(esquema))
+        pos_carga = comandos_pos_carga(esquema)
+        zipf.writestr(f'{PASTA_BANCO}/pos_carga.sql', sql_pos_carga(pos_carga))
+
+        # Maiores primeiro: as grandes não ficam sozinhas no fim
+        com_dados = sorted(
+            (info for info in esquema['tabelas'].values() if not info['somente_esquema']),
+            key=lambda info: info['estimativa_linhas'], reverse=True,
+        )
+        linhas_por_tabela = {}
+        conexoes = _ConexoesPorThread(conn_info, snapshot)
+        with tempfile.TemporaryDirectory(prefix='backup_copy_') as pasta_tmp, \
+                ThreadPoolExecutor(max_workers=_env_int('BACKUP_CONEXOES', 4)) as pool:
+            futuros = [pool.submit(_copiar_tabela, conexoes, info, pasta_tmp) for info in com_dados]
+            for feitas, futuro in enumerate(as_completed(futuros), start=1):
+                nome, caminho, linhas = futuro.result()
+                zipf.write(caminho, f'{PASTA_BANCO}/dados/{nome}.csv')
+                os.remove(caminho)
+                linhas_por_tabela[nome] = linhas
+                logger.info(f"[backup] {feitas}/{len(com_dados)} {nome}: {linhas} linha(s)")
+                if progresso:
+                    progresso(feitas, len(com_dados), nome)
+    finally:
+        if conexoes:
+            conexoes.fechar()
+        try:
+            coordenador.rollback()
+            coordenador.close()
+        except Exception:
+            pass
+
+    manifesto = {
+        'formato': FORMATO,
+        'criado_em': inicio.isoformat(),
+        'duracao_segundos': round((datetime.now() - inicio).total_seconds(), 1),
+        'snapshot_consistente': bool(snapshot),
+        'tabelas': [
+            {
+                'nome': info['nome'],
+                'colunas': _colunas_copiaveis(info),
+                'linhas': linhas_por_tabela.get(info['nome'], 0),
+                'arquivo': None if info['somente_esquema'] else f"dados/{info['nome']}.csv",
+            }
+            for info in esquema['tabelas'].values()
+        ],
+        'pos_carga': pos_carga,
+    }
+    zipf.writestr(f'{PASTA_BANCO}/manifesto.json', json.dumps(manifesto, indent=2, ensure_ascii=False))
+    return manifesto
+
+
+# ---------------------------------------------------------------------------
+# Supabase Storage (sincronização incremental)
+# ---------------------------------------------------------------------------
+
+def _config_storage():
+    url = (os.getenv('SUPABASE_URL') or '').rstrip('/')
+    chave = os.getenv('SUPABASE_SERVICE_KEY') or os.getenv('SUPABASE_ANON_KEY') or os.getenv('SUPABASE_KEY')
+    bucket = os.getenv('SUPABASE_BUCKET', 'uploads')
+    return url, chave, bucket
+
+
+def _listar_bucket(sessao, url, bucket, prefixo='', limite=1000):
+    """Todos os objetos do bucket (recursivo, paginado: a API devolve no máximo ``limit`` por chamada)."""
+    objetos = []
+    offset = 0
+    while True:
+        resp = sessao.post(
+            f"{url}/storage/v1/object/list/{bucket}",
+            json={'prefix': prefixo, 'limit': limite, 'offset': offset, 'sortBy': {'column': 'name', 'order': 'asc'}},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        itens = resp.json() or []
+        for item in itens:
+            nome = item.get('name')
+            if not nome:
+                continue
+            caminho = f"{prefixo}{nome}"
+            # Pastas vêm sem id/metadata
+            if item.get('id') is None and not item.get('metadata'):
+                objetos.extend(_listar_bucket(sessao, url, bucket, f"{caminho}/", limite))
+            else:
+                meta = item.get('metadata') or {}
+                objetos.append({
+                    'name': caminho,
+                    'size': meta.get('size', 0),
+                    'etag': (meta.get('eTag') or '').strip('"'),
+                    'last_modified': item.get('updated_at') or meta.get('lastModified'),
+                })
+        if len(itens) < limite:
+            return objetos
+        offset += limite
+
+
+def _ler_manifesto_espelho(pasta):
+    try:
+        with open(os.path.join(pasta, ARQUIVO_MANIFESTO_ESPELHO), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _gravar_manifesto_espelho(pasta, manifesto):
+    caminho = os.path.join(pasta, ARQUIVO_MANIFESTO_ESPELHO)
+    tmp = caminho + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False)
+    os.replace(tmp, caminho)
+
+
+def _inalterado(registro, objeto, caminho_local):
+    if not registro or not os.path.exists(caminho_local):
+        return False
+    if os.path.getsize(caminho_local) != registro.get('tamanho'):
+        return False
+    if objeto['etag'] and registro.get('etag'):
+        return objeto['etag'] == registro['etag']
+    return objeto['size'] == registro.get('tamanho') and objeto['last_modified'] == registro.get('atualizado_em')
+
+
+def _baixar_objeto(sessao, url, bucket, objeto, caminho_local):
+    """Baixa em streaming para o espelho (troca atômica) calculando o sha256."""
+    os.makedirs(os.path.dirname(caminho_local), exist_ok=True)
+    sha = hashlib.sha256()
+    tamanho = 0
+    tmp = caminho_local + '.parcial'
+    with sessao.get(f"{url}/storage/v1/object/{bucket}/{objeto['name']}", stream=True, timeout=120) as resp:
+        resp.raise_for_status()
+        with open(tmp, 'wb') as f:
+            for bloco in resp.iter_content(chunk_size=256 * 1024):
+                if bloco:
+                    f.write(bloco)
+                    sha.update(bloco)
+                    tamanho += len(bloco)
+    os.replace(tmp, caminho_local)
+    return {
+        'etag': objeto['etag'],
+        'tamanho': tamanho,
+        'atualizado_em': objeto['last_modified'],
+        'sha256': sha.hexdigest(),
+    }
+
+
+def sincronizar_storage(zipf, diretorio_espelho):
+    """
+    Atualiza o espelho local do bucket (só novos/alterados) e grava os
+    arquivos em ``supabase_storage/`` no ZIP, com o ``file_mapping.json``
+    esperado pela restauração. Devolve as estatísticas ou None sem credenciais.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    url, chave, bucket = _config_storage()
+    if not url or not chave:
+        logger.warning("[backup] Credenciais do Supabase Storage não configuradas; storage fora do backup")
+        return None
+
+    espelho = os.path.join(diretorio_espelho, bucket)
+    os.makedirs(espelho, exist_ok=True)
+    manifesto = _ler_manifesto_espelho(espelho)
+    downloads = _env_int('BACKUP_STORAGE_DOWNLOADS', 8)
+
+    sessao = requests.Session()
+    sessao.headers.update({'Authorization': f'Bearer {chave}', 'apikey': chave})
+    sessao.mount('https://', HTTPAdapter(pool_connections=downloads, pool_maxsize=downloads))
+    sessao.mount('http://', HTTPAdapter(pool_connections=downloads, pool_maxsize=downloads))
+
+    try:
+        objetos = _listar_bucket(sessao, url, bucket)
+        pendentes = [
+            objeto for objeto in objetos
+            if not _inalterado(manifesto.get(objeto['name']), objeto, os.path.join(espelho, objeto['name']))
+        ]
+        logger.info(f"[backup] Storage: {len(objetos)} arquivo(s), {len(pendentes)} novo(s)/alterado(s)")
+
+        falhas = set()
+        if pendentes:
+            with ThreadPoolExecutor(max_workers=downloads) as pool:
+                futuros = {
+                    pool.submit(_baixar_objeto, sessao, url, bucket, objeto, os.path.join(espelho, objeto['name'])): objeto
+                    for objeto in pendentes
+                }
+                for futuro in as_completed(futuros):
+                    objeto = futuros[futuro]
+                    try:
+                        manifesto[objeto['name']] = futuro.result()
+                    except Exception as e:
+                        falhas.add(objeto['name'])
+                        logger.warning(f"[backup] Falha ao baixar {objeto['name']}: {e}")
+    finally:
+        sessao.close()
+
+    # Arquivos removidos do bucket saem do espelho
+    atuais = {objeto['name'] for objeto in objetos}
+    for nome in [n for n in manifesto if n not in atuais]:
+        manifesto.pop(nome, None)
+        caminho = os.path.join(espelho, nome)
+        if os.path.exists(caminho):
+            os.remove(caminho)
+    _gravar_manifesto_espelho(espelho, manifesto)
+
+    incluidos = []
+    total_bytes = 0
+    for objeto in objetos:
+        caminho = os.path.join(espelho, objeto['name'])
+        if objeto['name'] in falhas or not os.path.exists(caminho):
+            continue
+        zipf.write(caminho, f"{PASTA_STORAGE}/{objeto['name']}", compress_type=_compressao(caminho))
+        registro = manifesto.get(objeto['name'], {})
+        incluidos.append(dict(objeto, sha256=registro.get('sha256')))
+        total_bytes += registro.get('tamanho') or 0
+
+    estatisticas = {
+        'bucket': bucket,
+        'files': incluidos,
+        'download_date': datetime.now().isoformat(),
+        'supabase_url': url,
+        'total_files': len(objetos),
+        'downloaded_files': len(pendentes) - len(falhas),
+        'reused_files': len(objetos) - len(pendentes),
+        'failed_files': len(falhas),
+        'total_size_bytes': total_bytes,
+    }
+    zipf.writestr(f'{PASTA_STORAGE}/file_mapping.json', json.dumps(estatisticas, indent=2, ensure_ascii=False))
+    return estatisticas
+
+
+# ---------------------------------------------------------------------------
+# Restauração
+# ---------------------------------------------------------------------------
+
+def backup_com_copy(caminho_zip):
+    """True se o ZIP foi gerado por ``despejar_postgresql`` (tem banco/manifesto.json)."""
+    try:
+        with zipfile.ZipFile(caminho_zip) as zipf:
+            return f'{PASTA_BANCO}/manifesto.json' in zipf.namelist()
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def extrair_arquivos(caminho_zip, destino):
+    """Extrai tudo menos ``banco/`` (os CSVs são lidos direto do ZIP na carga)."""
+    with zipfile.ZipFile(caminho_zip) as zipf:
+        membros = [m for m in zipf.namelist() if not m.startswith(f'{PASTA_BANCO}/')]
+        zipf.extractall(destino, membros)
+
+
+def no_schema_carga(comando):
+    """
+    Aponta para ``SCHEMA_CARGA`` as referências ao public que o catálogo
+    escreve qualificadas (``ON public.x`` dos índices, ``REFERENCES public.x``
+    das FKs); as demais saem sem schema e caem no search_path.
+    """
+    destino = f'{identificador(SCHEMA_CARGA)}.'
+    for prefixo in (' ON ONLY ', ' ON ', ' REFERENCES '):
+        comando = comando.replace(f'{prefixo}public.', f'{prefixo}{destino}')
+    return comando
+
+
+def _executar_autocommit(conn_info, comandos, rotulo, schema=None, estrito=False):
+    """
+    Executa cada comando na própria transação. Com ``schema``, roda com ele à
+    frente do search_path (comandos reescritos por ``no_schema_carga``). Sem
+    ``estrito`` as falhas viram avisos e o restante continua; com ``estrito``
+    a primeira falha interrompe com exceção.
+    """
+    avisos = []
+    if not comandos:
+        return avisos
+    conn = conectar_postgresql(conn_info)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("SET maintenance_work_mem = '256MB'")
+            except Exception:
+                pass
+            if schema:
+                cur.execute(f"SET search_path TO {identificador(schema)}, public")
+            for comando in comandos:
+                if schema:
+                    comando = no_schema_carga(comando)
+                try:
+                    cur.execute(comando)
+                except Exception as e:
+                    logger.warning(f"[restauracao] {rotulo}: {comando[:120]} -> {e}")
+                    if estrito:
+                        raise Exception(f"{rotulo}: {str(e).strip()[:300]}") from e
+                    avisos.append(f"{rotulo}: {str(e).strip()[:200]}")
+    finally:
+        conn.close()
+    return avisos
+
+
+def _carregar_tabela(conn_info, caminho_zip, tabela, schema):
+    """COPY FROM do CSV da tabela (no schema de carga) lido direto do ZIP, numa transação própria."""
+    colunas = ', '.join(identificador(c) for c in tabela['colunas'])
+    conn = conectar_postgresql(conn_info)
+    try:
+        with conn.cursor() as cur, zipfile.ZipFile(caminho_zip) as zipf, \
+                zipf.open(f"{PASTA_BANCO}/{tabela['arquivo']}") as csv:
+            cur.execute('SET LOCAL synchronous_commit = off')
+            cur.copy_expert(
+                f"COPY {identificador(schema)}.{identificador(tabela['nome'])} ({colunas}) "
+                f"FROM STDIN WITH (FORMAT csv, HEADER true, ENCODING 'UTF8')",
+                csv, size=1024 * 1024,
+            )
+            linhas = cur.rowcount
+        conn.commit()
+        return tabela['nome'], linhas
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _descartar_schema_carga(conn_info):
+    try:
+        conn = conectar_postgresql(conn_info)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DROP SCHEMA IF EXISTS {identificador(SCHEMA_CARGA)} CASCADE")
+        finally:
+            conn.close()
+    except Exception as e:
+        logger.warning(f"[restauracao] Falha ao remover o schema de carga {SCHEMA_CARGA}: {e}")
+
+
+def _trocar_schema(conn_info):
+    """
+    Numa transação: remove tabelas/sequências do public e move para ele tudo
+    o que foi carregado em ``SCHEMA_CARGA`` (tabelas, partições e sequências).
+    """
+    conn = conectar_postgresql(conn_info)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT string_agg(format('%I', tablename), ', ') FROM pg_tables WHERE schemaname = 'public'")
+            tabelas_atuais = cur.fetchone()[0]
+            if tabelas_atuais:
+                cur.execute(f"DROP TABLE IF EXISTS {tabelas_atuais} CASCADE")
+            cur.execute("SELECT string_agg(format('%I', sequencename), ', ') FROM pg_sequences WHERE schemaname = 'public'")
+            sequencias_atuais = cur.fetchone()[0]
+            if sequencias_atuais:
+                cur.execute(f"DROP SEQUENCE IF EXISTS {sequencias_atuais} CASCADE")
+
+            cur.execute("SELECT tablename FROM pg_tables WHERE schemaname = %s", (SCHEMA_CARGA,))
+            for (tabela,) in cur.fetchall():
+                cur.execute(f"ALTER TABLE {identificador(SCHEMA_CARGA)}.{identificador(tabela)} SET SCHEMA public")
+            # Sequências de IDENTITY já foram junto com a tabela; sobram as avulsas/serial
+            cur.execute("SELECT sequencename FROM pg_sequences WHERE schemaname = %s", (SCHEMA_CARGA,))
+            for (sequencia,) in cur.fetchall():
+                cur.execute(f"ALTER SEQUENCE {identificador(SCHEMA_CARGA)}.{identificador(sequencia)} SET SCHEMA public")
+            cur.execute(f"DROP SCHEMA {identificador(SCHEMA_CARGA)}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def restaurar_postgresql(caminho_zip, conn_info, progresso=None):
+    """
+    Restaura um backup de ``despejar_postgresql``:
+
+    1. cria o esquema do backup, sem restrições, num schema de carga
+       (``SCHEMA_CARGA``), sem tocar no public;
+    2. carrega as tabelas em paralelo (``BACKUP_CONEXOES``) com COPY FROM,
+       lendo os CSVs direto do ZIP. Sem PK/FK/índices durante a carga, não há
+       verificação linha a linha;
+    3. ainda no schema de carga, cria PK/UNIQUE/CHECK e índices em paralelo
+       entre tabelas, depois as FKs (validadas uma vez sobre a tabela cheia)
+       e ajusta as sequências;
+    4. só então, numa única transação, remove as tabelas/sequências atuais
+       do public e move para ele as carregadas (com restrições e índices).
+
+    Se algum COPY, restrição, índice ou FK falhar (chave duplicada, registro
+    órfão), o schema de carga é descartado, a exceção sobe e o banco atual
+    fica como estava. Só o ajuste de sequências vira aviso.
+
+    Durante a carga o banco ocupa o espaço das duas cópias.
+    ``progresso(etapa, feitas, total, tabela)`` é chamado a cada tabela.
+    Devolve ``{'tabelas', 'linhas', 'duracao_segundos', 'avisos'}``.
+    """
+    inicio = datetime.now()
+    with zipfile.ZipFile(caminho_zip) as zipf:
+        manifesto = json.loads(zipf.read(f'{PASTA_BANCO}/manifesto.json'))
+        esquema_sql = zipf.read(f'{PASTA_BANCO}/esquema.sql').decode('utf-8')
+    if manifesto.get('formato') != FORMATO:
+        raise Exception(f"Formato de backup não suportado: {manifesto.get('formato')}")
+
+    conn = conectar_postgresql(conn_info)
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {identificador(SCHEMA_CARGA)} CASCADE")
+            cur.execute(f"CREATE SCHEMA {identificador(SCHEMA_CARGA)}")
+            # Objetos sem schema no esquema.sql nascem no de carga; tipos e extensões vêm do public
+            cur.execute(f"SET LOCAL search_path TO {identificador(SCHEMA_CARGA)}, public")
+            cur.execute(esquema_sql)
+        conn.commit()
+        logger.info(f"[restauracao] Esquema criado em {SCHEMA_CARGA} ({len(manifesto['tabelas'])} tabelas)")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    com_dados = sorted(
+        (t for t in manifesto['tabelas'] if t.get('arquivo')),
+        key=lambda t: t.get('linhas') or 0, reverse=True,
+    )
+    total_linhas = 0
+    pos_carga = manifesto['pos_carga']
+    # Backups antigos guardaram os índices de tabelas particionadas com ON ONLY
+    por_tabela = [(tabela, [definicao_indice(c) for c in comandos]) for tabela, comandos in pos_carga['por_tabela'].items()]
+    try:
+        with ThreadPoolExecutor(max_workers=_env_int('BACKUP_CONEXOES', 4)) as pool:
+            futuros = [pool.submit(_carregar_tabela, conn_info, caminho_zip, tabela, SCHEMA_CARGA) for tabela in com_dados]
+            for feitas, futuro in enumerate(as_completed(futuros), start=1):
+                nome, linhas = futuro.result()
+                total_linhas += linhas
+                logger.info(f"[restauracao] {feitas}/{len(com_dados)} {nome}: {linhas} linha(s)")
+                if progresso:
+                    progresso('dados', feitas, len(com_dados), nome)
+
+        # Chaves, índices e FKs na cópia carregada: duplicata ou órfão aborta antes de tocar no public
+        _executar_autocommit(conn_info, pos_carga['extensoes'], 'extensão', estrito=True)
+        with ThreadPoolExecutor(max_workers=_env_int('BACKUP_CONEXOES', 4)) as pool:
+            futuros = {
+                pool.submit(_executar_autocommit, conn_info, comandos, tabela, SCHEMA_CARGA, True): tabela
+                for tabela, comandos in por_tabela
+            }
+            for feitas, futuro in enumerate(as_completed(futuros), start=1):
+                futuro.result()
+                if progresso:
+                    progresso('indices', feitas, len(por_tabela), futuros[futuro])
+        _executar_autocommit(conn_info, pos_carga['chaves_estrangeiras'], 'chave estrangeira', SCHEMA_CARGA, True)
+        avisos = _executar_autocommit(conn_info, pos_carga['sequencias'], 'sequência', SCHEMA_CARGA)
+
+        _trocar_schema(conn_info)
+    except Exception:
+        # Falha na carga, nas restrições ou na troca: o public continua com os dados anteriores
+        _descartar_schema_carga(conn_info)
+        raise
+    logger.info(f"[restauracao] Tabelas carregadas movidas de {SCHEMA_CARGA} para public")
+
+    resultado = {
+        'tabelas': len(manifesto['tabelas']),
+        'linhas': total_linhas,
+        'duracao_segundos': round((datetime.now() - inicio).total_seconds(), 1),
+        'avisos': avisos,
+    }
+    logger.info(f"[restauracao] Banco restaurado: {resultado['tabelas']} tabelas, {total_linhas} linhas "
+                f"em {resultado['duracao_segundos']}s ({len(avisos)} aviso(s))")
+    return resultado
+
+
+def _enviar_objeto(sessao, url, bucket, caminho_local, nome, tentativas=3):
+    """Upload com upsert (sem o par POST 409 + PUT) e nova tentativa em 429/5xx/timeout."""
+    import requests
+
+    for tentativa in range(1, tentativas + 1):
+        try:
+            with open(caminho_local, 'rb') as f:
+                resp = sessao.post(
+                    f"{url}/storage/v1/object/{bucket}/{nome}",
+                    data=f,
+                    headers={'x-upsert': 'true', 'Content-Type': 'application/octet-stream'},
+                    timeout=120,
+                )
+            if resp.status_code in (200, 201):
+                return True
+            if resp.status_code not in (429, 500, 502, 503, 504):
+                logger.warning(f"[restauracao] Erro ao enviar {nome}: HTTP {resp.status_code} {resp.text[:100]}")
+                return False
+        except requests.exceptions.RequestException as e:
+            logger.debug(f"[restauracao] Falha ao enviar {nome} (tentativa {tentativa}): {e}")
+        if tentativa < tentativas:
+            time.sleep(2 ** tentativa)
+    logger.warning(f"[restauracao] {nome} não enviado após {tentativas} tentativas")
+    return False
+
+
+def enviar_storage(diretorio_storage, nomes, url, chave, bucket, progresso=None):
+    """Envia os arquivos restaurados ao bucket em paralelo (``BACKUP_STORAGE_UPLOADS``, padrão 8). Devolve (enviados, falhas)."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    uploads = _env_int('BACKUP_STORAGE_UPLOADS', 8)
+    sessao = requests.Session()
+    sessao.headers.update({'Authorization': f'Bearer {chave}', 'apikey': chave})
+    sessao.mount('https://', HTTPAdapter(pool_connections=uploads, pool_maxsize=uploads))
+    sessao.mount('http://', HTTPAdapter(pool_connections=uploads, pool_maxsize=uploads))
+
+    existentes = [n for n in nomes if os.path.exists(os.path.join(diretorio_storage, n))]
+    enviados = 0
+    falhas = len(nomes) - len(existentes)
+    try:
+        with ThreadPoolExecutor(max_workers=uploads) as pool:
+            futuros = [
+                pool.submit(_enviar_objeto, sessao, url.rstrip('/'), bucket, os.path.join(diretorio_storage, nome), nome)
+                for nome in existentes
+            ]
+            for feitos, futuro in enumerate(as_completed(futuros), start=1):
+                if futuro.result():
+                    enviados += 1
+                else:
+                    falhas += 1
+                if progresso and (feitos % 20 == 0 or feitos == len(futuros)):
+                    progresso('storage', feitos, len(futuros), None)
+    finally:
+        sessao.close()
+    return enviados, falhas
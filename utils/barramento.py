@@ -0,0 +1,195 @@
+"""
+Barramento publish/subscribe para atualizações do chão de fábrica (SSE)
+
+Rotas publicam eventos pequenos (diffs de cartão) em canais como ``kanban``,
+``apontamento`` e ``notificacoes``; cada conexão SSE de ``/tempo-real/stream``
+assina os canais que interessam à tela.
+
+Backends:
+- ``memoria``: entrega dentro do processo (um worker);
+- ``redis``: Redis pub/sub para entregar entre workers/instâncias. Cada processo
+  mantém uma thread ouvinte que repassa as mensagens aos assinantes locais.
+
+``BARRAMENTO_BACKEND`` escolhe o backend (padrão: ``redis`` quando o cache
+estiver conectado ao Redis, senão ``memoria``).
+"""
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import itertools
+
+logger = logging.getLogger(__name__)
+
+_PREFIXO_CANAL_REDIS = 'tempo-real:'
+
+
+class Assinatura:
+    """Fila de eventos de um assinante (uma conexão SSE)"""
+
+    def __init__(self, barramento, canais, max_fila=200):
+        self._barramento = barramento
+        self.canais = set(canais)
+        self._fila = queue.Queue(maxsize=max_fila)
+        self.descartados = 0
+        self.fechada = False
+
+    def _entregar(self, evento):
+        try:
+            self._fila.put_nowait(evento)
+        except queue.Full:
+            # Cliente lento: descarta o mais antigo e avisa para ressincronizar
+            self.descartados += 1
+            try:
+                self._fila.get_nowait()
+                self._fila.put_nowait({'canal': evento.get('canal'), 'tipo': 'ressincronizar', 'dados': {}})
+            except (queue.Empty, queue.Full):
+                pass
+
+    def proximo(self, timeout=None):
+        """Próximo evento ou ``None`` após ``timeout`` segundos"""
+        try:
+            return self._fila.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def fechar(self):
+        if not self.fechada:
+            self.fechada = True
+            self._barramento._remover(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.fechar()
+
+
+class BarramentoMemoria:
+    """Entrega de eventos dentro do processo"""
+
+    nome = 'memoria'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._assinaturas = set()
+        self._seq = itertools.count(1)
+        self.stats = {'publicados': 0, 'entregues': 0}
+
+    def publicar(self, canal, tipo, **dados):
+        evento = {'canal': canal, 'tipo': tipo, 'dados': dados, 'em': time.time()}
+        self._publicar_evento(evento)
+        return evento
+
+    def _publicar_evento(self, evento):
+        self.stats['publicados'] += 1
+        self._distribuir(evento)
+
+    def _distribuir(self, evento):
+        evento = dict(evento, id=next(self._seq))
+        with self._lock:
+            destinos = [a for a in self._assinaturas if evento.get('canal') in a.canais]
+        for assinatura in destinos:
+            assinatura._entregar(evento)
+        self.stats['entregues'] += len(destinos)
+
+    def assinar(self, canais, max_fila=200):
+        assinatura = Assinatura(self, canais, max_fila=max_fila)
+        with self._lock:
+            self._assinaturas.add(assinatura)
+        return assinatura
+
+    def _remover(self, assinatura):
+        with self._lock:
+            self._assinaturas.discard(assinatura)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, backend=self.nome, assinantes=len(self._assinaturas))
+
+
+class BarramentoRedis(BarramentoMemoria):
+    """Publica no Redis; uma thread por processo repassa aos assinantes locais"""
+
+    nome = 'redis'
+
+    def __init__(self, redis_client):
+        super().__init__()
+        self._redis = redis_client
+        self._ouvinte = None
+        self._ouvinte_lock = threading.Lock()
+
+    def _publicar_evento(self, evento):
+        self.stats['publicados'] += 1
+        try:
+            self._redis.publish(_PREFIXO_CANAL_REDIS + evento['canal'], json.dumps(evento, default=str))
+        except Exception as e:
+            # Sem Redis: ao menos os assinantes deste processo recebem
+            logger.warning(f"[barramento] Falha ao publicar no Redis ({e}); entregando localmente")
+            self._distribuir(evento)
+
+    def assinar(self, canais, max_fila=200):
+        self._garantir_ouvinte()
+        return super().assinar(canais, max_fila=max_fila)
+
+    def _garantir_ouvinte(self):
+        with self._ouvinte_lock:
+            if self._ouvinte and self._ouvinte.is_alive():
+                return
+            self._ouvinte = threading.Thread(target=self._ouvir, name='barramento-redis', daemon=True)
+            self._ouvinte.start()
+
+    def _ouvir(self):
+        espera = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(_PREFIXO_CANAL_REDIS + '*')
+                espera = 1
+                for mensagem in pubsub.listen():
+                    if mensagem.get('type') != 'pmessage':
+                        continue
+                    try:
+                        self._distribuir(json.loads(mensagem['data']))
+                    except Exception as e:
+                        logger.debug(f"[barramento] Mensagem inválida ignorada: {e}")
+            except Exception as e:
+                logger.warning(f"[barramento] Ouvinte Redis desconectado: {e}; reconectando em {espera}s")
+                time.sleep(espera)
+                espera = min(espera * 2, 30)
+            finally:
+                try:
+                    if pubsub is not None:
+                        pubsub.close()
+                except Exception:
+                    pass
+
+
+def _criar_barramento():
+    backend = (os.getenv('BARRAMENTO_BACKEND') or '').strip().lower()
+    if backend != 'memoria':
+        try:
+            from utils.cache_manager import cache
+            if cache.redis_client is not None:
+                return BarramentoRedis(cache.redis_client)
+            if backend == 'redis':
+                logger.warning("[barramento] BARRAMENTO_BACKEND=redis sem Redis conectado; usando memória")
+        except Exception as e:
+            logger.warning(f"[barramento] Falha ao iniciar backend Redis: {e}")
+    return BarramentoMemoria()
+
+
+# Instância global (uma por processo)
+barramento = _criar_barramento()
+
+
+def publicar(canal, tipo, **dados):
+    """Publica sem nunca quebrar a rota chamadora"""
+    try:
+        return barramento.publicar(canal, tipo, **dados)
+    except Exception as e:
+        logger.warning(f"[barramento] Falha ao publicar {canal}/{tipo}: {e}")
+        return None
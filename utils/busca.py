@@ -0,0 +1,247 @@
+"""
+Busca por código e nome (itens, pedidos, OS e orçamentos)
+
+Uma única função ``buscar`` atende o typeahead e a leitura de código de
+barras no chão de fábrica, com ranking comum entre os tipos:
+
+- PostgreSQL: ``ILIKE '%termo%'`` nas tabelas de origem, atendido pelos
+  índices GIN ``gin_trgm_ops`` (pg_trgm) e, para nomes de itens com várias
+  palavras, pelo índice tsvector. Ver migrations/add_busca_indices.py.
+- SQLite: tabela FTS5 ``busca_indice`` (tokenizer trigram) mantida por
+  triggers em insert/update/delete das tabelas de origem, então também fica
+  correta após importações e restaurações feitas fora do ORM.
+- Sem índice (tabela FTS ausente ou outro banco): mesmo ILIKE, sem índice.
+
+Códigos exatos (leitura de código de barras) são sempre procurados antes,
+por igualdade, e ficam no topo.
+"""
+import logging
+import time
+
+from sqlalchemy import and_, bindparam, column, func, literal, literal_column, or_, select, table, text
+from sqlalchemy import inspect as sa_inspect
+
+logger = logging.getLogger(__name__)
+
+TABELA_FTS = 'busca_indice'
+
+# tipo -> tabela de origem, colunas de código (na ordem de exibição), coluna
+# de texto livre e o sufixo do rowid na tabela FTS (rowid = id * 8 + sufixo)
+FONTES = {
+    'item': {'tabela': 'item', 'codigos': ['codigo_acb'], 'texto': 'nome', 'sufixo': 1},
+    'pedido': {'tabela': 'pedido', 'codigos': ['numero_pedido_cliente', 'numero_pedido'], 'texto': 'nome_item', 'sufixo': 2},
+    'os': {'tabela': 'ordem_servico', 'codigos': ['numero'], 'texto': None, 'sufixo': 3},
+    'orcamento': {'tabela': 'orcamento', 'codigos': ['numero'], 'texto': 'cliente_nome', 'sufixo': 4},
+}
+ORDEM_TIPOS = list(FONTES)
+SEPARADOR_CODIGOS = ' | '
+# Trigramas: termos menores que isso não usam o índice
+TAMANHO_MINIMO_INDICE = 3
+
+_fts_ok = {'valor': None, 'verificado_em': 0.0}
+_trgm_ok = {'valor': None, 'verificado_em': 0.0}
+
+
+def _dialeto(connection):
+    return connection.dialect.name
+
+
+def _verificar_cache(cache, verificar):
+    """Resultado cacheado; negativo é rechecado a cada 5 min (migração pode rodar depois)"""
+    agora = time.time()
+    if cache['valor'] is None or (not cache['valor'] and agora - cache['verificado_em'] > 300):
+        try:
+            cache['valor'] = bool(verificar())
+        except Exception:
+            cache['valor'] = False
+        cache['verificado_em'] = agora
+    return cache['valor']
+
+
+def indice_fts_disponivel(connection):
+    if _dialeto(connection) != 'sqlite':
+        return False
+    return _verificar_cache(_fts_ok, lambda: sa_inspect(connection).has_table(TABELA_FTS))
+
+
+def _pg_trgm_disponivel(connection):
+    return _verificar_cache(_trgm_ok, lambda: connection.execute(
+        text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+    ).first())
+
+
+def limpar_cache_disponibilidade():
+    """Chamado pela migração depois de criar os índices."""
+    for cache in (_fts_ok, _trgm_ok):
+        cache['valor'] = None
+
+
+def _termos(consulta):
+    return [t for t in (consulta or '').split() if t]
+
+
+def _pontuar(termo, codigos, texto):
+    """Ranking comum a todos os bancos: código exato > prefixo > contém > nome.
+
+    Com várias palavras vale a frase inteira ou, se maior, a pior palavra.
+    """
+    palavras = termo.split()
+    if len(palavras) > 1:
+        return max(_pontuar_termo(termo, codigos, texto),
+                   min(_pontuar_termo(p, codigos, texto) for p in palavras))
+    return _pontuar_termo(termo, codigos, texto)
+
+
+def _pontuar_termo(termo, codigos, texto):
+    alvo = termo.casefold()
+    pontos = 10  # casou no banco (todas as palavras), sem relação mais forte
+    for codigo in codigos:
+        codigo = (codigo or '').casefold()
+        if not codigo:
+            continue
+        if codigo == alvo:
+            return 100
+        if codigo.startswith(alvo):
+            pontos = max(pontos, 80)
+        elif alvo in codigo:
+            pontos = max(pontos, 60)
+    texto = (texto or '').casefold()
+    if texto:
+        if texto == alvo:
+            pontos = max(pontos, 70)
+        elif texto.startswith(alvo):
+            pontos = max(pontos, 50)
+        elif any(palavra.startswith(alvo) for palavra in texto.split()):
+            pontos = max(pontos, 45)
+        elif alvo in texto:
+            pontos = max(pontos, 40)
+    return pontos
+
+
+def _resultado(tipo, ref_id, codigos, texto, termo):
+    codigos = [c for c in codigos if c]
+    return {
+        'tipo': tipo,
+        'id': ref_id,
+        'codigo': codigos[0] if codigos else '',
+        'codigos': codigos,
+        'texto': texto or '',
+        'pontuacao': _pontuar(termo, codigos, texto),
+    }
+
+
+def _tabela_origem(fonte):
+    colunas = ['id'] + fonte['codigos'] + ([fonte['texto']] if fonte['texto'] else [])
+    return table(fonte['tabela'], *[column(c) for c in colunas])
+
+
+def _linha_para_resultado(tipo, fonte, linha, termo):
+    codigos = [getattr(linha, c) for c in fonte['codigos']]
+    texto = getattr(linha, fonte['texto']) if fonte['texto'] else None
+    return _resultado(tipo, linha.id, codigos, texto, termo)
+
+
+def _buscar_exatos(connection, termo, tipos):
+    """Leitura de código de barras: igualdade nas colunas de código (índices únicos/B-tree)."""
+    if ' ' in termo.strip():
+        return []
+    resultados = []
+    for tipo in tipos:
+        fonte = FONTES[tipo]
+        t = _tabela_origem(fonte)
+        stmt = select(t).where(or_(*[t.c[c] == termo for c in fonte['codigos']])).limit(5)
+        for linha in connection.execute(stmt):
+            resultados.append(_linha_para_resultado(tipo, fonte, linha, termo))
+    return resultados
+
+
+def _buscar_fts(connection, termos, tipos, limite):
+    """SQLite: MATCH na tabela FTS5 trigram; termos curtos viram LIKE sobre o resultado."""
+    longos = [t for t in termos if len(t) >= TAMANHO_MINIMO_INDICE]
+    curtos = [t for t in termos if len(t) < TAMANHO_MINIMO_INDICE]
+    expressao = ' '.join('"{}"'.format(t.replace('"', '""')) for t in longos)
+
+    sql = (
+        f"SELECT tipo, ref_id, codigo, texto FROM {TABELA_FTS} "
+        f"WHERE {TABELA_FTS} MATCH :expressao AND tipo IN :tipos"
+    )
+    params = {'expressao': expressao, 'tipos': list(tipos)}
+    for i, curto in enumerate(curtos):
+        sql += f" AND (codigo || ' ' || texto) LIKE :curto_{i}"
+        params[f'curto_{i}'] = f'%{curto}%'
+    sql += " ORDER BY rank LIMIT :limite"
+    params['limite'] = limite
+
+    stmt = text(sql).bindparams(bindparam('tipos', expanding=True))
+    termo = ' '.join(termos)
+    return [
+        _resultado(linha.tipo, int(linha.ref_id), (linha.codigo or '').split(SEPARADOR_CODIGOS), linha.texto, termo)
+        for linha in connection.execute(stmt, params)
+    ]
+
+
+def _buscar_tabelas(connection, termos, tipos, limite):
+    """ILIKE por palavra nas tabelas de origem (PostgreSQL com pg_trgm ou fallback)."""
+    postgres = _dialeto(connection) == 'postgresql'
+    trgm = postgres and _pg_trgm_disponivel(connection)
+    termo = ' '.join(termos)
+    resultados = []
+    for tipo in tipos:
+        fonte = FONTES[tipo]
+        t = _tabela_origem(fonte)
+        colunas = [t.c[c] for c in fonte['codigos']] + ([t.c[fonte['texto']]] if fonte['texto'] else [])
+        condicao = and_(*[or_(*[c.ilike(f'%{p}%') for c in colunas]) for p in termos])
+        if postgres and tipo == 'item':
+            # Nome com palavras em outra ordem/forma: índice tsvector
+            simple = literal_column("'simple'")
+            condicao = or_(condicao, func.to_tsvector(simple, func.coalesce(t.c.nome, literal_column("''")))
+                           .bool_op('@@')(func.plainto_tsquery(simple, termo)))
+        stmt = select(t).where(condicao).limit(limite)
+        if trgm:
+            stmt = stmt.order_by(func.greatest(*[func.similarity(func.coalesce(c, ''), literal(termo)) for c in colunas]).desc())
+        for linha in connection.execute(stmt):
+            resultados.append(_linha_para_resultado(tipo, fonte, linha, termo))
+    return resultados
+
+
+def buscar(consulta, tipos=None, limite=20, connection=None):
+    """
+    Busca ranqueada em itens, pedidos, OS e orçamentos.
+
+    Retorna lista de dicts ``{tipo, id, codigo, codigos, texto, pontuacao}``
+    ordenada por pontuação (código exato = 100).
+    """
+    if connection is None:
+        from models import db
+        connection = db.session.connection()
+
+    termos = _termos(consulta)
+    tipos = [t for t in (tipos or ORDEM_TIPOS) if t in FONTES]
+    if not termos or not tipos:
+        return []
+    termo = ' '.join(termos)
+    candidatos = max(limite * 3, 30)
+
+    vistos = {(r['tipo'], r['id']): r for r in _buscar_exatos(connection, termo, tipos)}
+    encontrados = None
+    if indice_fts_disponivel(connection) and any(len(t) >= TAMANHO_MINIMO_INDICE for t in termos):
+        try:
+            encontrados = _buscar_fts(connection, termos, tipos, candidatos)
+        except Exception as e:
+            logger.warning(f"[busca] Falha na tabela FTS, usando ILIKE: {e}")
+    if encontrados is None:
+        encontrados = _buscar_tabelas(connection, termos, tipos, candidatos)
+
+    for r in encontrados:
+        vistos.setdefault((r['tipo'], r['id']), r)
+
+    resultados = sorted(
+        vistos.values(),
+        key=lambda r: (-r['pontuacao'], ORDEM_TIPOS.index(r['tipo']), len(r['codigo'] or r['texto']), r['codigo'], r['id']),
+    )
+    return resultados[:limite]
+
+
+def buscar_ids(tipo, consulta, limite=200, connection=None):
+    """Ids de um tipo na ordem do ranking (para telas que montam a própria consulta)."""
+    return [r['id'] for r in buscar(consulta, tipos=[tipo], limite=limite, connection=connection)]
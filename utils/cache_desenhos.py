@@ -0,0 +1,181 @@
+"""
+Cache em disco dos desenhos técnicos carimbados (APROVADO)
+
+O PDF carimbado é endereçado pelo conteúdo: ``<sha256 do PDF original>_<sha1
+de aprovador + data de aprovação>.pdf``. Dois itens com o mesmo arquivo e a
+mesma aprovação compartilham o arquivo, e o nome serve de ETag.
+
+Para não baixar o original a cada visualização, um índice por item guarda
+``{chave da versão: nome do arquivo carimbado}``, onde a chave da versão é o
+caminho do desenho + aprovador + data de aprovação. Aprovar/desaprovar muda a
+chave; reenviar o desenho com o mesmo nome (upload local) não muda, por isso
+as rotas chamam ``invalidar_item``.
+
+Diretório: ``DESENHOS_CACHE_DIR`` (padrão: <tmp>/linhamestre_desenhos). Os
+arquivos menos usados são removidos quando o total passa de
+``DESENHOS_CACHE_MAX_MB`` (padrão 500). O índice fica no disco, então vale
+para todos os workers da mesma máquina.
+"""
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Locks listrados: a chave cai numa faixa fixa (hash % N), sem crescer por chave.
+# Chaves diferentes na mesma faixa só esperam uma pela outra.
+_N_LOCKS = 64
+_locks = [threading.Lock() for _ in range(_N_LOCKS)]
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.getenv(nome, padrao))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def diretorio_cache():
+    base = os.getenv('DESENHOS_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'linhamestre_desenhos')
+    for sub in ('carimbados', 'itens'):
+        os.makedirs(os.path.join(base, sub), exist_ok=True)
+    return base
+
+
+def _lock(chave):
+    return _locks[hash(chave) % _N_LOCKS]
+
+
+def _gravar_atomico(caminho, conteudo):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(conteudo)
+        os.replace(tmp, caminho)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _caminho_indice(item_id):
+    return os.path.join(diretorio_cache(), 'itens', f'{int(item_id)}.json')
+
+
+def _ler_indice(item_id):
+    try:
+        with open(_caminho_indice(item_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _chave_aprovacao(aprovado_por_nome, aprovado_em):
+    bruto = f"{(aprovado_por_nome or '').strip()}|{aprovado_em.isoformat() if aprovado_em else ''}"
+    return hashlib.sha1(bruto.encode('utf-8')).hexdigest()[:16]
+
+
+def _chave_versao(item):
+    return hashlib.sha1('|'.join([
+        item.desenho_tecnico or '',
+        _chave_aprovacao(item.desenho_aprovado_por_nome, item.desenho_aprovado_em),
+    ]).encode('utf-8')).hexdigest()
+
+
+def _caminho_carimbado(nome):
+    return os.path.join(diretorio_cache(), 'carimbados', nome)
+
+
+def _tocar(caminho):
+    try:
+        os.utime(caminho, None)
+    except OSError:
+        pass
+
+
+def _podar(limite_bytes=None):
+    """Remove os arquivos carimbados menos acessados até caber no limite."""
+    limite_bytes = limite_bytes if limite_bytes is not None else _env_int('DESENHOS_CACHE_MAX_MB', 500) * 1024 * 1024
+    pasta = os.path.join(diretorio_cache(), 'carimbados')
+    arquivos = []
+    total = 0
+    for nome in os.listdir(pasta):
+        caminho = os.path.join(pasta, nome)
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            continue
+        arquivos.append((st.st_mtime, st.st_size, caminho))
+        total += st.st_size
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= limite_bytes:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+        except OSError:
+            pass
+
+
+def pdf_carimbado_em_cache(item):
+    """(caminho, etag) do PDF carimbado do item se já estiver em cache, senão (None, None). Não baixa nada."""
+    nome = _ler_indice(item.id).get(_chave_versao(item))
+    if nome:
+        caminho = _caminho_carimbado(nome)
+        if os.path.exists(caminho):
+            _tocar(caminho)
+            return caminho, nome[:-len('.pdf')]
+    return None, None
+
+
+def obter_pdf_carimbado(item, baixar, carimbar):
+    """
+    (caminho, etag) do PDF carimbado, gerando-o se preciso.
+
+    ``baixar(item)`` devolve os bytes do original (ou None) e
+    ``carimbar(pdf_bytes, aprovado_por_nome, aprovado_em)`` os bytes
+    carimbados. Requisições simultâneas do mesmo desenho (impressão de várias
+    OS) esperam a primeira em vez de carimbar de novo.
+    """
+    caminho, etag = pdf_carimbado_em_cache(item)
+    if caminho:
+        return caminho, etag
+
+    chave = _chave_versao(item)
+    with _lock(f'{item.id}:{chave}'):
+        caminho, etag = pdf_carimbado_em_cache(item)
+        if caminho:
+            return caminho, etag
+
+        pdf_bytes = baixar(item)
+        if not pdf_bytes:
+            return None, None
+
+        etag = f"{hashlib.sha256(pdf_bytes).hexdigest()}_{_chave_aprovacao(item.desenho_aprovado_por_nome, item.desenho_aprovado_em)}"
+        caminho = _caminho_carimbado(f'{etag}.pdf')
+        if os.path.exists(caminho):
+            _tocar(caminho)
+        else:
+            _gravar_atomico(caminho, carimbar(pdf_bytes, item.desenho_aprovado_por_nome, item.desenho_aprovado_em))
+            _podar()
+
+        # Só a versão atual fica no índice: aprovações antigas não voltam
+        _gravar_atomico(_caminho_indice(item.id), json.dumps({chave: f'{etag}.pdf'}).encode('utf-8'))
+        return caminho, etag
+
+
+def invalidar_item(item_id):
+    """Esquece o PDF carimbado do item (aprovação removida/alterada ou desenho reenviado)."""
+    try:
+        for nome in _ler_indice(item_id).values():
+            caminho = _caminho_carimbado(nome)
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        indice = _caminho_indice(item_id)
+        if os.path.exists(indice):
+            os.remove(indice)
+    except OSError as e:
+        logger.warning(f"[desenhos] Falha ao invalidar cache do item {item_id}: {e}")
@@ -1,12 +1,25 @@
 """
 Sistema de cache para métricas e dados calculados
 Suporta Redis (produção) e fallback para cache em memória (desenvolvimento)
+
+Recursos:
+- camada em memória limitada (LRU + TTL), segura para threads;
+- invalidação por tags/dependências (ex.: ``os:123`` invalida tudo que depende da OS 123);
+- invalidação por padrão usando ``SCAN`` no Redis (nunca ``KEYS``);
+- single-flight em ``get_or_set``: apenas um recálculo atende misses concorrentes
+  (lock listrado por chave no processo e ``SET NX`` no Redis entre workers);
+- chaves estáveis entre processos (sha1 dos argumentos serializados);
+- métricas de hit/miss por namespace (prefixo da chave até o primeiro ``:``).
 """
 import json
 import time
+import fnmatch
+import hashlib
 import logging
+import threading
+from collections import OrderedDict, defaultdict
 from functools import wraps
-from typing import Any, Optional, Callable
+from typing import Any, Optional, Callable, Iterable
 import os
 
 logger = logging.getLogger(__name__)
@@ -19,14 +32,127 @@ except ImportError:
     REDIS_AVAILABLE = False
     logger.warning("Redis não disponível. Usando cache em memória.")
 
+# Locks do single-flight local: a chave cai numa faixa fixa (hash % N)
+_N_LOCKS = 64
+
+# Prefixo das chaves de tags e locks no Redis
+_PREFIXO_TAG = 'cache:tag:'
+_PREFIXO_LOCK = 'cache:lock:'
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.getenv(nome, padrao))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def make_key(prefix: str, *args, **kwargs) -> str:
+    """
+    Gera chave estável entre processos/workers para ``prefix`` + argumentos.
+    (``hash()`` do Python é aleatorizado por processo e não serve para Redis.)
+    """
+    if not args and not kwargs:
+        return prefix
+    try:
+        bruto = json.dumps([args, kwargs], sort_keys=True, default=str, separators=(',', ':'))
+    except Exception:
+        bruto = repr((args, sorted(kwargs.items())))
+    return f"{prefix}:{hashlib.sha1(bruto.encode('utf-8')).hexdigest()}"
+
+
+def _namespace(key: str) -> str:
+    return key.split(':', 1)[0] if key else ''
+
+
+class MemoryCache:
+    """Camada em memória limitada: LRU por quantidade de entradas + TTL por entrada"""
+
+    def __init__(self, max_entries: int = 2000):
+        self.max_entries = max(1, int(max_entries))
+        self._dados = OrderedDict()  # key -> (expires_at, value)
+        self._tags = defaultdict(set)  # tag -> keys
+        self._tags_por_chave = {}  # key -> tags
+        self._lock = threading.RLock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._dados)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._dados.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remover(key)
+                return None
+            self._dados.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, tags=None):
+        with self._lock:
+            if key in self._dados:
+                self._remover(key)
+            self._dados[key] = (time.time() + ttl, value)
+            if tags:
+                self._tags_por_chave[key] = set(tags)
+                for tag in tags:
+                    self._tags[tag].add(key)
+            while len(self._dados) > self.max_entries:
+                mais_antiga = next(iter(self._dados))
+                self._remover(mais_antiga)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remover(key)
+
+    def delete_pattern(self, pattern):
+        with self._lock:
+            chaves = [k for k in self._dados if fnmatch.fnmatchcase(k, pattern)]
+            for key in chaves:
+                self._remover(key)
+            return len(chaves)
+
+    def delete_tags(self, tags):
+        with self._lock:
+            chaves = set()
+            for tag in tags:
+                chaves.update(self._tags.pop(tag, ()))
+            for key in chaves:
+                self._remover(key)
+            return len(chaves)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+            self._tags.clear()
+            self._tags_por_chave.clear()
+
+    def _remover(self, key):
+        self._dados.pop(key, None)
+        for tag in self._tags_por_chave.pop(key, ()):
+            chaves = self._tags.get(tag)
+            if chaves is not None:
+                chaves.discard(key)
+                if not chaves:
+                    self._tags.pop(tag, None)
+
+
 class CacheManager:
     """Gerenciador de cache com suporte a Redis e fallback para memória"""
-    
-    def __init__(self):
+
+    def __init__(self, max_entries: Optional[int] = None):
         self.redis_client = None
-        self.memory_cache = {}
+        self.memory_cache = MemoryCache(max_entries or _env_int('CACHE_MAX_ENTRIES', 2000))
         self.cache_stats = {'hits': 0, 'misses': 0, 'sets': 0}
-        
+        self.namespace_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'sets': 0, 'recalculos': 0, 'esperas': 0})
+        self.lock_ttl = _env_int('CACHE_LOCK_TTL_S', 30)
+        self._stats_lock = threading.Lock()
+        # RLock: um recálculo que chama get_or_set de outra chave na mesma faixa não trava a thread
+        self._locks_locais = [threading.RLock() for _ in range(_N_LOCKS)]
+
         # Tentar conectar ao Redis se disponível
         if REDIS_AVAILABLE:
             redis_url = os.getenv('REDIS_URL') or os.getenv('REDIS_TLS_URL')
@@ -44,119 +170,247 @@ class CacheManager:
                 except Exception as e:
                     logger.warning(f"Falha ao conectar Redis: {e}. Usando cache em memória.")
                     self.redis_client = None
-    
+
+    def _contar(self, key, campo):
+        with self._stats_lock:
+            if campo in self.cache_stats:
+                self.cache_stats[campo] += 1
+            self.namespace_stats[_namespace(key)][campo] += 1
+
     def get(self, key: str) -> Optional[Any]:
         """Busca valor no cache"""
         try:
             if self.redis_client:
                 value = self.redis_client.get(key)
-                if value:
-                    self.cache_stats['hits'] += 1
+                if value is not None:
+                    self._contar(key, 'hits')
                     return json.loads(value)
-                self.cache_stats['misses'] += 1
-                return None
             else:
-                # Cache em memória
-                if key in self.memory_cache:
-                    entry = self.memory_cache[key]
-                    if entry['expires_at'] > time.time():
-                        self.cache_stats['hits'] += 1
-                        return entry['value']
-                    else:
-                        del self.memory_cache[key]
-                self.cache_stats['misses'] += 1
-                return None
+                value = self.memory_cache.get(key)
+                if value is not None:
+                    self._contar(key, 'hits')
+                    return value
+            self._contar(key, 'misses')
+            return None
         except Exception as e:
             logger.error(f"Erro ao buscar cache {key}: {e}")
             return None
-    
-    def set(self, key: str, value: Any, ttl: int = 300):
-        """Define valor no cache com TTL em segundos"""
+
+    def set(self, key: str, value: Any, ttl: int = 300, tags: Optional[Iterable[str]] = None):
+        """
+        Define valor no cache com TTL em segundos.
+        ``tags`` associa a chave a dependências invalidáveis com ``invalidate_tags``.
+        """
+        tags = [str(t) for t in (tags or [])]
         try:
-            self.cache_stats['sets'] += 1
+            self._contar(key, 'sets')
             if self.redis_client:
-                self.redis_client.setex(
-                    key,
-                    ttl,
-                    json.dumps(value, default=str)
-                )
+                pipe = self.redis_client.pipeline()
+                pipe.setex(key, ttl, json.dumps(value, default=str))
+                for tag in tags:
+                    tag_key = _PREFIXO_TAG + tag
+                    pipe.sadd(tag_key, key)
+                    # O conjunto da tag vive pelo menos tanto quanto a chave mais longa
+                    pipe.expire(tag_key, max(ttl, self._ttl_restante(tag_key)))
+                pipe.execute()
             else:
-                # Cache em memória
-                self.memory_cache[key] = {
-                    'value': value,
-                    'expires_at': time.time() + ttl
-                }
-                # Limpar entradas expiradas (máximo 1000 entradas)
-                if len(self.memory_cache) > 1000:
-                    self._cleanup_memory_cache()
+                self.memory_cache.set(key, value, ttl, tags)
         except Exception as e:
             logger.error(f"Erro ao definir cache {key}: {e}")
-    
+
+    def _ttl_restante(self, redis_key):
+        try:
+            restante = self.redis_client.ttl(redis_key)
+            return restante if restante and restante > 0 else 0
+        except Exception:
+            return 0
+
     def delete(self, key: str):
         """Remove valor do cache"""
         try:
             if self.redis_client:
                 self.redis_client.delete(key)
             else:
-                self.memory_cache.pop(key, None)
+                self.memory_cache.delete(key)
         except Exception as e:
             logger.error(f"Erro ao deletar cache {key}: {e}")
-    
-    def invalidate_pattern(self, pattern: str):
-        """Invalida todas as chaves que correspondem ao padrão"""
+
+    def invalidate_pattern(self, pattern: str) -> int:
+        """Invalida todas as chaves que correspondem ao padrão glob (``kanban:*``)"""
         try:
             if self.redis_client:
-                keys = self.redis_client.keys(pattern)
-                if keys:
-                    self.redis_client.delete(*keys)
-            else:
-                # Cache em memória
-                keys_to_delete = [k for k in self.memory_cache.keys() if pattern.replace('*', '') in k]
-                for key in keys_to_delete:
-                    del self.memory_cache[key]
+                removidas = 0
+                lote = []
+                for key in self.redis_client.scan_iter(match=pattern, count=500):
+                    lote.append(key)
+                    if len(lote) >= 500:
+                        removidas += self.redis_client.unlink(*lote)
+                        lote = []
+                if lote:
+                    removidas += self.redis_client.unlink(*lote)
+                return removidas
+            return self.memory_cache.delete_pattern(pattern)
         except Exception as e:
             logger.error(f"Erro ao invalidar padrão {pattern}: {e}")
-    
-    def _cleanup_memory_cache(self):
-        """Remove entradas expiradas do cache em memória"""
-        now = time.time()
-        expired_keys = [k for k, v in self.memory_cache.items() if v['expires_at'] <= now]
-        for key in expired_keys:
-            del self.memory_cache[key]
-    
+            return 0
+
+    def invalidate_tags(self, *tags: str) -> int:
+        """Invalida todas as chaves associadas a qualquer uma das tags"""
+        tags = [str(t) for t in tags if t is not None]
+        if not tags:
+            return 0
+        try:
+            if self.redis_client:
+                tag_keys = [_PREFIXO_TAG + t for t in tags]
+                chaves = set()
+                for tag_key in tag_keys:
+                    chaves.update(self.redis_client.smembers(tag_key) or ())
+                pipe = self.redis_client.pipeline()
+                for chave in chaves:
+                    pipe.unlink(chave)
+                pipe.unlink(*tag_keys)
+                pipe.execute()
+                return len(chaves)
+            return self.memory_cache.delete_tags(tags)
+        except Exception as e:
+            logger.error(f"Erro ao invalidar tags {tags}: {e}")
+            return 0
+
+    @property
+    def compartilhado(self):
+        """True quando o cache (e a invalidação) vale para todos os workers"""
+        return self.redis_client is not None
+
+    def _lock_local(self, key):
+        return self._locks_locais[hash(key) % _N_LOCKS]
+
+    def get_or_set(self, key: str, func: Callable[[], Any], ttl: int = 300,
+                   tags: Optional[Iterable[str]] = None, espera_max: float = 10.0) -> Any:
+        """
+        Retorna o valor em cache ou calcula com ``func()`` e armazena.
+
+        Single-flight: misses concorrentes da mesma chave aguardam um único
+        recálculo (lock listrado no processo; ``SET NX`` no Redis entre workers).
+        Se um dos locks não for liberado em ``espera_max`` segundos o valor é
+        calculado sem ele (evita travar recálculos aninhados de faixas cruzadas).
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        lock = self._lock_local(key)
+        adquirido = lock.acquire(timeout=espera_max)
+        try:
+            value = self._get_sem_stats(key)
+            if value is not None:
+                self._contar(key, 'esperas')
+                return value
+
+            lock_redis = None
+            if self.redis_client:
+                lock_redis = self._adquirir_lock_redis(key)
+                if lock_redis is None:
+                    value = self._aguardar_valor_redis(key, espera_max)
+                    if value is not None:
+                        self._contar(key, 'esperas')
+                        return value
+            try:
+                self._contar(key, 'recalculos')
+                value = func()
+                if value is not None:
+                    self.set(key, value, ttl, tags)
+                return value
+            finally:
+                if lock_redis:
+                    self._liberar_lock_redis(key, lock_redis)
+        finally:
+            if adquirido:
+                lock.release()
+
+    def _get_sem_stats(self, key):
+        try:
+            if self.redis_client:
+                value = self.redis_client.get(key)
+                return json.loads(value) if value is not None else None
+            return self.memory_cache.get(key)
+        except Exception:
+            return None
+
+    def _adquirir_lock_redis(self, key):
+        token = f"{os.getpid()}:{threading.get_ident()}:{time.time()}"
+        try:
+            if self.redis_client.set(_PREFIXO_LOCK + key, token, nx=True, ex=self.lock_ttl):
+                return token
+        except Exception as e:
+            logger.debug(f"Falha ao obter lock de cache {key}: {e}")
+            return token  # Redis indisponível para lock: calcular localmente
+        return None
+
+    def _liberar_lock_redis(self, key, token):
+        try:
+            lock_key = _PREFIXO_LOCK + key
+            if self.redis_client.get(lock_key) == token:
+                self.redis_client.delete(lock_key)
+        except Exception as e:
+            logger.debug(f"Falha ao liberar lock de cache {key}: {e}")
+
+    def _aguardar_valor_redis(self, key, espera_max):
+        limite = time.time() + espera_max
+        intervalo = 0.05
+        while time.time() < limite:
+            time.sleep(intervalo)
+            value = self._get_sem_stats(key)
+            if value is not None:
+                return value
+            try:
+                if not self.redis_client.exists(_PREFIXO_LOCK + key):
+                    return self._get_sem_stats(key)
+            except Exception:
+                return None
+            intervalo = min(intervalo * 2, 0.5)
+        return None
+
+    def clear(self):
+        """Limpa o cache em memória (no Redis use ``invalidate_pattern``)"""
+        self.memory_cache.clear()
+
     def get_stats(self):
         """Retorna estatísticas do cache"""
-        total = self.cache_stats['hits'] + self.cache_stats['misses']
-        hit_rate = (self.cache_stats['hits'] / total * 100) if total > 0 else 0
-        return {
-            **self.cache_stats,
-            'hit_rate': round(hit_rate, 2),
-            'backend': 'redis' if self.redis_client else 'memory',
-            'memory_entries': len(self.memory_cache) if not self.redis_client else None
-        }
+        with self._stats_lock:
+            total = self.cache_stats['hits'] + self.cache_stats['misses']
+            hit_rate = (self.cache_stats['hits'] / total * 100) if total > 0 else 0
+            namespaces = {}
+            for ns, st in self.namespace_stats.items():
+                total_ns = st['hits'] + st['misses']
+                namespaces[ns] = dict(st, hit_rate=round(st['hits'] / total_ns * 100, 2) if total_ns else 0)
+            return {
+                **self.cache_stats,
+                'hit_rate': round(hit_rate, 2),
+                'backend': 'redis' if self.redis_client else 'memory',
+                'memory_entries': len(self.memory_cache) if not self.redis_client else None,
+                'memory_max_entries': self.memory_cache.max_entries if not self.redis_client else None,
+                'memory_evictions': self.memory_cache.evictions if not self.redis_client else None,
+                'namespaces': namespaces,
+            }
 
 # Instância global
 cache = CacheManager()
 
-def cached(key_prefix: str, ttl: int = 300):
-    """Decorator para cachear resultado de funções"""
+def cached(key_prefix: str, ttl: int = 300, tags: Optional[Callable[..., Iterable[str]]] = None):
+    """
+    Decorator para cachear resultado de funções.
+
+    A chave é estável entre workers (``make_key``) e o recálculo é single-flight.
+    ``tags`` é opcional: função que recebe os mesmos argumentos e devolve as tags
+    da entrada, ex.: ``tags=lambda os_id: [f'os:{os_id}']``.
+    """
     def decorator(func: Callable) -> Callable:
         @wraps(func)
         def wrapper(*args, **kwargs):
-            # Gerar chave de cache baseada nos argumentos
-            cache_key = f"{key_prefix}:{hash(str(args) + str(kwargs))}"
-            
-            # Tentar buscar do cache
-            cached_value = cache.get(cache_key)
-            if cached_value is not None:
-                logger.debug(f"Cache HIT: {cache_key}")
-                return cached_value
-            
-            # Executar função e cachear resultado
-            logger.debug(f"Cache MISS: {cache_key}")
-            result = func(*args, **kwargs)
-            cache.set(cache_key, result, ttl)
-            return result
-        
+            cache_key = make_key(key_prefix, *args, **kwargs)
+            entry_tags = tags(*args, **kwargs) if tags else None
+            return cache.get_or_set(cache_key, lambda: func(*args, **kwargs), ttl, entry_tags)
+
+        wrapper.invalidate = lambda *args, **kwargs: cache.delete(make_key(key_prefix, *args, **kwargs))
         return wrapper
     return decorator
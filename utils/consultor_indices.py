@@ -0,0 +1,253 @@
+"""
+Consultor de índices
+
+Compara os formatos de consulta que o app realmente executa nos caminhos
+quentes com os índices existentes no banco e reporta os que não têm
+índice utilizável. Roda no startup (apenas leitura do catálogo) e o último
+relatório fica disponível para o diagnóstico.
+
+Regra de cobertura (heurística de prefixo, igual para SQLite e PostgreSQL):
+um índice atende a consulta se a sua primeira coluna é uma das colunas de
+igualdade (ou a coluna de intervalo) da consulta e, quando o índice é
+parcial, o predicado é o mesmo da consulta. O relatório indica também
+quando o índice existente cobre apenas parte do prefixo.
+"""
+import logging
+import os
+import re
+import threading
+from datetime import datetime
+
+from sqlalchemy import inspect as sa_inspect
+
+logger = logging.getLogger(__name__)
+
+
+# Formatos de consulta: tabela, colunas de igualdade/IN (na ordem do índice
+# sugerido), coluna de intervalo/ordenação, predicado parcial e origem.
+FORMAS_CONSULTA = [
+    {
+        'nome': 'apontamento_aberto_combo',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['ordem_servico_id', 'item_id', 'trabalho_id', 'tipo_acao'],
+        'intervalo': None,
+        'parcial': 'data_fim IS NULL',
+        'origem': 'apontamento._query_apontamento_aberto / _obter_estados_batch',
+        'indice_sugerido': 'ix_apontamento_aberto_combo',
+    },
+    {
+        'nome': 'apontamento_aberto_operador',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['usuario_id', 'tipo_acao'],
+        'intervalo': 'data_hora',
+        'parcial': 'data_fim IS NULL',
+        'origem': 'apontamento._buscar_apontamento_aberto_operador',
+        'indice_sugerido': 'ix_apontamento_aberto_usuario',
+    },
+    {
+        'nome': 'apontamento_aberto_lista',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['lista_kanban', 'tipo_acao'],
+        'intervalo': None,
+        'parcial': 'data_fim IS NULL',
+        'origem': 'dashboard_apontamentos (máquinas ativas por lista)',
+        'indice_sugerido': 'ix_apontamento_aberto_lista',
+    },
+    {
+        'nome': 'apontamento_aberto_tipo_data',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['tipo_acao'],
+        'intervalo': 'data_hora',
+        'parcial': 'data_fim IS NULL',
+        'origem': 'notificacoes.monitoramento / gerenciar ativos',
+        'indice_sugerido': 'ix_apontamento_aberto_tipo_data',
+    },
+    {
+        'nome': 'apontamento_combo_janela',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['ordem_servico_id', 'item_id', 'trabalho_id'],
+        'intervalo': 'data_hora',
+        'parcial': None,
+        'origem': 'apontamento._calcular_metricas_stop*',
+        'indice_sugerido': 'ix_apontamento_combo_data_hora',
+    },
+    {
+        'nome': 'apontamento_lista_janela',
+        'tabela': 'apontamento_producao',
+        'igualdade': ['lista_kanban'],
+        'intervalo': 'data_hora',
+        'parcial': None,
+        'origem': 'dashboard_apontamentos (timeline)',
+        'indice_sugerido': 'ix_apontamento_lista_data_hora',
+    },
+    {
+        'nome': 'apontamento_janela',
+        'tabela': 'apontamento_producao',
+        'igualdade': [],
+        'intervalo': 'data_hora',
+        'parcial': None,
+        'origem': 'kanban (tempos do dia)',
+        'indice_sugerido': 'ix_apontamento_data_hora',
+    },
+    {
+        'nome': 'kanban_lista_posicao',
+        'tabela': 'ordem_servico',
+        'igualdade': ['status'],
+        'intervalo': 'posicao',
+        'parcial': None,
+        'origem': 'kanban.index / full-data',
+        'indice_sugerido': 'idx_ordem_servico_status_posicao',
+    },
+    {
+        'nome': 'fantasma_lista',
+        'tabela': 'cartao_fantasma',
+        'igualdade': ['lista_kanban', 'ativo'],
+        'intervalo': 'posicao_fila',
+        'parcial': None,
+        'origem': 'kanban (cartões fantasma por lista)',
+        'indice_sugerido': 'idx_cartao_fantasma_lista_ativo',
+    },
+    {
+        'nome': 'pedido_por_os',
+        'tabela': 'pedido_ordem_servico',
+        'igualdade': ['ordem_servico_id'],
+        'intervalo': None,
+        'parcial': None,
+        'origem': 'kanban / detalhes da OS',
+        'indice_sugerido': 'idx_pedido_os_ordem_id',
+    },
+]
+
+_lock = threading.Lock()
+_ultimo_relatorio = None
+
+
+def _normalizar_predicado(predicado):
+    if predicado is None:
+        return None
+    texto = str(predicado).strip().lower()
+    texto = re.sub(r'[()"]', '', texto)
+    return re.sub(r'\s+', ' ', texto).strip() or None
+
+
+def _predicado_indice(indice):
+    opcoes = indice.get('dialect_options') or {}
+    return _normalizar_predicado(opcoes.get('postgresql_where') or opcoes.get('sqlite_where'))
+
+
+def _indices_tabela(inspector, tabela):
+    """Índices da tabela incluindo a PK (que também atende igualdade por id)."""
+    indices = []
+    for indice in inspector.get_indexes(tabela):
+        colunas = [c for c in (indice.get('column_names') or []) if c]
+        if colunas:
+            indices.append({
+                'nome': indice.get('name'),
+                'colunas': colunas,
+                'parcial': _predicado_indice(indice),
+            })
+    try:
+        pk = inspector.get_pk_constraint(tabela) or {}
+        if pk.get('constrained_columns'):
+            indices.append({'nome': pk.get('name') or f'{tabela}_pkey', 'colunas': pk['constrained_columns'], 'parcial': None})
+    except Exception:
+        pass
+    return indices
+
+
+def _prefixo_coberto(forma, colunas):
+    """Quantas colunas do índice, a partir da primeira, a consulta consegue usar."""
+    igualdade = set(forma['igualdade'])
+    usadas = 0
+    for coluna in colunas:
+        if coluna in igualdade:
+            usadas += 1
+            continue
+        if coluna == forma['intervalo']:
+            usadas += 1
+        break
+    return usadas
+
+
+def _avaliar_forma(forma, indices):
+    parcial_forma = _normalizar_predicado(forma['parcial'])
+    esperado = len(forma['igualdade']) + (1 if forma['intervalo'] else 0)
+    melhor = None
+    for indice in indices:
+        # Índice parcial só serve para consultas com o mesmo predicado
+        if indice['parcial'] and indice['parcial'] != parcial_forma:
+            continue
+        usadas = _prefixo_coberto(forma, indice['colunas'])
+        if usadas and (melhor is None or usadas > melhor[1]):
+            melhor = (indice['nome'], usadas)
+
+    if melhor is None:
+        situacao = 'ausente'
+    elif melhor[1] < esperado:
+        situacao = 'parcial'
+    else:
+        situacao = 'ok'
+    return {
+        'nome': forma['nome'],
+        'tabela': forma['tabela'],
+        'origem': forma['origem'],
+        'situacao': situacao,
+        'indice_usado': melhor[0] if melhor else None,
+        'colunas_usadas': melhor[1] if melhor else 0,
+        'colunas_esperadas': esperado,
+        'indice_sugerido': forma['indice_sugerido'],
+    }
+
+
+def analisar_indices(engine, formas=None):
+    """Avalia os formatos de consulta contra o catálogo do banco."""
+    inspector = sa_inspect(engine)
+    tabelas = set(inspector.get_table_names())
+    cache = {}
+    resultados = []
+    for forma in (formas or FORMAS_CONSULTA):
+        tabela = forma['tabela']
+        if tabela not in tabelas:
+            continue
+        if tabela not in cache:
+            cache[tabela] = _indices_tabela(inspector, tabela)
+        resultados.append(_avaliar_forma(forma, cache[tabela]))
+
+    return {
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'dialeto': engine.dialect.name,
+        'formas': resultados,
+        'ausentes': [r for r in resultados if r['situacao'] == 'ausente'],
+        'parciais': [r for r in resultados if r['situacao'] == 'parcial'],
+    }
+
+
+def verificar_no_startup(engine):
+    """Roda a análise e registra avisos no log. Desligável com CONSULTOR_INDICES_ATIVO=0."""
+    global _ultimo_relatorio
+
+    if os.environ.get('CONSULTOR_INDICES_ATIVO', '1').strip().lower() in ('0', 'false', 'no', 'off'):
+        return None
+
+    relatorio = analisar_indices(engine)
+    with _lock:
+        _ultimo_relatorio = relatorio
+
+    for r in relatorio['ausentes']:
+        logger.warning(
+            "Consultor de índices: %s.%s sem índice utilizável (origem: %s); sugerido %s",
+            r['tabela'], r['nome'], r['origem'], r['indice_sugerido'],
+        )
+    for r in relatorio['parciais']:
+        logger.info(
+            "Consultor de índices: %s.%s usa %s (%d/%d colunas); sugerido %s",
+            r['tabela'], r['nome'], r['indice_usado'], r['colunas_usadas'], r['colunas_esperadas'], r['indice_sugerido'],
+        )
+    if relatorio['ausentes']:
+        logger.warning("Consultor de índices: rode 'python migrations/add_apontamento_indexes.py' e 'python migrations/add_performance_indexes.py'")
+    return relatorio
+
+
+def ultimo_relatorio():
+    with _lock:
+        return _ultimo_relatorio
@@ -0,0 +1,231 @@
+"""
+Estado materializado do chão de fábrica (cartões de /apontamento/status-ativos)
+
+Mantém em memória os cartões já montados de cada OS e reconstrói apenas as OS
+marcadas como alteradas. As marcações chegam por três caminhos:
+
+- eventos da sessão SQLAlchemy (after_flush/after_commit) para as entidades que
+  compõem o cartão (apontamentos, status de produção, OS, cartões fantasma...);
+- chamadas explícitas a ``marcar_os`` em rotas que usam update em massa;
+- a marca d'água consultada a cada leitura, que detecta gravações feitas por
+  outros workers/processos.
+
+Uma reconstrução completa acontece na primeira leitura, após ``invalidar_tudo``
+ou quando o estado ultrapassa ``STATUS_ATIVOS_MAX_IDADE_S`` segundos.
+"""
+import os
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# Entidades cuja alteração afeta apenas a OS referenciada
+_ENTIDADES_POR_OS = {
+    'ApontamentoProducao': 'ordem_servico_id',
+    'StatusProducaoOS': 'ordem_servico_id',
+    'CartaoFantasma': 'ordem_servico_id',
+    'PedidoOrdemServico': 'ordem_servico_id',
+    'OrdemServico': 'id',
+}
+
+# Entidades compartilhadas entre várias OS: qualquer alteração invalida tudo
+_ENTIDADES_GLOBAIS = {'KanbanLista', 'Pedido', 'Item', 'ItemTrabalho', 'Trabalho', 'Cliente'}
+
+_CHAVE_SESSAO = '_estado_chao_fabrica'
+
+
+def _max_idade_padrao():
+    try:
+        return max(0, int(os.getenv('STATUS_ATIVOS_MAX_IDADE_S', '120')))
+    except ValueError:
+        return 120
+
+
+class EstadoChaoFabrica:
+    """Armazena as entradas por OS e controla o que precisa ser reconstruído"""
+
+    def __init__(self, max_idade_s=None):
+        self.max_idade_s = _max_idade_padrao() if max_idade_s is None else max_idade_s
+        self._lock = threading.RLock()  # estado em memória (trechos curtos, sem consulta ao banco)
+        self._lock_reconstrucao = threading.Lock()
+        self._entradas = {}
+        self._sujas = set()
+        self._invalidado = True
+        self._invalidacoes = 0  # invalidar_tudo durante uma reconstrução total a mantém pendente
+        self._construido_em = 0.0
+        self._marca_dagua = None
+        self.versao = 0
+        self.stats = {'leituras': 0, 'reconstrucoes_totais': 0, 'reconstrucoes_parciais': 0, 'os_reconstruidas': 0}
+
+    def marcar_os(self, *os_ids):
+        """Marca OS como alteradas; a próxima leitura reconstrói apenas elas"""
+        ids = {int(i) for i in os_ids if i is not None}
+        if not ids:
+            return
+        with self._lock:
+            self._sujas.update(ids)
+            self.versao += 1
+
+    def invalidar_tudo(self):
+        with self._lock:
+            self._invalidado = True
+            self._invalidacoes += 1
+            self.versao += 1
+
+    def obter(self, construtor, detectar_alteracoes=None):
+        """
+        Retorna (entradas, info) com o estado atualizado.
+
+        ``construtor(os_ids)`` recebe ``None`` (reconstrução completa) ou um
+        conjunto de ids e devolve ``{os_id: entrada}``; OS ausentes no retorno
+        são removidas do estado.
+
+        ``detectar_alteracoes(marca_anterior)`` é opcional e devolve
+        ``(nova_marca, os_ids)``, onde ``os_ids`` ``None`` indica que tudo deve
+        ser reconstruído.
+
+        A marca d'água é consultada sem lock e, sem nada pendente, o estado
+        atual volta direto. Só a reconstrução é serializada (uma por vez), com
+        nova verificação depois de obter o lock.
+        """
+        with self._lock:
+            self.stats['leituras'] += 1
+            marca, invalidado = self._marca_dagua, self._invalidado
+
+        if detectar_alteracoes is not None and not invalidado:
+            try:
+                nova_marca, alteradas = detectar_alteracoes(marca)
+                with self._lock:
+                    if alteradas is None:
+                        self._invalidado = True
+                    elif alteradas:
+                        self._sujas.update(alteradas)
+                    # Outra leitura pode ter avançado a marca enquanto esta consultava
+                    if self._marca_dagua == marca:
+                        self._marca_dagua = nova_marca
+            except Exception as e:
+                logger.warning(f"[estado_chao_fabrica] Falha ao verificar marca d'água: {e}")
+
+        info = {'reconstrucao': None, 'os_reconstruidas': 0}
+        if not self._precisa_reconstruir():
+            with self._lock:
+                info['versao'] = self.versao
+                return list(self._entradas.values()), info
+
+        with self._lock_reconstrucao:
+            with self._lock:
+                total = self._expirado()
+                invalidacoes = self._invalidacoes
+                pendentes = set(self._sujas)
+                self._sujas.clear()
+            if total:
+                marca_nova = None
+                if detectar_alteracoes is not None:
+                    try:
+                        marca_nova, _ = detectar_alteracoes(None)
+                    except Exception as e:
+                        logger.warning(f"[estado_chao_fabrica] Falha ao registrar marca d'água: {e}")
+                try:
+                    entradas = dict(construtor(None) or {})
+                except Exception:
+                    with self._lock:
+                        self._invalidado = True
+                        self._sujas.update(pendentes)
+                    raise
+                with self._lock:
+                    self._entradas = entradas
+                    self._invalidado = self._invalidacoes != invalidacoes
+                    self._construido_em = time.time()
+                    if detectar_alteracoes is not None:
+                        self._marca_dagua = marca_nova
+                    self.stats['reconstrucoes_totais'] += 1
+                info['reconstrucao'] = 'total'
+                info['os_reconstruidas'] = len(entradas)
+            elif pendentes:
+                try:
+                    novas = construtor(pendentes) or {}
+                except Exception:
+                    with self._lock:
+                        self._sujas.update(pendentes)
+                    raise
+                with self._lock:
+                    entradas = dict(self._entradas)
+                    for os_id in pendentes:
+                        entrada = novas.get(os_id)
+                        if entrada is None:
+                            entradas.pop(os_id, None)
+                        else:
+                            entradas[os_id] = entrada
+                    self._entradas = entradas
+                    self.stats['reconstrucoes_parciais'] += 1
+                info['reconstrucao'] = 'parcial'
+                info['os_reconstruidas'] = len(pendentes)
+
+            with self._lock:
+                self.stats['os_reconstruidas'] += info['os_reconstruidas']
+                info['versao'] = self.versao
+                return list(self._entradas.values()), info
+
+    def _expirado(self):
+        idade = time.time() - self._construido_em
+        return self._invalidado or bool(self.max_idade_s and idade > self.max_idade_s)
+
+    def _precisa_reconstruir(self):
+        with self._lock:
+            return self._expirado() or bool(self._sujas)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, versao=self.versao, os_em_memoria=len(self._entradas),
+                        pendentes=len(self._sujas), max_idade_s=self.max_idade_s)
+
+
+def _coletar_alteracoes(session_, objetos, acumulado):
+    for obj in objetos:
+        nome = obj.__class__.__name__
+        if nome in _ENTIDADES_GLOBAIS:
+            acumulado['tudo'] = True
+            continue
+        atributo = _ENTIDADES_POR_OS.get(nome)
+        if not atributo:
+            continue
+        os_id = getattr(obj, atributo, None)
+        if os_id is not None:
+            acumulado['os_ids'].add(os_id)
+
+
+def registrar_eventos_sessao(session_cls, estado):
+    """Liga os eventos da sessão ao estado: OS tocadas no flush são marcadas no commit"""
+
+    @event.listens_for(session_cls, 'after_flush')
+    def _estado_after_flush(session_, flush_context):
+        try:
+            acumulado = session_.info.setdefault(_CHAVE_SESSAO, {'os_ids': set(), 'tudo': False})
+            _coletar_alteracoes(session_, session_.new, acumulado)
+            _coletar_alteracoes(session_, session_.dirty, acumulado)
+            _coletar_alteracoes(session_, session_.deleted, acumulado)
+        except Exception as e:
+            logger.debug(f"[estado_chao_fabrica] Falha ao coletar alterações do flush: {e}")
+
+    @event.listens_for(session_cls, 'after_commit')
+    def _estado_after_commit(session_):
+        acumulado = session_.info.pop(_CHAVE_SESSAO, None)
+        if not acumulado:
+            return
+        if acumulado.get('tudo'):
+            estado.invalidar_tudo()
+        elif acumulado.get('os_ids'):
+            estado.marcar_os(*acumulado['os_ids'])
+
+    @event.listens_for(session_cls, 'after_soft_rollback')
+    def _estado_after_soft_rollback(session_, previous_transaction):
+        # Só a transação externa descarta; um savepoint desfeito não anula o resto
+        if previous_transaction.parent is None:
+            session_.info.pop(_CHAVE_SESSAO, None)
+
+
+# Instância global (uma por processo)
+estado_chao_fabrica = EstadoChaoFabrica()
@@ -0,0 +1,228 @@
+"""
+Exportações XLSX em segundo plano com memória constante
+
+Uma exportação é uma função ``gerar(caminho, progresso)`` executada numa
+thread com app context. A planilha é escrita com ``Workbook(write_only=True)``
+diretamente num arquivo temporário: as linhas vão para o disco à medida que
+são lidas do banco (``yield_per``), então o consumo de memória não cresce com
+o número de linhas. Os estilos são nomeados e registrados uma vez por
+workbook, em vez de um objeto de estilo por célula.
+
+O registro guarda só o status e o caminho do arquivo. Exportações concluídas
+(ou com erro) expiram após ``EXPORTACAO_TTL_SEGUNDOS`` (padrão 30 min) e o
+arquivo é removido na próxima consulta ao registro.
+
+Para um novo relatório basta declarar as colunas e um gerador de linhas:
+
+    def _gerar(caminho, progresso):
+        consulta = db.session.query(...).order_by(...)
+        gravar_planilha(caminho, 'Estoque', COLUNAS, consulta.yield_per(1000),
+                        total=consulta.count(), progresso=progresso)
+
+    export_id = iniciar_exportacao(current_app._get_current_object(), _gerar, 'estoque.xlsx')
+"""
+import os
+import time
+import uuid
+import logging
+import tempfile
+import threading
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+TTL_PADRAO_SEGUNDOS = 1800
+# Linhas lidas por ida ao banco e intervalo entre atualizações de progresso
+LOTE_LINHAS = 1000
+
+_EXPORTACOES = {}
+_EXPORTACOES_LOCK = threading.Lock()
+
+
+def _ttl_segundos():
+    try:
+        return max(60, int(os.environ.get('EXPORTACAO_TTL_SEGUNDOS', TTL_PADRAO_SEGUNDOS)))
+    except ValueError:
+        return TTL_PADRAO_SEGUNDOS
+
+
+def _estilos():
+    """Estilos nomeados compartilhados por todas as células da planilha."""
+    centro = Alignment(horizontal='center', vertical='center')
+    direita = Alignment(horizontal='right', vertical='center')
+    return [
+        NamedStyle(name='exp_cabecalho', font=Font(color='FFFFFF', bold=True),
+                   fill=PatternFill(fill_type='solid', fgColor='1F4E78'), alignment=centro),
+        NamedStyle(name='exp_texto', alignment=Alignment(horizontal='left', vertical='center')),
+        NamedStyle(name='exp_centro', alignment=centro),
+        NamedStyle(name='exp_inteiro', number_format='0', alignment=centro),
+        NamedStyle(name='exp_decimal', number_format='#,##0.00', alignment=direita),
+        NamedStyle(name='exp_moeda', number_format='R$ #,##0.00', alignment=direita),
+        NamedStyle(name='exp_percentual', number_format='0.00', alignment=direita),
+        NamedStyle(name='exp_data', number_format='DD/MM/YYYY', alignment=centro),
+        NamedStyle(name='exp_data_hora', number_format='DD/MM/YYYY HH:MM', alignment=centro),
+    ]
+
+
+class Coluna:
+    """Coluna da planilha: título do cabeçalho, largura e estilo nomeado (sem o prefixo ``exp_``)."""
+
+    def __init__(self, titulo, largura=14, estilo='texto'):
+        self.titulo = titulo
+        self.largura = largura
+        self.estilo = f'exp_{estilo}'
+
+
+def gravar_planilha(caminho, titulo_aba, colunas, linhas, total=None, progresso=None, congelar='B2'):
+    """
+    Escreve ``linhas`` (iterável de sequências na ordem de ``colunas``) em
+    ``caminho`` sem manter a planilha em memória. Devolve o número de linhas.
+
+    ``progresso(percentual, mensagem)`` é chamado a cada ``LOTE_LINHAS``
+    linhas, entre 5% e 95% quando ``total`` é informado.
+    """
+    wb = Workbook(write_only=True)
+    for estilo in _estilos():
+        wb.add_named_style(estilo)
+    ws = wb.create_sheet(titulo_aba)
+
+    # Em write-only, dimensões, painéis e filtro precisam vir antes das linhas
+    for indice, coluna in enumerate(colunas, start=1):
+        ws.column_dimensions[get_column_letter(indice)].width = coluna.largura
+    if congelar:
+        ws.freeze_panes = congelar
+    ws.auto_filter.ref = f"A1:{get_column_letter(len(colunas))}1"
+
+    def celula(valor, estilo):
+        c = WriteOnlyCell(ws, value=valor)
+        c.style = estilo
+        return c
+
+    ws.append([celula(coluna.titulo, 'exp_cabecalho') for coluna in colunas])
+    if progresso:
+        progresso(percentual=5, mensagem='Preparando planilha...')
+
+    estilos = [coluna.estilo for coluna in colunas]
+    escritas = 0
+    for linha in linhas:
+        ws.append([celula(valor, estilo) for valor, estilo in zip(linha, estilos)])
+        escritas += 1
+        if progresso and escritas % LOTE_LINHAS == 0:
+            if total:
+                percentual = min(5 + int((escritas / total) * 90), 95)
+                progresso(percentual=percentual, mensagem=f'Processando linha {escritas} de {total}...')
+            else:
+                progresso(percentual=50, mensagem=f'Processando linha {escritas}...')
+
+    if progresso:
+        progresso(percentual=97, mensagem='Finalizando arquivo...')
+    wb.save(caminho)
+    return escritas
+
+
+def _remover_arquivo(caminho):
+    if caminho and os.path.exists(caminho):
+        try:
+            os.remove(caminho)
+        except OSError as e:
+            logger.warning(f"[exportacao] Não foi possível remover {caminho}: {e}")
+
+
+def limpar_expiradas(agora=None):
+    """Remove do registro (e do disco) as exportações encerradas há mais que o TTL."""
+    agora = agora or time.time()
+    ttl = _ttl_segundos()
+    with _EXPORTACOES_LOCK:
+        expiradas = [
+            export_id for export_id, exp in _EXPORTACOES.items()
+            if exp.get('concluido_em') and agora - exp['concluido_em'] > ttl
+        ]
+        removidas = [_EXPORTACOES.pop(export_id) for export_id in expiradas]
+    for exportacao in removidas:
+        _remover_arquivo(exportacao.get('caminho'))
+    return len(removidas)
+
+
+def _atualizar(export_id, **kwargs):
+    with _EXPORTACOES_LOCK:
+        exportacao = _EXPORTACOES.get(export_id)
+        if exportacao:
+            exportacao.update(kwargs)
+
+
+def _executar(app, export_id, gerar, caminho, descricao, mensagem_pronto):
+    with app.app_context():
+        try:
+            gerar(caminho, lambda percentual, mensagem: _atualizar(
+                export_id, status='processando', percentual=percentual, mensagem=mensagem,
+            ))
+            _atualizar(export_id, status='pronto', percentual=100,
+                       mensagem=mensagem_pronto, concluido_em=time.time())
+        except Exception as exc:
+            logger.error(f"[exportacao] Falha ao gerar {export_id}: {exc}")
+            _remover_arquivo(caminho)
+            _atualizar(export_id, status='erro', mensagem=f'Falha ao gerar {descricao}: {exc}',
+                       caminho=None, concluido_em=time.time())
+        finally:
+            try:
+                from models import db
+                db.session.remove()
+            except Exception:
+                pass
+
+
+def iniciar_exportacao(app, gerar, nome_arquivo, sufixo='.xlsx', descricao='planilha',
+                       mensagem_pronto='Planilha pronta para download.', **dados):
+    """Registra e dispara a exportação numa thread; devolve o export_id.
+
+    Serve para qualquer arquivo gerado em segundo plano (``sufixo`` e
+    mensagens ajustáveis, ex.: PDF de impressão em lote). ``dados`` extras
+    (ex.: ``usuario_id``) ficam no registro para conferência na rota de
+    download.
+    """
+    limpar_expiradas()
+    export_id = uuid.uuid4().hex
+    fd, caminho = tempfile.mkstemp(prefix=f'exportacao_{export_id}_', suffix=sufixo)
+    os.close(fd)
+
+    with _EXPORTACOES_LOCK:
+        _EXPORTACOES[export_id] = dict(
+            dados,
+            status='processando',
+            percentual=0,
+            mensagem='Iniciando exportação...',
+            caminho=caminho,
+            nome_arquivo=nome_arquivo,
+            criado_em=time.time(),
+            concluido_em=None,
+        )
+
+    threading.Thread(
+        target=_executar, args=(app, export_id, gerar, caminho, descricao, mensagem_pronto), daemon=True,
+    ).start()
+    return export_id
+
+
+def obter_exportacao(export_id):
+    """Cópia do registro da exportação, ou None se não existe/expirou."""
+    limpar_expiradas()
+    with _EXPORTACOES_LOCK:
+        exportacao = _EXPORTACOES.get(export_id)
+        return dict(exportacao) if exportacao else None
+
+
+def status_exportacao(exportacao):
+    """Campos de status no formato já usado pelas telas (polling)."""
+    return {
+        'ok': True,
+        'status': exportacao.get('status'),
+        'percentual': exportacao.get('percentual', 0),
+        'mensagem': exportacao.get('mensagem', ''),
+        'pronto': exportacao.get('status') == 'pronto',
+        'erro': exportacao.get('status') == 'erro',
+    }
@@ -0,0 +1,268 @@
+"""
+Derivadas de imagens (miniaturas WebP/AVIF)
+
+No upload de uma imagem, ``save_file`` agenda a geração das derivadas num
+pool de ``IMAGENS_DERIVADAS_WORKERS`` threads (padrão 2), fora da
+requisição. Cada tamanho de ``TAMANHOS`` (lado maior em pixels) é gravado em
+WebP ao lado do original, com o nome ``<original>.<tamanho>.webp`` (ex.:
+``imagens/ab12_polia.jpg.thumb.webp``), no disco local ou no mesmo bucket do
+Supabase. AVIF também é gerado quando o Pillow instalado suporta.
+
+``get_file_url(caminho, size='thumb')`` monta a URL da derivada pela
+convenção de nome, sem consultar disco ou rede. Imagens antigas (ou cuja
+geração não terminou, ex.: função serverless congelada após a resposta) são
+derivadas sob demanda na primeira vez que a URL é pedida: a rota local gera a
+partir do arquivo original; a de redirecionamento do Supabase redireciona
+para o original e agenda no mesmo pool o download, a geração e o envio das
+derivadas. Originais que não puderam ser derivados (ex.: arquivo corrompido
+ou ausente) ficam ``IMAGENS_DERIVADAS_FALHA_TTL_S`` segundos (padrão 600)
+sem nova tentativa.
+"""
+import io
+import os
+import re
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+logger = logging.getLogger(__name__)
+
+# Lado maior (px) de cada tamanho
+TAMANHOS = {
+    'thumb': 160,
+    'medio': 640,
+}
+
+EXTENSOES_IMAGEM = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp', 'tif', 'tiff'}
+
+MIMETYPES = {'webp': 'image/webp', 'avif': 'image/avif'}
+
+_PADRAO_DERIVADA = re.compile(r'^(?P<original>.+)\.(?P<tamanho>[a-z]+)\.(?P<formato>webp|avif)$')
+
+_executor = None
+_executor_lock = threading.Lock()
+# Derivadas do Supabase já confirmadas neste processo (evita HEAD repetido)
+_confirmadas = set()
+# Originais do Supabase com geração agendada e os que falharam (-> expira_em)
+_em_andamento = set()
+_falhas = {}
+_sob_demanda_lock = threading.Lock()
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(1, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def formatos():
+    """Formatos gerados: WebP sempre; AVIF se houver encoder no Pillow."""
+    from PIL import Image
+    Image.init()
+    return ['webp', 'avif'] if 'AVIF' in Image.SAVE else ['webp']
+
+
+def eh_imagem(caminho):
+    return bool(caminho) and '.' in caminho and caminho.rsplit('.', 1)[1].lower() in EXTENSOES_IMAGEM
+
+
+def caminho_derivada(caminho, tamanho, formato='webp'):
+    return f'{caminho}.{tamanho}.{formato}'
+
+
+def separar_derivada(caminho):
+    """(caminho do original, tamanho, formato) se ``caminho`` for de uma derivada; senão None."""
+    m = _PADRAO_DERIVADA.match(caminho or '')
+    if not m or m.group('tamanho') not in TAMANHOS or not eh_imagem(m.group('original')):
+        return None
+    return m.group('original'), m.group('tamanho'), m.group('formato')
+
+
+def gerar_derivadas(conteudo):
+    """``{(tamanho, formato): bytes}`` a partir dos bytes da imagem original."""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(conteudo)) as original:
+        original.seek(0)  # GIF animado: só o primeiro quadro
+        imagem = ImageOps.exif_transpose(original)
+        imagem = imagem.convert('RGBA' if imagem.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    derivadas = {}
+    for tamanho, lado in TAMANHOS.items():
+        reduzida = imagem.copy()
+        reduzida.thumbnail((lado, lado), Image.LANCZOS)
+        for formato in formatos():
+            saida = io.BytesIO()
+            if formato == 'webp':
+                reduzida.save(saida, 'WEBP', quality=80, method=4)
+            else:
+                reduzida.save(saida, 'AVIF', quality=55)
+            derivadas[(tamanho, formato)] = saida.getvalue()
+    return derivadas
+
+
+# ---------------------------------------------------------------------------
+# Gravação (disco local ou Supabase)
+# ---------------------------------------------------------------------------
+
+def gravar_local(caminho_arquivo, conteudo=None):
+    """Grava as derivadas ao lado de ``caminho_arquivo`` (lê o original se ``conteudo`` não vier)."""
+    if conteudo is None:
+        with open(caminho_arquivo, 'rb') as f:
+            conteudo = f.read()
+    for (tamanho, formato), dados in gerar_derivadas(conteudo).items():
+        destino = caminho_derivada(caminho_arquivo, tamanho, formato)
+        temporario = f'{destino}.tmp'
+        with open(temporario, 'wb') as f:
+            f.write(dados)
+        os.replace(temporario, destino)
+
+
+def _config_supabase():
+    url = (os.environ.get('SUPABASE_URL') or '').rstrip('/')
+    chave = os.environ.get('SUPABASE_KEY')
+    return url, chave
+
+
+def enviar_supabase(bucket, caminho_storage, conteudo):
+    """Gera e envia (upsert) as derivadas de ``bucket/caminho_storage``."""
+    from utils.storage import guardar, sessao, url_publica
+
+    url, chave = _config_supabase()
+    if not url or not chave:
+        raise RuntimeError('SUPABASE_URL/SUPABASE_KEY não configurados')
+    for (tamanho, formato), dados in gerar_derivadas(conteudo).items():
+        destino = caminho_derivada(caminho_storage, tamanho, formato)
+        resposta = sessao().post(
+            f"{url}/storage/v1/object/{bucket}/{quote(destino, safe='/')}",
+            headers={
+                'Authorization': f'Bearer {chave}',
+                'apikey': chave,
+                'Content-Type': MIMETYPES[formato],
+                'x-upsert': 'true',
+            },
+            data=dados,
+            timeout=60,
+        )
+        if resposta.status_code not in (200, 201):
+            raise RuntimeError(f'upload de {destino} falhou: {resposta.status_code} {resposta.text[:200]}')
+        _confirmadas.add(f'{bucket}/{destino}')
+        guardar(url_publica(bucket, destino), dados)
+
+
+def _executor_derivadas():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=_env_int('IMAGENS_DERIVADAS_WORKERS', 2), thread_name_prefix='imagens-derivadas',
+            )
+        return _executor
+
+
+def agendar(caminho_salvo, conteudo, caminho_local=None):
+    """
+    Agenda a geração das derivadas de um upload recém-salvo. ``caminho_salvo``
+    é o valor gravado no banco (``supabase://bucket/pasta/arquivo`` ou
+    ``pasta/arquivo``) e ``caminho_local`` o arquivo em disco no modo local.
+    """
+    if not caminho_salvo or not conteudo or not eh_imagem(caminho_salvo):
+        return None
+
+    def tarefa():
+        try:
+            if caminho_salvo.startswith('supabase://'):
+                bucket, _, caminho_storage = caminho_salvo[len('supabase://'):].partition('/')
+                enviar_supabase(bucket, caminho_storage, conteudo)
+            elif caminho_local:
+                gravar_local(caminho_local, conteudo)
+        except Exception as e:
+            logger.warning(f"[imagens] Derivadas de {caminho_salvo} não geradas: {e}")
+
+    return _executor_derivadas().submit(tarefa)
+
+
+# ---------------------------------------------------------------------------
+# Sob demanda (imagens antigas)
+# ---------------------------------------------------------------------------
+
+def derivada_local(caminho_derivada_fs):
+    """Caminho da derivada local, gerando a partir do original se preciso. None se não há original."""
+    if os.path.exists(caminho_derivada_fs):
+        return caminho_derivada_fs
+    partes = separar_derivada(caminho_derivada_fs)
+    if not partes or not os.path.exists(partes[0]):
+        return None
+    try:
+        gravar_local(partes[0])
+    except Exception as e:
+        logger.warning(f"[imagens] Falha ao gerar derivada de {partes[0]}: {e}")
+        return None
+    return caminho_derivada_fs if os.path.exists(caminho_derivada_fs) else None
+
+
+def _derivar_supabase(bucket, caminho_original):
+    """Baixa o original e envia as derivadas; a falha fica no cache negativo."""
+    from utils.storage import ler, url_publica
+
+    chave = f'{bucket}/{caminho_original}'
+    try:
+        original = ler(url_publica(bucket, caminho_original), timeout=60)
+        if original is None:
+            raise RuntimeError('original não encontrado')
+        enviar_supabase(bucket, caminho_original, original)
+    except Exception as e:
+        logger.warning(f"[imagens] Derivadas de {chave} não geradas: {e}")
+        with _sob_demanda_lock:
+            _falhas[chave] = time.monotonic() + _env_int('IMAGENS_DERIVADAS_FALHA_TTL_S', 600)
+    finally:
+        with _sob_demanda_lock:
+            _em_andamento.discard(chave)
+
+
+def garantir_supabase(bucket, caminho_storage_derivada):
+    """
+    True se a derivada existe no bucket. Se faltar, agenda a geração a partir
+    do original e retorna False (a rota redireciona para o original); também
+    False enquanto a geração está na fila ou depois de uma falha recente.
+    """
+    from utils.storage import sessao, url_publica
+
+    chave_cache = f'{bucket}/{caminho_storage_derivada}'
+    if chave_cache in _confirmadas:
+        return True
+    partes = separar_derivada(caminho_storage_derivada)
+    url, chave = _config_supabase()
+    if not partes or not url:
+        return False
+
+    chave_original = f'{bucket}/{partes[0]}'
+    with _sob_demanda_lock:
+        if chave_original in _em_andamento:
+            return False
+        if _falhas.get(chave_original, 0) > time.monotonic():
+            return False
+        _falhas.pop(chave_original, None)
+
+    try:
+        if sessao().head(url_publica(bucket, caminho_storage_derivada), timeout=10).status_code == 200:
+            _confirmadas.add(chave_cache)
+            return True
+    except Exception as e:
+        logger.warning(f"[imagens] Derivada {chave_cache} indisponível: {e}")
+        return False
+
+    with _sob_demanda_lock:
+        if chave_original in _em_andamento:
+            return False
+        _em_andamento.add(chave_original)
+    try:
+        _executor_derivadas().submit(_derivar_supabase, bucket, partes[0])
+    except Exception as e:
+        logger.warning(f"[imagens] Geração de {chave_original} não agendada: {e}")
+        with _sob_demanda_lock:
+            _em_andamento.discard(chave_original)
+    return False
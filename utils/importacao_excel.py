@@ -0,0 +1,221 @@
+"""
+Importação de planilhas em etapas (pedidos e estoque de peças)
+
+1. Leitura em streaming (``load_workbook(read_only=True)``): a planilha não é
+   carregada inteira em memória.
+2. As telas validam todas as linhas contra dicionários de referência
+   carregados de uma vez (clientes, unidades, itens), em vez de uma consulta
+   por linha.
+3. As linhas válidas ficam na tabela ``importacao_excel_temp``, chaveadas pelo
+   ``import_id`` que vai no formulário de confirmação, e não no cookie de
+   sessão (que estoura com poucas centenas de linhas).
+4. Na confirmação os registros são inseridos em lotes de ``TAMANHO_LOTE``.
+
+Importações não confirmadas são descartadas após ``HORAS_EXPIRACAO``. Cada
+importação só é visível para o usuário que a gravou.
+"""
+import json
+import uuid
+import logging
+from datetime import datetime, timedelta
+
+from flask import has_request_context, session
+from openpyxl import load_workbook
+from sqlalchemy import bindparam, delete, func, insert, or_, update
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE = 500
+HORAS_EXPIRACAO = 24
+
+
+class PlanilhaInvalida(ValueError):
+    """Arquivo que não é XLSX legível ou sem linha de cabeçalho."""
+
+
+def ler_planilha(arquivo, canonizar):
+    """
+    Abre a planilha em modo somente leitura.
+
+    Devolve ``(cabecalhos, col_index, linhas)``: cabeçalhos canonizados, o
+    índice da primeira coluna de cada cabeçalho e um gerador de
+    ``(numero_linha, valores)`` com os valores completados até o número de
+    colunas do cabeçalho (o modo read-only corta células vazias no fim).
+    """
+    try:
+        wb = load_workbook(arquivo, read_only=True, data_only=True)
+    except Exception as e:
+        raise PlanilhaInvalida(f'Erro ao ler XLSX: {e}')
+
+    ws = wb.active
+    linhas = ws.iter_rows(values_only=True)
+    cabecalho = next(linhas, None)
+    if not cabecalho or not any(v not in (None, '') for v in cabecalho):
+        wb.close()
+        raise PlanilhaInvalida('XLSX vazio ou sem cabeçalho.')
+
+    cabecalhos = [canonizar(h) for h in cabecalho]
+    col_index = {}
+    for i, h in enumerate(cabecalhos):
+        if h:
+            # Não sobrescrever primeira ocorrência (coluna repetida)
+            col_index.setdefault(h, i)
+
+    largura = len(cabecalhos)
+
+    def _gerar():
+        try:
+            for numero, valores in enumerate(linhas, start=2):
+                valores = tuple(valores or ())
+                if len(valores) < largura:
+                    valores = valores + (None,) * (largura - len(valores))
+                yield numero, valores
+        finally:
+            wb.close()
+
+    return cabecalhos, col_index, _gerar()
+
+
+def chave_texto(valor):
+    """Chave de comparação sem diferença de maiúsculas/minúsculas (equivale ao ILIKE sem curingas)."""
+    return str(valor or '').strip().casefold()
+
+
+def em_lotes(sequencia, tamanho=TAMANHO_LOTE):
+    lote = []
+    for elemento in sequencia:
+        lote.append(elemento)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def mapa_por_texto(consulta, coluna_texto, valores, tamanho=TAMANHO_LOTE):
+    """
+    ``{chave_texto(valor da coluna): linha}`` das linhas de ``consulta`` cuja
+    coluna casa (sem caixa) com algum dos ``valores``; em caso de repetição
+    fica a de menor id. Consulta em lotes para não estourar o limite de
+    parâmetros do banco.
+    """
+    valores = {str(v).strip() for v in valores if str(v or '').strip()}
+    encontrados = {}
+    for lote in em_lotes(sorted(valores), tamanho):
+        minusculos = sorted({v.lower() for v in lote})
+        # lower() do SQLite só trata ASCII: o valor original cobre a igualdade exata
+        filtro = or_(func.lower(coluna_texto).in_(minusculos), coluna_texto.in_(lote))
+        for linha in consulta.filter(filtro).order_by(None).all():
+            chave = chave_texto(getattr(linha, coluna_texto.key))
+            atual = encontrados.get(chave)
+            if atual is None or linha.id < atual.id:
+                encontrados[chave] = linha
+    return encontrados
+
+
+def _modelo():
+    from models import ImportacaoExcelTemp
+    return ImportacaoExcelTemp
+
+
+def limpar_importacoes_antigas(horas=HORAS_EXPIRACAO):
+    from models import db
+    limite = datetime.utcnow() - timedelta(hours=horas)
+    modelo = _modelo()
+    try:
+        removidas = modelo.query.filter(modelo.criado_em < limite).delete(synchronize_session=False)
+        if removidas:
+            logger.info(f"[importacao] {removidas} linha(s) de importações expiradas removidas")
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"[importacao] Falha ao limpar importações antigas: {e}")
+
+
+def salvar_linhas(tipo, linhas):
+    """Grava as linhas validadas (dicts com ``row_number``) e devolve o ``import_id``. Faz commit."""
+    from models import db
+    modelo = _modelo()
+    limpar_importacoes_antigas()
+
+    import_id = str(uuid.uuid4())
+    usuario_id = _usuario_atual()
+    criado_em = datetime.utcnow()
+    for lote in em_lotes(linhas):
+        db.session.execute(insert(modelo), [
+            {
+                'import_id': import_id,
+                'tipo': tipo,
+                'usuario_id': usuario_id,
+                'linha': linha['row_number'],
+                'dados': json.dumps(linha, ensure_ascii=False, default=str),
+                'confirmado': False,
+                'criado_em': criado_em,
+            }
+            for linha in lote
+        ])
+    db.session.commit()
+    return import_id
+
+
+def _usuario_atual():
+    return session.get('usuario_id') if has_request_context() else None
+
+
+def _consulta(import_id, tipo):
+    """Linhas da importação, sempre restritas ao dono (sem sessão: as gravadas sem usuário)"""
+    modelo = _modelo()
+    usuario_id = _usuario_atual()
+    dono = modelo.usuario_id.is_(None) if usuario_id is None else modelo.usuario_id == usuario_id
+    return modelo.query.filter(modelo.import_id == (import_id or ''), modelo.tipo == tipo, dono)
+
+
+def carregar_linhas(import_id, tipo):
+    """Linhas da importação na ordem da planilha e se ela já foi confirmada."""
+    modelo = _modelo()
+    registros = _consulta(import_id, tipo).with_entities(modelo.dados, modelo.confirmado).order_by(modelo.linha).all()
+    return [json.loads(r.dados) for r in registros], any(r.confirmado for r in registros)
+
+
+def marcar_confirmadas(import_id, tipo, linhas_mantidas):
+    """
+    Marca a importação como confirmada, mantendo só as linhas importadas (para
+    impressão): um DELETE por lote das demais e um UPDATE em lote (executemany)
+    das mantidas. Não faz commit.
+    """
+    from models import db
+    modelo = _modelo()
+    tabela = modelo.__table__
+    mantidas = {linha['row_number']: linha for linha in linhas_mantidas}
+    registros = _consulta(import_id, tipo).with_entities(modelo.id, modelo.linha).all()
+
+    for lote in em_lotes([r.id for r in registros if r.linha not in mantidas]):
+        db.session.execute(delete(tabela).where(tabela.c.id.in_(lote)))
+
+    confirmadas = [
+        {'b_id': r.id, 'b_dados': json.dumps(mantidas[r.linha], ensure_ascii=False, default=str)}
+        for r in registros if r.linha in mantidas
+    ]
+    if confirmadas:
+        db.session.execute(
+            update(tabela)
+            .where(tabela.c.id == bindparam('b_id'))
+            .values(dados=bindparam('b_dados'), confirmado=True),
+            confirmadas,
+        )
+
+
+def remover_linhas(import_id, tipo):
+    """Descarta a importação. Não faz commit."""
+    _consulta(import_id, tipo).delete(synchronize_session=False)
+
+
+def registrar_auditoria(entidade_tipo, import_id, quantidade, detalhes=None):
+    """
+    Um registro de auditoria por importação: as inserções em lote não passam
+    pelo flush que audita objeto a objeto. Vai para o audit_log após o commit.
+    """
+    from models import db
+    from utils.auditoria import registrar
+    mudancas = {'importacao_excel': import_id, 'quantidade': quantidade}
+    mudancas.update(detalhes or {})
+    registrar(db.session(), 'create', entidade_tipo, f'importacao:{import_id}'[:64], mudancas)
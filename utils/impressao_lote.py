@@ -0,0 +1,277 @@
+"""
+Impressão em lote de OS num único PDF
+
+Para cada OS do lote entra a folha da OS (gerada com reportlab) seguida dos
+desenhos técnicos dos itens, carimbados quando aprovados. O PDF é montado em
+segundo plano pelo registro de ``utils.exportacao_xlsx`` (status/percentual
+por polling, arquivo temporário com TTL).
+
+Os desenhos são baixados uma única vez por item, em paralelo, num pool
+limitado a ``IMPRESSAO_LOTE_DOWNLOADS`` threads (padrão 4) para não abrir
+dezenas de conexões com o Storage ao mesmo tempo. Desenhos aprovados passam
+pelo cache de ``utils.cache_desenhos``.
+"""
+import io
+import os
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
+from xml.sax.saxutils import escape
+
+from flask import current_app
+from sqlalchemy.orm import selectinload
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE_PDF = 'application/pdf'
+MAXIMO_OS_LOTE = 300
+
+
+def _env_int(nome, padrao):
+    try:
+        return max(1, int(os.getenv(nome, padrao)))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def carregar_ordens(ordem_ids=None, lista=None):
+    """OS do lote: ids na ordem informada ou todas as OS de uma lista do Kanban (pela posição)."""
+    from models import OrdemServico, PedidoOrdemServico, Pedido, Item, ItemTrabalho, ItemMaterial
+
+    consulta = OrdemServico.query.options(
+        selectinload(OrdemServico.pedidos).selectinload(PedidoOrdemServico.pedido).options(
+            selectinload(Pedido.cliente),
+            selectinload(Pedido.unidade_entrega),
+            selectinload(Pedido.item).options(
+                selectinload(Item.trabalhos).selectinload(ItemTrabalho.trabalho),
+                selectinload(Item.materiais).selectinload(ItemMaterial.material),
+            ),
+        )
+    )
+    if lista:
+        return consulta.filter(OrdemServico.status == lista).order_by(OrdemServico.posicao, OrdemServico.id).limit(MAXIMO_OS_LOTE).all()
+
+    ids = [int(i) for i in (ordem_ids or [])][:MAXIMO_OS_LOTE]
+    por_id = {o.id: o for o in consulta.filter(OrdemServico.id.in_(ids)).all()} if ids else {}
+    return [por_id[i] for i in dict.fromkeys(ids) if i in por_id]
+
+
+def _itens_da_ordem(ordem):
+    """Itens distintos da OS na ordem dos pedidos, com a quantidade total."""
+    itens = {}
+    for pedido_os in ordem.pedidos:
+        pedido = pedido_os.pedido
+        if not pedido or not pedido.item:
+            continue
+        atual = itens.setdefault(pedido.item.id, {'item': pedido.item, 'quantidade': 0})
+        atual['quantidade'] += pedido.quantidade or 0
+    return list(itens.values())
+
+
+def _tratamentos(item):
+    partes = []
+    if item.tempera:
+        partes.append(f"Têmpera {item.tipo_tempera or ''}".strip())
+    if item.pintura:
+        partes.append(' '.join(p for p in ['Pintura', item.tipo_pintura, item.cor_pintura] if p))
+    if item.zincagem:
+        partes.append(f"Zincagem {item.tipo_zincagem or ''}".strip())
+    if getattr(item, 'tipo_embalagem', None):
+        partes.append(f"Embalagem {item.tipo_embalagem}")
+    return ', '.join(partes)
+
+
+def folha_ordem_pdf(ordem):
+    """Folha resumida da OS em PDF (pedidos, materiais, trabalhos e tratamentos por item)."""
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.lib.units import mm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+    from models import local_now_naive
+
+    estilos = getSampleStyleSheet()
+    normal = estilos['BodyText']
+
+    def p(texto):
+        return Paragraph(escape(str(texto if texto is not None else '')), normal)
+
+    def tabela(linhas, larguras):
+        t = Table(linhas, colWidths=larguras, repeatRows=1)
+        t.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1F4E78')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 0.4, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+        return t
+
+    historia = [
+        Paragraph(f"ORDEM DE SERVIÇO {escape(ordem.numero or str(ordem.id))}", estilos['Title']),
+        p(' | '.join(filter(None, [
+            f"Criada em {ordem.data_criacao.strftime('%d/%m/%Y')}" if ordem.data_criacao else '',
+            f"Lista: {ordem.status}" if ordem.status else '',
+            (f"Aprovada por {ordem.aprovado_por_nome or '-'} em {ordem.aprovado_em.strftime('%d/%m/%Y %H:%M')}"
+             if ordem.aprovado_em else 'Não aprovada'),
+        ]))),
+        Spacer(1, 4 * mm),
+    ]
+
+    linhas = [['Pedido', 'Pedido cliente', 'Cliente', 'Unidade', 'Item', 'Qtd', 'Previsão']]
+    for pedido_os in ordem.pedidos:
+        pedido = pedido_os.pedido
+        if not pedido:
+            continue
+        item = pedido.item
+        linhas.append([
+            p(pedido.numero_pedido or '-'),
+            p(pedido.numero_pedido_cliente or '-'),
+            p(pedido.cliente.nome if pedido.cliente else ''),
+            p(pedido.unidade_entrega.nome if pedido.unidade_entrega else ''),
+            p(f"{item.codigo_acb} - {item.nome}" if item else (pedido.nome_item or '')),
+            pedido.quantidade or 0,
+            pedido.previsao_entrega.strftime('%d/%m/%Y') if pedido.previsao_entrega else '-',
+        ])
+    historia += [tabela(linhas, [22 * mm, 24 * mm, 30 * mm, 24 * mm, 50 * mm, 12 * mm, 20 * mm]), Spacer(1, 5 * mm)]
+
+    for dados in _itens_da_ordem(ordem):
+        item = dados['item']
+        historia.append(Paragraph(
+            f"{escape(item.codigo_acb or '')} - {escape(item.nome or '')} (Qtd total: {dados['quantidade']})",
+            estilos['Heading3'],
+        ))
+        if item.materiais:
+            historia.append(tabela(
+                [['Material', 'Comprimento (mm)', 'Qtd']] + [
+                    [p(im.material.nome if im.material else ''), im.comprimento or '', im.quantidade or 1]
+                    for im in item.materiais
+                ],
+                [110 * mm, 40 * mm, 20 * mm],
+            ))
+            historia.append(Spacer(1, 2 * mm))
+        if item.trabalhos:
+            historia.append(tabela(
+                [['#', 'Trabalho', 'Setup', 'Peça', 'OBS']] + [
+                    [i, p(it.trabalho.nome if it.trabalho else 'Sem nome'), it.tempo_setup_formatado,
+                     it.tempo_peca_formatado, p(it.obs or '')]
+                    for i, it in enumerate(item.trabalhos, start=1)
+                ],
+                [10 * mm, 55 * mm, 20 * mm, 20 * mm, 77 * mm],
+            ))
+        tratamentos = _tratamentos(item)
+        if tratamentos:
+            historia.append(p(f"Tratamentos: {tratamentos}"))
+        historia.append(Spacer(1, 4 * mm))
+
+    historia.append(p(f"Gerado em {local_now_naive().strftime('%d/%m/%Y %H:%M')}"))
+
+    saida = io.BytesIO()
+    SimpleDocTemplate(saida, pagesize=A4, leftMargin=12 * mm, rightMargin=12 * mm,
+                      topMargin=12 * mm, bottomMargin=12 * mm,
+                      title=f"OS {ordem.numero}").build(historia)
+    return saida.getvalue()
+
+
+def _pagina_aviso(texto):
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    saida = io.BytesIO()
+    c = canvas.Canvas(saida, pagesize=A4)
+    c.setFont('Helvetica-Bold', 14)
+    c.drawCentredString(A4[0] / 2, A4[1] / 2, texto)
+    c.showPage()
+    c.save()
+    return saida.getvalue()
+
+
+def baixar_desenhos(itens, baixar, carimbar, progresso=None):
+    """
+    {item_id: caminho ou bytes do PDF} com os desenhos dos itens, baixados em
+    paralelo (pool limitado). Itens aprovados vêm carimbados do cache em disco.
+    ``baixar(item)`` devolve os bytes do original; falhas viram None.
+    """
+    from utils.cache_desenhos import obter_pdf_carimbado
+
+    app = current_app._get_current_object()
+    # Cópias simples: objetos ORM não atravessam threads
+    copias = [
+        SimpleNamespace(
+            id=item.id,
+            codigo_acb=item.codigo_acb,
+            desenho_tecnico=item.desenho_tecnico,
+            desenho_aprovado_por_nome=item.desenho_aprovado_por_nome,
+            desenho_aprovado_em=item.desenho_aprovado_em,
+        )
+        for item in itens if item.desenho_tecnico
+    ]
+
+    def tarefa(copia):
+        with app.app_context():
+            if copia.desenho_aprovado_em:
+                caminho, _etag = obter_pdf_carimbado(copia, baixar, carimbar)
+                return caminho
+            return baixar(copia)
+
+    resultados = {}
+    if not copias:
+        return resultados
+    with ThreadPoolExecutor(max_workers=min(_env_int('IMPRESSAO_LOTE_DOWNLOADS', 4), len(copias))) as pool:
+        futuros = {pool.submit(tarefa, copia): copia for copia in copias}
+        for concluidos, futuro in enumerate(as_completed(futuros), start=1):
+            copia = futuros[futuro]
+            try:
+                resultados[copia.id] = futuro.result()
+            except Exception as e:
+                logger.warning(f"[impressao_lote] Desenho do item {copia.codigo_acb} indisponível: {e}")
+                resultados[copia.id] = None
+            if progresso:
+                progresso(concluidos, len(copias))
+    return resultados
+
+
+def gerar_pdf_lote(caminho, ordens, baixar, carimbar, progresso=None):
+    """Grava em ``caminho`` o PDF com a folha de cada OS seguida dos desenhos dos seus itens."""
+    from pypdf import PdfReader, PdfWriter
+
+    itens = {}
+    for ordem in ordens:
+        for dados in _itens_da_ordem(ordem):
+            itens.setdefault(dados['item'].id, dados['item'])
+
+    def progresso_download(feitos, total):
+        if progresso:
+            progresso(percentual=5 + int(feitos / total * 55), mensagem=f'Baixando desenhos ({feitos} de {total})...')
+
+    if progresso:
+        progresso(percentual=5, mensagem=f'Baixando desenhos de {len(itens)} item(ns)...')
+    desenhos = baixar_desenhos(list(itens.values()), baixar, carimbar, progresso_download)
+
+    writer = PdfWriter()
+    leitores = {}
+    for indice, ordem in enumerate(ordens, start=1):
+        writer.append(PdfReader(io.BytesIO(folha_ordem_pdf(ordem))))
+        for dados in _itens_da_ordem(ordem):
+            item = dados['item']
+            if not item.desenho_tecnico:
+                continue
+            if item.id not in leitores:
+                origem = desenhos.get(item.id)
+                try:
+                    if not origem:
+                        raise ValueError('desenho não baixado')
+                    leitores[item.id] = PdfReader(origem if isinstance(origem, str) else io.BytesIO(origem))
+                except Exception as e:
+                    logger.warning(f"[impressao_lote] Desenho do item {item.codigo_acb} ignorado: {e}")
+                    leitores[item.id] = PdfReader(io.BytesIO(_pagina_aviso(f'Desenho de {item.codigo_acb} indisponível')))
+            writer.append(leitores[item.id])
+        if progresso:
+            progresso(percentual=60 + int(indice / len(ordens) * 35), mensagem=f'Montando OS {indice} de {len(ordens)}...')
+
+    if progresso:
+        progresso(percentual=97, mensagem='Finalizando PDF...')
+    with open(caminho, 'wb') as f:
+        writer.write(f)
+    return len(writer.pages)
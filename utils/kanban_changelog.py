@@ -0,0 +1,228 @@
+"""
+Log de alterações do Kanban (sync incremental do PWA)
+
+Cada flush que insere, altera ou remove cartões (OS e seu status de produção),
+cartões fantasma, apontamentos ou listas grava linhas em ``kanban_alteracao`` na mesma transação.
+O ``id`` da tabela é a sequência monotônica usada por ``/kanban/sync?since=<seq>``:
+o cliente guarda o último seq aplicado e recebe apenas o que mudou depois dele.
+O mesmo seq é a marca d'água do estado de ``/apontamento/status-ativos`` entre
+workers.
+
+Updates em massa (``query.update``) não passam pelos eventos da sessão; nesses
+casos a rota chama ``registrar_alteracoes`` antes do commit.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import timedelta
+
+from sqlalchemy import delete, event, func, inspect as sa_inspect
+
+logger = logging.getLogger(__name__)
+
+# Classe do modelo -> (entidade no log, atributo com o id usado pelo cliente)
+_ENTIDADES = {
+    'OrdemServico': ('cartao', 'id'),
+    'PedidoOrdemServico': ('cartao', 'ordem_servico_id'),
+    'StatusProducaoOS': ('cartao', 'ordem_servico_id'),
+    'CartaoFantasma': ('fantasma', 'id'),
+    'ApontamentoProducao': ('apontamento', 'id'),
+    'KanbanLista': ('lista', 'id'),
+}
+
+# Lacunas de seq mais novas que isso podem ser transações ainda não commitadas
+JANELA_LACUNA = timedelta(seconds=10)
+
+_CHAVE_SESSAO = '_kanban_changelog_ok'
+_tabela_ok = {'valor': None, 'verificado_em': 0.0}
+
+_poda = {'em': 0.0}
+_poda_lock = threading.Lock()
+
+
+def _retencao_dias():
+    try:
+        return max(1, int(os.getenv('KANBAN_LOG_RETENCAO_DIAS', '7')))
+    except ValueError:
+        return 7
+
+
+def _tabela_disponivel(connection):
+    """Evita quebrar o flush quando a tabela ainda não foi criada (rechecado a cada 5 min)"""
+    agora = time.time()
+    if _tabela_ok['valor'] is None or (not _tabela_ok['valor'] and agora - _tabela_ok['verificado_em'] > 300):
+        try:
+            _tabela_ok['valor'] = sa_inspect(connection).has_table('kanban_alteracao')
+        except Exception:
+            _tabela_ok['valor'] = False
+        _tabela_ok['verificado_em'] = agora
+    return _tabela_ok['valor']
+
+
+def _linhas_do_flush(session_):
+    from models import local_now_naive
+
+    vistos = set()
+    agora = local_now_naive()
+    linhas = []
+
+    def _adicionar(obj, operacao):
+        mapeamento = _ENTIDADES.get(obj.__class__.__name__)
+        if not mapeamento:
+            return
+        entidade, atributo = mapeamento
+        entidade_id = getattr(obj, atributo, None)
+        if entidade_id is None:
+            return
+        # Remover um vínculo pedido/OS altera o cartão, não o apaga
+        if operacao == 'delete' and entidade == 'cartao' and atributo != 'id':
+            operacao = 'upsert'
+        chave = (entidade, entidade_id, operacao)
+        if chave in vistos:
+            return
+        vistos.add(chave)
+        linhas.append({'entidade': entidade, 'entidade_id': int(entidade_id),
+                       'operacao': operacao, 'data_criacao': agora})
+
+    for obj in session_.new:
+        _adicionar(obj, 'upsert')
+    for obj in session_.dirty:
+        if session_.is_modified(obj, include_collections=False):
+            _adicionar(obj, 'upsert')
+    for obj in session_.deleted:
+        _adicionar(obj, 'delete')
+    return linhas
+
+
+def registrar_alteracoes(session_, entidade, ids, operacao='upsert'):
+    """Registra alterações feitas fora do ORM (ex.: update em massa) na transação atual"""
+    from models import KanbanAlteracao, local_now_naive
+
+    ids = [int(i) for i in ids or [] if i is not None]
+    if not ids:
+        return
+    try:
+        connection = session_.connection()
+        if not _tabela_disponivel(connection):
+            return
+        agora = local_now_naive()
+        with connection.begin_nested():
+            connection.execute(
+                KanbanAlteracao.__table__.insert(),
+                [{'entidade': entidade, 'entidade_id': i, 'operacao': operacao, 'data_criacao': agora} for i in ids]
+            )
+    except Exception as e:
+        logger.warning(f"[kanban_changelog] Falha ao registrar alterações de {entidade}: {e}")
+
+
+def registrar_eventos_sessao(session_cls):
+    """Grava o log no after_flush, na mesma transação das alterações"""
+    from models import KanbanAlteracao
+
+    @event.listens_for(session_cls, 'after_flush')
+    def _changelog_after_flush(session_, flush_context):
+        try:
+            linhas = _linhas_do_flush(session_)
+            if not linhas:
+                return
+            connection = session_.connection()
+            if not _tabela_disponivel(connection):
+                return
+            # SAVEPOINT: no PostgreSQL um INSERT com erro abortaria a transação do usuário
+            with connection.begin_nested():
+                connection.execute(KanbanAlteracao.__table__.insert(), linhas)
+        except Exception as e:
+            logger.warning(f"[kanban_changelog] Falha ao gravar log de alterações: {e}")
+
+
+def seq_atual(session_):
+    """Maior seq gravado (0 se o log estiver vazio; None se a tabela não existir)"""
+    from models import KanbanAlteracao
+
+    try:
+        if not _tabela_disponivel(session_.connection()):
+            return None
+        return int(session_.query(func.max(KanbanAlteracao.id)).scalar() or 0)
+    except Exception as e:
+        logger.warning(f"[kanban_changelog] Falha ao ler seq atual: {e}")
+        return None
+
+
+def buscar_alteracoes(session_, since, limite=500):
+    """
+    Alterações com seq > ``since`` (até ``limite`` linhas).
+
+    Retorna dict com ``alteracoes`` (deduplicadas por entidade, a última
+    operação vence), ``seq`` (novo cursor), ``has_more`` e ``reset`` (o cursor
+    é anterior ao que foi removido pela retenção; o cliente deve recarregar tudo).
+
+    O cursor não avança além de uma lacuna recente na sequência: a linha que
+    falta pode pertencer a uma transação que ainda não foi commitada.
+    """
+    from models import KanbanAlteracao, local_now_naive
+
+    menor = session_.query(func.min(KanbanAlteracao.id)).scalar()
+    if menor is not None and since < menor - 1:
+        return {'alteracoes': {}, 'seq': since, 'has_more': False, 'reset': True}
+
+    rows = (
+        session_.query(KanbanAlteracao.id, KanbanAlteracao.entidade, KanbanAlteracao.entidade_id,
+                       KanbanAlteracao.operacao, KanbanAlteracao.data_criacao)
+        .filter(KanbanAlteracao.id > since)
+        .order_by(KanbanAlteracao.id.asc())
+        .limit(limite + 1)
+        .all()
+    )
+    has_more = len(rows) > limite
+    rows = rows[:limite]
+
+    limite_lacuna = local_now_naive() - JANELA_LACUNA
+    cursor = since
+    esperado = since
+    bloqueado = False
+    alteracoes = {}
+    for row in rows:
+        if row.id != esperado + 1 and row.data_criacao and row.data_criacao > limite_lacuna:
+            bloqueado = True
+        esperado = row.id
+        if not bloqueado:
+            cursor = row.id
+        alteracoes[(row.entidade, row.entidade_id)] = row.operacao
+
+    return {'alteracoes': alteracoes, 'seq': cursor, 'has_more': has_more and not bloqueado, 'reset': False}
+
+
+def podar(db_engine, retencao_dias=None):
+    """
+    Remove entradas mais antigas que a retenção (KANBAN_LOG_RETENCAO_DIAS, padrão 7).
+    Usa conexão própria: nunca faz commit da sessão de uma requisição.
+    """
+    from models import KanbanAlteracao, local_now_naive
+
+    limite = local_now_naive() - timedelta(days=retencao_dias or _retencao_dias())
+    tabela = KanbanAlteracao.__table__
+    try:
+        with db_engine.begin() as conn:
+            return conn.execute(delete(tabela).where(tabela.c.data_criacao < limite)).rowcount or 0
+    except Exception as e:
+        logger.warning(f"[kanban_changelog] Falha ao podar log: {e}")
+        return 0
+
+
+def podar_em_segundo_plano(app, intervalo_s=3600):
+    """Dispara ``podar`` numa thread, no máximo uma vez por ``intervalo_s`` por processo"""
+    with _poda_lock:
+        if time.time() - _poda['em'] < intervalo_s:
+            return False
+        _poda['em'] = time.time()
+
+    def _executar():
+        with app.app_context():
+            from models import db
+            removidas = podar(db.engine)
+            if removidas:
+                logger.info(f"[kanban_changelog] {removidas} entradas antigas removidas do log de alterações")
+
+    threading.Thread(target=_executar, name='kanban-changelog-poda', daemon=True).start()
+    return True
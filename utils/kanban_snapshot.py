@@ -0,0 +1,92 @@
+"""
+Snapshot versionado do quadro Kanban (página legada ``/kanban?legacy=1``)
+
+Guarda um único snapshot montado (listas, cartões, métricas) associado a um
+número de versão. A versão é o seq do log de alterações do Kanban
+(``kanban_alteracao``), gravado na mesma transação de qualquer inserção,
+alteração ou remoção de OS, cartão fantasma, apontamento, status de produção
+ou lista, venha ela de qualquer worker, da tela de apontamento ou da criação
+de OS/pedidos. A leitura só reaproveita o snapshot se a versão dele for a
+atual, então a página fica consistente logo após uma movimentação sem
+recalcular as métricas de todas as listas a cada visualização.
+
+``incrementar_versao`` descarta o snapshot local na hora (rotas do quadro, após
+o commit). Se o log de alterações não estiver disponível a versão cai para um
+contador local ao processo; ``KANBAN_SNAPSHOT_MAX_IDADE_S`` limita por quanto
+tempo um snapshot pode ser servido nesse caso (e para dados fora do log, como
+tempos de ItemTrabalho).
+"""
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def _max_idade_padrao():
+    try:
+        return max(0, int(os.getenv('KANBAN_SNAPSHOT_MAX_IDADE_S', '300')))
+    except ValueError:
+        return 300
+
+
+class SnapshotQuadroKanban:
+    """Um snapshot por processo, válido enquanto a versão do quadro não mudar"""
+
+    def __init__(self, max_idade_s=None):
+        self.max_idade_s = _max_idade_padrao() if max_idade_s is None else max_idade_s
+        self._lock = threading.Lock()
+        self._versao_local = 0
+        self._snapshot = None  # (versao, criado_em, dados)
+        self.stats = {'hits': 0, 'misses': 0, 'incrementos': 0}
+
+    def versao_atual(self):
+        """Versão atual do quadro: seq do log de alterações (compartilhado entre workers)"""
+        from models import db
+        from utils.kanban_changelog import seq_atual
+
+        seq = seq_atual(db.session)
+        if seq is not None:
+            return ('seq', seq)
+        return ('local', self._versao_local)
+
+    def incrementar_versao(self):
+        """Marca o quadro como alterado neste processo; o snapshot atual deixa de valer"""
+        with self._lock:
+            self._versao_local += 1
+            self._snapshot = None
+            self.stats['incrementos'] += 1
+            return self._versao_local
+
+    def obter(self, versao):
+        """Dados do snapshot se ele pertencer a ``versao`` e não estiver expirado"""
+        with self._lock:
+            snap = self._snapshot
+            if snap and snap[0] == versao and (not self.max_idade_s or time.time() - snap[1] <= self.max_idade_s):
+                self.stats['hits'] += 1
+                return snap[2]
+            self.stats['misses'] += 1
+            return None
+
+    def guardar(self, versao, dados):
+        """Substitui o snapshot (apenas um é mantido, então a memória fica limitada)"""
+        # Não guardar dados montados antes de um incremento concorrente
+        if versao != self.versao_atual():
+            return
+        with self._lock:
+            self._snapshot = (versao, time.time(), dados)
+
+    def limpar(self):
+        with self._lock:
+            self._snapshot = None
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, versao_local=self._versao_local,
+                        versao_snapshot=self._snapshot[0] if self._snapshot else None,
+                        max_idade_s=self.max_idade_s)
+
+
+# Instância global (uma por processo)
+snapshot_quadro = SnapshotQuadroKanban()
@@ -0,0 +1,263 @@
+"""
+Listagens paginadas por cursor (keyset)
+
+Cada tela de listagem declara uma ``Listagem`` com a consulta base, as
+ordenações aceitas, os filtros aceitos na query string e as colunas que a
+tabela realmente mostra. A paginação é por cursor: o cursor guarda os valores
+da ordenação da última linha entregue e a próxima página começa logo depois
+dela (``WHERE (chave, id) > (:valor, :id)``), então o custo de cada página não
+cresce com o tamanho da tabela, ao contrário de OFFSET.
+
+Parâmetros aceitos na query string:
+    ordem   nome da ordenação; prefixo '-' inverte a direção
+    limite  linhas por página (padrão 100, máximo 500)
+    cursor  valor de ``proximo_cursor`` devolvido pela página anterior
+    formato 'json' (colunas projetadas) ou 'html' (linhas renderizadas)
+    demais  filtros declarados na listagem
+"""
+import base64
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+from flask import jsonify, render_template, request
+from sqlalchemy import and_, or_
+
+logger = logging.getLogger(__name__)
+
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 500
+# Linhas renderizadas junto com a página; o restante vem da API em lotes
+PRIMEIRA_PAGINA_LISTAGEM = 200
+
+
+class CursorInvalido(ValueError):
+    """Cursor adulterado, de outra ordenação ou de outra versão da listagem."""
+
+
+class Pagina:
+    def __init__(self, registros, proximo_cursor, limite, ordem):
+        self.registros = registros
+        self.proximo_cursor = proximo_cursor
+        self.limite = limite
+        self.ordem = ordem
+
+    @property
+    def tem_mais(self):
+        return self.proximo_cursor is not None
+
+
+def _valor_para_cursor(valor):
+    if isinstance(valor, datetime):
+        return {'t': 'dt', 'v': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'t': 'd', 'v': valor.isoformat()}
+    if isinstance(valor, Decimal):
+        return {'t': 'n', 'v': str(valor)}
+    return valor
+
+
+def _valor_do_cursor(valor):
+    if isinstance(valor, dict):
+        tipo, bruto = valor.get('t'), valor.get('v')
+        if tipo == 'dt':
+            return datetime.fromisoformat(bruto)
+        if tipo == 'd':
+            return date.fromisoformat(bruto)
+        if tipo == 'n':
+            return Decimal(bruto)
+        raise CursorInvalido('Tipo de valor desconhecido no cursor')
+    return valor
+
+
+def codificar_cursor(ordem, valores):
+    carga = json.dumps({'o': ordem, 'v': [_valor_para_cursor(v) for v in valores]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(carga.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor, ordem, quantidade):
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        carga = json.loads(bruto.decode('utf-8'))
+        valores = [_valor_do_cursor(v) for v in carga['v']]
+    except CursorInvalido:
+        raise
+    except Exception:
+        raise CursorInvalido('Cursor inválido')
+    if carga.get('o') != ordem or len(valores) != quantidade:
+        raise CursorInvalido('Cursor não corresponde à ordenação solicitada')
+    return valores
+
+
+def _valor_json(valor):
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def predicado_keyset(chaves, valores):
+    """(k1, k2, ..., id) depois de (v1, v2, ..., vid), respeitando a direção de cada chave.
+
+    Expandido em OR de prefixos iguais porque a comparação de tuplas não
+    existe em todos os dialetos e as direções podem ser mistas.
+    """
+    alternativas = []
+    for i, (expr, desc) in enumerate(chaves):
+        iguais = [chaves[j][0] == valores[j] for j in range(i)]
+        passo = expr < valores[i] if desc else expr > valores[i]
+        alternativas.append(and_(*iguais, passo) if iguais else passo)
+    return or_(*alternativas)
+
+
+def filtro_texto(*colunas):
+    """Filtro 'contém' (case-insensitive) em qualquer uma das colunas."""
+    def filtrar(query, valores):
+        termo = f"%{valores[0]}%"
+        return query.filter(or_(*[coluna.ilike(termo) for coluna in colunas]))
+    return filtrar
+
+
+def filtro_data(coluna, operador):
+    """Filtro de data (AAAA-MM-DD) com operador '>=' ou '<='; datas inválidas são ignoradas."""
+    def filtrar(query, valores):
+        try:
+            valor = datetime.strptime(valores[0], '%Y-%m-%d').date()
+        except ValueError:
+            return query
+        return query.filter(coluna >= valor if operador == '>=' else coluna <= valor)
+    return filtrar
+
+
+def filtro_ids(coluna):
+    """Filtro por lista de ids (?cliente_id=1&cliente_id=2); valores não numéricos são ignorados."""
+    def filtrar(query, valores):
+        ids = [int(v) for v in valores if v.isdigit()]
+        return query.filter(coluna.in_(ids)) if ids else query
+    return filtrar
+
+
+class Listagem:
+    """Especificação de uma listagem paginada.
+
+    consulta     callable sem argumentos que devolve a Query base (com joins
+                 necessários para filtros, ordenações e campos)
+    chave        coluna única usada como desempate (normalmente o id)
+    ordenacoes   {nome: [(expressão, 'asc'|'desc'), ...]}; as expressões não
+                 podem ser nulas (use coalesce), senão o cursor pula linhas
+    campos       {nome: expressão} projetados no formato JSON
+    filtros      {parâmetro: fn(query, valores) -> query}; recebe a lista de
+                 valores não vazios do parâmetro (aceita ?status=a&status=b)
+    opcoes_carga loader options aplicadas só quando a página devolve entidades
+    """
+
+    def __init__(self, consulta, chave, ordenacoes, ordem_padrao, campos=None, filtros=None,
+                 opcoes_carga=None, limite_padrao=LIMITE_PADRAO, limite_maximo=LIMITE_MAXIMO):
+        self.consulta = consulta
+        self.chave = chave
+        self.ordenacoes = ordenacoes
+        self.ordem_padrao = ordem_padrao
+        self.campos = campos or {}
+        self.filtros = filtros or {}
+        self.opcoes_carga = opcoes_carga or ()
+        self.limite_padrao = limite_padrao
+        self.limite_maximo = limite_maximo
+
+    def _resolver_ordem(self, ordem):
+        ordem = (ordem or self.ordem_padrao).strip()
+        inverter = ordem.startswith('-')
+        nome = ordem.lstrip('-')
+        if nome not in self.ordenacoes:
+            nome, inverter = self.ordem_padrao.lstrip('-'), self.ordem_padrao.startswith('-')
+        chaves = [(expr, (direcao == 'desc') != inverter) for expr, direcao in self.ordenacoes[nome]]
+        # Desempate pela chave única na direção da última ordenação
+        chaves.append((self.chave, chaves[-1][1] if chaves else inverter))
+        return ('-' if inverter else '') + nome, chaves
+
+    def _resolver_limite(self, limite):
+        try:
+            limite = int(limite) if limite not in (None, '') else self.limite_padrao
+        except (TypeError, ValueError):
+            limite = self.limite_padrao
+        return max(1, min(limite, self.limite_maximo))
+
+    def aplicar_filtros(self, query, args):
+        for parametro, filtro in self.filtros.items():
+            valores = [v.strip() for v in args.getlist(parametro) if v and v.strip()]
+            if valores:
+                query = filtro(query, valores)
+        return query
+
+    def paginar(self, args, projecao=False, limite=None):
+        """Busca uma página. ``projecao=True`` devolve dicts só com ``campos``."""
+        ordem, chaves = self._resolver_ordem(args.get('ordem'))
+        limite = self._resolver_limite(limite if limite is not None else args.get('limite'))
+
+        query = self.aplicar_filtros(self.consulta(), args)
+        cursor = (args.get('cursor') or '').strip()
+        if cursor:
+            valores = decodificar_cursor(cursor, ordem, len(chaves))
+            query = query.filter(predicado_keyset(chaves, valores))
+
+        rotulos = [expr.label(f'_chave_{i}') for i, (expr, _) in enumerate(chaves)]
+        if projecao:
+            query = query.with_entities(*[expr.label(nome) for nome, expr in self.campos.items()], *rotulos)
+        else:
+            query = query.options(*self.opcoes_carga).add_columns(*rotulos)
+
+        query = query.order_by(*[expr.desc() if desc else expr.asc() for expr, desc in chaves])
+        linhas = query.limit(limite + 1).all()
+
+        proximo = None
+        if len(linhas) > limite:
+            linhas = linhas[:limite]
+            ultima = linhas[-1]
+            proximo = codificar_cursor(ordem, [getattr(ultima, f'_chave_{i}') for i in range(len(chaves))])
+
+        if projecao:
+            registros = [{nome: _valor_json(getattr(linha, nome)) for nome in self.campos} for linha in linhas]
+        else:
+            registros = [linha[0] for linha in linhas]
+        return Pagina(registros, proximo, limite, ordem)
+
+
+def responder_pagina(listagem, template_linhas, nome_registros, templates_extras=None, **contexto):
+    """Resposta padrão das APIs de listagem.
+
+    formato=html devolve as linhas já renderizadas com o mesmo partial usado
+    na página, para a tabela anexar sem duplicar o markup em JavaScript.
+    ``templates_extras`` ({chave: template}) renderiza markup que não cabe
+    dentro da tabela (ex.: modais por linha) em ``extras``.
+    """
+    formato = (request.args.get('formato') or 'json').strip().lower()
+    try:
+        if formato == 'html':
+            pagina = listagem.paginar(request.args)
+            contexto[nome_registros] = pagina.registros
+            extras = {chave: render_template(template, **contexto) for chave, template in (templates_extras or {}).items()}
+            return jsonify({
+                'success': True,
+                'html': render_template(template_linhas, **contexto),
+                'extras': extras,
+                'quantidade': len(pagina.registros),
+                'proximo_cursor': pagina.proximo_cursor,
+                'tem_mais': pagina.tem_mais,
+                'ordem': pagina.ordem,
+            })
+
+        pagina = listagem.paginar(request.args, projecao=True)
+        return jsonify({
+            'success': True,
+            'registros': pagina.registros,
+            'quantidade': len(pagina.registros),
+            'proximo_cursor': pagina.proximo_cursor,
+            'tem_mais': pagina.tem_mais,
+            'ordem': pagina.ordem,
+        })
+    except CursorInvalido as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        logger.error(f"Erro ao paginar listagem: {str(e)}")
+        return jsonify({'success': False, 'message': 'Erro ao carregar a listagem'}), 500
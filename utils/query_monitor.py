@@ -1,8 +1,30 @@
 """
-Utilitário para monitorar e logar queries lentas do SQLAlchemy
+Utilitário para monitorar queries do SQLAlchemy
+
+- ``QueryMonitor`` mantém estatísticas globais do processo (total de queries,
+  tempo acumulado e as últimas queries lentas).
+- ``PerfilSQL`` é o perfil de uma requisição (guardado em ``flask.g``): número de
+  queries, tempo total de SQL, statements repetidos (assinaturas de N+1) e as
+  queries mais lentas. Requisições concorrentes não interferem entre si.
+- ``instalar_profiler(app)`` liga os listeners no ``Engine`` e os hooks
+  ``before_request``/``after_request``: adiciona o header ``Server-Timing``,
+  guarda os perfis recentes para ``/diagnostico/sql`` e aplica orçamentos de
+  queries por endpoint.
+
+Orçamentos: ``ORCAMENTOS_PADRAO`` pode ser sobrescrito por
+``SQL_ORCAMENTOS="apontamento.status_ativos=30,itens.listar_itens=15"``.
+``SQL_ORCAMENTO_MODO`` define o que acontece ao estourar: ``log`` (padrão) ou
+``erro`` (levanta ``OrcamentoQueriesExcedido``; padrão com ``app.testing``,
+lido a cada requisição, então vale também quando o teste liga ``testing``
+depois de ``create_app()``).
 """
+import os
+import re
 import time
+import heapq
 import logging
+import threading
+from collections import Counter, deque
 from functools import wraps
 from sqlalchemy import event
 from sqlalchemy.engine import Engine
@@ -12,81 +34,332 @@ logger = logging.getLogger(__name__)
 # Threshold em segundos para considerar query lenta
 SLOW_QUERY_THRESHOLD = 0.5
 
+# Máximo de queries por requisição, por endpoint
+ORCAMENTOS_PADRAO = {
+    'apontamento.status_ativos': 30,
+    'itens.listar_itens': 15,
+    'kanban.full_data': 15,
+    'kanban.sync': 15,
+}
+
+# Statement repetido a partir de N vezes na mesma requisição = suspeita de N+1
+LIMITE_REPETICOES = 5
+MAX_LENTAS_POR_REQUISICAO = 5
+MAX_PERFIS_RECENTES = 200
+
+
+class OrcamentoQueriesExcedido(AssertionError):
+    """Endpoint executou mais queries que o orçamento configurado"""
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.getenv(nome, padrao))
+    except (TypeError, ValueError):
+        return padrao
+
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMERO = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_PARAM = re.compile(r"%\(\w+\)s|:\w+|\$\d+|%s")
+_RE_LISTA_IN = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_RE_ESPACOS = re.compile(r"\s+")
+
+
+def fingerprint(statement):
+    """Normaliza um statement (literais e listas IN viram ``?``) para agrupar repetições"""
+    s = _RE_STRING.sub('?', statement or '')
+    s = _RE_PARAM.sub('?', s)
+    s = _RE_NUMERO.sub('?', s)
+    s = _RE_LISTA_IN.sub('(?)', s)
+    return _RE_ESPACOS.sub(' ', s).strip()[:300]
+
+
+class PerfilSQL:
+    """Queries de uma requisição"""
+
+    def __init__(self, endpoint=None, metodo=None, caminho=None):
+        self.endpoint = endpoint
+        self.metodo = metodo
+        self.caminho = caminho
+        self.inicio = time.time()
+        self.total_queries = 0
+        self.tempo_sql = 0.0
+        self.statements = Counter()
+        self._lentas = []  # heap (duração, seq, statement)
+        self._seq = 0
+
+    def registrar(self, statement, duracao):
+        self.total_queries += 1
+        self.tempo_sql += duracao
+        self.statements[fingerprint(statement)] += 1
+        self._seq += 1
+        item = (duracao, self._seq, (statement or '')[:500])
+        if len(self._lentas) < MAX_LENTAS_POR_REQUISICAO:
+            heapq.heappush(self._lentas, item)
+        elif duracao > self._lentas[0][0]:
+            heapq.heapreplace(self._lentas, item)
+
+    def repetidas(self, limite=None):
+        """Statements executados ``limite`` vezes ou mais (assinaturas de N+1)"""
+        limite = limite or _env_int('SQL_LIMITE_REPETICOES', LIMITE_REPETICOES)
+        return [{'statement': s, 'vezes': n} for s, n in self.statements.most_common() if n >= limite]
+
+    def lentas(self):
+        return [{'duracao_ms': round(d * 1000, 2), 'statement': s}
+                for d, _, s in sorted(self._lentas, reverse=True)]
+
+    def resumo(self, status=None):
+        duracao = time.time() - self.inicio
+        return {
+            'endpoint': self.endpoint,
+            'metodo': self.metodo,
+            'caminho': self.caminho,
+            'status': status,
+            'inicio': self.inicio,
+            'duracao_ms': round(duracao * 1000, 2),
+            'total_queries': self.total_queries,
+            'tempo_sql_ms': round(self.tempo_sql * 1000, 2),
+            'repetidas': self.repetidas(),
+            'lentas': self.lentas(),
+        }
+
+
+def _perfil_atual():
+    """Perfil da requisição corrente (None fora de requisição ou com profiler desligado)"""
+    try:
+        from flask import g, has_request_context
+        if has_request_context():
+            return g.get('_perfil_sql')
+    except Exception:
+        pass
+    return None
+
+
 class QueryMonitor:
     """Monitor de performance de queries"""
-    
+
     def __init__(self, threshold=SLOW_QUERY_THRESHOLD):
         self.threshold = threshold
-        self.slow_queries = []
+        self.slow_queries = deque(maxlen=50)
         self.query_count = 0
         self.total_time = 0
-    
-    def setup_monitoring(self, engine):
-        """Configura monitoramento de queries no engine SQLAlchemy"""
-        
+        self._lock = threading.Lock()
+        self._instalado = False
+        self.perfis_recentes = deque(maxlen=MAX_PERFIS_RECENTES)
+        self.por_endpoint = {}
+        self.orcamentos_excedidos = 0
+
+    def setup_monitoring(self, engine=Engine):
+        """
+        Configura monitoramento de queries no SQLAlchemy.
+
+        Por padrão escuta a classe ``Engine`` (todas as engines do processo).
+        """
+        if self._instalado:
+            return
+        self._instalado = True
+
         @event.listens_for(engine, "before_cursor_execute")
         def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-            conn.info.setdefault('query_start_time', []).append(time.time())
-        
+            conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
         @event.listens_for(engine, "after_cursor_execute")
         def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
-            total = time.time() - conn.info['query_start_time'].pop(-1)
-            self.query_count += 1
-            self.total_time += total
-            
+            inicios = conn.info.get('query_start_time')
+            if not inicios:
+                return
+            total = time.perf_counter() - inicios.pop(-1)
+            with self._lock:
+                self.query_count += 1
+                self.total_time += total
+
+            perfil = _perfil_atual()
+            if perfil is not None:
+                perfil.registrar(statement, total)
+
             if total > self.threshold:
                 # Query lenta detectada
-                self.slow_queries.append({
-                    'duration': total,
-                    'statement': statement[:500],  # Limitar tamanho
-                    'parameters': str(parameters)[:200] if parameters else None
-                })
-                
+                with self._lock:
+                    self.slow_queries.append({
+                        'duration': total,
+                        'statement': statement[:500],  # Limitar tamanho
+                        'parameters': str(parameters)[:200] if parameters else None,
+                        'endpoint': perfil.endpoint if perfil else None,
+                    })
+
                 logger.warning(
                     f"🐌 SLOW QUERY ({total:.3f}s): {statement[:200]}..."
                 )
-    
+
+    def registrar_perfil(self, resumo):
+        """Guarda o resumo de uma requisição e agrega por endpoint"""
+        with self._lock:
+            self.perfis_recentes.append(resumo)
+            agg = self.por_endpoint.setdefault(resumo['endpoint'] or '-', {
+                'requisicoes': 0, 'queries': 0, 'max_queries': 0, 'tempo_sql_ms': 0.0, 'n_mais_1': 0,
+            })
+            agg['requisicoes'] += 1
+            agg['queries'] += resumo['total_queries']
+            agg['max_queries'] = max(agg['max_queries'], resumo['total_queries'])
+            agg['tempo_sql_ms'] += resumo['tempo_sql_ms']
+            if resumo['repetidas']:
+                agg['n_mais_1'] += 1
+
     def get_stats(self):
         """Retorna estatísticas de queries"""
-        return {
-            'total_queries': self.query_count,
-            'total_time': round(self.total_time, 3),
-            'avg_time': round(self.total_time / self.query_count, 3) if self.query_count > 0 else 0,
-            'slow_queries_count': len(self.slow_queries),
-            'slow_queries': self.slow_queries[-10:]  # Últimas 10
-        }
-    
+        with self._lock:
+            slow = list(self.slow_queries)
+            return {
+                'total_queries': self.query_count,
+                'total_time': round(self.total_time, 3),
+                'avg_time': round(self.total_time / self.query_count, 3) if self.query_count > 0 else 0,
+                'slow_queries_count': len(slow),
+                'slow_queries': slow[-10:]  # Últimas 10
+            }
+
+    def get_perfis(self):
+        """Perfis recentes e agregados por endpoint (página /diagnostico/sql)"""
+        with self._lock:
+            por_endpoint = []
+            for endpoint, agg in self.por_endpoint.items():
+                n = agg['requisicoes'] or 1
+                por_endpoint.append({
+                    'endpoint': endpoint,
+                    'requisicoes': agg['requisicoes'],
+                    'media_queries': round(agg['queries'] / n, 1),
+                    'max_queries': agg['max_queries'],
+                    'media_sql_ms': round(agg['tempo_sql_ms'] / n, 2),
+                    'n_mais_1': agg['n_mais_1'],
+                    'orcamento': obter_orcamentos().get(endpoint),
+                })
+            por_endpoint.sort(key=lambda e: e['max_queries'], reverse=True)
+            return {
+                'recentes': list(reversed(self.perfis_recentes)),
+                'por_endpoint': por_endpoint,
+                'orcamentos_excedidos': self.orcamentos_excedidos,
+            }
+
     def reset_stats(self):
         """Reseta estatísticas"""
-        self.slow_queries = []
-        self.query_count = 0
-        self.total_time = 0
+        with self._lock:
+            self.slow_queries.clear()
+            self.query_count = 0
+            self.total_time = 0
+            self.perfis_recentes.clear()
+            self.por_endpoint = {}
+            self.orcamentos_excedidos = 0
 
 # Instância global do monitor
 query_monitor = QueryMonitor()
 
+
+def obter_orcamentos():
+    """Orçamentos padrão combinados com ``SQL_ORCAMENTOS`` (endpoint=N separados por vírgula)"""
+    orcamentos = dict(ORCAMENTOS_PADRAO)
+    for parte in (os.getenv('SQL_ORCAMENTOS') or '').split(','):
+        if '=' not in parte:
+            continue
+        endpoint, _, valor = parte.partition('=')
+        try:
+            orcamentos[endpoint.strip()] = int(valor)
+        except ValueError:
+            logger.warning(f"Orçamento de queries inválido ignorado: {parte!r}")
+    return orcamentos
+
+
+def verificar_orcamento(resumo, modo='log'):
+    """Loga (ou levanta ``OrcamentoQueriesExcedido`` no modo ``erro``) se o endpoint estourou o orçamento"""
+    limite = obter_orcamentos().get(resumo.get('endpoint'))
+    if limite is None or resumo['total_queries'] <= limite:
+        return True
+    with query_monitor._lock:
+        query_monitor.orcamentos_excedidos += 1
+    mensagem = (
+        f"Orçamento de queries excedido em {resumo['endpoint']}: "
+        f"{resumo['total_queries']} > {limite}"
+    )
+    if resumo['repetidas']:
+        mensagem += f" | repetida {resumo['repetidas'][0]['vezes']}x: {resumo['repetidas'][0]['statement'][:150]}"
+    if modo == 'erro':
+        raise OrcamentoQueriesExcedido(mensagem)
+    logger.warning(f"⚠️ {mensagem}")
+    return False
+
+
+def _server_timing(resumo):
+    descricao = f"{resumo['total_queries']} queries"
+    partes = [
+        f'db;dur={resumo["tempo_sql_ms"]};desc="{descricao}"',
+        f'app;dur={resumo["duracao_ms"]}',
+    ]
+    if resumo['repetidas']:
+        partes.append(f'n1;desc="{len(resumo["repetidas"])} statements repetidos"')
+    return ', '.join(partes)
+
+
+def instalar_profiler(app):
+    """
+    Liga o profiler por requisição no app.
+
+    ``SQL_PROFILER_ATIVO=0`` desliga os hooks (o monitor global continua ativo).
+    """
+    query_monitor.setup_monitoring()
+
+    if os.getenv('SQL_PROFILER_ATIVO', '1').strip().lower() in ('0', 'false', 'nao', 'não', 'no'):
+        return
+
+    from flask import current_app, g, request
+
+    @app.before_request
+    def _iniciar_perfil_sql():
+        if request.endpoint and request.endpoint.startswith('static'):
+            return
+        g._perfil_sql = PerfilSQL(request.endpoint, request.method, request.path)
+
+    @app.after_request
+    def _finalizar_perfil_sql(response):
+        perfil = g.pop('_perfil_sql', None)
+        if perfil is None:
+            return response
+        resumo = perfil.resumo(status=response.status_code)
+        query_monitor.registrar_perfil(resumo)
+        response.headers.add('Server-Timing', _server_timing(resumo))
+
+        if resumo['repetidas']:
+            logger.info(
+                f"Possível N+1 em {resumo['endpoint']}: "
+                + '; '.join(f"{r['vezes']}x {r['statement'][:120]}" for r in resumo['repetidas'][:3])
+            )
+        modo = (os.getenv('SQL_ORCAMENTO_MODO') or ('erro' if current_app.testing else 'log')).strip().lower()
+        verificar_orcamento(resumo, modo=modo)
+        return response
+
+
 def monitor_route_performance(f):
-    """Decorator para monitorar performance de rotas"""
+    """Decorator para monitorar performance de rotas (usa o perfil da própria requisição)"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
         start_time = time.time()
-        query_monitor.reset_stats()
-        
+        perfil = _perfil_atual()
+        queries_antes = perfil.total_queries if perfil else 0
+
         try:
             result = f(*args, **kwargs)
             duration = time.time() - start_time
-            
-            stats = query_monitor.get_stats()
-            if duration > 1.0 or stats['slow_queries_count'] > 0:
+
+            queries = (perfil.total_queries - queries_antes) if perfil else None
+            lentas = sum(1 for d, _, _ in perfil._lentas if d > query_monitor.threshold) if perfil else 0
+            if duration > 1.0 or lentas > 0:
                 logger.warning(
                     f"⚠️ Route {f.__name__} took {duration:.3f}s | "
-                    f"Queries: {stats['total_queries']} | "
-                    f"Slow: {stats['slow_queries_count']}"
+                    f"Queries: {queries if queries is not None else '-'} | "
+                    f"Slow: {lentas}"
                 )
-            
+
             return result
         except Exception as e:
             logger.error(f"❌ Error in route {f.__name__}: {e}")
             raise
-    
+
     return decorated_function
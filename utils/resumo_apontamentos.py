@@ -0,0 +1,353 @@
+"""
+Resumo de tempos por OS/item/trabalho (tabela ``apontamento_resumo``)
+
+Cada linha acumula os tempos de setup, produção e pausas dos apontamentos
+encerrados de uma combinação OS/item/trabalho, além da última quantidade
+apontada e das contagens de sessões. O resumo é atualizado por deltas no
+``after_flush`` da sessão, na mesma transação do apontamento: encerrar um
+apontamento (``data_fim`` preenchido), editar seus horários ou removê-lo
+soma/subtrai apenas a parcela daquele registro.
+
+Durações seguem o critério histórico das telas: ``data_fim - data_hora``,
+agrupadas por categoria (setup: inicio_setup/fim_setup; produção:
+inicio_producao/fim_producao; pausas: pausa/stop). Apontamentos ainda abertos
+não entram nos tempos; quem precisa do tempo corrente soma o trecho aberto.
+
+Remoções não fazem a última quantidade/último apontamento voltarem no tempo.
+Inserções fora do ORM (restauração de backup, massa de benchmark) não passam
+pelos eventos; nesses casos chame ``reconstruir``.
+
+O upsert roda num SAVEPOINT: se falhar, a transação do apontamento segue
+intacta (no PostgreSQL um erro sem savepoint abortaria o commit do usuário com
+``InFailedSqlTransaction``). As OS afetadas ficam marcadas como pendentes e são
+reconstruídas após o commit, em conexão própria; o que não der para
+reconstruir na hora é tentado de novo no próximo commit (``reconciliar``).
+"""
+import time
+import logging
+import threading
+from collections import defaultdict
+
+from sqlalchemy import and_, case, event, inspect as sa_inspect, or_, select
+
+logger = logging.getLogger(__name__)
+
+CATEGORIAS = {
+    'inicio_setup': 'tempo_setup_s',
+    'fim_setup': 'tempo_setup_s',
+    'inicio_producao': 'tempo_producao_s',
+    'fim_producao': 'tempo_producao_s',
+    'pausa': 'tempo_pausas_s',
+    'stop': 'tempo_pausas_s',
+}
+
+CONTADORES = {
+    'inicio_setup': 'sessoes_setup',
+    'inicio_producao': 'sessoes_producao',
+    'pausa': 'pausas',
+    'stop': 'pausas',
+}
+
+SOMAS = (
+    'tempo_setup_s', 'tempo_producao_s', 'tempo_pausas_s',
+    'sessoes_setup', 'sessoes_producao', 'pausas', 'total_apontamentos',
+)
+
+_CAMPOS = ('ordem_servico_id', 'item_id', 'trabalho_id', 'tipo_acao', 'data_hora', 'data_fim', 'quantidade')
+
+_tabela_ok = {'valor': None, 'verificado_em': 0.0}
+
+# OS cujo delta não foi aplicado (resumo divergente até ``reconciliar``)
+_pendentes = set()
+_pendentes_lock = threading.Lock()
+
+
+def _tabela_disponivel(connection):
+    """Evita quebrar o flush quando a tabela ainda não foi criada (rechecado a cada 5 min)"""
+    agora = time.time()
+    if _tabela_ok['valor'] is None or (not _tabela_ok['valor'] and agora - _tabela_ok['verificado_em'] > 300):
+        try:
+            _tabela_ok['valor'] = sa_inspect(connection).has_table('apontamento_resumo')
+        except Exception:
+            _tabela_ok['valor'] = False
+        _tabela_ok['verificado_em'] = agora
+    return _tabela_ok['valor']
+
+
+def _novo_acumulado():
+    acumulado = dict.fromkeys(SOMAS, 0)
+    acumulado.update({'ultima_quantidade': None, 'ultima_quantidade_em': None, 'ultimo_apontamento_em': None})
+    return acumulado
+
+
+def _somar(acumulado, estado, sinal=1):
+    """Aplica a parcela de um apontamento (``sinal`` -1 remove a parcela anterior)"""
+    acumulado['total_apontamentos'] += sinal
+    campo = CATEGORIAS.get(estado['tipo_acao'])
+    if campo and estado['data_fim'] and estado['data_hora']:
+        acumulado[campo] += sinal * int((estado['data_fim'] - estado['data_hora']).total_seconds())
+        contador = CONTADORES.get(estado['tipo_acao'])
+        if contador:
+            acumulado[contador] += sinal
+    if sinal > 0 and estado['data_hora']:
+        if acumulado['ultimo_apontamento_em'] is None or estado['data_hora'] > acumulado['ultimo_apontamento_em']:
+            acumulado['ultimo_apontamento_em'] = estado['data_hora']
+        if estado['quantidade'] is not None and (
+                acumulado['ultima_quantidade_em'] is None or estado['data_hora'] >= acumulado['ultima_quantidade_em']):
+            acumulado['ultima_quantidade'] = int(estado['quantidade'])
+            acumulado['ultima_quantidade_em'] = estado['data_hora']
+
+
+def _combo(estado):
+    chave = (estado['ordem_servico_id'], estado['item_id'], estado['trabalho_id'])
+    return chave if None not in chave else None
+
+
+def _estado_anterior(obj):
+    """Valores antes do flush (histórico dos atributos ainda disponível no after_flush)"""
+    st = sa_inspect(obj)
+    estado = {}
+    alterado = False
+    for campo in _CAMPOS:
+        hist = st.attrs[campo].history
+        if hist.has_changes():
+            alterado = True
+            estado[campo] = hist.deleted[0] if hist.deleted else None
+        else:
+            estado[campo] = getattr(obj, campo)
+    return estado, alterado
+
+
+def _estado_atual(obj):
+    return {campo: getattr(obj, campo) for campo in _CAMPOS}
+
+
+def _deltas_do_flush(session_):
+    from models import ApontamentoProducao
+
+    deltas = defaultdict(_novo_acumulado)
+    for obj in session_.new:
+        if isinstance(obj, ApontamentoProducao):
+            estado = _estado_atual(obj)
+            chave = _combo(estado)
+            if chave:
+                _somar(deltas[chave], estado)
+    for obj in session_.dirty:
+        if not isinstance(obj, ApontamentoProducao):
+            continue
+        anterior, alterado = _estado_anterior(obj)
+        if not alterado:
+            continue
+        atual = _estado_atual(obj)
+        chave_anterior, chave_atual = _combo(anterior), _combo(atual)
+        if chave_anterior:
+            _somar(deltas[chave_anterior], anterior, -1)
+        if chave_atual:
+            _somar(deltas[chave_atual], atual)
+    for obj in session_.deleted:
+        if isinstance(obj, ApontamentoProducao):
+            anterior, _ = _estado_anterior(obj)
+            chave = _combo(anterior)
+            if chave:
+                _somar(deltas[chave], anterior, -1)
+    return deltas
+
+
+def _linhas(acumulados, agora):
+    linhas = []
+    for (os_id, item_id, trabalho_id), acumulado in acumulados.items():
+        linhas.append({
+            'ordem_servico_id': os_id,
+            'item_id': item_id,
+            'trabalho_id': trabalho_id,
+            'atualizado_em': agora,
+            **acumulado,
+        })
+    return linhas
+
+
+def _aplicar_deltas(connection, linhas):
+    """Upsert somando os deltas; última quantidade/apontamento só avançam no tempo"""
+    from models import ResumoApontamento
+
+    tabela = ResumoApontamento.__table__
+    dialeto = connection.dialect.name
+    if dialeto == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialeto == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        insert = None
+
+    if insert is not None:
+        stmt = insert(tabela)
+        novo = stmt.excluded
+        avanca_quantidade = and_(
+            novo.ultima_quantidade_em.isnot(None),
+            or_(tabela.c.ultima_quantidade_em.is_(None), novo.ultima_quantidade_em >= tabela.c.ultima_quantidade_em),
+        )
+        avanca_apontamento = and_(
+            novo.ultimo_apontamento_em.isnot(None),
+            or_(tabela.c.ultimo_apontamento_em.is_(None), novo.ultimo_apontamento_em > tabela.c.ultimo_apontamento_em),
+        )
+        valores = {campo: tabela.c[campo] + novo[campo] for campo in SOMAS}
+        valores.update({
+            'ultima_quantidade': case((avanca_quantidade, novo.ultima_quantidade), else_=tabela.c.ultima_quantidade),
+            'ultima_quantidade_em': case((avanca_quantidade, novo.ultima_quantidade_em), else_=tabela.c.ultima_quantidade_em),
+            'ultimo_apontamento_em': case((avanca_apontamento, novo.ultimo_apontamento_em), else_=tabela.c.ultimo_apontamento_em),
+            'atualizado_em': novo.atualizado_em,
+        })
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['ordem_servico_id', 'item_id', 'trabalho_id'],
+            set_=valores,
+        )
+        connection.execute(stmt, linhas)
+        return
+
+    # Outros dialetos: UPDATE e, se a linha não existir, INSERT
+    for linha in linhas:
+        filtro = and_(
+            tabela.c.ordem_servico_id == linha['ordem_servico_id'],
+            tabela.c.item_id == linha['item_id'],
+            tabela.c.trabalho_id == linha['trabalho_id'],
+        )
+        atual = connection.execute(select(tabela).where(filtro)).mappings().first()
+        if atual is None:
+            connection.execute(tabela.insert(), [linha])
+            continue
+        valores = {campo: (atual[campo] or 0) + linha[campo] for campo in SOMAS}
+        if linha['ultima_quantidade_em'] is not None and (
+                atual['ultima_quantidade_em'] is None or linha['ultima_quantidade_em'] >= atual['ultima_quantidade_em']):
+            valores['ultima_quantidade'] = linha['ultima_quantidade']
+            valores['ultima_quantidade_em'] = linha['ultima_quantidade_em']
+        if linha['ultimo_apontamento_em'] is not None and (
+                atual['ultimo_apontamento_em'] is None or linha['ultimo_apontamento_em'] > atual['ultimo_apontamento_em']):
+            valores['ultimo_apontamento_em'] = linha['ultimo_apontamento_em']
+        valores['atualizado_em'] = linha['atualizado_em']
+        connection.execute(tabela.update().where(filtro).values(**valores))
+
+
+def registrar_eventos_sessao(session_cls):
+    """Atualiza o resumo no after_flush, na mesma transação dos apontamentos"""
+    from models import local_now_naive
+
+    @event.listens_for(session_cls, 'after_flush')
+    def _resumo_after_flush(session_, flush_context):
+        deltas = None
+        try:
+            deltas = _deltas_do_flush(session_)
+            if not deltas:
+                return
+            connection = session_.connection()
+            if not _tabela_disponivel(connection):
+                return
+            # SAVEPOINT: uma falha aqui não pode abortar a transação do apontamento
+            with connection.begin_nested():
+                _aplicar_deltas(connection, _linhas(deltas, local_now_naive()))
+        except Exception as e:
+            logger.warning(f"[resumo_apontamentos] Falha ao atualizar resumo (OS marcadas para reconstrução): {e}")
+            if deltas:
+                with _pendentes_lock:
+                    _pendentes.update(os_id for os_id, _, _ in deltas)
+
+    @event.listens_for(session_cls, 'after_commit')
+    def _resumo_after_commit(session_):
+        if _pendentes:
+            reconciliar(session_.get_bind())
+
+
+def reconciliar(db_engine):
+    """Reconstrói o resumo das OS marcadas como pendentes (conexão própria); retorna quantas OS"""
+    with _pendentes_lock:
+        os_ids = set(_pendentes)
+        _pendentes.clear()
+    if not os_ids:
+        return 0
+    try:
+        with db_engine.begin() as conn:
+            reconstruir(conn, os_ids)
+        logger.info(f"[resumo_apontamentos] Resumo reconstruído para {len(os_ids)} OS")
+        return len(os_ids)
+    except Exception as e:
+        logger.warning(f"[resumo_apontamentos] Falha ao reconstruir resumo de {len(os_ids)} OS: {e}")
+        with _pendentes_lock:
+            _pendentes.update(os_ids)
+        return 0
+
+
+def pendentes():
+    """OS com resumo divergente aguardando ``reconciliar``"""
+    with _pendentes_lock:
+        return sorted(_pendentes)
+
+
+def carregar_resumos(session_, os_ids):
+    """
+    Resumos das OS informadas em uma query.
+
+    Retorna ``{(os_id, item_id, trabalho_id): ResumoApontamento}`` ou ``None``
+    quando a tabela não existe (quem chama volta a somar o histórico).
+    """
+    from models import ResumoApontamento
+
+    os_ids = [i for i in set(os_ids or []) if i is not None]
+    try:
+        if not _tabela_disponivel(session_.connection()):
+            return None
+    except Exception:
+        return None
+    resumos = {}
+    for i in range(0, len(os_ids), 500):
+        lote = os_ids[i:i + 500]
+        for resumo in session_.query(ResumoApontamento).filter(ResumoApontamento.ordem_servico_id.in_(lote)).all():
+            resumos[(resumo.ordem_servico_id, resumo.item_id, resumo.trabalho_id)] = resumo
+    return resumos
+
+
+def ultimo_com_quantidade(resumos, os_id, item_id=None):
+    """Resumo da OS (opcionalmente de um item) com a quantidade apontada mais recente"""
+    melhor = None
+    for (r_os, r_item, _), resumo in resumos.items():
+        if r_os != os_id or (item_id is not None and r_item != item_id):
+            continue
+        if resumo.ultima_quantidade is None or resumo.ultima_quantidade_em is None:
+            continue
+        if melhor is None or resumo.ultima_quantidade_em >= melhor.ultima_quantidade_em:
+            melhor = resumo
+    return melhor
+
+
+def reconstruir(connection, os_ids=None, lote=5000):
+    """
+    Recalcula o resumo a partir do histórico (todas as OS ou apenas ``os_ids``).
+
+    Lê apenas as colunas necessárias em streaming e grava em lotes; retorna o
+    número de combinações gravadas.
+    """
+    from models import ApontamentoProducao, ResumoApontamento, local_now_naive
+
+    ap = ApontamentoProducao.__table__
+    tabela = ResumoApontamento.__table__
+    ids = sorted({i for i in os_ids if i is not None}) if os_ids is not None else None
+
+    consulta = select(*(ap.c[campo] for campo in _CAMPOS)).order_by(ap.c.data_hora.asc(), ap.c.id.asc())
+    remover = tabela.delete()
+    if ids is not None:
+        if not ids:
+            return 0
+        consulta = consulta.where(ap.c.ordem_servico_id.in_(ids))
+        remover = remover.where(tabela.c.ordem_servico_id.in_(ids))
+
+    acumulados = defaultdict(_novo_acumulado)
+    resultado = connection.execute(consulta.execution_options(yield_per=lote))
+    for row in resultado.mappings():
+        estado = dict(row)
+        chave = _combo(estado)
+        if chave:
+            _somar(acumulados[chave], estado)
+
+    connection.execute(remover)
+    linhas = _linhas(acumulados, local_now_naive())
+    for i in range(0, len(linhas), lote):
+        connection.execute(tabela.insert(), linhas[i:i + lote])
+    return len(linhas)
@@ -0,0 +1,529 @@
+"""
+Cliente do Supabase Storage: leitura com cache local em disco e upload
+
+Todas as leituras HTTP de arquivos (imagens de itens nas exportações,
+desenhos para carimbar/imprimir, miniaturas) passam por ``ler(url)``:
+
+- uma única ``requests.Session`` por processo (``sessao()``), com pool de
+  ``STORAGE_POOL`` conexões keep-alive (padrão 16) e novas tentativas com
+  backoff em falha de conexão e 429/5xx para GET/HEAD;
+- um cache em disco endereçado pelo conteúdo: ``objetos/<sha256>`` guarda os
+  bytes e ``chaves/<sha1 da URL>.json`` aponta a URL para o hash, com o ETag
+  do Storage. Dentro de ``STORAGE_CACHE_TTL_S`` (padrão 3600) o arquivo é
+  usado sem consultar a rede; depois disso é revalidado com ``If-None-Match``
+  (304 mantém o arquivo). Arquivos iguais em URLs diferentes ocupam um só
+  blob.
+
+Uploads gravam no cache (``guardar``), então o arquivo recém-enviado não é
+baixado de volta na primeira exportação. Os blobs menos usados são removidos
+quando o total passa de ``STORAGE_CACHE_MAX_MB`` (padrão 1000); arquivos
+acima de ``STORAGE_CACHE_MAX_OBJETO_MB`` (padrão 50) não entram no cache.
+
+Diretório: ``STORAGE_CACHE_DIR`` (padrão: <tmp>/linhamestre_storage),
+compartilhado pelos workers da mesma máquina.
+
+Upload (``enviar``): o bucket é verificado/criado uma vez por processo (e de
+novo só se um upload falhar) e o arquivo vai como corpo binário, lido do
+stream em blocos, sem montar o multipart em memória: um round-trip por
+arquivo. Acima de ``STORAGE_UPLOAD_RESUMIVEL_MB`` (padrão 20) usa o upload
+resumível (TUS) em pedaços de 6 MB, retomando do último pedaço confirmado se
+a conexão cair. ``enviar_varios`` envia os arquivos de um formulário em
+paralelo (``STORAGE_UPLOADS_PARALELOS``, padrão 4).
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+import tempfile
+import mimetypes
+import threading
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote, urljoin
+
+logger = logging.getLogger(__name__)
+
+_sessao = None
+_sessao_lock = threading.Lock()
+
+# Um lock por faixa de URLs (hash % N): o número de locks não cresce com o
+# número de objetos já baixados.
+_N_LOCKS = 64
+_locks = [threading.Lock() for _ in range(_N_LOCKS)]
+
+_stats = defaultdict(int)
+_stats_lock = threading.Lock()
+
+_buckets_verificados = set()
+_buckets_lock = threading.Lock()
+
+# Tamanho de pedaço exigido pelo upload resumível do Supabase (exceto o último)
+TAMANHO_PEDACO_TUS = 6 * 1024 * 1024
+
+
+class ErroUpload(Exception):
+    """Falha ao enviar um arquivo ao Storage (mensagem pronta para o usuário)."""
+
+
+def _env_int(nome, padrao):
+    try:
+        return int(os.getenv(nome, padrao))
+    except (TypeError, ValueError):
+        return padrao
+
+
+def _contar(evento, quantidade=1):
+    with _stats_lock:
+        _stats[evento] += quantidade
+
+
+# ---------------------------------------------------------------------------
+# Sessão HTTP
+# ---------------------------------------------------------------------------
+
+def sessao():
+    """``requests.Session`` compartilhada do processo (keep-alive + novas tentativas em GET/HEAD)."""
+    global _sessao
+    with _sessao_lock:
+        if _sessao is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            conexoes = max(1, _env_int('STORAGE_POOL', 16))
+            tentativas = Retry(
+                total=max(0, _env_int('STORAGE_TENTATIVAS', 3)),
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({'GET', 'HEAD'}),
+                raise_on_status=False,
+            )
+            s = requests.Session()
+            adaptador = HTTPAdapter(pool_connections=conexoes, pool_maxsize=conexoes, max_retries=tentativas)
+            s.mount('https://', adaptador)
+            s.mount('http://', adaptador)
+            _sessao = s
+        return _sessao
+
+
+def url_publica(bucket, caminho):
+    """URL pública de ``bucket/caminho`` (None sem SUPABASE_URL)."""
+    base = (os.environ.get('SUPABASE_URL') or '').rstrip('/')
+    if not base:
+        return None
+    return f"{base}/storage/v1/object/public/{bucket}/{quote(caminho, safe='/')}"
+
+
+# ---------------------------------------------------------------------------
+# Cache em disco
+# ---------------------------------------------------------------------------
+
+def diretorio_cache():
+    base = os.getenv('STORAGE_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'linhamestre_storage')
+    for sub in ('objetos', 'chaves'):
+        os.makedirs(os.path.join(base, sub), exist_ok=True)
+    return base
+
+
+def _lock(chave):
+    return _locks[hash(chave) % _N_LOCKS]
+
+
+def _chave_url(url):
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def _caminho_indice(url):
+    return os.path.join(diretorio_cache(), 'chaves', f'{_chave_url(url)}.json')
+
+
+def _caminho_blob(sha256):
+    return os.path.join(diretorio_cache(), 'objetos', sha256)
+
+
+def _ler_indice(url):
+    try:
+        with open(_caminho_indice(url), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _gravar_atomico(caminho, conteudo):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(conteudo)
+        os.replace(tmp, caminho)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _gravar_indice(url, registro):
+    _gravar_atomico(_caminho_indice(url), json.dumps(registro).encode('utf-8'))
+
+
+def _tocar(caminho):
+    try:
+        os.utime(caminho, None)
+    except OSError:
+        pass
+
+
+def _podar(limite_bytes=None):
+    """Remove os blobs menos acessados até caber no limite (índices órfãos viram miss)."""
+    limite_bytes = limite_bytes if limite_bytes is not None else _env_int('STORAGE_CACHE_MAX_MB', 1000) * 1024 * 1024
+    pasta = os.path.join(diretorio_cache(), 'objetos')
+    arquivos = []
+    total = 0
+    for nome in os.listdir(pasta):
+        caminho = os.path.join(pasta, nome)
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            continue
+        arquivos.append((st.st_mtime, st.st_size, caminho))
+        total += st.st_size
+    for _, tamanho, caminho in sorted(arquivos):
+        if total <= limite_bytes:
+            break
+        try:
+            os.remove(caminho)
+            total -= tamanho
+            _contar('removidos')
+        except OSError:
+            pass
+
+
+def _guardar_bytes(url, conteudo, etag=None):
+    """Grava o blob (se ainda não existir) e aponta a URL para ele."""
+    if len(conteudo) > _env_int('STORAGE_CACHE_MAX_OBJETO_MB', 50) * 1024 * 1024:
+        return None
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    blob = _caminho_blob(sha256)
+    if os.path.exists(blob):
+        _tocar(blob)
+    else:
+        _gravar_atomico(blob, conteudo)
+        _podar()
+    _gravar_indice(url, {'sha256': sha256, 'etag': etag, 'tamanho': len(conteudo), 'verificado_em': time.time()})
+    return blob
+
+
+def _blob_em_cache(url):
+    """(registro do índice, caminho do blob) se a URL tem blob em disco; senão (registro ou None, None)."""
+    registro = _ler_indice(url)
+    if not registro:
+        return None, None
+    blob = _caminho_blob(registro.get('sha256', ''))
+    if not os.path.exists(blob):
+        return registro, None
+    return registro, blob
+
+
+def _ler_blob(blob):
+    _tocar(blob)
+    with open(blob, 'rb') as f:
+        return f.read()
+
+
+def caminho_em_cache(url):
+    """Caminho do blob da URL se estiver em cache e dentro do TTL; não acessa a rede."""
+    if not url:
+        return None
+    try:
+        registro, blob = _blob_em_cache(url)
+        if blob and time.time() - registro.get('verificado_em', 0) < _env_int('STORAGE_CACHE_TTL_S', 3600):
+            _tocar(blob)
+            return blob
+    except OSError:
+        pass
+    return None
+
+
+def ler(url, timeout=10):
+    """
+    Bytes do objeto em ``url`` (cache local, revalidado após o TTL) ou None
+    se o servidor não o devolver. Leituras simultâneas da mesma URL esperam a
+    primeira em vez de baixar de novo.
+    """
+    if not url:
+        return None
+
+    try:
+        blob = caminho_em_cache(url)
+        if blob:
+            _contar('hits')
+            return _ler_blob(blob)
+    except OSError:
+        pass
+
+    with _lock(_chave_url(url)):
+        try:
+            blob = caminho_em_cache(url)
+            if blob:
+                _contar('hits')
+                return _ler_blob(blob)
+            registro, blob = _blob_em_cache(url)
+        except OSError:
+            registro, blob = None, None
+
+        cabecalhos = {}
+        if blob and registro.get('etag'):
+            cabecalhos['If-None-Match'] = registro['etag']
+
+        resp = sessao().get(url, headers=cabecalhos, timeout=timeout)
+        if resp.status_code == 304 and blob:
+            _contar('revalidados')
+            registro['verificado_em'] = time.time()
+            try:
+                _gravar_indice(url, registro)
+                return _ler_blob(blob)
+            except OSError:
+                pass
+        if resp.status_code != 200:
+            _contar('falhas')
+            return None
+
+        conteudo = resp.content
+        _contar('misses')
+        _contar('bytes_baixados', len(conteudo))
+        try:
+            _guardar_bytes(url, conteudo, resp.headers.get('ETag'))
+        except OSError as e:
+            logger.warning(f"[storage] Falha ao gravar cache de {url}: {e}")
+        return conteudo
+
+
+def guardar(url, origem):
+    """
+    Grava no cache o conteúdo recém-enviado para ``url`` (write-through do
+    upload). ``origem`` pode ser bytes ou um arquivo aberto (lido do início,
+    sem carregar inteiro na memória se passar do limite por objeto).
+    """
+    if not url or origem is None:
+        return
+    try:
+        if isinstance(origem, (bytes, bytearray)):
+            conteudo = bytes(origem)
+        else:
+            limite = _env_int('STORAGE_CACHE_MAX_OBJETO_MB', 50) * 1024 * 1024
+            origem.seek(0)
+            conteudo = origem.read(limite + 1)
+            origem.seek(0)
+            if len(conteudo) > limite:
+                return
+        with _lock(_chave_url(url)):
+            _guardar_bytes(url, conteudo)
+        _contar('gravados')
+    except Exception as e:
+        logger.warning(f"[storage] Falha ao gravar cache de {url}: {e}")
+
+
+def invalidar(url):
+    """Esquece a URL (o blob fica até ser podado, pois pode ser de outra URL)."""
+    try:
+        indice = _caminho_indice(url)
+        if os.path.exists(indice):
+            os.remove(indice)
+    except OSError as e:
+        logger.warning(f"[storage] Falha ao invalidar cache de {url}: {e}")
+
+
+# ---------------------------------------------------------------------------
+# Upload
+# ---------------------------------------------------------------------------
+
+def _config():
+    url = (os.environ.get('SUPABASE_URL') or '').rstrip('/')
+    chave = os.environ.get('SUPABASE_KEY')
+    bucket = os.environ.get('SUPABASE_BUCKET', 'uploads')
+    return url, chave, bucket
+
+
+def _autenticacao(chave):
+    return {'Authorization': f'Bearer {chave}', 'apikey': chave}
+
+
+def garantir_bucket(url, chave, bucket):
+    """Verifica (e cria, se preciso) o bucket uma vez por processo."""
+    if bucket in _buckets_verificados:
+        return
+    with _buckets_lock:
+        if bucket in _buckets_verificados:
+            return
+        cabecalhos = _autenticacao(chave)
+        try:
+            resp = sessao().get(f"{url}/storage/v1/bucket/{bucket}", headers=cabecalhos, timeout=10)
+            if resp.status_code != 200:
+                logger.info(f"[storage] Bucket {bucket} não encontrado ({resp.status_code}); tentando criar")
+                criacao = sessao().post(
+                    f"{url}/storage/v1/bucket",
+                    headers=cabecalhos,
+                    json={'id': bucket, 'name': bucket, 'public': True},
+                    timeout=10,
+                )
+                logger.debug("[storage] Criação do bucket: %s - %s", criacao.status_code, criacao.text[:200])
+            _buckets_verificados.add(bucket)
+        except Exception as e:
+            # Segue para o upload: se o bucket realmente faltar, o erro aparece lá
+            logger.warning(f"[storage] Falha ao verificar o bucket {bucket}: {e}")
+
+
+def _tamanho_stream(stream):
+    stream.seek(0, os.SEEK_END)
+    tamanho = stream.tell()
+    stream.seek(0)
+    return tamanho
+
+
+def _enviar_resumivel(url, chave, bucket, caminho, stream, tamanho, mimetype, tentativas=4):
+    """Upload TUS em pedaços de 6 MB; após falha, consulta o offset no servidor e continua dali."""
+    import requests
+
+    cabecalhos = dict(_autenticacao(chave), **{'Tus-Resumable': '1.0.0'})
+    metadados = ','.join(
+        f"{nome} {base64.b64encode(valor.encode('utf-8')).decode('ascii')}"
+        for nome, valor in (('bucketName', bucket), ('objectName', caminho), ('contentType', mimetype))
+    )
+    endpoint = f"{url}/storage/v1/upload/resumable"
+    criacao = sessao().post(
+        endpoint,
+        headers=dict(cabecalhos, **{'Upload-Length': str(tamanho), 'Upload-Metadata': metadados}),
+        timeout=30,
+    )
+    if criacao.status_code != 201 or not criacao.headers.get('Location'):
+        raise ErroUpload(f"Erro no upload: {criacao.status_code} {criacao.reason}")
+    destino = urljoin(endpoint + '/', criacao.headers['Location'])
+
+    offset = 0
+    falhas = 0
+    while offset < tamanho:
+        stream.seek(offset)
+        pedaco = stream.read(TAMANHO_PEDACO_TUS)
+        try:
+            resp = sessao().patch(
+                destino,
+                headers=dict(cabecalhos, **{
+                    'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream',
+                }),
+                data=pedaco,
+                timeout=(10, 120),
+            )
+            if resp.status_code == 204:
+                offset = int(resp.headers.get('Upload-Offset', offset + len(pedaco)))
+                falhas = 0
+                continue
+            if resp.status_code not in (409, 423, 429) and resp.status_code < 500:
+                raise ErroUpload(f"Erro no upload: {resp.status_code} {resp.reason}")
+            motivo = f"HTTP {resp.status_code}"
+        except requests.exceptions.RequestException as e:
+            motivo = str(e)
+        falhas += 1
+        if falhas > tentativas:
+            raise ErroUpload(f"Erro no upload: interrompido em {offset}/{tamanho} bytes: {motivo}")
+        logger.warning(f"[storage] Upload de {caminho} falhou em {offset}/{tamanho} bytes ({motivo}); retomando")
+        time.sleep(2 ** falhas)
+        try:
+            consulta = sessao().head(destino, headers=cabecalhos, timeout=10)
+            if consulta.status_code == 200 and consulta.headers.get('Upload-Offset'):
+                offset = int(consulta.headers['Upload-Offset'])
+        except requests.exceptions.RequestException:
+            pass
+
+
+def enviar(file, folder):
+    """
+    Envia um ``FileStorage`` para ``<bucket>/<folder>/<uuid>_<nome>`` e devolve
+    ``supabase://<bucket>/<caminho>``. Levanta ``ErroUpload``. Não usa o
+    contexto da requisição, então pode rodar em outra thread.
+    """
+    from werkzeug.utils import secure_filename
+
+    url, chave, bucket = _config()
+    if not url or not chave:
+        raise ErroUpload('Configuração do Supabase Storage incompleta. Verifique as variáveis de ambiente SUPABASE_URL e SUPABASE_KEY.')
+
+    garantir_bucket(url, chave, bucket)
+
+    nome = secure_filename(file.filename)
+    caminho = f"{folder}/{uuid.uuid4().hex[:8]}_{nome}"
+    mimetype = file.mimetype or mimetypes.guess_type(nome)[0] or 'application/octet-stream'
+    stream = file.stream
+    tamanho = _tamanho_stream(stream)
+
+    try:
+        if tamanho > _env_int('STORAGE_UPLOAD_RESUMIVEL_MB', 20) * 1024 * 1024:
+            _enviar_resumivel(url, chave, bucket, caminho, stream, tamanho, mimetype)
+        else:
+            # Corpo binário lido do stream em blocos (Content-Length conhecido)
+            resp = sessao().post(
+                f"{url}/storage/v1/object/{bucket}/{quote(caminho, safe='/')}",
+                headers=dict(_autenticacao(chave), **{'Content-Type': mimetype}),
+                data=stream,
+                timeout=(10, 300),
+            )
+            if resp.status_code not in (200, 201):
+                logger.error(f"[storage] Upload de {caminho} falhou: {resp.status_code} {resp.text[:200]}")
+                raise ErroUpload(f"Erro no upload: {resp.status_code} {resp.reason}")
+    except Exception:
+        # Bucket removido/recriado: verificar de novo no próximo upload
+        _buckets_verificados.discard(bucket)
+        raise
+
+    _contar('uploads')
+    _contar('bytes_enviados', tamanho)
+    # Write-through: exportações/impressões leem do cache local
+    guardar(url_publica(bucket, caminho), stream)
+    return f"supabase://{bucket}/{caminho}"
+
+
+def enviar_varios(arquivos):
+    """
+    Envia ``[(file, folder), ...]`` em paralelo. Devolve, na mesma ordem, o
+    caminho ``supabase://`` ou a exceção de cada arquivo.
+    """
+    if len(arquivos) < 2:
+        resultados = []
+        for file, folder in arquivos:
+            try:
+                resultados.append(enviar(file, folder))
+            except Exception as e:
+                resultados.append(e)
+        return resultados
+
+    # Verifica o bucket antes, para as threads não disputarem a verificação
+    url, chave, bucket = _config()
+    if url and chave:
+        garantir_bucket(url, chave, bucket)
+
+    paralelos = max(1, min(len(arquivos), _env_int('STORAGE_UPLOADS_PARALELOS', 4)))
+    with ThreadPoolExecutor(max_workers=paralelos, thread_name_prefix='storage-upload') as pool:
+        futuros = [pool.submit(enviar, file, folder) for file, folder in arquivos]
+    resultados = []
+    for futuro in futuros:
+        try:
+            resultados.append(futuro.result())
+        except Exception as e:
+            resultados.append(e)
+    return resultados
+
+
+def get_stats():
+    with _stats_lock:
+        stats = dict(_stats)
+    consultas = stats.get('hits', 0) + stats.get('misses', 0) + stats.get('revalidados', 0)
+    stats['taxa_acerto'] = round((stats.get('hits', 0) + stats.get('revalidados', 0)) / consultas, 3) if consultas else None
+    try:
+        pasta = os.path.join(diretorio_cache(), 'objetos')
+        tamanhos = [os.path.getsize(os.path.join(pasta, n)) for n in os.listdir(pasta)]
+        stats['objetos'] = len(tamanhos)
+        stats['bytes_em_disco'] = sum(tamanhos)
+    except OSError:
+        pass
+    return stats